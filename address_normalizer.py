@@ -0,0 +1,263 @@
+# address_normalizer.py
+# 台灣地址正規化模組 (預先編譯 + 記憶化版)
+# 正規化規則與 data_processor.normalize_taiwan_address (v2.8) 完全相同，
+# 差別在於：正規表示式與對照表只在模組載入時建立一次、縣市補全改用前綴樹比對、
+# 並以 LRU 快取記住已處理過的原始字串，另提供整欄 (pandas Series) 的批次 API。
+
+import re
+from functools import lru_cache
+from typing import Dict
+
+import pandas as pd
+
+# 快取上限：涵蓋一次同步中所有不同的地址字串綽綽有餘
+CACHE_SIZE = 65536
+
+_FULL_WIDTH_TABLE = str.maketrans("０１２３４５６７８９", "0123456789")
+
+_RE_PARENTHESES = re.compile(r'[\(（].*?[\)）]')
+_RE_NEIGHBORHOOD = re.compile(r'(\d+)鄰')
+_RE_REPEATED_UNIT = re.compile(r'(縣|市|區|鄉|鎮|村|里|路|街|段|巷|弄|號|樓)\1+')
+_RE_CHINESE_NUMBER = re.compile(r'([一二三四五六七八九十百]+)(?=段|巷|弄|號|樓|街)')
+_RE_WHITESPACE = re.compile(r'\s+')
+_RE_ADDRESS_PARTS = re.compile(
+    r'(?P<city>\D+?[縣市])?(?P<district>\D+?[區鄉鎮市])?(?P<village>\D+?[村里])?'
+    r'(?P<road>.*?((路|街|大道|道)(?!.*(路|街|大道|道))))?(?P<section>.*?[段])?'
+    r'(?P<lane>.*?[巷])?(?P<alley>.*?[弄])?(?P<number>[\d之、-]+[號])?(?P<floor>.*?[樓])?(?P<rest>.*)'
+)
+
+_CN_NUM_MAP = {'〇': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+# 省略縣名的鄉鎮市 -> 補上完整縣市名稱
+COUNTY_MAP = {
+    # 彰化縣 (2市 6鎮 18鄉)
+    "彰化市": "彰化縣彰化市",
+    "員林市": "彰化縣員林市",
+    "和美鎮": "彰化縣和美鎮",
+    "鹿港鎮": "彰化縣鹿港鎮",
+    "溪湖鎮": "彰化縣溪湖鎮",
+    "二林鎮": "彰化縣二林鎮",
+    "田中鎮": "彰化縣田中鎮",
+    "北斗鎮": "彰化縣北斗鎮",
+    "花壇鄉": "彰化縣花壇鄉",
+    "芬園鄉": "彰化縣芬園鄉",
+    "大村鄉": "彰化縣大村鄉",
+    "永靖鄉": "彰化縣永靖鄉",
+    "伸港鄉": "彰化縣伸港鄉",
+    "線西鄉": "彰化縣線西鄉",
+    "福興鄉": "彰化縣福興鄉",
+    "秀水鄉": "彰化縣秀水鄉",
+    "埔心鄉": "彰化縣埔心鄉",
+    "埔鹽鄉": "彰化縣埔鹽鄉",
+    "大城鄉": "彰化縣大城鄉",
+    "芳苑鄉": "彰化縣芳苑鄉",
+    "竹塘鄉": "彰化縣竹塘鄉",
+    "社頭鄉": "彰化縣社頭鄉",
+    "二水鄉": "彰化縣二水鄉",
+    "田尾鄉": "彰化縣田尾鄉",
+    "埤頭鄉": "彰化縣埤頭鄉",
+    "溪州鄉": "彰化縣溪州鄉",
+
+    # 雲林縣 (1市 5鎮 14鄉)
+    "斗六市": "雲林縣斗六市",
+    "斗南鎮": "雲林縣斗南鎮",
+    "虎尾鎮": "雲林縣虎尾鎮",
+    "西螺鎮": "雲林縣西螺鎮",
+    "土庫鎮": "雲林縣土庫鎮",
+    "北港鎮": "雲林縣北港鎮",
+    "莿桐鄉": "雲林縣莿桐鄉",
+    "林內鄉": "雲林縣林內鄉",
+    "古坑鄉": "雲林縣古坑鄉",
+    "大埤鄉": "雲林縣大埤鄉",
+    "崙背鄉": "雲林縣崙背鄉",
+    "二崙鄉": "雲林縣二崙鄉",
+    "麥寮鄉": "雲林縣麥寮鄉",
+    "東勢鄉": "雲林縣東勢鄉",
+    "褒忠鄉": "雲林縣褒忠鄉",
+    "臺西鄉": "雲林縣臺西鄉",
+    "元長鄉": "雲林縣元長鄉",
+    "四湖鄉": "雲林縣四湖鄉",
+    "口湖鄉": "雲林縣口湖鄉",
+    "水林鄉": "雲林縣水林鄉",
+
+    # 嘉義縣 (2市 3鎮 15鄉)
+    "太保市": "嘉義縣太保市",
+    "朴子市": "嘉義縣朴子市",
+    "布袋鎮": "嘉義縣布袋鎮",
+    "大林鎮": "嘉義縣大林鎮",
+    "民雄鄉": "嘉義縣民雄鄉",
+    "溪口鄉": "嘉義縣溪口鄉",
+    "新港鄉": "嘉義縣新港鄉",
+    "六腳鄉": "嘉義縣六腳鄉",
+    "東石鄉": "嘉義縣東石鄉",
+    "義竹鄉": "嘉義縣義竹鄉",
+    "鹿草鄉": "嘉義縣鹿草鄉",
+    "水上鄉": "嘉義縣水上鄉",
+    "中埔鄉": "嘉義縣中埔鄉",
+    "竹崎鄉": "嘉義縣竹崎鄉",
+    "梅山鄉": "嘉義縣梅山鄉",
+    "番路鄉": "嘉義縣番路鄉",
+    "大埔鄉": "嘉義縣大埔鄉",
+    "阿里山鄉": "嘉義縣阿里山鄉",
+
+    # 嘉義市 (直轄市)
+    "嘉義市": "嘉義市嘉義市",
+
+    # 新竹縣 (1市 3鎮 9鄉)
+    "竹北市": "新竹縣竹北市",
+    "竹東鎮": "新竹縣竹東鎮",
+    "新埔鎮": "新竹縣新埔鎮",
+    "關西鎮": "新竹縣關西鎮",
+    "湖口鄉": "新竹縣湖口鄉",
+    "新豐鄉": "新竹縣新豐鄉",
+    "芎林鄉": "新竹縣芎林鄉",
+    "橫山鄉": "新竹縣橫山鄉",
+    "北埔鄉": "新竹縣北埔鄉",
+    "寶山鄉": "新竹縣寶山鄉",
+    "峨眉鄉": "新竹縣峨眉鄉",
+    "尖石鄉": "新竹縣尖石鄉",
+    "五峰鄉": "新竹縣五峰鄉",
+
+    # 新竹市 (直轄市)
+    "新竹市": "新竹市新竹市",
+}
+
+_TRIE_END = ''
+
+def _build_prefix_trie(mapping: dict) -> dict:
+    """將 {簡稱: 全名} 建成以字元為節點的前綴樹，葉節點以空字串鍵存放 (簡稱, 全名)。"""
+    trie = {}
+    for short, full in mapping.items():
+        node = trie
+        for char in short:
+            node = node.setdefault(char, {})
+        node[_TRIE_END] = (short, full)
+    return trie
+
+_COUNTY_TRIE = _build_prefix_trie(COUNTY_MAP)
+
+def _expand_county(addr: str) -> str:
+    """
+    沿前綴樹走訪地址開頭，找到最長的鄉鎮市簡稱後補上縣市名稱。
+    對照表中沒有任何簡稱是另一個簡稱的前綴，因此結果與逐一 startswith 掃描相同。
+    """
+    node = _COUNTY_TRIE
+    found = None
+    for char in addr:
+        node = node.get(char)
+        if node is None:
+            break
+        if _TRIE_END in node:
+            found = node[_TRIE_END]
+    if found is None:
+        return addr
+    short, full = found
+    return full + addr[len(short):]
+
+def chinese_to_arabic(cn_num_str: str) -> str:
+    """
+    進階的中文數字轉阿拉伯數字函式，能處理'五百五十七'這樣的語意。
+    """
+    if not isinstance(cn_num_str, str): return cn_num_str
+
+    # 直接替換，處理 "五十之三" -> "50之3"
+    for cn, ar in _CN_NUM_MAP.items():
+        cn_num_str = cn_num_str.replace(cn, str(ar))
+
+    # 處理進位
+    if '十' in cn_num_str and cn_num_str.startswith('十'):
+        cn_num_str = '1' + cn_num_str
+
+    def _trans(s):
+        num = 0
+        if s:
+            idx = s.find('十')
+            if idx != -1:
+                num += int(s[:idx]) * 10
+                if len(s) > idx+1:
+                    num += int(s[idx+1:])
+            else:
+                num += int(s)
+        return num
+
+    sec = cn_num_str.split('百')
+    if len(sec) > 2: # 避免多個 "百"
+        return cn_num_str
+
+    num = 0
+    if len(sec) == 2:
+        if sec[0]:
+            num += int(sec[0]) * 100
+        else: #處理 "百三" -> 103
+             num += 100
+        num += _trans(sec[1])
+    else:
+        num = _trans(sec[0])
+    return str(num)
+
+def _chinese_number_repl(match) -> str:
+    return chinese_to_arabic(match.group(1))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_cached(address: str) -> tuple:
+    """核心正規化邏輯，回傳 (full, city, district)。以原始字串為鍵做 LRU 快取。"""
+    if not address.strip():
+        return ("", "", "")
+
+    addr = address.strip().upper().replace(" ", "").replace("\u3000", "").replace("臺", "台")
+    addr = addr.replace('.', '、').replace('-', '之')
+    addr = addr.translate(_FULL_WIDTH_TABLE)
+    addr = addr.replace('鎭', '鎮')
+    addr = addr.replace('F', '樓')
+    addr = _RE_PARENTHESES.sub('', addr)
+    addr = _RE_NEIGHBORHOOD.sub('', addr)
+    addr = _RE_REPEATED_UNIT.sub(r'\1', addr)
+    addr = _RE_CHINESE_NUMBER.sub(_chinese_number_repl, addr)
+    addr = _expand_county(addr)
+
+    match = _RE_ADDRESS_PARTS.search(addr)
+    if not match: return (addr, "", "")
+    parts = match.groupdict(default='')
+
+    # --- 擴充權威性判斷規則 ---
+    village_part = parts['village']
+    # 如果地址中包含路/街/段，或「巷」，則村里為贅述，應忽略
+    if parts['road'] or parts['section'] or parts['lane']:
+        village_part = ''
+
+    normalized_full = f"{parts['city']}{parts['district']}{village_part}{parts['road']}{parts['section']}{parts['lane']}{parts['alley']}{parts['number']}{parts['floor']}{parts['rest']}"
+    normalized_full = _RE_WHITESPACE.sub('', normalized_full).strip()
+
+    return (normalized_full, parts['city'], parts['district'])
+
+def normalize_address(address) -> Dict[str, str]:
+    """對單一台灣地址進行深度正規化，回傳 {'full', 'city', 'district'}。"""
+    if not isinstance(address, str):
+        return {'full': "", 'city': "", 'district': ""}
+    full, city, district = _normalize_cached(address)
+    return {'full': full, 'city': city, 'district': district}
+
+def normalize_address_series(addresses: pd.Series) -> pd.DataFrame:
+    """
+    批次正規化一整欄地址。
+    相同的原始字串只會計算一次，回傳與輸入同索引、含 full / city / district 三欄的 DataFrame。
+    """
+    codes, uniques = pd.factorize(addresses, use_na_sentinel=True)
+    results = [_normalize_cached(a) if isinstance(a, str) else ("", "", "") for a in uniques]
+    # 在最後補一組空值，讓 NaN (代碼 -1) 直接對應到空字串
+    results.append(("", "", ""))
+    table = pd.DataFrame(results, columns=['full', 'city', 'district'])
+    out = table.iloc[codes].reset_index(drop=True)
+    out.index = addresses.index
+    return out
+
+def normalize_address_map(addresses) -> Dict[str, str]:
+    """將多個原始地址批次轉成 {原始地址: 正規化完整地址} 的字典 (忽略空值)。"""
+    series = pd.Series(list(addresses), dtype=object).dropna().drop_duplicates()
+    if series.empty:
+        return {}
+    return dict(zip(series, normalize_address_series(series)['full']))
+
+def clear_cache():
+    """清除 LRU 快取 (例如修改了 COUNTY_MAP 之後)。"""
+    _normalize_cached.cache_clear()
@@ -0,0 +1,214 @@
+# cli.py
+# 無介面 (headless) 的命令列入口，供排程 (cron / Windows 工作排程器) 於夜間執行同步。
+#
+#   python cli.py sync-workers                       # 移工名冊同步 (管線化下載 + 批次寫入)
+#   python cli.py sync-b04 --start 2025-01-01        # B04 帳務同步 (預設為本月 1 日至今天)
+#   python cli.py gen-recurring --start 2025-01      # 產生固定收入 (預設為本月)
+#   python cli.py refresh-aggregates                 # 重新整理彙總/統計資料
+#   python cli.py data-quality --apply               # 資料品質檢查 (加上 --apply 才會校正)
+#   python cli.py batch-reports --month 2025-06      # 月底批次報表 (預設為所有我司管理宿舍，輸出 reports/2025-06.zip)
+#
+# 所有設定皆讀取 config.ini (與介面相同)。工作同樣記錄在 "Jobs" 表，介面上可看到排程工作的進度。
+# 結束代碼：0 成功、1 失敗、2 參數錯誤、3 已有同類型工作執行中、4 設定或資料庫連線錯誤。
+
+import argparse
+import configparser
+import json
+import os
+import sys
+from datetime import date, datetime
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_BUSY = 3
+EXIT_CONFIG = 4
+
+def _app_dir() -> str:
+    """程式所在資料夾 (打包成 .exe 時為執行檔所在資料夾)。"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def _parse_date(value: str) -> date:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式錯誤: '{value}' (應為 YYYY-MM-DD)")
+
+def _parse_month(value: str) -> date:
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"月份格式錯誤: '{value}' (應為 YYYY-MM)")
+
+def _load_config(config_path: str) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    return config
+
+# ==============================================================================
+# 各指令的工作內容 (以 job_runner.run_job_inline 執行，簽章需接受 log_callback / progress_callback)
+# ==============================================================================
+
+def _sync_workers(config, args, log_callback, progress_callback):
+    import sync_pipeline
+    import updater
+    url = config.get('System', 'URL', fallback='http://127.0.0.1')
+    auth = (config.get('System', 'ACCOUNT', fallback=''), config.get('System', 'PASSWORD', fallback=''))
+    temp_dir = args.temp_dir or config.get('System', 'TEMP_DIR', fallback='temp_downloads')
+    max_departure_ratio = updater.DEPARTURE_SAFETY_RATIO if args.max_departure_ratio is None else args.max_departure_ratio
+    if args.no_departure_guard:
+        max_departure_ratio = None
+    return sync_pipeline.run_worker_sync_pipeline(
+        url, auth, temp_dir, log_callback, progress_callback,
+        max_workers=args.workers, max_departure_ratio=max_departure_ratio
+    )
+
+def _sync_b04(config, args, log_callback, progress_callback):
+    import sync_pipeline
+    url = config.get('SystemB04', 'URL', fallback='http://192.168.1.168/labor')
+    auth = (config.get('SystemB04', 'ACCOUNT', fallback=''), config.get('SystemB04', 'PASSWORD', fallback=''))
+    temp_dir = args.temp_dir or config.get('SystemB04', 'TEMP_DIR', fallback='temp_downloads_accounting')
+    start = args.start or date.today().replace(day=1)
+    end = args.end or date.today()
+    mapping = sync_pipeline.load_fee_config().get('mapping', {})
+    return sync_pipeline.run_b04_sync_pipeline(
+        url, auth, (start, end), temp_dir, mapping, log_callback, progress_callback, max_workers=args.workers
+    )
+
+def _gen_recurring(config, args, log_callback, progress_callback):
+    from data_models import income_model
+    start = args.start or date.today().replace(day=1)
+    end = args.end or start
+    log_callback(f"INFO: 產生 {start:%Y-%m} ~ {end:%Y-%m} 的固定收入...")
+    success, message = income_model.batch_generate_recurring_income(start, end)
+    log_callback(f"{'SUCCESS' if success else 'ERROR'}: {message}")
+    return {'status': 'success' if success else 'failed', 'message': message}
+
+def _refresh_aggregates(config, args, log_callback, progress_callback):
+    import database
+    from data_models import analytics_model  # 載入時註冊 utility_anomalies 重新整理函式
+    results = database.refresh_aggregates(log_callback, names=args.only)
+    failed = [name for name, outcome in results.items() if outcome != 'success']
+    return {'status': 'failed' if failed or not results else 'success', 'refreshed': len(results) - len(failed), 'failed': failed}
+
+def _data_quality(config, args, log_callback, progress_callback):
+    from data_models import data_quality_model
+    report_df = data_quality_model.run_checks(apply=args.apply, rules=args.only, log_callback=log_callback)
+    for row in report_df[report_df['問題筆數'] > 0].itertuples(index=False):
+        log_callback(f"  {row[1]}.{row[2]}: 問題 {row[3]} 筆，{'已修正' if args.apply else '可自動修正'} {row[4]} 筆")
+    found = int(report_df['問題筆數'].sum()) if not report_df.empty else 0
+    fixed = int(report_df.iloc[:, 4].sum()) if not report_df.empty else 0
+    return {'status': 'success', 'found': found, 'fixed' if args.apply else 'fixable': fixed}
+
+def _batch_reports(config, args, log_callback, progress_callback):
+    import report_batch
+    from data_models import dormitory_model
+    year_month = f"{args.month:%Y-%m}"
+    dorm_ids = args.dorms or [d['id'] for d in dormitory_model.get_my_company_dorms_for_selection()]
+    output = args.out or os.path.join('reports', f"{year_month}.zip")
+    result = report_batch.generate_dorm_reports(
+        dorm_ids, year_month, output, report_types=args.types, fixed_subsidy=args.subsidy,
+        include_external_workers=args.include_external, log_callback=log_callback,
+        progress_callback=progress_callback, max_workers=args.workers
+    )
+    return {**result, 'output': os.path.abspath(output)}
+
+COMMANDS = {
+    'sync-workers': ('worker_sync', '排程：移工名冊同步', _sync_workers),
+    'sync-b04': ('b04_sync', '排程：B04 帳務同步', _sync_b04),
+    'gen-recurring': ('recurring_income', '排程：產生固定收入', _gen_recurring),
+    'refresh-aggregates': ('refresh_aggregates', '排程：重新整理彙總資料', _refresh_aggregates),
+    'data-quality': ('data_quality', '排程：資料品質檢查', _data_quality),
+    'batch-reports': ('batch_reports', '排程：月底批次報表', _batch_reports),
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='cli', description='宿舍管理系統的排程/命令列工具')
+    parser.add_argument('--config', help='config.ini 路徑 (預設為程式所在資料夾中的 config.ini)')
+    parser.add_argument('--quiet', action='store_true', help='不輸出執行日誌，只輸出最後結果')
+    parser.add_argument('--json', action='store_true', help='以 JSON 格式輸出最後結果')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('sync-workers', help='下載移工報表並同步至資料庫')
+    p.add_argument('--temp-dir', help='暫存資料夾 (預設為 config.ini [System] TEMP_DIR)')
+    p.add_argument('--workers', type=int, help='解析報表的行程數 (預設為 CPU 核心數)')
+    p.add_argument('--max-departure-ratio', type=float, help='離職標記的安全比例上限 (預設為 updater.DEPARTURE_SAFETY_RATIO)')
+    p.add_argument('--no-departure-guard', action='store_true', help='停用離職標記的安全比例檢查')
+
+    p = subparsers.add_parser('sync-b04', help='下載 B04 帳務報表並匯入費用')
+    p.add_argument('--start', type=_parse_date, help='帳務起始日 YYYY-MM-DD (預設為本月 1 日)')
+    p.add_argument('--end', type=_parse_date, help='帳務結束日 YYYY-MM-DD (預設為今天)')
+    p.add_argument('--temp-dir', help='暫存資料夾 (預設為 config.ini [SystemB04] TEMP_DIR)')
+    p.add_argument('--workers', type=int, help='解析報表的行程數 (預設為 CPU 核心數)')
+
+    p = subparsers.add_parser('gen-recurring', help='依固定收入設定產生每月收入')
+    p.add_argument('--start', type=_parse_month, help='起始月份 YYYY-MM (預設為本月)')
+    p.add_argument('--end', type=_parse_month, help='結束月份 YYYY-MM (預設與起始月份相同)')
+
+    p = subparsers.add_parser('refresh-aggregates', help='重新整理彙總/統計資料')
+    p.add_argument('--only', nargs='+', help='只執行指定名稱的重新整理項目')
+
+    p = subparsers.add_parser('data-quality', help='檢查 (並校正) 日期、月份格式、宿舍正規化地址與重複的費用歷史')
+    p.add_argument('--apply', action='store_true', help='實際寫入校正結果 (預設只檢查)')
+    p.add_argument('--only', nargs='+', help='只執行指定的規則 (date_range / month_format / dorm_address / fee_history_duplicates)')
+
+    import report_batch
+    p = subparsers.add_parser('batch-reports', help='為多間宿舍產生指定月份的報表 (每間一個 Excel 檔)')
+    p.add_argument('--month', type=_parse_month, required=True, help='報表月份 YYYY-MM')
+    p.add_argument('--out', help='輸出的 .zip 檔或資料夾 (預設為 reports/<月份>.zip)')
+    p.add_argument('--dorms', type=int, nargs='+', help='宿舍 ID (預設為所有我司管理宿舍)')
+    p.add_argument('--types', nargs='+', choices=list(report_batch.REPORT_TYPES), help='報表種類 (預設全部)')
+    p.add_argument('--subsidy', type=int, default=report_batch.DEFAULT_FIXED_SUBSIDY, help='超額水電費計算基準 (元/月)')
+    p.add_argument('--include-external', action='store_true', help='超額水電費將「掛宿外住」人員納入分攤計算')
+    p.add_argument('--workers', type=int, help='產生活頁簿的行程數 (預設為 CPU 核心數，1 表示不使用行程池)')
+    return parser
+
+# 以路徑為值的參數：使用者給的相對路徑以呼叫時的工作目錄為準
+PATH_ARGUMENTS = ('config', 'temp_dir', 'out')
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+
+    for name in PATH_ARGUMENTS:
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    # 排程執行時的工作目錄不一定是程式資料夾；切換過去讓相對路徑 (暫存資料夾、fee_config.json) 與介面一致
+    os.chdir(_app_dir())
+    import database
+    if args.config:
+        database.CONFIG_FILE = args.config
+    if not os.path.exists(database.CONFIG_FILE):
+        print(f"CRITICAL: 找不到設定檔 {database.CONFIG_FILE}", file=sys.stderr)
+        return EXIT_CONFIG
+    conn = database.get_db_connection()
+    if not conn:
+        print("CRITICAL: 無法連接到資料庫，請檢查 config.ini 的 [Database] 設定。", file=sys.stderr)
+        return EXIT_CONFIG
+    conn.close()
+
+    import job_runner
+    config = _load_config(database.CONFIG_FILE)
+    job_type, title, func = COMMANDS[args.command]
+    echo = None if args.quiet else (lambda message: print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True))
+    result = job_runner.run_job_inline(job_type, title, func, config, args, echo=echo)
+
+    status = result.get('status')
+    exit_code = {'success': EXIT_OK, 'busy': EXIT_BUSY}.get(status, EXIT_FAILED)
+    summary = {'command': args.command, 'exit_code': exit_code, **result}
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, default=str))
+    else:
+        print(f"{args.command}: {status} " + ', '.join(f"{k}={v}" for k, v in result.items() if k != 'status'))
+    return exit_code
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
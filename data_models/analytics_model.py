@@ -1,9 +1,15 @@
+import numpy as np
 import pandas as pd
+import psycopg2.extensions
+from psycopg2.extras import execute_values
 import database
 
 def _execute_query_to_dataframe(conn, query, params=None):
-    """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
-    with conn.cursor() as cursor:
+    """
+    一個輔助函式，用來手動執行查詢並回傳 DataFrame。
+    分析查詢動輒數十萬列，改用回傳 tuple 的一般游標 (比 RealDictCursor 逐列建立字典快數倍)。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
         cursor.execute(query, params)
         records = cursor.fetchall()
         if not records:
@@ -69,56 +75,138 @@ def get_bill_history_for_meter(meter_id: int):
     finally:
         if conn: conn.close()
 
+# --- 異常偵測引擎 ---
+# 所有電水錶一次計算，不逐錶、逐帳單迴圈：
+#   金額：每個錶的四分位數以 percentile_cont 在資料庫端計算，只把超出 IQR 範圍的帳單傳回
+#   用量：以 groupby().shift / cumsum 一次算出每筆帳單的「上一期」與「歷年同月平均」
+# 兩者皆可用 meter_ids 只計算指定的電水錶。
+
+IQR_MIN_BILLS = 4
+IQR_FACTOR = 1.5
+
+EXPENSE_ANOMALY_QUERY = """
+    WITH bills AS (
+        SELECT
+            b.id AS bill_id, b.meter_id,
+            d.original_address, m.meter_type, m.meter_number,
+            b.bill_end_date, b.amount, b.payer, b.is_pass_through
+        FROM "UtilityBills" b
+        JOIN "Meters" m ON b.meter_id = m.id
+        JOIN "Dormitories" d ON b.dorm_id = d.id
+        WHERE d.primary_manager = '我司' {meter_filter}
+    ),
+    bounds AS (
+        SELECT
+            meter_id,
+            COUNT(*) AS bill_count,
+            percentile_cont(0.25) WITHIN GROUP (ORDER BY amount) AS q1,
+            percentile_cont(0.75) WITHIN GROUP (ORDER BY amount) AS q3
+        FROM bills
+        GROUP BY meter_id
+    ),
+    ranged AS (
+        SELECT
+            meter_id,
+            q1 - %(factor)s * (q3 - q1) AS lower_bound,
+            q3 + %(factor)s * (q3 - q1) AS upper_bound
+        FROM bounds
+        WHERE bill_count >= %(min_bills)s
+    )
+    SELECT bills.*, ranged.lower_bound, ranged.upper_bound
+    FROM bills
+    JOIN ranged ON bills.meter_id = ranged.meter_id
+    WHERE bills.amount < ranged.lower_bound OR bills.amount > ranged.upper_bound
+    ORDER BY bills.original_address, bills.meter_type, bills.meter_number, bills.bill_end_date
+"""
+
+USAGE_BILLS_QUERY = """
+    SELECT
+        b.id AS bill_id, b.meter_id,
+        d.original_address, m.meter_type, m.meter_number,
+        b.bill_end_date, b.usage_amount::float8 AS usage_amount, b.payer, b.is_pass_through
+    FROM "UtilityBills" b
+    JOIN "Meters" m ON b.meter_id = m.id
+    JOIN "Dormitories" d ON b.dorm_id = d.id
+    WHERE d.primary_manager = '我司' AND b.usage_amount IS NOT NULL {meter_filter}
+"""
+
+def _meter_filter(meter_ids) -> tuple:
+    """meter_ids 為 None 時計算所有電水錶，否則只計算指定的電水錶。"""
+    if meter_ids is None:
+        return "", {}
+    return "AND b.meter_id = ANY(%(meter_ids)s)", {"meter_ids": [int(m) for m in meter_ids]}
+
+def _score_expense_anomalies(conn, meter_ids=None) -> pd.DataFrame:
+    """以 IQR 找出金額異常的帳單 (保留 bill_id / meter_id 及上下限)。"""
+    meter_filter, params = _meter_filter(meter_ids)
+    params.update({"factor": IQR_FACTOR, "min_bills": IQR_MIN_BILLS})
+    df = _execute_query_to_dataframe(conn, EXPENSE_ANOMALY_QUERY.format(meter_filter=meter_filter), params)
+    if df.empty:
+        return df
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    df['判斷'] = np.where(df['amount'] > df['upper_bound'], '費用過高', '費用過低')
+    df['正常範圍'] = [f"{int(low):,} ~ {int(high):,}" for low, high in zip(df['lower_bound'], df['upper_bound'])]
+    return df
+
+def _score_usage_anomalies(df: pd.DataFrame, threshold_percent: float) -> pd.DataFrame:
+    """
+    對一批帳單 (可含多個電水錶) 一次計算用量異常：
+    先與上一期比較，超出門檻即為異常；否則再與「歷年同月份」的平均用量比較。
+    """
+    if df.empty:
+        return df
+    df = df.copy()
+    df['bill_end_date'] = pd.to_datetime(df['bill_end_date'])
+    df = df.sort_values(['meter_id', 'bill_end_date'], kind='stable').reset_index(drop=True)
+    usage = df['usage_amount']
+
+    by_meter = df.groupby('meter_id', sort=False)
+    prev_usage = by_meter['usage_amount'].shift(1)
+    prev_date = by_meter['bill_end_date'].shift(1)
+
+    # 同一個錶、同月份之前所有帳單的平均 (不含本期)
+    by_month = [df['meter_id'], df['bill_end_date'].dt.month]
+    prior_usage = usage.groupby(by_month, sort=False).shift(1)
+    prior_sum = prior_usage.groupby(by_month, sort=False).cumsum()
+    prior_count = df.groupby(by_month, sort=False).cumcount()
+    last_year_avg = (prior_sum / prior_count).where(prior_count > 0)
+
+    prev_percent = (usage - prev_usage) / prev_usage * 100
+    yoy_percent = (usage - last_year_avg) / last_year_avg * 100
+    prev_hit = (prev_usage > 0) & (prev_percent.abs() > threshold_percent)
+    yoy_hit = ~prev_hit & (last_year_avg > 0) & (yoy_percent.abs() > threshold_percent)
+
+    hits = prev_hit | yoy_hit
+    if not hits.any():
+        return df.iloc[0:0]
+    result = df[hits].copy()
+    percent = prev_percent.where(prev_hit, yoy_percent)[hits]
+    result['compare_base'] = prev_usage.where(prev_hit, last_year_avg)[hits]
+    result['判斷'] = np.where(percent > 0, '用量過高', '用量過低')
+    direction = np.where(percent > 0, '增加', '減少')
+    prev_text = "較上期 (" + prev_date[hits].dt.strftime('%Y-%m-%d') + ") "
+    yoy_text = "較去年同期平均 (" + last_year_avg[hits].map('{:.1f}'.format) + ") "
+    result['分析說明'] = (
+        prev_text.where(prev_hit[hits], yoy_text) + direction + " " + percent.abs().map('{:.0f}%'.format)
+    )
+    return result.sort_values(['original_address', 'meter_type', 'meter_number', 'bill_end_date'], kind='stable')
+
+def _load_usage_bills(conn, meter_ids=None) -> pd.DataFrame:
+    meter_filter, params = _meter_filter(meter_ids)
+    return _execute_query_to_dataframe(conn, USAGE_BILLS_QUERY.format(meter_filter=meter_filter), params)
+
 def find_expense_anomalies():
     """
-    【v1.1 修改版】使用統計學方法 (IQR)，找出所有我司管理宿舍中，費用異常升高或降低的帳單紀錄。
-    新增「支付方」和「是否為代收代付」欄位。
+    【v2.0 向量化版】使用統計學方法 (IQR)，找出所有我司管理宿舍中，費用異常升高或降低的帳單紀錄。
+    四分位數在資料庫端以 percentile_cont 一次算出所有電水錶的範圍，只傳回異常的帳單。
     """
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
     try:
-        query = """
-            SELECT
-                d.original_address,
-                m.meter_type,
-                m.meter_number,
-                b.bill_start_date,
-                b.bill_end_date,
-                b.amount,
-                b.payer,
-                b.is_pass_through
-            FROM "UtilityBills" b
-            JOIN "Meters" m ON b.meter_id = m.id
-            JOIN "Dormitories" d ON b.dorm_id = d.id
-            WHERE d.primary_manager = '我司'
-        """
-        df = _execute_query_to_dataframe(conn, query)
-        if df.empty or len(df) < 4:
+        result_df = _score_expense_anomalies(conn)
+        if result_df.empty:
             return pd.DataFrame()
 
-        anomalies = []
-        for meter, group in df.groupby(['original_address', 'meter_type', 'meter_number']):
-            if len(group) < 4: continue
-
-            Q1 = group['amount'].quantile(0.25)
-            Q3 = group['amount'].quantile(0.75)
-            IQR = Q3 - Q1
-            
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
-            
-            outliers = group[(group['amount'] < lower_bound) | (group['amount'] > upper_bound)].copy()
-            
-            if not outliers.empty:
-                outliers['判斷'] = outliers['amount'].apply(lambda x: '費用過高' if x > upper_bound else '費用過低')
-                outliers['正常範圍'] = f"{int(lower_bound):,} ~ {int(upper_bound):,}"
-                anomalies.append(outliers)
-
-        if not anomalies:
-            return pd.DataFrame()
-            
-        result_df = pd.concat(anomalies)
-        
         result_df.rename(columns={
             'original_address': '宿舍地址',
             'meter_type': '類型',
@@ -128,83 +216,213 @@ def find_expense_anomalies():
             'payer': '支付方',
             'is_pass_through': '是否為代收代付'
         }, inplace=True)
-        
+
         return result_df[['宿舍地址', '類型', '錶號', '帳單迄日', '異常金額', '支付方', '是否為代收代付', '正常範圍', '判斷']]
     finally:
         if conn: conn.close()
 
 def find_usage_anomalies(threshold_percent: float = 10.0):
     """
-    【v1.1 修正版】分析所有電水錶的「用量」，找出與「上一期」或「去年同期」相比，波動超過指定百分比的紀錄。
-    修正 Decimal 與 float 型別不相容的錯誤。
+    【v2.0 向量化版】分析所有電水錶的「用量」，找出與「上一期」或「去年同期」相比，波動超過指定百分比的紀錄。
+    所有電水錶一次以 groupby 計算，用量在資料庫端即轉為 float。
     """
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
+    try:
+        result_df = _score_usage_anomalies(_load_usage_bills(conn), threshold_percent)
+        if result_df.empty:
+            return pd.DataFrame()
+
+        result_df['bill_end_date'] = result_df['bill_end_date'].dt.strftime('%Y-%m-%d')
+        result_df.rename(columns={
+            'original_address': '宿舍地址',
+            'meter_type': '類型',
+            'meter_number': '錶號',
+            'bill_end_date': '帳單迄日',
+            'usage_amount': '本期用量',
+            'compare_base': '比較基準',
+            'payer': '支付方',
+            'is_pass_through': '代收代付?'
+        }, inplace=True)
+
+        return result_df[['宿舍地址', '類型', '錶號', '帳單迄日', '本期用量', '比較基準', '支付方', '代收代付?', '判斷', '分析說明']].reset_index(drop=True)
+    finally:
+        if conn: conn.close()
+
+# --- 異常旗標 (UtilityAnomalies) ---
+# 偵測結果保存在 "UtilityAnomalies"，頁面只讀取未處理 (open) 的旗標，不必每次重新掃描所有帳單。
+# 新增、修改、刪除帳單時由 finance_model / 批次匯入呼叫 refresh_anomalies(cursor, [錶號ID])，
+# 只重新計算受影響的電水錶 (IQR 範圍與同月平均都以整個錶的歷史計算，錶就是最小的重算範圍)。
+# 排程的 refresh-aggregates 會整表重新計算一次，補上其他途徑寫入的帳單。
+
+USAGE_THRESHOLD_PERCENT = 10.0
+ANOMALY_STATUS_OPEN = 'open'
+ANOMALY_STATUS_DISMISSED = 'dismissed'
+
+def _anomaly_records(expense_df: pd.DataFrame, usage_df: pd.DataFrame) -> list:
+    """(bill_id, meter_id, kind, verdict, baseline, description)"""
+    records = []
+    if not expense_df.empty:
+        records += [
+            (int(bill_id), int(meter_id), 'expense', verdict, None, normal_range)
+            for bill_id, meter_id, verdict, normal_range
+            in zip(expense_df['bill_id'], expense_df['meter_id'], expense_df['判斷'], expense_df['正常範圍'])
+        ]
+    if not usage_df.empty:
+        records += [
+            (int(bill_id), int(meter_id), 'usage', verdict, float(baseline), description)
+            for bill_id, meter_id, verdict, baseline, description
+            in zip(usage_df['bill_id'], usage_df['meter_id'], usage_df['判斷'], usage_df['compare_base'], usage_df['分析說明'])
+        ]
+    return records
+
+def refresh_anomalies(cursor, meter_ids=None) -> int:
+    """
+    在呼叫端的交易中重新計算指定電水錶 (None 為全部) 的異常旗標，回傳目前的旗標數。
+    仍然異常的帳單保留原本的處理狀態；判斷結果改變 (例如過高變過低) 時重新開啟。
+    """
+    if meter_ids is not None:
+        meter_ids = sorted({int(m) for m in meter_ids if m is not None and not pd.isna(m)})
+        if not meter_ids:
+            return 0
+    conn = cursor.connection
+    records = _anomaly_records(
+        _score_expense_anomalies(conn, meter_ids),
+        _score_usage_anomalies(_load_usage_bills(conn, meter_ids), USAGE_THRESHOLD_PERCENT)
+    )
+
+    kept_ids = []
+    if records:
+        kept = execute_values(cursor, f"""
+            INSERT INTO "UtilityAnomalies" AS a (bill_id, meter_id, kind, verdict, baseline, description)
+            VALUES %s
+            ON CONFLICT (bill_id, kind) DO UPDATE SET
+                meter_id = EXCLUDED.meter_id,
+                baseline = EXCLUDED.baseline,
+                description = EXCLUDED.description,
+                status = CASE WHEN a.verdict IS DISTINCT FROM EXCLUDED.verdict THEN '{ANOMALY_STATUS_OPEN}' ELSE a.status END,
+                detected_at = CASE WHEN a.verdict IS DISTINCT FROM EXCLUDED.verdict THEN CURRENT_TIMESTAMP ELSE a.detected_at END,
+                verdict = EXCLUDED.verdict
+            RETURNING a.id
+        """, records, page_size=1000, fetch=True)
+        kept_ids = [row['id'] for row in kept]
+
+    # 不再異常 (或已移到其他錶、宿舍已非我司管理) 的旗標移除
+    scope = "TRUE" if meter_ids is None else "meter_id = ANY(%(meter_ids)s)"
+    cursor.execute(f"""
+        DELETE FROM "UtilityAnomalies" WHERE {scope} AND id <> ALL(%(kept_ids)s)
+    """, {'meter_ids': meter_ids, 'kept_ids': kept_ids})
+    return len(kept_ids)
+
+@database.register_aggregate_refresher('utility_anomalies')
+def rebuild_anomalies(cursor):
+    """整表重新計算所有電水錶的異常旗標。"""
+    count = refresh_anomalies(cursor)
+    print(f"INFO: 水電異常旗標已重新計算，共 {count} 筆。")
+
+def rebuild_all_anomalies():
+    """供頁面按鈕使用：在獨立交易中整表重新計算。"""
+    conn = database.get_db_connection()
+    if not conn: return False, "資料庫連線失敗。"
+    try:
+        with conn.cursor() as cursor:
+            count = refresh_anomalies(cursor)
+        conn.commit()
+        return True, f"已重新計算所有電水錶，共 {count} 筆異常。"
+    except Exception as e:
+        if conn: conn.rollback()
+        return False, f"重新計算異常時發生錯誤: {e}"
+    finally:
+        if conn: conn.close()
+
+OPEN_EXPENSE_ANOMALIES_QUERY = """
+    SELECT
+        a.id,
+        d.original_address AS "宿舍地址", m.meter_type AS "類型", m.meter_number AS "錶號",
+        b.bill_end_date AS "帳單迄日", b.amount AS "異常金額",
+        b.payer AS "支付方", b.is_pass_through AS "是否為代收代付",
+        a.description AS "正常範圍", a.verdict AS "判斷"
+    FROM "UtilityAnomalies" a
+    JOIN "UtilityBills" b ON a.bill_id = b.id
+    JOIN "Meters" m ON a.meter_id = m.id
+    JOIN "Dormitories" d ON b.dorm_id = d.id
+    WHERE a.kind = 'expense' AND a.status = %(status)s
+    ORDER BY d.original_address, m.meter_type, m.meter_number, b.bill_end_date
+"""
+
+OPEN_USAGE_ANOMALIES_QUERY = """
+    SELECT
+        a.id,
+        d.original_address AS "宿舍地址", m.meter_type AS "類型", m.meter_number AS "錶號",
+        to_char(b.bill_end_date, 'YYYY-MM-DD') AS "帳單迄日",
+        b.usage_amount::float8 AS "本期用量", a.baseline::float8 AS "比較基準",
+        b.payer AS "支付方", b.is_pass_through AS "代收代付?",
+        a.verdict AS "判斷", a.description AS "分析說明"
+    FROM "UtilityAnomalies" a
+    JOIN "UtilityBills" b ON a.bill_id = b.id
+    JOIN "Meters" m ON a.meter_id = m.id
+    JOIN "Dormitories" d ON b.dorm_id = d.id
+    WHERE a.kind = 'usage' AND a.status = %(status)s
+    ORDER BY d.original_address, m.meter_type, m.meter_number, b.bill_end_date
+"""
+
+def _get_open_anomalies(query: str) -> pd.DataFrame:
+    conn = database.get_db_connection()
+    if not conn: return pd.DataFrame()
+    try:
+        return _execute_query_to_dataframe(conn, query, {'status': ANOMALY_STATUS_OPEN})
+    finally:
+        if conn: conn.close()
+
+def get_open_expense_anomalies() -> pd.DataFrame:
+    """讀取尚未處理的金額異常旗標 (欄位同 find_expense_anomalies，另含旗標 id)。"""
+    return _get_open_anomalies(OPEN_EXPENSE_ANOMALIES_QUERY)
+
+def get_open_usage_anomalies() -> pd.DataFrame:
+    """讀取尚未處理的用量異常旗標 (欄位同 find_usage_anomalies，另含旗標 id)。"""
+    return _get_open_anomalies(OPEN_USAGE_ANOMALIES_QUERY)
+
+def dismiss_anomalies(anomaly_ids: list):
+    """將旗標標示為已處理；帳單之後若再被判定為不同的異常會重新開啟。"""
+    if not anomaly_ids:
+        return False, "沒有選擇任何異常紀錄。"
+    conn = database.get_db_connection()
+    if not conn: return False, "資料庫連線失敗。"
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'UPDATE "UtilityAnomalies" SET status = %s WHERE id = ANY(%s)',
+                (ANOMALY_STATUS_DISMISSED, [int(i) for i in anomaly_ids])
+            )
+            count = cursor.rowcount
+        conn.commit()
+        return True, f"已將 {count} 筆異常標示為已處理。"
+    except Exception as e:
+        if conn: conn.rollback()
+        return False, f"更新異常狀態時發生錯誤: {e}"
+    finally:
+        if conn: conn.close()
+
+def get_recent_anomalies(days: int = 30) -> pd.DataFrame:
+    """最近 days 天內新偵測到、尚未處理的異常 (供提醒頁面使用)。"""
+    conn = database.get_db_connection()
+    if not conn: return pd.DataFrame()
     try:
         query = """
             SELECT
-                d.original_address, m.meter_type, m.meter_number,
-                b.bill_end_date, b.usage_amount, b.payer, b.is_pass_through
-            FROM "UtilityBills" b
-            JOIN "Meters" m ON b.meter_id = m.id
+                d.original_address AS "宿舍地址", m.meter_type AS "類型", m.meter_number AS "錶號",
+                b.bill_end_date AS "帳單迄日",
+                CASE a.kind WHEN 'expense' THEN '金額' ELSE '用量' END AS "異常類型",
+                a.verdict AS "判斷",
+                CASE a.kind WHEN 'expense' THEN '正常範圍 ' || a.description ELSE a.description END AS "說明",
+                a.detected_at::date AS "偵測日期"
+            FROM "UtilityAnomalies" a
+            JOIN "UtilityBills" b ON a.bill_id = b.id
+            JOIN "Meters" m ON a.meter_id = m.id
             JOIN "Dormitories" d ON b.dorm_id = d.id
-            WHERE d.primary_manager = '我司' AND b.usage_amount IS NOT NULL
+            WHERE a.status = %(status)s AND a.detected_at >= CURRENT_TIMESTAMP - make_interval(days => %(days)s)
+            ORDER BY a.detected_at DESC, d.original_address
         """
-        df = _execute_query_to_dataframe(conn, query)
-        if df.empty:
-            return pd.DataFrame()
-
-        df['bill_end_date'] = pd.to_datetime(df['bill_end_date'])
-        df.sort_values(by=['original_address', 'meter_type', 'meter_number', 'bill_end_date'], inplace=True)
-        
-        anomalies = []
-        
-        for meter, group in df.groupby(['original_address', 'meter_type', 'meter_number']):
-            if len(group) < 2: continue
-
-            group['prev_usage'] = group['usage_amount'].shift(1)
-            group['prev_date'] = group['bill_end_date'].shift(1)
-            
-            group['year'] = group['bill_end_date'].dt.year
-            group['month'] = group['bill_end_date'].dt.month
-            group['last_year_avg'] = group.groupby('month')['usage_amount'].transform(lambda x: x.shift(1).expanding().mean())
-
-            for _, row in group.iterrows():
-                # --- 將所有運算元都轉為 float 型別 ---
-                current_usage = float(row['usage_amount'])
-                
-                # 與上期比
-                prev_usage = row['prev_usage']
-                if pd.notna(prev_usage) and prev_usage > 0:
-                    prev_usage = float(prev_usage)
-                    percent_diff = ((current_usage - prev_usage) / prev_usage) * 100
-                    if abs(percent_diff) > threshold_percent:
-                        reason = f"較上期 ({row['prev_date'].strftime('%Y-%m-%d')}) {'增加' if percent_diff > 0 else '減少'} {abs(percent_diff):.0f}%"
-                        anomalies.append({
-                            "宿舍地址": meter[0], "類型": meter[1], "錶號": meter[2],
-                            "帳單迄日": row['bill_end_date'].strftime('%Y-%m-%d'),
-                            "本期用量": current_usage, "比較基準": prev_usage,
-                            "支付方": row['payer'], "代收代付?": row['is_pass_through'],
-                            "判斷": "用量過高" if percent_diff > 0 else "用量過低",
-                            "分析說明": reason
-                        })
-                        continue
-
-                # 與去年同期比
-                last_year_avg = row['last_year_avg']
-                if pd.notna(last_year_avg) and last_year_avg > 0:
-                    percent_diff = ((current_usage - last_year_avg) / last_year_avg) * 100
-                    if abs(percent_diff) > threshold_percent:
-                        reason = f"較去年同期平均 ({last_year_avg:.1f}) {'增加' if percent_diff > 0 else '減少'} {abs(percent_diff):.0f}%"
-                        anomalies.append({
-                            "宿舍地址": meter[0], "類型": meter[1], "錶號": meter[2],
-                            "帳單迄日": row['bill_end_date'].strftime('%Y-%m-%d'),
-                            "本期用量": current_usage, "比較基準": last_year_avg,
-                            "支付方": row['payer'], "代收代付?": row['is_pass_through'],
-                            "判斷": "用量過高" if percent_diff > 0 else "用量過低",
-                            "分析說明": reason
-                        })
-
-        return pd.DataFrame(anomalies)
+        return _execute_query_to_dataframe(conn, query, {'status': ANOMALY_STATUS_OPEN, 'days': int(days)})
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
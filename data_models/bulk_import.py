@@ -0,0 +1,555 @@
+# data_models/bulk_import.py
+# 批次匯入 (batch_import_view 上傳的 Excel) 的共用分段引擎。
+# 原本每個 batch_import_* 函式都各自 iterrows()、逐筆比對宿舍地址並逐筆 SELECT + INSERT/UPDATE。
+# 這裡把流程拆成固定的階段，各匯入功能只需以「規格 (spec)」宣告欄位與寫入目標：
+#   1. 驗證與轉換欄位：整欄向量化處理，每列以「宣告順序中第一個錯誤」作為錯誤原因
+#   2. 外鍵解析：宿舍地址、廠商名稱以快取的對照表整欄比對
+#   3. 以 COPY 將通過驗證的列寫入暫存表
+#   4. 合併：每個目標資料表以一個 SQL 敘述完成 (upsert / insert / update)
+#   5. 回傳成功筆數、失敗列 (附「錯誤原因」) 與因重複而跳過的列
+# 若資料庫拒絕整批合併 (例如欄位長度超過限制)，會退回以 SAVEPOINT 逐列重試，只讓出錯的列失敗。
+#
+# 地址與廠商對照表在同一行程中快取共用：新增、修改、刪除宿舍或廠商的函式需呼叫 invalidate()。
+# 其他行程的寫入則由 CACHE_TTL 與「有找不到的資料時重新載入一次」兜底。
+
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+import database
+from address_normalizer import normalize_address_series
+
+# 快取對照表的最長使用時間 (秒)
+CACHE_TTL = 300
+
+STAGING_TABLE = 'bulk_import_staging'
+ERROR_COLUMN = '錯誤原因'
+DUPLICATE_MESSAGE = "資料重複，已跳過"
+REQUIRED_MESSAGE = "「{column}」為必填欄位"
+INVALID_MESSAGE = "「{column}」格式錯誤: {value}"
+TRUE_VALUES = ['TRUE', '1', 'Y', 'YES', '是']
+
+# 目標表的整數欄位皆為 INTEGER，超出範圍的值在驗證階段就視為格式錯誤
+_INTEGER_LIMIT = 2 ** 31
+
+_lock = threading.Lock()
+_cached_lookups = None
+
+def _execute_query_to_dataframe(conn, query, params=None):
+    """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        records = cursor.fetchall()
+        if not records:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            return pd.DataFrame([], columns=columns)
+
+        columns = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(records, columns=columns)
+
+# ==============================================================================
+# 宿舍地址 / 廠商對照表 (快取)
+# ==============================================================================
+
+def _reverse_map(keys: pd.Series, ids: pd.Series) -> pd.Series:
+    """建立 {鍵: id} 的對照 Series；重複的鍵以最後一筆為準 (與逐筆建立 dict 時覆蓋的結果相同)。"""
+    mapping = pd.Series(ids.values, index=keys.values, dtype=object)
+    mapping = mapping[mapping.index.notna()]
+    return mapping[~mapping.index.duplicated(keep='last')]
+
+def load_lookups(conn) -> dict:
+    """從資料庫載入宿舍地址與廠商的對照表 (不經過快取)。"""
+    dorms = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories" ORDER BY id')
+    vendors = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name, service_category FROM "Vendors" ORDER BY id')
+    return {
+        'built_at': time.monotonic(),
+        'original_address': _reverse_map(dorms['original_address'], dorms['id']),
+        'normalized_address': _reverse_map(dorms['normalized_address'], dorms['id']),
+        'vendors': vendors,
+    }
+
+def get_lookups(conn, force_reload: bool = False) -> dict:
+    """取得快取的對照表；尚未建立、已逾時或 force_reload 時以 conn 重新載入。"""
+    global _cached_lookups
+    with _lock:
+        lookups = _cached_lookups
+    if force_reload or lookups is None or time.monotonic() - lookups['built_at'] > CACHE_TTL:
+        lookups = load_lookups(conn)
+        with _lock:
+            _cached_lookups = lookups
+    return lookups
+
+def invalidate():
+    """清除快取的對照表。新增、修改、刪除宿舍 (地址) 或廠商後呼叫。"""
+    global _cached_lookups
+    with _lock:
+        _cached_lookups = None
+
+def resolve_dorm_ids(addresses: pd.Series, lookups: dict) -> pd.Series:
+    """
+    整欄比對宿舍地址 (已去除前後空白，空字串視為空值)，回傳同索引的 dorm_id (Int64，找不到為 <NA>)。
+    比對順序：原始地址 → 直接比對正規化地址 → 正規化輸入後再比對正規化地址。
+    """
+    ids = pd.to_numeric(addresses.map(lookups['original_address']), errors='coerce').astype('Int64')
+    ids = ids.fillna(pd.to_numeric(addresses.map(lookups['normalized_address']), errors='coerce').astype('Int64'))
+    pending = ids.isna() & (addresses != '')
+    if pending.any():
+        normalized = normalize_address_series(addresses[pending])['full']
+        ids[pending] = pd.to_numeric(normalized.map(lookups['normalized_address']), errors='coerce').astype('Int64')
+    return ids.where(addresses != '')
+
+def resolve_vendor_ids(names: pd.Series, lookups: dict, category: str = None) -> pd.Series:
+    """整欄比對廠商名稱 (可限定服務項目)，回傳同索引的 vendor_id (Int64，找不到為 <NA>)。"""
+    vendors = lookups['vendors']
+    if category is not None:
+        vendors = vendors[vendors['service_category'] == category]
+    ids = names.map(_reverse_map(vendors['vendor_name'], vendors['id']))
+    return pd.to_numeric(ids.where(names != ''), errors='coerce').astype('Int64')
+
+def lookup_dorm_ids(conn, addresses: pd.Series) -> pd.Series:
+    """以快取對照表整欄比對宿舍地址 (供住宿匯入等自行處理寫入的流程使用)。"""
+    ctx = {'conn': conn, 'lookups': get_lookups(conn)}
+    return _resolve_with_reload(ctx, lambda lookups: resolve_dorm_ids(addresses, lookups), addresses != '')
+
+def _resolve_with_reload(ctx: dict, resolve, wanted: pd.Series) -> pd.Series:
+    """
+    以快取對照表比對；若有應找到卻找不到的值且對照表並非剛載入，重新載入一次再比對，
+    避免其他行程剛新增的宿舍或廠商因快取過期而被判定為找不到。
+    """
+    result = resolve(ctx['lookups'])
+    if (result.isna() & wanted).any() and time.monotonic() - ctx['lookups']['built_at'] > 1:
+        ctx['lookups'] = get_lookups(ctx['conn'], force_reload=True)
+        result = resolve(ctx['lookups'])
+    return result
+
+# ==============================================================================
+# 欄位轉換器：每個轉換器為 {'sql_type', 'convert'}，convert(frame, values, ctx) 回傳 (值, 錯誤訊息)
+# 值與錯誤訊息皆為與 frame 同索引的 Series；錯誤訊息為空字串代表該列通過。
+# ==============================================================================
+
+def column_values(frame: pd.DataFrame, column: str) -> pd.Series:
+    """取出 Excel 欄位；檔案中沒有此欄時視為整欄空白。"""
+    if column in frame:
+        return frame[column]
+    return pd.Series(None, index=frame.index, dtype=object)
+
+def is_blank(series: pd.Series) -> pd.Series:
+    """空值或只有空白的字串。"""
+    return series.isna() | (series.astype(str).str.strip() == '')
+
+def stripped_text(series: pd.Series) -> pd.Series:
+    """轉為去除前後空白的字串，空白值轉為空字串。"""
+    return series.astype(str).str.strip().where(~is_blank(series), '')
+
+def no_errors(index) -> pd.Series:
+    return pd.Series('', index=index, dtype=object)
+
+def _messages(template: str, column: str, raw: pd.Series, mask: pd.Series, errors: pd.Series) -> pd.Series:
+    """將 mask 所選的列填入錯誤訊息 (template 可使用 {column} 與 {value})。"""
+    if mask.any():
+        errors = errors.copy()
+        errors[mask] = [template.format(column=column, value=value) for value in raw[mask].astype(str).str.strip()]
+    return errors
+
+def _blank_or_required(column, raw, blank, required, errors):
+    if required:
+        errors = _messages(required if isinstance(required, str) else REQUIRED_MESSAGE, column, raw, blank, errors)
+    return errors
+
+def text(column: str, default=None, required=None) -> dict:
+    """文字欄位：去除前後空白，空白時使用 default；required 為 True 或錯誤訊息時空白視為錯誤。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        result = raw.astype(str).str.strip().astype(object)
+        result[blank] = default
+        return result, _blank_or_required(column, raw, blank, required, no_errors(frame.index))
+    return {'sql_type': 'TEXT', 'convert': convert}
+
+def _parse_numbers(raw: pd.Series, blank: pd.Series) -> pd.Series:
+    return pd.to_numeric(raw.astype(str).str.strip().where(~blank), errors='coerce')
+
+def integer(column: str, default=None, required=None, invalid=INVALID_MESSAGE) -> dict:
+    """整數欄位：小數無條件捨去 (同 int())，空白時使用 default，無法轉換的值視為錯誤。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        parsed = _parse_numbers(raw, blank)
+        bad = ~blank & (parsed.isna() | ~np.isfinite(parsed) | (parsed.abs() >= _INTEGER_LIMIT))
+        result = np.trunc(parsed.where(~bad)).astype('Int64')
+        if default is not None:
+            result = result.fillna(default)
+        errors = _messages(invalid, column, raw, bad, no_errors(frame.index))
+        return result, _blank_or_required(column, raw, blank, required, errors)
+    return {'sql_type': 'INTEGER', 'convert': convert}
+
+def number(column: str, invalid=INVALID_MESSAGE) -> dict:
+    """數值欄位 (選填，可含小數)；invalid 為 None 時無法轉換的值直接留空。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        parsed = _parse_numbers(raw, blank)
+        bad = ~blank & (parsed.isna() | ~np.isfinite(parsed))
+        errors = _messages(invalid, column, raw, bad, no_errors(frame.index)) if invalid else no_errors(frame.index)
+        return parsed.where(~bad).astype(object), errors
+    return {'sql_type': 'NUMERIC', 'convert': convert}
+
+def parse_dates(raw: pd.Series, blank: pd.Series) -> pd.Series:
+    """整欄解析日期 (每個值各自推斷格式，與逐筆 pd.to_datetime 相同)，無法解析為 NaT。"""
+    return pd.to_datetime(raw.where(~blank), errors='coerce', format='mixed')
+
+def day(column: str, required=None, invalid=INVALID_MESSAGE) -> dict:
+    """日期欄位，轉為 date。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        parsed = parse_dates(raw, blank)
+        bad = ~blank & parsed.isna()
+        result = pd.Series(parsed.dt.date.values, index=frame.index, dtype=object).where(parsed.notna(), None)
+        errors = _messages(invalid, column, raw, bad, no_errors(frame.index))
+        return result, _blank_or_required(column, raw, blank, required, errors)
+    return {'sql_type': 'DATE', 'convert': convert}
+
+def month(column: str, required=None, invalid=INVALID_MESSAGE) -> dict:
+    """月份欄位，轉為 'YYYY-MM' 字串。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        parsed = parse_dates(raw, blank)
+        bad = ~blank & parsed.isna()
+        result = parsed.dt.strftime('%Y-%m').astype(object).where(parsed.notna(), None)
+        errors = _messages(invalid, column, raw, bad, no_errors(frame.index))
+        return result, _blank_or_required(column, raw, blank, required, errors)
+    return {'sql_type': 'TEXT', 'convert': convert}
+
+def as_is(column: str) -> dict:
+    """原樣保留的欄位 (空值為 None)，通常用於寫入 JSON 明細。"""
+    def convert(frame, values, ctx):
+        result = column_values(frame, column).astype(object)
+        result = pd.Series([value.item() if isinstance(value, np.generic) else value for value in result], index=frame.index, dtype=object)
+        result[result.isna()] = None
+        return result, no_errors(frame.index)
+    return {'sql_type': 'TEXT', 'convert': convert}
+
+def to_bool_series(raw: pd.Series, blank_value=False) -> pd.Series:
+    """'TRUE' / '1' / 'Y' / 'YES' / '是' 為真，其他值為假，空值為 blank_value。"""
+    result = raw.astype(str).str.strip().str.upper().isin(TRUE_VALUES).astype(object)
+    result[raw.isna()] = blank_value
+    return result
+
+def boolean(column: str, blank_value=False) -> dict:
+    """是/否欄位。"""
+    def convert(frame, values, ctx):
+        return to_bool_series(column_values(frame, column), blank_value), no_errors(frame.index)
+    return {'sql_type': 'BOOLEAN', 'convert': convert}
+
+def constant(value, sql_type: str = 'TEXT') -> dict:
+    """固定值欄位。"""
+    def convert(frame, values, ctx):
+        return pd.Series([value] * len(frame), index=frame.index, dtype=object), no_errors(frame.index)
+    return {'sql_type': sql_type, 'convert': convert}
+
+def dorm(column: str = '宿舍地址', missing="宿舍地址為空", not_found="在資料庫中找不到對應的宿舍地址: {value}") -> dict:
+    """宿舍地址 → dorm_id；空白與找不到的地址皆為錯誤。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        blank = is_blank(raw)
+        addresses = stripped_text(raw)
+        ids = _resolve_with_reload(ctx, lambda lookups: resolve_dorm_ids(addresses, lookups), ~blank)
+        errors = _messages(missing, column, raw, blank, no_errors(frame.index))
+        errors = _messages(not_found, column, raw, ~blank & ids.isna(), errors)
+        return ids, errors
+    return {'sql_type': 'INTEGER', 'convert': convert}
+
+def vendor(column: str, category: str = None, not_found: str = None) -> dict:
+    """廠商名稱 → vendor_id (選填)；有 not_found 訊息時，有填寫卻找不到的名稱視為錯誤，否則留空。"""
+    def convert(frame, values, ctx):
+        raw = column_values(frame, column)
+        names = stripped_text(raw)
+        filled = names != ''
+        ids = _resolve_with_reload(ctx, lambda lookups: resolve_vendor_ids(names, lookups, category), filled)
+        errors = no_errors(frame.index)
+        if not_found:
+            errors = _messages(not_found, column, raw, filled & ids.isna(), errors)
+        return ids, errors
+    return {'sql_type': 'INTEGER', 'convert': convert}
+
+def computed(sql_type: str, func) -> dict:
+    """自訂欄位：func(frame, values, ctx) 回傳 (值 Series, 錯誤訊息 Series 或 None)。values 為先前已轉換的欄位。"""
+    def convert(frame, values, ctx):
+        result, errors = func(frame, values, ctx)
+        return result, errors if errors is not None else no_errors(frame.index)
+    return {'sql_type': sql_type, 'convert': convert}
+
+def json_object(fields: list) -> dict:
+    """JSON 明細欄位：fields 為 [(JSON 鍵, 轉換器), ...]，各轉換器的錯誤依序併入；空值寫成 null，日期寫成 'YYYY-MM-DD'。"""
+    def convert(frame, values, ctx):
+        columns, errors = {}, no_errors(frame.index)
+        for key, field in fields:
+            result, field_errors = field['convert'](frame, values, ctx)
+            errors = errors.where(errors != '', field_errors)
+            columns[key] = result
+        records = pd.DataFrame(columns, index=frame.index).astype(object).to_dict('records')
+        documents = [
+            json.dumps({key: (None if pd.isna(value) else value) for key, value in record.items()}, ensure_ascii=False, default=str)
+            for record in records
+        ]
+        return pd.Series(documents, index=frame.index, dtype=object), errors
+    return {'sql_type': 'JSONB', 'convert': convert}
+
+def check(func) -> dict:
+    """只做驗證、不寫入暫存表的規則 (欄位名稱填 None)：func(frame, values, ctx) 回傳錯誤訊息 Series。"""
+    def convert(frame, values, ctx):
+        return None, func(frame, values, ctx)
+    return {'sql_type': None, 'convert': convert}
+
+def null_safe(column: str) -> str:
+    """比對鍵：兩邊皆為 NULL 時也視為相同。"""
+    return f't."{column}" IS NOT DISTINCT FROM s."{column}"'
+
+# ==============================================================================
+# 合併 SQL
+# ==============================================================================
+
+def _key_condition(key: list) -> str:
+    """比對鍵：欄位名稱代表 t.欄位 = s.欄位，其他字串視為以 t (目標表) / s (暫存表) 撰寫的條件。"""
+    return ' AND '.join(f't."{item}" = s."{item}"' if item.isidentifier() else f'({item})' for item in key) or 'TRUE'
+
+def _target_columns(target: dict) -> dict:
+    columns = target['columns']
+    if isinstance(columns, dict):
+        return columns
+    return {column: f's."{column}"' for column in columns}
+
+def _target_sql(target: dict, row_filter: str) -> str:
+    """產生單一目標表的合併敘述。row_filter 用於限定暫存表中的列 (整批為 TRUE，逐列重試時為單列)。"""
+    table = f'"{target["table"]}"'
+    columns = _target_columns(target)
+    key_columns = {item for item in target.get('key', []) if item.isidentifier()}
+    match = _key_condition(target.get('key', []))
+    where = ' AND '.join([row_filter] + ([f'({target["where"]})'] if target.get('where') else []))
+    insert_columns = ', '.join(f'"{c}"' for c in columns)
+    insert_values = ', '.join(columns.values())
+    if target['mode'] == 'insert':
+        return f'INSERT INTO {table} ({insert_columns}) SELECT {insert_values} FROM {STAGING_TABLE} s WHERE {where} ORDER BY s._row'
+
+    assignments = ', '.join(
+        f'"{c}" = COALESCE({expr}, t."{c}")' if target.get('coalesce') else f'"{c}" = {expr}'
+        for c, expr in columns.items() if c not in key_columns
+    )
+    update_sql = f'UPDATE {table} t SET {assignments} FROM {STAGING_TABLE} s WHERE {match} AND {where} RETURNING s._row'
+    if target['mode'] == 'update':
+        return update_sql
+    # upsert：同一敘述中的 UPDATE 與 INSERT 看到相同的快照，因此 INSERT 只會寫入原本不存在的鍵
+    return f"""
+        WITH updated AS ({update_sql})
+        INSERT INTO {table} ({insert_columns})
+        SELECT {insert_values} FROM {STAGING_TABLE} s
+        WHERE {where} AND NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})
+        ORDER BY s._row
+    """
+
+def _merge(cursor, targets: list, rows: list, row_filter: str, params=None) -> set:
+    """執行所有目標表的合併，回傳 update 模式中找不到對應紀錄的列。"""
+    not_found = set()
+    for target in targets:
+        cursor.execute(_target_sql(target, row_filter), params)
+        if target['mode'] == 'update':
+            matched = {record['_row'] for record in cursor.fetchall()}
+            not_found |= set(rows) - matched
+    return not_found
+
+def _merge_rows(cursor, targets: list, rows: list) -> tuple:
+    """
+    整批合併；若資料庫拒絕整批，改以 SAVEPOINT 逐列重試。
+    回傳 (找不到對應紀錄的列 set, {列: 資料庫錯誤訊息})。
+    """
+    cursor.execute('SAVEPOINT bulk_merge')
+    try:
+        not_found = _merge(cursor, targets, rows, 'TRUE')
+        cursor.execute('RELEASE SAVEPOINT bulk_merge')
+        return not_found, {}
+    except psycopg2.Error:
+        cursor.execute('ROLLBACK TO SAVEPOINT bulk_merge')
+
+    not_found, row_errors = set(), {}
+    for row in rows:
+        cursor.execute('SAVEPOINT bulk_merge_row')
+        try:
+            not_found |= _merge(cursor, targets, [row], 's._row = %(row)s', {'row': row})
+            cursor.execute('RELEASE SAVEPOINT bulk_merge_row')
+        except psycopg2.Error as row_error:
+            cursor.execute('ROLLBACK TO SAVEPOINT bulk_merge_row')
+            row_errors[row] = str(row_error).strip()
+    return not_found, row_errors
+
+# ==============================================================================
+# 主流程
+# ==============================================================================
+
+def convert_fields(frame: pd.DataFrame, fields: list, ctx: dict) -> tuple:
+    """依序轉換所有欄位，回傳 (值 DataFrame, 錯誤訊息 Series)；每列保留第一個錯誤。"""
+    values = pd.DataFrame(index=frame.index)
+    errors = no_errors(frame.index)
+    for name, field in fields:
+        result, field_errors = field['convert'](frame, values, ctx)
+        errors = errors.where(errors != '', field_errors)
+        if name is not None:
+            values[name] = result
+    return values, errors
+
+def _result_frame(df: pd.DataFrame, positions, messages) -> pd.DataFrame:
+    if len(positions) == 0:
+        return pd.DataFrame()
+    result = df.iloc[list(positions)].copy()
+    result[ERROR_COLUMN] = list(messages)
+    return result
+
+def run_import(df: pd.DataFrame, spec: dict) -> dict:
+    """
+    依規格執行一次批次匯入，回傳 {'success': 成功筆數, 'failed': 失敗列, 'skipped': 因重複而跳過的列}。
+    失敗與跳過的列保留原始欄位與索引，並附上「錯誤原因」。
+
+    spec 的內容：
+      label            匯入名稱 (用於日誌)
+      fields           [(暫存欄位名稱, 轉換器), ...]；順序即錯誤檢查的優先順序
+      skip_when        (選填) func(frame, values) → 布林 Series，為真的有效列直接略過 (不計成功也不算失敗)
+      unique           (選填) 檔案內的重複判斷欄位；無 duplicate_check 時以最後一列為準 (同逐列覆蓋的結果)
+      combine_duplicates (選填) 為真時檔案內重複的列逐欄合併 (取最後一個非空值)，用於 COALESCE 更新
+      duplicate_check  (選填) {'table', 'key', 'where', 'report'}：資料庫已有相同鍵的列會跳過，
+                       檔案內重複時保留第一列；report 為真時跳過的列會回傳於 skipped
+      allocate         (選填) {暫存欄位: 資料表}：合併前預先取得該表的序號，供多個目標表互相關聯
+      targets          [{'table', 'mode': 'upsert' | 'insert' | 'update', 'columns', 'key', 'where',
+                         'coalesce', 'not_found'}, ...]；每個目標表一個合併敘述。
+                       columns 預設為所有暫存欄位，也可為 {目標欄位: SQL 運算式} (暫存表別名 s)；
+                       key 為比對鍵，欄位名稱代表 t.欄位 = s.欄位，其他字串為自訂條件 (目標表別名 t)
+      after_merge      (選填) func(cursor)：合併後、提交前在同一交易中執行 (暫存表仍可查詢)，
+                       例如重新計算受影響電水錶的異常旗標
+      invalidates      (選填) 為真時匯入後清除對照表快取 (例如廠商匯入)
+    """
+    result = {'success': 0, 'failed': pd.DataFrame(), 'skipped': pd.DataFrame()}
+    conn = database.get_db_connection()
+    if not conn:
+        error_df = df.copy()
+        error_df[ERROR_COLUMN] = "無法連接到資料庫"
+        result['failed'] = error_df
+        return result
+
+    frame = df.reset_index(drop=True)
+    try:
+        ctx = {'conn': conn, 'lookups': get_lookups(conn)}
+        values, errors = convert_fields(frame, spec['fields'], ctx)
+        valid = errors == ''
+        if 'skip_when' in spec:
+            valid &= ~spec['skip_when'](frame, values)
+        candidates = values[valid]
+
+        skipped = set()
+        duplicate_check = spec.get('duplicate_check')
+        representative = pd.Series(candidates.index, index=candidates.index)
+        if spec.get('unique') and not candidates.empty:
+            if duplicate_check:
+                repeated = candidates.duplicated(subset=spec['unique'], keep='first')
+                skipped |= set(candidates.index[repeated])
+                candidates = candidates[~repeated]
+                representative = representative[~repeated]
+            else:
+                group = candidates.groupby(spec['unique'], dropna=False, sort=False).ngroup()
+                representative = representative.groupby(group).transform('last')
+                if spec.get('combine_duplicates'):
+                    # 逐列更新 (COALESCE) 時，同一筆的多列依序疊加：每欄取最後一個非空值
+                    combined = candidates.groupby(group, sort=False).last()
+                    combined.index = candidates.index.to_series().groupby(group, sort=False).last().values
+                    candidates = combined
+                else:
+                    candidates = candidates[~candidates.duplicated(subset=spec['unique'], keep='last')]
+
+        staged_columns = [name for name, field in spec['fields'] if name is not None]
+        allocate = spec.get('allocate', {})
+        column_sql = ', '.join([f'"{name}" {field["sql_type"]}' for name, field in spec['fields'] if name is not None]
+                               + [f'"{name}" INTEGER' for name in allocate])
+        not_found, row_errors = set(), {}
+        with conn.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE {STAGING_TABLE} (_row INTEGER PRIMARY KEY, {column_sql}) ON COMMIT DROP')
+            staged = candidates.assign(_row=candidates.index)
+            database.copy_dataframe(cursor, STAGING_TABLE, staged, ['_row'] + staged_columns)
+            rows = list(staged['_row'])
+
+            if duplicate_check and rows:
+                condition = _key_condition(duplicate_check['key'])
+                if duplicate_check.get('where'):
+                    condition += f' AND ({duplicate_check["where"]})'
+                cursor.execute(f"""
+                    DELETE FROM {STAGING_TABLE} s
+                    WHERE EXISTS (SELECT 1 FROM "{duplicate_check['table']}" t WHERE {condition})
+                    RETURNING s._row
+                """)
+                existing = {record['_row'] for record in cursor.fetchall()}
+                skipped |= existing
+                rows = [row for row in rows if row not in existing]
+
+            for column, table in allocate.items():
+                cursor.execute(f"""UPDATE {STAGING_TABLE} SET "{column}" = nextval(pg_get_serial_sequence('"{table}"', 'id'))""")
+
+            if rows:
+                targets = [{'columns': staged_columns, **target} for target in spec['targets']]
+                not_found, row_errors = _merge_rows(cursor, targets, rows)
+                if 'after_merge' in spec:
+                    spec['after_merge'](cursor)
+        conn.commit()
+        if spec.get('invalidates'):
+            invalidate()
+
+        # 每列的最終結果：驗證錯誤 → 合併錯誤 / 找不到對應紀錄 (檔案內重複的列沿用代表列的結果) → 成功
+        final_errors = errors.copy()
+        for target in spec['targets']:
+            if target['mode'] == 'update' and not_found:
+                for row in not_found:
+                    row_errors.setdefault(row, target['not_found'].format(**values.loc[row].to_dict()))
+        merged = representative.map(lambda row: row_errors.get(row, ''))
+        final_errors[merged.index] = final_errors[merged.index].where(merged == '', merged)
+        succeeded = merged.index[(merged == '') & ~merged.index.isin(list(skipped))]
+
+        failed_positions = final_errors.index[final_errors != '']
+        result['success'] = len(succeeded)
+        result['failed'] = _result_frame(df, failed_positions, final_errors[failed_positions])
+        if duplicate_check and duplicate_check.get('report'):
+            skipped_positions = sorted(skipped)
+            result['skipped'] = _result_frame(df, skipped_positions, [DUPLICATE_MESSAGE] * len(skipped_positions))
+        print(f"INFO: 批次匯入{spec['label']}完成，成功 {result['success']} 筆，失敗 {len(failed_positions)} 筆，跳過 {len(skipped)} 筆。")
+        return result
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"批次匯入{spec['label']}時發生嚴重錯誤: {e}")
+        error_df = df.copy()
+        error_df[ERROR_COLUMN] = f"系統層級錯誤: {e}"
+        result['failed'] = error_df
+        return result
+    finally:
+        if conn: conn.close()
+
+def import_in_chunks(import_func, chunks, on_progress=None) -> tuple:
+    """
+    將分段讀入的資料 (excel_reader.iter_excel_chunks) 依序交給匯入函式 (各 batch_import_*)，
+    每段各自提交，最後合併各段結果，以與匯入函式相同的格式回傳 (成功筆數, 失敗列[, 跳過列])。
+    on_progress(已處理列數, 該段的失敗列) 於每段完成後呼叫，供介面即時顯示進度與錯誤。
+    """
+    success, processed, parts = 0, 0, None
+    for chunk in chunks:
+        result = import_func(chunk)
+        if parts is None:
+            parts = [[] for _ in result[1:]]
+        success += result[0]
+        for collected, frame in zip(parts, result[1:]):
+            if not frame.empty:
+                collected.append(frame)
+        processed += len(chunk)
+        if on_progress:
+            on_progress(processed, result[1])
+    if parts is None:
+        return success, pd.DataFrame()
+    return (success, *[pd.concat(collected) if collected else pd.DataFrame() for collected in parts])
@@ -1,8 +1,10 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import database
 from decimal import Decimal
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -20,66 +22,72 @@ def get_dormitory_dashboard_data():
     """
     【v3.2 同月計算修正版】獲取每個宿舍的人數與租金統計。
     修正：費用計算改為找出每位員工「最新的一個收費月份」，並加總該月份的所有費用。
+    【v3.3 住宿索引版】在住人員改由 occupancy_index 取得，資料庫只需計算在住人員的費用。
     """
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
     try:
-        query = """
-            WITH CurrentAccommodation AS (
-                SELECT
-                    ah.room_id,
-                    w.unique_id,
-                    w.gender
-                FROM "AccommodationHistory" ah
-                JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
-                WHERE (ah.end_date IS NULL OR ah.end_date > CURRENT_DATE)
-                  AND (w.accommodation_end_date IS NULL OR w.accommodation_end_date > CURRENT_DATE)
-            ),
+        index = occupancy_index.get_index(conn)
+        stays = index['stays']
+        today = pd.Timestamp(datetime.today().date())
+        # 目前住宿：住宿紀錄與移工的住宿迄日皆未結束 (不限起始日，已排定入住者也計入)
+        residents = stays[
+            (stays['end_date'].isna() | (stays['end_date'] > today))
+            & (stays['accommodation_end_date'].isna() | (stays['accommodation_end_date'] > today))
+        ][['room_id', 'worker_unique_id', 'gender']]
+        if residents.empty:
+            return pd.DataFrame()
+
+        fee_query = """
             -- 1. 找出每位員工「最近一次有費用紀錄的月份」
-            LatestFeeMonth AS (
+            WITH LatestFeeMonth AS (
                 SELECT
                     worker_unique_id,
                     MAX(effective_date) as max_date
                 FROM "FeeHistory"
                 WHERE effective_date <= CURRENT_DATE
+                  AND worker_unique_id = ANY(%(worker_ids)s)
                 GROUP BY worker_unique_id
-            ),
-            -- 2. 加總該員工「該月份」的所有費用
-            WorkerCurrentTotal AS (
-                SELECT 
-                    fh.worker_unique_id, 
-                    SUM(fh.amount) as total_fee
-                FROM "FeeHistory" fh
-                JOIN LatestFeeMonth lfm ON fh.worker_unique_id = lfm.worker_unique_id
-                -- 【關鍵】只加總同一年月的費用
-                WHERE TO_CHAR(fh.effective_date, 'YYYY-MM') = TO_CHAR(lfm.max_date, 'YYYY-MM')
-                GROUP BY fh.worker_unique_id
-            ),
-            CurrentResidents AS (
-                SELECT
-                    ca.room_id,
-                    ca.unique_id,
-                    ca.gender,
-                    COALESCE(wct.total_fee, 0) as total_fee
-                FROM CurrentAccommodation ca
-                LEFT JOIN WorkerCurrentTotal wct ON ca.unique_id = wct.worker_unique_id
             )
+            -- 2. 加總該員工「該月份」的所有費用
             SELECT 
-                d.original_address AS "宿舍地址", d.primary_manager AS "主要管理人",
-                COUNT(cr.unique_id) AS "總人數",
-                SUM(CASE WHEN cr.gender = '男' THEN 1 ELSE 0 END) AS "男性人數",
-                SUM(CASE WHEN cr.gender = '女' THEN 1 ELSE 0 END) AS "女性人數",
-                SUM(cr.total_fee) AS "月租金總額",
-                MODE() WITHIN GROUP (ORDER BY cr.total_fee) AS "最多人數租金",
-                ROUND(AVG(cr.total_fee)) AS "平均租金"
-            FROM "Dormitories" d
-            LEFT JOIN "Rooms" r ON d.id = r.dorm_id
-            LEFT JOIN CurrentResidents cr ON r.id = cr.room_id
-            GROUP BY d.id, d.original_address, d.primary_manager
-            HAVING COUNT(cr.unique_id) > 0
-            ORDER BY "主要管理人", "總人數" DESC
+                fh.worker_unique_id, 
+                SUM(fh.amount) as total_fee
+            FROM "FeeHistory" fh
+            JOIN LatestFeeMonth lfm ON fh.worker_unique_id = lfm.worker_unique_id
+            -- 【關鍵】只加總同一年月的費用
+            WHERE TO_CHAR(fh.effective_date, 'YYYY-MM') = TO_CHAR(lfm.max_date, 'YYYY-MM')
+            GROUP BY fh.worker_unique_id
         """
-        return _execute_query_to_dataframe(conn, query)
+        fees = _execute_query_to_dataframe(conn, fee_query, {'worker_ids': residents['worker_unique_id'].unique().tolist()})
+        fee_map = pd.Series(pd.to_numeric(fees['total_fee']).values, index=fees['worker_unique_id']) if not fees.empty else pd.Series(dtype=float)
+
+        dorms = index['rooms'][['room_id', 'dorm_id', 'original_address', 'primary_manager']]
+        residents = residents.merge(dorms, on='room_id')
+        if residents.empty:
+            return pd.DataFrame()
+        residents['total_fee'] = residents['worker_unique_id'].map(fee_map).fillna(0)
+        residents['is_male'] = residents['gender'] == '男'
+        residents['is_female'] = residents['gender'] == '女'
+
+        grouped = residents.groupby('dorm_id')
+        # 最多人數租金：出現次數最多的金額，同次數時取較小者 (同 MODE() WITHIN GROUP)
+        counts = residents.groupby(['dorm_id', 'total_fee']).size().rename('n').reset_index()
+        mode = counts.sort_values(['n', 'total_fee'], ascending=[False, True]).drop_duplicates('dorm_id').set_index('dorm_id')['total_fee']
+        average = grouped['total_fee'].mean()
+
+        result = pd.DataFrame({
+            "宿舍地址": grouped['original_address'].first(),
+            "主要管理人": grouped['primary_manager'].first(),
+            "總人數": grouped.size(),
+            "男性人數": grouped['is_male'].sum().astype(int),
+            "女性人數": grouped['is_female'].sum().astype(int),
+            "月租金總額": grouped['total_fee'].sum().astype(int),
+            "最多人數租金": mode.astype(int),
+            # 四捨五入 (同 SQL ROUND，.5 進位)
+            "平均租金": (np.sign(average) * np.floor(average.abs() + 0.5)).astype(int),
+        })
+        return result.sort_values(["主要管理人", "總人數"], ascending=[True, False], kind='stable').reset_index(drop=True)
     finally:
         if conn: conn.close()
         
@@ -582,4 +590,22 @@ def get_employer_resident_counts(year_month: str, min_count: int = 0):
         """
         return _execute_query_to_dataframe(conn, query, params)
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
+
+def get_dashboard_overview_data():
+    """
+    儀表板中不需任何篩選條件的資料 (住宿總覽、特殊狀況統計、年均費用預測)。
+    三個查詢互不相依，以 database.run_concurrently 同時執行，回傳 {名稱: 各函式原本的回傳值}。
+    """
+    return database.run_concurrently({
+        'overview': get_dormitory_dashboard_data,
+        'status_summary': get_special_status_summary,
+        'annual_forecast': get_expense_forecast_data,
+    })
+
+def get_monthly_dashboard_data(year_month: str):
+    """指定月份的季節性費用預測與實際損益，兩個查詢同時執行，回傳 {名稱: 各函式原本的回傳值}。"""
+    return database.run_concurrently({
+        'seasonal_forecast': (get_seasonal_expense_forecast, year_month),
+        'finance': (get_financial_dashboard_data, year_month),
+    })
@@ -0,0 +1,210 @@
+# data_models/data_quality_model.py
+# 資料品質檢查與批次校正引擎 (取代逐格查詢、逐格更新的 date_fix_model)。
+# 每條規則從系統目錄 (information_schema) 找出要處理的欄位，每個欄位只執行一道伺服器端敘述：
+# 以資料修改 CTE 同時完成「修正」與「統計問題筆數」，不需把資料讀回 Python。
+# 規則以 @register_rule 註冊，新增其他校正 (例如地址重新正規化) 只要再寫一個規則函式。
+#
+# 每條規則回傳多筆結果 {'table', 'column', 'found', 'fixed', 'note'}：
+#   found  檢查時發現的問題筆數 (修正前)
+#   fixed  已修正 (apply=True) 或可自動修正 (apply=False) 的筆數，其餘需人工處理
+
+import pandas as pd
+import database
+from address_normalizer import normalize_address_series
+from . import bulk_import
+from . import editor_sync
+
+DATE_MIN = '1900-01-01'
+DATE_MAX = '2100-12-31'
+# 民國年誤填為西元年 (例如 0114-03-01) 的判斷範圍，修正時加上 1911 年
+ROC_YEAR_MAX = 200
+ROC_YEAR_OFFSET = 1911
+
+MONTH_FORMAT_PATTERN = r'^\d{4}-(0[1-9]|1[0-2])$'
+# 可自動修正的月份寫法：2025/1、2025.01、2025-1-15、2025年1月 ...
+MONTH_LOOSE_PATTERN = r'^\s*(\d{4})\s*[-/.年]\s*(\d{1,2})\s*(月|[-/.]\s*\d{1,2}.*)?\s*$'
+
+RULES = {}
+
+def register_rule(name: str, label: str):
+    """裝飾器：註冊一條資料品質規則 (func(cursor, apply) → 結果列表)。"""
+    def decorator(func):
+        RULES[name] = {'label': label, 'func': func}
+        return func
+    return decorator
+
+def _discover_columns(cursor, condition: str, params: tuple = ()) -> list:
+    """從系統目錄找出 public schema 中符合條件的 (資料表, 欄位, 型別)，排除檢視表。"""
+    cursor.execute(f"""
+        SELECT c.table_name, c.column_name, c.data_type
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name AND t.table_type = 'BASE TABLE'
+        WHERE c.table_schema = 'public' AND ({condition})
+        ORDER BY c.table_name, c.ordinal_position
+    """, params)
+    return [(row['table_name'], row['column_name'], row['data_type']) for row in cursor.fetchall()]
+
+@register_rule('date_range', '日期超出合理範圍')
+def _check_date_ranges(cursor, apply: bool) -> list:
+    """
+    所有 date / timestamp 欄位：早於 1900 年或晚於 2100 年視為錯誤。
+    年份在 1~200 之間的多半是民國年誤填 (0114-03-01)，可自動加上 1911 年修正；其他僅回報。
+    """
+    results = []
+    columns = _discover_columns(cursor, "c.data_type IN ('date', 'timestamp without time zone', 'timestamp with time zone')")
+    for table, column, _ in columns:
+        fixable = f"""
+            "{column}" < %(date_min)s AND EXTRACT(YEAR FROM "{column}") BETWEEN 1 AND %(roc_max)s
+        """
+        if apply:
+            fix_sql = f"""
+                UPDATE "{table}" SET "{column}" = "{column}" + make_interval(years => %(offset)s)
+                WHERE {fixable} RETURNING 1
+            """
+        else:
+            fix_sql = f'SELECT 1 FROM "{table}" WHERE {fixable}'
+        cursor.execute(f"""
+            WITH fixed AS ({fix_sql})
+            SELECT
+                (SELECT COUNT(*) FROM "{table}" WHERE "{column}" < %(date_min)s OR "{column}" > %(date_max)s) AS found,
+                (SELECT COUNT(*) FROM fixed) AS fixed
+        """, {'date_min': DATE_MIN, 'date_max': DATE_MAX, 'roc_max': ROC_YEAR_MAX, 'offset': ROC_YEAR_OFFSET})
+        row = cursor.fetchone()
+        results.append({
+            'table': table, 'column': column, 'found': row['found'], 'fixed': row['fixed'],
+            'note': f"民國年誤填可自動修正；其餘超出 {DATE_MIN[:4]}~{DATE_MAX[:4]} 的日期需人工確認"
+        })
+    return results
+
+@register_rule('month_format', '月份格式不一致')
+def _check_month_formats(cursor, apply: bool) -> list:
+    """
+    以文字儲存的月份欄位 (欄位名稱以 _month 結尾，例如攤提起訖月) 統一為 'YYYY-MM'。
+    空字串改為 NULL；無法辨識的寫法僅回報。
+    """
+    results = []
+    columns = _discover_columns(cursor, "c.data_type IN ('character varying', 'text') AND c.column_name LIKE %s", ('%\\_month',))
+    for table, column, _ in columns:
+        normalized = f"""
+            CASE WHEN btrim("{column}") = '' THEN NULL
+                 ELSE (regexp_match("{column}", %(loose)s))[1] || '-' || lpad((regexp_match("{column}", %(loose)s))[2], 2, '0')
+            END
+        """
+        fixable = f"""
+            "{column}" !~ %(strict)s
+            AND (btrim("{column}") = '' OR (
+                "{column}" ~ %(loose)s AND ((regexp_match("{column}", %(loose)s))[2])::int BETWEEN 1 AND 12
+            ))
+        """
+        if apply:
+            fix_sql = f'UPDATE "{table}" SET "{column}" = {normalized} WHERE {fixable} RETURNING 1'
+        else:
+            fix_sql = f'SELECT 1 FROM "{table}" WHERE {fixable}'
+        cursor.execute(f"""
+            WITH fixed AS ({fix_sql})
+            SELECT
+                (SELECT COUNT(*) FROM "{table}" WHERE "{column}" IS NOT NULL AND "{column}" !~ %(strict)s) AS found,
+                (SELECT COUNT(*) FROM fixed) AS fixed
+        """, {'strict': MONTH_FORMAT_PATTERN, 'loose': MONTH_LOOSE_PATTERN})
+        row = cursor.fetchone()
+        results.append({
+            'table': table, 'column': column, 'found': row['found'], 'fixed': row['fixed'],
+            'note': "統一為 YYYY-MM；無法辨識的寫法需人工確認"
+        })
+    return results
+
+@register_rule('dorm_address', '宿舍正規化地址過期')
+def _check_dorm_addresses(cursor, apply: bool) -> list:
+    """
+    以目前的地址正規化規則重新計算所有宿舍的 normalized_address / city / district (整欄計算、一次寫回)。
+    重新正規化後會與其他宿舍重複 (違反唯一限制) 的地址不修改，僅回報。
+    """
+    cursor.execute('SELECT id, original_address, normalized_address, city, district FROM "Dormitories"')
+    dorms = pd.DataFrame(cursor.fetchall(), columns=['id', 'original_address', 'normalized_address', 'city', 'district'])
+    if dorms.empty:
+        return [{'table': 'Dormitories', 'column': 'normalized_address', 'found': 0, 'fixed': 0, 'note': "無宿舍資料"}]
+
+    fresh = normalize_address_series(dorms['original_address'])
+    fresh = fresh.rename(columns={'full': 'normalized_address'}).assign(id=dorms['id'])
+    has_address = fresh['normalized_address'] != ''
+    stale = has_address & (
+        (fresh['normalized_address'] != dorms['normalized_address'])
+        | (fresh['city'] != dorms['city'].fillna(''))
+        | (fresh['district'] != dorms['district'].fillna(''))
+    )
+
+    # 新地址不可與其他宿舍 (含其他同批修改後的宿舍) 重複
+    final_address = fresh['normalized_address'].where(stale, dorms['normalized_address'])
+    duplicated = final_address.duplicated(keep=False)
+    fixable = stale & ~duplicated
+
+    if apply and fixable.any():
+        editor_sync.update_rows(cursor, "Dormitories", 'id', fresh[fixable], ['normalized_address', 'city', 'district'])
+        bulk_import.invalidate()
+    return [{
+        'table': 'Dormitories', 'column': 'normalized_address', 'found': int(stale.sum()), 'fixed': int(fixable.sum()),
+        'note': "依目前的正規化規則重新計算；會與其他宿舍重複的地址需人工合併"
+    }]
+
+@register_rule('fee_history_duplicates', '費用歷史重複紀錄')
+def _check_fee_history_duplicates(cursor, apply: bool) -> list:
+    """
+    FeeHistory 中同一人、同一費用類型、同一生效日的重複紀錄 (建立唯一索引前的舊資料)。
+    修正時每組只保留 id 最大 (最後寫入) 的一筆，並補建唯一索引；請先以檢查模式確認後再執行。
+    """
+    duplicates = database.find_fee_history_duplicates(cursor)
+    surplus = sum(row['count'] - 1 for row in duplicates)
+    if apply and duplicates:
+        cursor.execute("""
+            DELETE FROM "FeeHistory" a USING "FeeHistory" b
+            WHERE a.worker_unique_id = b.worker_unique_id AND a.fee_type = b.fee_type
+              AND a.effective_date = b.effective_date AND a.id < b.id
+        """)
+        cursor.execute(database.FEE_HISTORY_UNIQUE_INDEX)
+    return [{
+        'table': 'FeeHistory', 'column': 'worker_unique_id, fee_type, effective_date', 'found': surplus, 'fixed': surplus,
+        'note': f"{len(duplicates)} 組重複；修正時每組保留最新一筆並建立唯一索引，金額不同的組別請先人工確認"
+    }]
+
+def run_checks(apply: bool = False, rules: list = None, log_callback=print) -> pd.DataFrame:
+    """
+    執行資料品質規則 (預設全部)。apply=False 只檢查不修改；apply=True 在單一交易中完成所有修正。
+    回傳每個欄位一列的報告：規則、資料表、欄位、問題筆數、已修正/可修正筆數、說明。
+    """
+    columns = ['規則', '資料表', '欄位', '問題筆數', '已修正筆數' if apply else '可自動修正筆數', '說明']
+    conn = database.get_db_connection()
+    if not conn:
+        log_callback("ERROR: 無法連接到資料庫。")
+        return pd.DataFrame(columns=columns)
+
+    report = []
+    try:
+        with conn.cursor() as cursor:
+            for name, rule in RULES.items():
+                if rules and name not in rules:
+                    continue
+                log_callback(f"INFO: 正在執行規則「{rule['label']}」...")
+                for result in rule['func'](cursor, apply):
+                    report.append([rule['label'], result['table'], result['column'], result['found'], result['fixed'], result['note']])
+        if apply:
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception as e:
+        if conn: conn.rollback()
+        log_callback(f"ERROR: 資料品質檢查時發生錯誤，所有修改已復原: {e}")
+        raise
+    finally:
+        if conn: conn.close()
+
+    report_df = pd.DataFrame(report, columns=columns)
+    problems = int(report_df['問題筆數'].sum()) if not report_df.empty else 0
+    log_callback(f"INFO: 資料品質檢查完成，共發現 {problems} 筆問題" + (f"，已修正 {int(report_df[columns[4]].sum())} 筆。" if apply else "。"))
+    return report_df
+
+def summarize_by_table(report_df: pd.DataFrame) -> pd.DataFrame:
+    """將欄位層級的報告彙總為每個資料表一列。"""
+    if report_df.empty:
+        return report_df
+    return report_df.groupby('資料表', as_index=False)[report_df.columns[3:5].tolist()].sum()
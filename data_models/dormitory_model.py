@@ -1,9 +1,11 @@
 import pandas as pd
 import psycopg2
 import database
-import numpy as np
 from data_processor import normalize_taiwan_address
 from . import cleaning_model
+from . import bulk_import
+from . import editor_sync
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -132,6 +134,7 @@ def update_room_details(room_id: int, details: dict):
                 return False, f"更新失敗：找不到 ID 為 {room_id} 的房間紀錄。"
 
         conn.commit()
+        occupancy_index.invalidate()
         return True, "房間資料更新成功！"
     except psycopg2.IntegrityError as e: # 更具體地捕捉唯一性約束錯誤
         if conn: conn.rollback()
@@ -170,6 +173,8 @@ def delete_dormitory_by_id(dorm_id: int):
             
             cursor.execute('DELETE FROM "Dormitories" WHERE id = %s', (dorm_id,))
         conn.commit()
+        occupancy_index.invalidate()
+        bulk_import.invalidate()
         return True, "宿舍及其相關資料已成功刪除。"
     except Exception as e:
         if conn: conn.rollback()
@@ -229,6 +234,8 @@ def update_dormitory_details(dorm_id: int, details: dict):
             sql = f'UPDATE "Dormitories" SET {fields} WHERE id = %s'
             cursor.execute(sql, tuple(values))
         conn.commit()
+        occupancy_index.invalidate()
+        bulk_import.invalidate()
         return True, "宿舍資料更新成功！"
     except Exception as e:
         if conn: conn.rollback()
@@ -247,6 +254,7 @@ def update_room_details(room_id: int, details: dict):
             sql = f'UPDATE "Rooms" SET {fields} WHERE id = %s'
             cursor.execute(sql, tuple(values))
         conn.commit()
+        occupancy_index.invalidate()
         return True, "房間資料更新成功！"
     except Exception as e:
         if conn: conn.rollback()
@@ -266,6 +274,7 @@ def add_new_room_to_dorm(details: dict):
             cursor.execute(sql, tuple(details.values()))
             new_id = cursor.fetchone()['id']
         conn.commit()
+        occupancy_index.invalidate()
         return True, "房間新增成功", new_id
     except Exception as e:
         if conn: conn.rollback()
@@ -295,6 +304,7 @@ def delete_room_by_id(room_id: int):
             
             cursor.execute('DELETE FROM "Rooms" WHERE id = %s', (room_id,))
         conn.commit()
+        occupancy_index.invalidate()
         return True, "房間刪除成功"
     except Exception as e:
         if conn: conn.rollback()
@@ -397,6 +407,7 @@ def add_new_dormitory(details: dict):
             cursor.execute('INSERT INTO "Rooms" (dorm_id, room_number) VALUES (%s, %s)', (new_dorm_id, "[未分配房間]"))
 
         conn.commit() # 先提交宿舍和房間的新增
+        bulk_import.invalidate()
 
         # --- 如果是 '我司' 管理，則初始化清掃排程 ---
         if details.get('primary_manager') == '我司' and new_dorm_id:
@@ -436,6 +447,23 @@ def get_distinct_person_in_charge():
     finally:
         if conn: conn.close()
 
+ROOM_EDITOR_COLUMNS = [
+    'room_number', 'capacity', 'gender_policy', 'nationality_policy', 'room_notes', 'area_sq_meters',
+    'key_status', 'air_conditioner', 'room_equipment', 'issue'
+]
+
+ROOMS_EDITOR_QUERY = """
+    SELECT 
+        id, room_number, capacity, 
+        gender_policy, nationality_policy, 
+        room_notes,
+        area_sq_meters,
+        key_status, air_conditioner, room_equipment, issue
+    FROM "Rooms" 
+    WHERE dorm_id = %s
+    ORDER BY room_number
+"""
+
 def get_rooms_for_editor(dorm_id: int):
     """
     【v2.6 新增】為 data_editor 查詢指定宿舍下的所有房間 (原始欄位名稱)。
@@ -444,140 +472,69 @@ def get_rooms_for_editor(dorm_id: int):
     if not conn: return pd.DataFrame()
     try:
         # 【修改】調整 SELECT 順序：鑰匙 -> 冷氣 -> 房間配備 -> 問題 (最後一個)
-        query = """
-            SELECT 
-                id, room_number, capacity, 
-                gender_policy, nationality_policy, 
-                room_notes,
-                area_sq_meters,
-                key_status, air_conditioner, room_equipment, issue
-            FROM "Rooms" 
-            WHERE dorm_id = %s
-            ORDER BY room_number
-        """
-        return _execute_query_to_dataframe(conn, query, (dorm_id,))
+        return _execute_query_to_dataframe(conn, ROOMS_EDITOR_QUERY, (dorm_id,))
     finally:
         if conn: conn.close()
 
+def _check_rooms_can_be_deleted(cursor, room_ids: list):
+    """一次查詢所有待刪除房間的在住人數，有任何房間仍有人居住時丟出例外 (列出所有房間)。"""
+    if not room_ids:
+        return
+    cursor.execute("""
+        SELECT r.id, r.room_number, COUNT(ah.id) AS count
+        FROM "Rooms" r
+        JOIN "AccommodationHistory" ah ON ah.room_id = r.id
+        WHERE r.id = ANY(%s) AND (ah.end_date IS NULL OR ah.end_date > CURRENT_DATE)
+        GROUP BY r.id, r.room_number
+        ORDER BY r.room_number
+    """, (list(room_ids),))
+    occupied = cursor.fetchall()
+    if occupied:
+        raise Exception("；".join(
+            f"無法刪除房號 {row['room_number']} (ID: {row['id']})，因為裡面還有 {row['count']} 位在住人員" for row in occupied
+        ) + "。")
+
+def _prepare_room_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    """整批套用房間欄位的預設值 (性別限制預設「可混住」、國籍限制預設「不限」)。"""
+    prepared = rows[['id'] + ROOM_EDITOR_COLUMNS].copy()
+    prepared['gender_policy'] = prepared['gender_policy'].where(~editor_sync.blank_mask(prepared['gender_policy']), '可混住')
+    prepared['nationality_policy'] = prepared['nationality_policy'].where(~editor_sync.blank_mask(prepared['nationality_policy']), '不限')
+    return prepared
+
 def batch_sync_rooms(dorm_id: int, edited_df: pd.DataFrame):
     """
     【v2.7 修正版】在單一交易中，批次同步宿舍的房間。
     修正重點：加入 clean_val 函式，防止 data_editor 回傳 list 導致資料庫報錯。
+    【v3.2 差異引擎版】以 editor_sync 整批比對與驗證 (清單值的解包由 editor_sync.clean_value 處理)，
+    刪除前的在住檢查合併為一次查詢，刪除、新增、更新各只需一次資料庫往返。
     """
     conn = database.get_db_connection()
     if not conn: 
         return False, "資料庫連線失敗。"
 
     try:
-        # 1. 取得資料庫目前的狀態
-        original_df = get_rooms_for_editor(dorm_id)
-        original_ids = set(original_df['id'].dropna())
-        
-        # 2. 取得 data_editor 編輯後的狀態
-        edited_df = edited_df.replace({pd.NaT: None, np.nan: None})
-        edited_ids = set(edited_df['id'].dropna())
-
-        # 3. 計算差異
-        ids_to_delete = original_ids - edited_ids
-        new_rows_df = edited_df[edited_df['id'].isnull()]
-        updated_rows_df = edited_df[edited_df['id'].isin(original_ids)]
-
-        # --- 【核心修正】內部 helper: 解包 Streamlit 可能回傳的 list ---
-        def clean_val(val):
-            if isinstance(val, list):
-                # 如果是清單 (如 [4])，取出第一個值；若是空清單則回傳 None
-                return val[0] if len(val) > 0 else None
-            return val
+        original_df = _execute_query_to_dataframe(conn, ROOMS_EDITOR_QUERY, (dorm_id,))
+        diff = editor_sync.compute_diff(original_df, edited_df, 'id', ROOM_EDITOR_COLUMNS)
+        inserts, updates = diff['inserts'], diff['updates']
 
         with conn.cursor() as cursor:
-            
-            # --- 動作 A：處理刪除 ---
-            if ids_to_delete:
-                for room_id_to_delete in ids_to_delete:
-                    # 取得房號用於錯誤訊息
-                    room_number_to_delete = original_df[original_df['id'] == room_id_to_delete]['room_number'].iloc[0]
-                    
-                    # 安全檢查
-                    check_sql = """
-                        SELECT COUNT(id) as count 
-                        FROM "AccommodationHistory" 
-                        WHERE room_id = %s AND (end_date IS NULL OR end_date > CURRENT_DATE)
-                    """
-                    cursor.execute(check_sql, (room_id_to_delete,))
-                    result = cursor.fetchone()
-                    
-                    if result and result['count'] > 0:
-                        raise Exception(f"無法刪除房號 {room_number_to_delete} (ID: {room_id_to_delete})，因為裡面還有 {result['count']} 位在住人員。")
-                    
-                    cursor.execute('DELETE FROM "Rooms" WHERE id = %s', (room_id_to_delete,))
-
-            # --- 動作 B：處理新增 ---
-            if not new_rows_df.empty:
-                for _, row in new_rows_df.iterrows():
-                    room_num = clean_val(row['room_number'])
-                    if not room_num or pd.isna(room_num):
-                        raise Exception("新增失敗：『房號』為必填欄位，不可為空。")
-                    
-                    # 加入新欄位
-                    insert_sql = """
-                        INSERT INTO "Rooms" (
-                            dorm_id, room_number, capacity, gender_policy, nationality_policy, 
-                            room_notes, area_sq_meters,
-                            key_status, air_conditioner, room_equipment, issue
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    cursor.execute(insert_sql, (
-                        dorm_id,
-                        room_num,
-                        clean_val(row.get('capacity')),
-                        clean_val(row.get('gender_policy')) or '可混住',
-                        clean_val(row.get('nationality_policy')) or '不限',
-                        clean_val(row.get('room_notes')),
-                        clean_val(row.get('area_sq_meters')),
-                        # 【新增】傳入新欄位的值
-                        clean_val(row.get('key_status')),
-                        clean_val(row.get('air_conditioner')),
-                        clean_val(row.get('room_equipment')),
-                        clean_val(row.get('issue')),
-                    ))
-
-            # --- 動作 C：處理更新 ---
-            if not updated_rows_df.empty:
-                original_indexed = original_df.set_index('id')
-                for _, row in updated_rows_df.iterrows():
-                    room_id_to_update = row['id']
-                    original_row = original_indexed.loc[room_id_to_update]
-                    
-                    if not row.equals(original_row):
-                        room_num = clean_val(row['room_number'])
-                        if not room_num or pd.isna(room_num):
-                             raise Exception(f"更新失敗 (ID: {room_id_to_update})：『房號』不可改為空值。")
-
-                        # 【修改】加入新欄位更新
-                        update_sql = """
-                            UPDATE "Rooms" SET 
-                                room_number = %s, capacity = %s, gender_policy = %s, 
-                                nationality_policy = %s, room_notes = %s, area_sq_meters = %s,
-                                key_status = %s, air_conditioner = %s, room_equipment = %s, issue = %s
-                            WHERE id = %s
-                        """
-                        cursor.execute(update_sql, (
-                            room_num,
-                            clean_val(row.get('capacity')),
-                            clean_val(row.get('gender_policy')) or '可混住',
-                            clean_val(row.get('nationality_policy')) or '不限',
-                            clean_val(row.get('room_notes')),
-                            clean_val(row.get('area_sq_meters')),
-                            # 傳入新欄位的值
-                            clean_val(row.get('key_status')),
-                            clean_val(row.get('air_conditioner')),
-                            clean_val(row.get('room_equipment')),
-                            clean_val(row.get('issue')),
-                            room_id_to_update
-                        ))
+            # --- 動作 A：刪除前的安全檢查 (一次查詢) ---
+            _check_rooms_can_be_deleted(cursor, diff['deletes'])
+
+            # --- 整批驗證：房號為必填 ---
+            missing_insert = editor_sync.blank_mask(inserts['room_number'])
+            if missing_insert.any():
+                raise Exception("新增失敗：『房號』為必填欄位，不可為空。")
+            missing_update = editor_sync.blank_mask(updates['room_number'])
+            if missing_update.any():
+                raise Exception(f"更新失敗 (ID: {updates.loc[missing_update.idxmax(), 'id']})：『房號』不可改為空值。")
+
+            editor_sync.delete_rows(cursor, "Rooms", 'id', diff['deletes'])
+            editor_sync.insert_rows(cursor, "Rooms", _prepare_room_rows(inserts).assign(dorm_id=dorm_id), ['dorm_id'] + ROOM_EDITOR_COLUMNS)
+            editor_sync.update_rows(cursor, "Rooms", 'id', _prepare_room_rows(updates), ROOM_EDITOR_COLUMNS)
         
         conn.commit()
+        occupancy_index.invalidate()
         return True, "房間資料已成功同步。"
 
     except Exception as e:
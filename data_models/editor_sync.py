@@ -0,0 +1,193 @@
+# data_models/editor_sync.py
+# st.data_editor 儲存時共用的差異引擎。
+#   1. compute_diff：以原始資料比對編輯後的表格，整批算出新增、更新 (只含實際有變動的列) 與刪除
+#   2. 各同步函式以布林遮罩整批驗證，再將欄位整欄轉換為資料庫型別
+#   3. delete_rows / insert_rows / update_rows：每種動作只需一次往返
+#      (DELETE ... = ANY、execute_values 的 INSERT、UPDATE ... FROM (VALUES ...))
+# VALUES 內的每個值都會轉型為目標欄位的型別 (型別由系統目錄查詢一次後快取)，整欄皆為空值時也不會被推斷為 text。
+
+import numbers
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+PAGE_SIZE = 1000
+
+_lock = threading.Lock()
+_column_types = {}
+
+def clean_value(value):
+    """將 data_editor 回傳的儲存格值轉為可寫入資料庫的 Python 值 (清單取第一個值、NaN/NaT 轉為 None)。"""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        value = value[0] if len(value) > 0 else None
+    if value is None:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+        return None if isinstance(value, float) and np.isnan(value) else value
+    return value
+
+def clean_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """整張表轉為 object 型別並清理儲存格 (同 clean_value)。"""
+    cleaned = df.astype(object)
+    for column in cleaned.columns:
+        cleaned[column] = cleaned[column].map(clean_value)
+    return cleaned
+
+def _key_series(series: pd.Series) -> pd.Series:
+    """鍵值欄位：數字鍵統一轉為 int (data_editor 的 ID 常以浮點數回傳)，空值為 None。"""
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.notna().sum() == series.notna().sum():
+        return numeric.astype('Int64').astype(object).where(numeric.notna(), None)
+    return series
+
+def _comparable(value):
+    """比較用的正規化：日期與時間轉為 Timestamp、數字 (含 Decimal) 轉為 float，其餘保持原值。"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (datetime, date)):
+        return pd.Timestamp(value)
+    if isinstance(value, numbers.Number) or type(value).__name__ == 'Decimal':
+        return float(value)
+    return value
+
+def _changed_mask(edited: pd.DataFrame, original: pd.DataFrame) -> pd.Series:
+    """逐欄比較兩張已對齊的表，任一欄不同即視為有變動 (兩邊皆為空值視為相同)。"""
+    changed = pd.Series(False, index=edited.index)
+    for column in edited.columns:
+        left = edited[column].map(_comparable)
+        right = original[column].map(_comparable)
+        both_null = left.isna() & right.isna()
+        equal = pd.Series(left.to_numpy() == right.to_numpy(), index=edited.index).astype(bool)
+        changed |= ~(equal | both_null)
+    return changed
+
+def compute_diff(original_df: pd.DataFrame, edited_df: pd.DataFrame, key: str, columns: list) -> dict:
+    """
+    比對 data_editor 編輯前後的表格，回傳：
+      inserts  鍵值為空的新列
+      updates  鍵值存在於原始資料，且 columns 中任一欄有變動的列
+      deletes  原始資料中有、編輯後已不存在的鍵值 (list)
+    兩張表皆會先經過 clean_frame；編輯後缺少的欄位視為空值。
+    """
+    edited = clean_frame(edited_df).reset_index(drop=True)
+    for column in columns:
+        if column not in edited.columns:
+            edited[column] = None
+    edited[key] = _key_series(edited[key])
+
+    original = clean_frame(original_df) if not original_df.empty else pd.DataFrame(columns=[key] + columns)
+    original[key] = _key_series(original[key])
+    original = original.drop_duplicates(subset=[key]).set_index(key)
+    for column in columns:
+        if column not in original.columns:
+            original[column] = None
+
+    original_keys = set(original.index.dropna())
+    has_key = edited[key].notna()
+    existing = edited[has_key & edited[key].isin(original_keys)]
+    aligned = original.reindex(existing[key].tolist())[columns]
+    aligned.index = existing.index
+    changed = _changed_mask(existing[columns], aligned) if not existing.empty else pd.Series(False, index=existing.index)
+
+    return {
+        'inserts': edited[~has_key],
+        'updates': existing[changed],
+        'deletes': sorted(original_keys - set(edited[key].dropna())),
+    }
+
+# --- 整欄型別轉換 (語意同 finance_model.safe_int / safe_float) ---
+
+def int_column(series: pd.Series, default=None) -> pd.Series:
+    """轉為整數 (小數直接捨去)；空值或無法轉換時為 default。"""
+    numeric = pd.to_numeric(series, errors='coerce')
+    return np.trunc(numeric).astype('Int64').astype(object).where(numeric.notna(), default)
+
+def float_column(series: pd.Series) -> pd.Series:
+    """轉為浮點數；空值或無法轉換時為 None。"""
+    numeric = pd.to_numeric(series, errors='coerce')
+    return numeric.astype(object).where(numeric.notna(), None)
+
+def date_column(series: pd.Series) -> pd.Series:
+    """轉為 date 物件；空值或無法轉換時為 None。"""
+    parsed = pd.to_datetime(series, errors='coerce')
+    return pd.Series([value.date() if pd.notna(value) else None for value in parsed], index=series.index, dtype=object)
+
+def bool_column(series: pd.Series) -> pd.Series:
+    """轉為布林值 (空值為 False)，同 bool(row.get(...))。"""
+    return series.map(lambda value: bool(value) if value is not None else False)
+
+def blank_mask(series: pd.Series) -> pd.Series:
+    """空值、空字串或其他「假值」(同 not value 判斷)。"""
+    return series.map(lambda value: value is None or not value)
+
+def column_or(df: pd.DataFrame, column: str, default=None) -> pd.Series:
+    """取出欄位；表格中沒有該欄時以 default 填滿 (同 row.get(column, default))。"""
+    if column in df.columns:
+        return df[column]
+    return pd.Series(default, index=df.index, dtype=object)
+
+# --- 寫入 ---
+
+def _get_column_types(cursor, table: str) -> dict:
+    """查詢 (並快取) 資料表各欄位的型別名稱 (不含長度限制，長度仍由欄位本身檢查)。"""
+    with _lock:
+        if table in _column_types:
+            return _column_types[table]
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, NULL) AS type_name
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+    """, (f'"{table}"',))
+    types = {row['attname']: row['type_name'] for row in cursor.fetchall()}
+    with _lock:
+        _column_types[table] = types
+    return types
+
+def _template(cursor, table: str, columns: list) -> str:
+    types = _get_column_types(cursor, table)
+    return '(' + ', '.join(f'%s::{types[column]}' for column in columns) + ')'
+
+def _records(frame: pd.DataFrame, columns: list) -> list:
+    return [tuple(clean_value(value) for value in row) for row in frame[columns].itertuples(index=False, name=None)]
+
+def delete_rows(cursor, table: str, key: str, keys: list) -> int:
+    """一次刪除多筆紀錄。"""
+    if not keys:
+        return 0
+    cursor.execute(f'DELETE FROM "{table}" WHERE "{key}" = ANY(%s)', (list(keys),))
+    return cursor.rowcount
+
+def insert_rows(cursor, table: str, frame: pd.DataFrame, columns: list) -> int:
+    """以 execute_values 一次新增多筆紀錄 (frame 的欄位名稱即資料表欄位名稱)。"""
+    if frame.empty:
+        return 0
+    column_sql = ', '.join(f'"{column}"' for column in columns)
+    execute_values(
+        cursor, f'INSERT INTO "{table}" ({column_sql}) VALUES %s',
+        _records(frame, columns), template=_template(cursor, table, columns), page_size=PAGE_SIZE
+    )
+    return len(frame)
+
+def update_rows(cursor, table: str, key: str, frame: pd.DataFrame, columns: list) -> int:
+    """以 UPDATE ... FROM (VALUES ...) 一次更新多筆紀錄 (frame 需包含 key 與 columns)。"""
+    if frame.empty:
+        return 0
+    all_columns = [key] + columns
+    set_sql = ', '.join(f'"{column}" = v."{column}"' for column in columns)
+    alias_sql = ', '.join(f'"{column}"' for column in all_columns)
+    execute_values(
+        cursor,
+        f'UPDATE "{table}" AS t SET {set_sql} FROM (VALUES %s) AS v ({alias_sql}) WHERE t."{key}" = v."{key}"',
+        _records(frame, all_columns), template=_template(cursor, table, all_columns), page_size=PAGE_SIZE
+    )
+    return len(frame)
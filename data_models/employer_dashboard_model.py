@@ -1042,4 +1042,24 @@ def get_employer_cash_flow_details_for_dorm(employer_names: list, dorm_id: int,
         return income_df, expense_df
 
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
+
+def get_employer_details_for_dorms(employer_names: list, dorm_ids: list, period: str, cash_flow: bool = False):
+    """
+    一次取得多間宿舍的詳細收支項目 (報表匯出用)，回傳 {dorm_id: (income_df, expense_df)}。
+    各宿舍的查詢互不相依，以 database.run_concurrently 同時執行；cash_flow=True 時使用現金流 (不攤提) 版本。
+    """
+    details_func = get_employer_cash_flow_details_for_dorm if cash_flow else get_employer_financial_details_for_dorm
+    return database.run_concurrently({
+        dorm_id: (details_func, employer_names, dorm_id, period) for dorm_id in dict.fromkeys(dorm_ids)
+    })
+
+def get_employer_monthly_data(employer_names: list, year_month: str, only_my_company: bool = False):
+    """
+    按月檢視頁籤所需的收支摘要與在住人員明細，兩個查詢同時執行。
+    回傳 {'summary': DataFrame, 'details': DataFrame}。
+    """
+    return database.run_concurrently({
+        'summary': (get_employer_financial_summary, employer_names, year_month, only_my_company),
+        'details': (get_employer_resident_details, employer_names, year_month, only_my_company),
+    })
@@ -0,0 +1,156 @@
+# data_models/excel_reader.py
+# 批次匯入的 Excel 讀取層：以串流方式分段讀取上傳的檔案，記憶體用量只與每段的列數有關，
+# 不會像 pd.read_excel 一樣把整本活頁簿載入記憶體。
+#   - 已安裝 python-calamine 時使用它 (Rust 實作，速度最快)
+#   - 否則使用 openpyxl 的唯讀模式 (read_only) 逐列讀取
+#   - 舊版 .xls 無法串流，交由 pandas 一次讀入後再分段
+# 產生的 DataFrame 與 pd.read_excel 相同：第一個工作表、第一列為標題、略過結尾的空白列，
+# 索引為資料列的序號 (跨段連續)，因此失敗列的索引可直接對照原始檔案。
+
+import openpyxl
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+CHUNK_SIZE = 5000
+PREVIEW_ROWS = 5
+
+def _rewind(file):
+    """Streamlit 的上傳檔案可重複讀取，每次讀取前回到開頭。"""
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+def _is_xls(file) -> bool:
+    name = file if isinstance(file, str) else getattr(file, 'name', '')
+    return str(name).lower().endswith('.xls')
+
+def _convert_cell(value):
+    """與 pd.read_excel 相同的儲存格轉換：空字串視為空值、整數值的浮點數轉為 int。"""
+    if isinstance(value, str) and value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _iter_raw_rows(file):
+    """逐列產生第一個工作表的原始儲存格值 (tuple/list)。"""
+    _rewind(file)
+    if CALAMINE_AVAILABLE:
+        workbook = CalamineWorkbook.from_filelike(file) if hasattr(file, 'read') else CalamineWorkbook.from_path(file)
+        yield from workbook.get_sheet_by_index(0).iter_rows()
+        return
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        # 部分系統匯出的檔案記錄的範圍不正確，重設後以實際內容為準
+        worksheet.reset_dimensions()
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _header_names(row) -> list:
+    """整理標題列：去除尾端空白欄、空標題命名為 Unnamed: n、重複標題加上 .1 .2 (同 pandas)。"""
+    values = [_convert_cell(value) for value in row]
+    while values and values[-1] is None:
+        values.pop()
+    names, seen = [], {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _build_frame(rows: list, columns: list, start: int, as_text: bool) -> pd.DataFrame:
+    index = pd.RangeIndex(start, start + len(rows))
+    if as_text:
+        # 等同 pd.read_excel(dtype=str).fillna('')
+        frame = pd.DataFrame(rows, columns=columns, index=index, dtype=object)
+        return frame.map(lambda value: '' if value is None else str(value))
+    return pd.DataFrame(rows, columns=columns, index=index)
+
+def _iter_xls_chunks(file, chunk_size: int, as_text: bool):
+    _rewind(file)
+    df = pd.read_excel(file, dtype=str).fillna('') if as_text else pd.read_excel(file)
+    if df.empty:
+        yield df
+        return
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+def iter_excel_chunks(file, chunk_size: int = CHUNK_SIZE, as_text: bool = False, max_rows: int = None):
+    """
+    分段讀取上傳的 Excel 檔案，每次產生最多 chunk_size 列的 DataFrame。
+    as_text=True 時所有欄位皆為字串 (空白為 '')，同 pd.read_excel(dtype=str).fillna('')。
+    至少會產生一段 (檔案沒有資料列時為只有欄位的空 DataFrame)。
+    """
+    if _is_xls(file):
+        yield from _iter_xls_chunks(file, chunk_size, as_text)
+        return
+
+    rows_iter = _iter_raw_rows(file)
+    try:
+        columns = None
+        for row in rows_iter:
+            if any(_convert_cell(value) is not None for value in row):
+                columns = _header_names(row)
+                break
+        if columns is None:
+            yield pd.DataFrame()
+            return
+
+        width = len(columns)
+        buffer, start, yielded, blank_rows = [], 0, False, 0
+        for row in rows_iter:
+            values = [_convert_cell(value) for value in row[:width]]
+            if all(value is None for value in values):
+                # 同 pd.read_excel：中間的空白列保留 (維持列號對應)，檔案結尾的空白列略過
+                blank_rows += 1
+                continue
+            buffer.extend([[None] * width for _ in range(blank_rows)])
+            blank_rows = 0
+            values.extend([None] * (width - len(values)))
+            buffer.append(values)
+            if max_rows is not None and start + len(buffer) >= max_rows:
+                buffer = buffer[:max_rows - start]
+                break
+            while len(buffer) >= chunk_size:
+                yield _build_frame(buffer[:chunk_size], columns, start, as_text)
+                yielded = True
+                start += chunk_size
+                buffer = buffer[chunk_size:]
+        if buffer or not yielded:
+            yield _build_frame(buffer, columns, start, as_text)
+    finally:
+        # 提前結束 (預覽) 時也要關閉活頁簿
+        rows_iter.close()
+
+def read_excel_preview(file, rows: int = PREVIEW_ROWS, as_text: bool = False) -> pd.DataFrame:
+    """只讀取檔案開頭幾列供預覽，不需載入整個檔案。"""
+    chunks = iter_excel_chunks(file, chunk_size=rows, as_text=as_text, max_rows=rows)
+    try:
+        return next(chunks)
+    finally:
+        chunks.close()
+
+def estimate_row_count(file):
+    """由工作表記錄的範圍估計資料列數 (供進度條使用)；無法估計時回傳 None。"""
+    if _is_xls(file):
+        return None
+    _rewind(file)
+    try:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+    except Exception:
+        return None
+    return max(max_row - 1, 0) if max_row else None
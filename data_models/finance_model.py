@@ -3,8 +3,10 @@ from datetime import datetime, date
 import database
 import json
 import os
-import numpy as np
 from . import worker_model
+from . import identity_resolver
+from . import editor_sync
+from . import analytics_model
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -491,6 +493,7 @@ def add_bill_record(details: dict):
             sql = f'INSERT INTO "UtilityBills" ({columns}) VALUES ({placeholders}) RETURNING id'
             cursor.execute(sql, tuple(details.values()))
             new_id = cursor.fetchone()['id']
+            analytics_model.refresh_anomalies(cursor, [details.get('meter_id')])
         conn.commit()
         return True, f"成功新增費用紀錄 (ID: {new_id})", new_id
     except Exception as e:
@@ -508,10 +511,15 @@ def update_bill_record(record_id: int, details: dict):
             if 'amount' in details:
                 details['amount'] = safe_int(details['amount'])
                 
+            cursor.execute('SELECT meter_id FROM "UtilityBills" WHERE id = %s', (record_id,))
+            old_meter_ids = [row['meter_id'] for row in cursor.fetchall()]
             fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
             values = list(details.values()) + [record_id]
-            sql = f'UPDATE "UtilityBills" SET {fields} WHERE id = %s'
+            sql = f'UPDATE "UtilityBills" SET {fields} WHERE id = %s RETURNING meter_id'
             cursor.execute(sql, tuple(values))
+            # 帳單可能改掛到其他錶，新舊兩個錶都要重新計算異常
+            new_meter_ids = [row['meter_id'] for row in cursor.fetchall()]
+            analytics_model.refresh_anomalies(cursor, old_meter_ids + new_meter_ids)
         conn.commit()
         return True, "帳單紀錄更新成功！"
     except Exception as e:
@@ -526,7 +534,8 @@ def delete_bill_record(record_id: int):
     if not conn: return False, "DB connection failed."
     try:
         with conn.cursor() as cursor:
-            cursor.execute('DELETE FROM "UtilityBills" WHERE id = %s', (record_id,))
+            cursor.execute('DELETE FROM "UtilityBills" WHERE id = %s RETURNING meter_id', (record_id,))
+            analytics_model.refresh_anomalies(cursor, [row['meter_id'] for row in cursor.fetchall()])
         conn.commit()
         return True, "帳單紀錄已成功刪除。"
     except Exception as e:
@@ -601,10 +610,11 @@ def batch_delete_bill_records(record_ids: list):
     try:
         with conn.cursor() as cursor:
             # 使用 ANY(%s) 語法可以安全地處理 ID 列表
-            query = 'DELETE FROM "UtilityBills" WHERE id = ANY(%s)'
+            query = 'DELETE FROM "UtilityBills" WHERE id = ANY(%s) RETURNING meter_id'
             cursor.execute(query, (record_ids,))
             # cursor.rowcount 會回傳受影響的行數
             deleted_count = cursor.rowcount
+            analytics_model.refresh_anomalies(cursor, [row['meter_id'] for row in cursor.fetchall()])
         conn.commit()
         return True, f"成功刪除了 {deleted_count} 筆費用紀錄。"
     except Exception as e:
@@ -749,6 +759,30 @@ def get_expense_details_by_compliance_id(compliance_id: int):
     finally:
         if conn: conn.close()
 
+BILL_EDITOR_COLUMNS = [
+    'bill_type', 'amount', 'usage_amount', 'peak_usage', 'off_peak_usage', 'sat_half_peak_usage',
+    'bill_start_date', 'bill_end_date', 'payer', 'is_pass_through', 'is_invoiced', 'notes'
+]
+BILL_USAGE_COLUMNS = ['usage_amount', 'peak_usage', 'off_peak_usage', 'sat_half_peak_usage']
+
+METER_BILLS_EDITOR_QUERY = """
+    SELECT *
+    FROM "UtilityBills"
+    WHERE meter_id = %s
+    ORDER BY bill_end_date DESC
+"""
+
+DORM_BILLS_EDITOR_QUERY = """
+    SELECT 
+        id, meter_id, bill_type, amount, usage_amount,
+        peak_usage, off_peak_usage, sat_half_peak_usage,
+        bill_start_date, bill_end_date, payer, 
+        is_pass_through, is_invoiced, notes
+    FROM "UtilityBills"
+    WHERE dorm_id = %s
+    ORDER BY bill_end_date DESC
+"""
+
 def get_bills_for_editor(meter_id: int):
     """
     【v2.9 新增】為 data_editor 查詢指定錶號的所有獨立帳單紀錄。
@@ -757,141 +791,86 @@ def get_bills_for_editor(meter_id: int):
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
     try:
-        # 【修改】加入 peak_usage 和 off_peak_usage
-        query = """
-            SELECT *
-            FROM "UtilityBills"
-            WHERE meter_id = %s
-            ORDER BY bill_end_date DESC
-        """
-        return _execute_query_to_dataframe(conn, query, (meter_id,))
+        return _execute_query_to_dataframe(conn, METER_BILLS_EDITOR_QUERY, (meter_id,))
     finally:
         if conn: conn.close()
 
+def _validate_bill_rows(inserts: pd.DataFrame, updates: pd.DataFrame):
+    """
+    整批檢查新增與更新的帳單：必填欄位 (類型、金額、起訖日) 與起訖日先後。
+    有錯誤時以第一筆錯誤列的訊息丟出例外 (先檢查新增、再檢查更新)。
+    """
+    for is_insert, rows in ((True, inserts), (False, updates)):
+        if rows.empty:
+            continue
+        start = pd.to_datetime(rows['bill_start_date'], errors='coerce')
+        end = pd.to_datetime(rows['bill_end_date'], errors='coerce')
+        missing = editor_sync.blank_mask(rows['bill_type']) | start.isna() | end.isna() | rows['amount'].isna()
+        reversed_dates = ~missing & (start > end)
+        invalid = missing | reversed_dates
+        if not invalid.any():
+            continue
+        row_index = invalid.idxmax()
+        row = rows.loc[row_index]
+        if is_insert:
+            if missing[row_index]:
+                raise Exception("新增失敗：『費用類型』、『帳單金額』、『起始日』、『結束日』不可為空。")
+            raise Exception(f"新增失敗 (類型 {row['bill_type']})：『起始日』不可晚於『結束日』。")
+        if missing[row_index]:
+            raise Exception(f"更新失敗 (ID: {row['id']})：必填欄位不可為空。")
+        raise Exception(f"更新失敗 (ID: {row['id']})：『起始日』不可晚於『結束日』。")
+
+def _prepare_bill_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    """整批將帳單欄位轉為資料庫型別 (金額同 safe_int、用量同 safe_float)。"""
+    prepared = rows[['id'] + BILL_EDITOR_COLUMNS].copy()
+    prepared['amount'] = editor_sync.int_column(rows['amount'], default=0)
+    for column in BILL_USAGE_COLUMNS:
+        prepared[column] = editor_sync.float_column(rows[column])
+    prepared['bill_start_date'] = editor_sync.date_column(rows['bill_start_date'])
+    prepared['bill_end_date'] = editor_sync.date_column(rows['bill_end_date'])
+    prepared['is_pass_through'] = editor_sync.bool_column(rows['is_pass_through'])
+    prepared['is_invoiced'] = editor_sync.bool_column(rows['is_invoiced'])
+    return prepared
+
+def _sync_bills(conn, original_df: pd.DataFrame, edited_df: pd.DataFrame, editor_columns: list, prepare_rows, insert_values: dict):
+    """
+    帳單 data_editor 的共用同步流程：整批比對 → 整批驗證 → 刪除、新增、更新各一次往返。
+    editor_columns 為可編輯 (需比對與更新) 的欄位，insert_values 為新增時額外寫入的固定欄位。
+    最後只重新計算有變動的帳單所屬 (含修改前所屬) 電水錶的異常旗標。
+    """
+    if 'payer' not in edited_df.columns:
+        edited_df = edited_df.assign(payer='我司')
+    diff = editor_sync.compute_diff(original_df, edited_df, 'id', editor_columns)
+    _validate_bill_rows(diff['inserts'], diff['updates'])
+
+    inserts = prepare_rows(diff['inserts']).assign(**insert_values)
+    updates = prepare_rows(diff['updates'])
+    with conn.cursor() as cursor:
+        editor_sync.delete_rows(cursor, "UtilityBills", 'id', diff['deletes'])
+        editor_sync.insert_rows(cursor, "UtilityBills", inserts, list(insert_values) + editor_columns)
+        editor_sync.update_rows(cursor, "UtilityBills", 'id', updates, editor_columns)
+
+        changed_ids = set(diff['deletes']) | set(diff['updates']['id'])
+        affected_meters = set(original_df.loc[original_df['id'].isin(changed_ids), 'meter_id']) if changed_ids else set()
+        for rows in (inserts, updates):
+            if 'meter_id' in rows.columns:
+                affected_meters |= set(rows['meter_id'])
+        analytics_model.refresh_anomalies(cursor, affected_meters)
+
 def batch_sync_bills(meter_id: int, dorm_id: int, edited_df: pd.DataFrame):
     """
     【v2.9 新增】在單一交易中，批次同步 (新增、更新、刪除) 指定錶號的帳單。
+    【v3.2 差異引擎版】以 editor_sync 整批比對與驗證，只寫入實際有變動的列，
+    刪除、新增、更新各只需一次資料庫往返。
     """
     conn = database.get_db_connection()
     if not conn: 
         return False, "資料庫連線失敗。"
 
     try:
-        # 1. 取得資料庫目前的狀態
-        original_df = get_bills_for_editor(meter_id)
-        original_ids = set(original_df['id'].dropna())
-        
-        # 2. 取得 data_editor 編輯後的狀態
-        edited_df = edited_df.replace({pd.NaT: None, np.nan: None})
-        edited_ids = set(edited_df['id'].dropna())
-
-        # 3. 計算差異
-        ids_to_delete = original_ids - edited_ids
-        new_rows_df = edited_df[edited_df['id'].isnull()]
-        updated_rows_df = edited_df[edited_df['id'].isin(original_ids)]
-        
-        bill_type_options = ["電費", "水費", "天然氣", "網路費", "子母車", "清潔", "瓦斯費"]
-
-        with conn.cursor() as cursor:
-            
-            # --- 動作 A：處理刪除 ---
-            if ids_to_delete:
-                cursor.execute(
-                    'DELETE FROM "UtilityBills" WHERE id = ANY(%s)', 
-                    (list(ids_to_delete),)
-                )
-
-            # --- 動作 B：處理新增 ---
-            if not new_rows_df.empty:
-                for _, row in new_rows_df.iterrows():
-                    raw_start_date = row['bill_start_date']
-                    raw_end_date = row['bill_end_date']
-
-                    if not row['bill_type'] or pd.isna(raw_start_date) or pd.isna(raw_end_date) or pd.isna(row['amount']):
-                        raise Exception("新增失敗：『費用類型』、『帳單金額』、『起始日』、『結束日』不可為空。")
-                    
-                    start_date_obj = pd.to_datetime(raw_start_date).date()
-                    end_date_obj = pd.to_datetime(raw_end_date).date()
-                    if start_date_obj > end_date_obj:
-                        raise Exception(f"新增失敗 (類型 {row['bill_type']})：『起始日』不可晚於『結束日』。")
-                    
-                    final_bill_type = row['bill_type']
-                    
-                    # 【安全轉換】
-                    amount_val = safe_int(row['amount'])
-                    usage_val = safe_float(row.get('usage_amount'))
-                    peak_val = safe_float(row.get('peak_usage'))
-                    off_peak_val = safe_float(row.get('off_peak_usage'))
-                    sat_half_peak_val = safe_float(row.get('sat_half_peak_usage'))
-                    
-                    # 【修改】加入 peak_usage 和 off_peak_usage
-                    insert_sql = """
-                        INSERT INTO "UtilityBills" (
-                            dorm_id, meter_id, bill_type, amount, usage_amount, 
-                            peak_usage, off_peak_usage, sat_half_peak_usage,
-                            bill_start_date, bill_end_date, payer, 
-                            is_pass_through, is_invoiced, notes
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
-                    """
-                    cursor.execute(insert_sql, (
-                        dorm_id, meter_id, final_bill_type,
-                        amount_val, usage_val,
-                        peak_val, off_peak_val, sat_half_peak_val, 
-                        start_date_obj,
-                        end_date_obj,
-                        row.get('payer', '我司'),
-                        bool(row.get('is_pass_through')),
-                        bool(row.get('is_invoiced')),
-                        row.get('notes')
-                    ))
-
-            # --- 動作 C：處理更新 ---
-            if not updated_rows_df.empty:
-                original_indexed = original_df.set_index('id')
-                for _, row in updated_rows_df.iterrows():
-                    bill_id_to_update = row['id']
-                    original_row = original_indexed.loc[bill_id_to_update]
-                    
-                    if not row.equals(original_row):
-                        raw_start_date_upd = row['bill_start_date']
-                        raw_end_date_upd = row['bill_end_date']
-                        
-                        if not row['bill_type'] or pd.isna(raw_start_date_upd) or pd.isna(raw_end_date_upd) or pd.isna(row['amount']):
-                            raise Exception(f"更新失敗 (ID: {bill_id_to_update})：必填欄位不可為空。")
-                        
-                        start_date_obj_upd = pd.to_datetime(raw_start_date_upd).date()
-                        end_date_obj_upd = pd.to_datetime(raw_end_date_upd).date()
-                        if start_date_obj_upd > end_date_obj_upd:
-                             raise Exception(f"更新失敗 (ID: {bill_id_to_update})：『起始日』不可晚於『結束日』。")
-
-                        # 【安全轉換】
-                        amount_val_upd = safe_int(row['amount'])
-                        usage_val_upd = safe_float(row.get('usage_amount'))
-                        peak_val = safe_float(row.get('peak_usage'))
-                        off_peak_val = safe_float(row.get('off_peak_usage'))
-                        sat_half_peak_val = safe_float(row.get('sat_half_peak_usage'))
-
-                        # 更新 SQL
-                        update_sql = """
-                            UPDATE "UtilityBills" SET 
-                                bill_type = %s, amount = %s, usage_amount = %s,
-                                peak_usage = %s, off_peak_usage = %s, sat_half_peak_usage = %s, -- 【新增此欄】
-                                bill_start_date = %s, bill_end_date = %s, payer = %s,
-                                is_pass_through = %s, is_invoiced = %s, notes = %s
-                            WHERE id = %s
-                        """
-                        cursor.execute(update_sql, (
-                            row['bill_type'], amount_val_upd, usage_val_upd,
-                            peak_val, off_peak_val, sat_half_peak_val,
-                            start_date_obj_upd,
-                            end_date_obj_upd,
-                            row.get('payer', '我司'),
-                            bool(row.get('is_pass_through')),
-                            bool(row.get('is_invoiced')),
-                            row.get('notes'),
-                            bill_id_to_update
-                        ))
-        
+        original_df = _execute_query_to_dataframe(conn, METER_BILLS_EDITOR_QUERY, (meter_id,))
+        _sync_bills(conn, original_df, edited_df, BILL_EDITOR_COLUMNS, _prepare_bill_rows,
+                    {'dorm_id': dorm_id, 'meter_id': meter_id})
         conn.commit()
         return True, "帳單資料已成功同步。"
 
@@ -909,150 +888,30 @@ def get_bills_for_dorm_editor(dorm_id: int):
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
     try:
-        query = """
-            SELECT 
-                id, meter_id, bill_type, amount, usage_amount,
-                peak_usage, off_peak_usage, sat_half_peak_usage,
-                bill_start_date, bill_end_date, payer, 
-                is_pass_through, is_invoiced, notes
-            FROM "UtilityBills"
-            WHERE dorm_id = %s
-            ORDER BY bill_end_date DESC
-        """
-        return _execute_query_to_dataframe(conn, query, (dorm_id,))
+        return _execute_query_to_dataframe(conn, DORM_BILLS_EDITOR_QUERY, (dorm_id,))
     finally:
         if conn: conn.close()
 
+def _prepare_dorm_bill_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    """同 _prepare_bill_rows，另外轉換每列的 meter_id (空值或 0 代表不屬於任何錶號)。"""
+    prepared = _prepare_bill_rows(rows)
+    meter_ids = editor_sync.int_column(rows['meter_id'])
+    prepared['meter_id'] = meter_ids.where(meter_ids.map(lambda value: value is not None and value != 0), None)
+    return prepared
 
 def batch_sync_dorm_bills(dorm_id: int, edited_df: pd.DataFrame):
     """
     在單一交易中，批次同步 (新增、更新、刪除) 指定 *宿舍* 的帳單。
+    【v3.2 差異引擎版】與 batch_sync_bills 共用 editor_sync 的整批比對、驗證與寫入。
     """
     conn = database.get_db_connection()
     if not conn: 
         return False, "資料庫連線失敗。"
 
     try:
-        # 1. 取得資料庫目前的狀態
-        original_df = get_bills_for_dorm_editor(dorm_id)
-        original_ids = set(original_df['id'].dropna())
-        
-        # 2. 取得 data_editor 編輯後的狀態
-        edited_df = edited_df.replace({pd.NaT: None, np.nan: None})
-        
-        # 清理 meter_id：確保來自新空行 (NaN) 的值被存為 None
-        if 'meter_id' in edited_df.columns:
-             # 【安全轉換】meter_id
-             edited_df['meter_id'] = edited_df['meter_id'].apply(lambda x: safe_int(x) if pd.notna(x) and x != 0 else None)
-
-        edited_ids = set(edited_df['id'].dropna())
-
-        # 3. 計算差異
-        ids_to_delete = original_ids - edited_ids
-        new_rows_df = edited_df[edited_df['id'].isnull()]
-        updated_rows_df = edited_df[edited_df['id'].isin(original_ids)]
-        
-        bill_type_options = ["電費", "水費", "天然氣", "網路費", "子母車", "清潔", "瓦斯費"]
-
-        with conn.cursor() as cursor:
-            
-            # --- 動作 A：處理刪除 ---
-            if ids_to_delete:
-                cursor.execute(
-                    'DELETE FROM "UtilityBills" WHERE id = ANY(%s)', 
-                    (list(ids_to_delete),)
-                )
-
-            # --- 動作 B：處理新增 ---
-            if not new_rows_df.empty:
-                for _, row in new_rows_df.iterrows():
-                    raw_start_date = row['bill_start_date']
-                    raw_end_date = row['bill_end_date']
-
-                    # 驗證必填欄位
-                    if not row['bill_type'] or pd.isna(raw_start_date) or pd.isna(raw_end_date) or pd.isna(row['amount']):
-                        raise Exception("新增失敗：『費用類型』、『帳單金額』、『起始日』、『結束日』不可為空。")
-                    
-                    # --- 【核心修改 (V4)】 ---
-                    start_date_obj = pd.to_datetime(raw_start_date).date()
-                    end_date_obj = pd.to_datetime(raw_end_date).date()
-                    if start_date_obj > end_date_obj:
-                        raise Exception(f"新增失敗 (類型 {row['bill_type']})：『起始日』不可晚於『結束日』。")
-                    # --- 【修改結束】 ---
-                    
-                    # 【安全轉換】
-                    amount_val = safe_int(row['amount'])
-                    usage_val = safe_float(row.get('usage_amount'))
-                    peak_val = safe_float(row.get('peak_usage'))
-                    off_peak_val = safe_float(row.get('off_peak_usage'))
-                    sat_half_peak_val = safe_float(row.get('sat_half_peak_usage'))
-                    meter_id_val = safe_int(row.get('meter_id')) if pd.notna(row.get('meter_id')) else None
-
-                    insert_sql = """
-                        INSERT INTO "UtilityBills" (
-                            dorm_id, meter_id, bill_type, amount, usage_amount, 
-                            peak_usage, off_peak_usage, sat_half_peak_usage, -- 新增
-                            bill_start_date, bill_end_date, payer, 
-                            is_pass_through, is_invoiced, notes
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    cursor.execute(insert_sql, (
-                        dorm_id, meter_id_val, row['bill_type'],
-                        amount_val, usage_val,
-                        peak_val, off_peak_val, sat_half_peak_val, # 新增參數
-                        start_date_obj, end_date_obj,
-                        row.get('payer', '我司'), bool(row.get('is_pass_through')), bool(row.get('is_invoiced')), row.get('notes')
-                    ))
-
-            # --- 動作 C：處理更新 ---
-            if not updated_rows_df.empty:
-                original_indexed = original_df.set_index('id')
-                for _, row in updated_rows_df.iterrows():
-                    bill_id_to_update = int(row['id'])
-                    original_row = original_indexed.loc[bill_id_to_update]
-                    
-                    if not row.equals(original_row):
-                        raw_start_date_upd = row['bill_start_date']
-                        raw_end_date_upd = row['bill_end_date']
-
-                        if not row['bill_type'] or pd.isna(raw_start_date_upd) or pd.isna(raw_end_date_upd) or pd.isna(row['amount']):
-                            raise Exception(f"更新失敗 (ID: {bill_id_to_update})：必填欄位不可為空。")
-                        
-                        start_date_obj_upd = pd.to_datetime(raw_start_date_upd).date()
-                        end_date_obj_upd = pd.to_datetime(raw_end_date_upd).date()
-
-                        # 【核心修正】使用 safe_int/safe_float 避免 list 錯誤
-                        try:
-                            amount_val_upd = safe_int(row['amount'])
-                            usage_val_upd = safe_float(row.get('usage_amount'))
-                            peak_val = safe_float(row.get('peak_usage'))
-                            off_peak_val = safe_float(row.get('off_peak_usage'))
-                            sat_half_peak_val = safe_float(row.get('sat_half_peak_usage'))
-                            meter_id_val_upd = safe_int(row.get('meter_id')) if pd.notna(row.get('meter_id')) else None
-
-                        except ValueError as ve:
-                             raise Exception(f"數值格式錯誤 (ID: {bill_id_to_update}): {ve}")
-
-                        update_sql = """
-                            UPDATE "UtilityBills" SET 
-                                meter_id = %s, bill_type = %s, amount = %s, 
-                                usage_amount = %s, peak_usage = %s, off_peak_usage = %s, sat_half_peak_usage = %s, -- 新增
-                                bill_start_date = %s, bill_end_date = %s, payer = %s,
-                                is_pass_through = %s, is_invoiced = %s, notes = %s
-                            WHERE id = %s
-                        """
-                        try:
-                            cursor.execute(update_sql, (
-                            meter_id_val_upd, row['bill_type'], amount_val_upd, 
-                            usage_val_upd, peak_val, off_peak_val, sat_half_peak_val,
-                            start_date_obj_upd, end_date_obj_upd,
-                            row.get('payer', '我司'), bool(row.get('is_pass_through')), bool(row.get('is_invoiced')), row.get('notes'),
-                            bill_id_to_update
-                        ))
-                        except Exception as sql_err:
-                            # 捕捉 SQL 執行錯誤並提供詳細資訊
-                            raise Exception(f"SQL執行失敗 (ID: {bill_id_to_update}): {sql_err} | 嘗試寫入數值: Amount={amount_val_upd}, MeterID={meter_id_val_upd}")
-        
+        original_df = _execute_query_to_dataframe(conn, DORM_BILLS_EDITOR_QUERY, (dorm_id,))
+        _sync_bills(conn, original_df, edited_df, ['meter_id'] + BILL_EDITOR_COLUMNS, _prepare_dorm_bill_rows,
+                    {'dorm_id': dorm_id})
         conn.commit()
         return True, "帳單資料已成功同步。"
 
@@ -1065,12 +924,18 @@ def batch_sync_dorm_bills(dorm_id: int, edited_df: pd.DataFrame):
     finally:
         if conn: conn.close()
 
+FEE_IMPORT_STAGING_TABLE = 'fee_import_staging'
+
 def batch_import_external_fees(df: pd.DataFrame):
     """
     批次匯入外部 B04 報表的費用資料至 FeeHistory。
-    【v3.0 自動加總版】
+    【v3.1 批次寫入版】
     在寫入資料庫前，先將「同一人 + 同一日 + 同一費用類型」的多筆資料金額加總。
     解決「水費+電費」對應到「水電費」時的覆蓋問題。
+    比對到員工的資料以 COPY 寫入暫存表，再以一道 INSERT ... ON CONFLICT DO UPDATE 完成新增或更新，
+    不再逐筆查詢與寫入 (依賴 FeeHistory 上 (worker_unique_id, fee_type, effective_date) 的唯一索引)。
+    可一次傳入多個報表合併後的資料，員工快取只建立一次，所有費用在同一交易中寫入。
+    回傳 (成功筆數, 跳過筆數, 錯誤訊息列表)；找不到的員工每人只列一行 (附上跳過的費用筆數與金額)。
     """
     if df.empty:
         return 0, 0, []
@@ -1078,8 +943,6 @@ def batch_import_external_fees(df: pd.DataFrame):
     conn = database.get_db_connection()
     if not conn: return 0, 0, ["資料庫連線失敗"]
 
-    success_count = 0
-    skip_count = 0
     errors = []
 
     # --- 【核心修改 1】資料預處理與加總 ---
@@ -1087,7 +950,14 @@ def batch_import_external_fees(df: pd.DataFrame):
     df['passport_number'] = df['passport_number'].fillna("")
     df['employer_name'] = df['employer_name'].fillna("").str.strip()
     df['worker_name'] = df['worker_name'].fillna("").str.strip()
-    
+
+    # 日期統一轉為 date，避免 "2025-1-5" 與 "2025-01-05" 被視為不同日期
+    parsed_dates = pd.to_datetime(df['effective_date'], errors='coerce')
+    invalid_dates = df[parsed_dates.isna()]
+    for _, row in invalid_dates.iterrows():
+        errors.append(f"日期格式錯誤: {row['employer_name']} - {row['worker_name']} - {row['effective_date']}")
+    df = df[parsed_dates.notna()].assign(effective_date=parsed_dates[parsed_dates.notna()].dt.date)
+
     # 2. 執行加總 (GroupBy)
     # 根據「人 + 費用類型 + 日期」分組，將「金額」相加，「原始名稱」串接
     # 例如：水費(200) + 電費(300) -> 水電費(500)
@@ -1102,66 +972,36 @@ def batch_import_external_fees(df: pd.DataFrame):
 
     try:
         with conn.cursor() as cursor:
-            # 1. 建立員工快取
-            cursor.execute('SELECT unique_id, employer_name, worker_name, passport_number FROM "Workers"')
-            workers = cursor.fetchall()
-            
-            worker_map = {}
-            for w in workers:
-                p_num = str(w['passport_number']).strip() if w['passport_number'] else ""
-                if p_num == 'None': p_num = "" 
-
-                key = (
-                    str(w['employer_name']).strip(),
-                    str(w['worker_name']).strip(),
-                    p_num
-                )
-                worker_map[key] = w['unique_id']
-
-            # 2. 遍歷 "加總後" 的資料進行匯入
-            for _, row in df_aggregated.iterrows():
-                
-                # 準備比對 Key
-                passport_key = str(row['passport_number']).strip()
-                key = (
-                    str(row['employer_name']),
-                    str(row['worker_name']),
-                    passport_key
-                )
-                
-                worker_id = worker_map.get(key)
-                
-                if not worker_id:
-                    p_display = passport_key if passport_key else "(無護照)"
-                    errors.append(f"找不到員工: {row['employer_name']} - {row['worker_name']} - {p_display}")
-                    skip_count += 1
-                    continue
-
-                # 3. 執行 Upsert (有則更新，無則新增)
-                # 這裡的 row['amount'] 已經是加總過的金額了
-                check_sql = """
-                    SELECT id FROM "FeeHistory" 
-                    WHERE worker_unique_id = %s AND fee_type = %s AND effective_date = %s
-                """
-                cursor.execute(check_sql, (worker_id, row['fee_type'], row['effective_date']))
-                existing = cursor.fetchone()
-
-                if existing:
-                    # 更新為新的總金額
-                    update_sql = 'UPDATE "FeeHistory" SET amount = %s WHERE id = %s'
-                    cursor.execute(update_sql, (row['amount'], existing['id']))
-                else:
-                    # 新增紀錄
-                    insert_sql = """
-                        INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date)
-                        VALUES (%s, %s, %s, %s)
-                    """
-                    cursor.execute(insert_sql, (worker_id, row['fee_type'], row['amount'], row['effective_date']))
-                
-                success_count += 1
+            # 1. 以共用的身分索引整批比對 (雇主、姓名、護照皆去除前後空白，空護照視為 "")
+            df_aggregated['passport_number'] = df_aggregated['passport_number'].astype(str).str.strip()
+            matched = df_aggregated.assign(unique_id=identity_resolver.resolve_identity(
+                conn, df_aggregated['employer_name'], df_aggregated['worker_name'], df_aggregated['passport_number']
+            ))
+            unmatched = matched[matched['unique_id'].isna()]
+            unmatched_workers = unmatched.groupby(['employer_name', 'worker_name', 'passport_number'], as_index=False).agg(
+                fee_count=('fee_type', 'size'), total_amount=('amount', 'sum')
+            )
+            for _, row in unmatched_workers.iterrows():
+                p_display = row['passport_number'] if row['passport_number'] else "(無護照)"
+                errors.append(f"找不到員工: {row['employer_name']} - {row['worker_name']} - {p_display} ({row['fee_count']} 筆費用，共 {row['total_amount']} 元)")
+            matched = matched[matched['unique_id'].notna()]
+
+            # 2. 批次 Upsert (有則更新為新的總金額，無則新增)
+            if not matched.empty:
+                cursor.execute(f"""
+                    CREATE TEMP TABLE {FEE_IMPORT_STAGING_TABLE} (
+                        unique_id TEXT, fee_type TEXT, amount NUMERIC, effective_date DATE
+                    ) ON COMMIT DROP
+                """)
+                database.copy_dataframe(cursor, FEE_IMPORT_STAGING_TABLE, matched, ['unique_id', 'fee_type', 'amount', 'effective_date'])
+                cursor.execute(f"""
+                    INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date)
+                    SELECT unique_id, fee_type, amount, effective_date FROM {FEE_IMPORT_STAGING_TABLE}
+                    ON CONFLICT (worker_unique_id, fee_type, effective_date) DO UPDATE SET amount = EXCLUDED.amount
+                """)
 
         conn.commit()
-        return success_count, skip_count, errors
+        return len(matched), len(unmatched) + len(invalid_dates), errors
 
     except Exception as e:
         if conn: conn.rollback()
@@ -0,0 +1,220 @@
+# data_models/identity_resolver.py
+# 移工身分比對 (identity resolution) 的共用元件。
+# 名冊同步、B04 費用匯入與住宿匯入原本各自以 iterrows() 或逐筆 SQL 建立比對資料。
+# 這裡一次載入所有工人的識別欄位，以向量化方式建立雜湊索引 (pandas Index / Series)，
+# 並提供對整個 DataFrame 的批次比對，數千筆資料只需數毫秒。
+#
+# 索引在同一行程中快取共用：寫入 Workers 識別欄位的函式需呼叫 invalidate()。
+# 其他行程 (例如排程 CLI) 的寫入則由 CACHE_TTL 與「有找不到的資料時重新載入一次」兜底。
+
+import threading
+import time
+
+import pandas as pd
+
+# 快取索引的最長使用時間 (秒)
+CACHE_TTL = 300
+
+WORKER_IDENTITY_QUERY = """
+    SELECT unique_id, employer_name, worker_name, passport_number, arc_number, accommodation_start_date
+    FROM "Workers"
+"""
+
+_lock = threading.Lock()
+_cached_index = None
+
+def _execute_query_to_dataframe(conn, query, params=None):
+    """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        records = cursor.fetchall()
+        if not records:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            return pd.DataFrame([], columns=columns)
+
+        columns = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(records, columns=columns)
+
+def _text_key(series: pd.Series) -> pd.Series:
+    """將欄位轉為去除前後空白的字串 (空值轉為空字串)，供比對使用。"""
+    return series.astype(object).where(series.notna(), '').astype(str).str.strip()
+
+def _to_date_series(series: pd.Series) -> pd.Series:
+    """將 'YYYY-MM-DD' 字串或 date 物件整欄轉為 datetime64 (無效值為 NaT)。"""
+    return pd.to_datetime(series.astype(object).where(series.notna(), None), errors='coerce').dt.normalize()
+
+def build_index(workers: pd.DataFrame) -> dict:
+    """
+    由工人資料建立比對索引 (需含 WORKER_IDENTITY_QUERY 的欄位)。
+    重複的證號或身分組合以「最後一筆」為準，與逐筆建立 dict 時覆蓋的結果相同。
+    """
+    uid = workers['unique_id']
+    employer = _text_key(workers['employer_name'])
+    name = _text_key(workers['worker_name'])
+    start = _to_date_series(workers['accommodation_start_date'])
+
+    def _reverse_map(col):
+        values = workers[col]
+        keyed = values.notna() & (values.astype(str) != '')
+        keys = values[keyed].astype(str).str.strip()
+        return pd.Series(uid[keyed].values, index=keys.values, dtype=object).groupby(level=0).last()
+
+    # (雇主, 姓名, 護照)：空護照與字串 'None' 皆視為 ''
+    passport = _text_key(workers['passport_number']).replace('None', '')
+    identity_key = pd.MultiIndex.from_arrays([employer, name, passport])
+    identity = pd.Series(uid.values, index=identity_key, dtype=object).groupby(level=[0, 1, 2]).last()
+
+    # 雇主+姓名：同名人數、第一位的 ID 與交工日，以及依交工日細分的人數
+    name_groups = pd.DataFrame({'employer': employer, 'name': name, 'uid': uid, 'start': start})
+    grouped = name_groups.groupby(['employer', 'name'])
+    by_name = grouped['uid'].agg(['size', 'first'])
+    by_name['start'] = grouped['start'].first()
+    by_name_date = name_groups.dropna(subset=['start']).groupby(['employer', 'name', 'start'])['uid'].agg(['size', 'first'])
+
+    return {
+        'built_at': time.monotonic(),
+        'unique_ids': pd.Index(uid),
+        'arc': _reverse_map('arc_number'),
+        'passport': _reverse_map('passport_number'),
+        'identity': identity,
+        'by_name': by_name,
+        'by_name_date': by_name_date,
+        'employer_by_id': pd.Series(employer.values, index=uid.values, dtype=object),
+    }
+
+def load_index(conn) -> dict:
+    """從資料庫載入所有工人的識別欄位並建立索引 (不經過快取)。"""
+    return build_index(_execute_query_to_dataframe(conn, WORKER_IDENTITY_QUERY))
+
+def get_index(conn, force_reload: bool = False) -> dict:
+    """取得快取的比對索引；尚未建立、已逾時或 force_reload 時以 conn 重新載入。"""
+    global _cached_index
+    with _lock:
+        index = _cached_index
+    if force_reload or index is None or time.monotonic() - index['built_at'] > CACHE_TTL:
+        index = load_index(conn)
+        with _lock:
+            _cached_index = index
+    return index
+
+def invalidate():
+    """清除快取的索引。新增、刪除工人或修改其雇主、姓名、證號、交工日後呼叫。"""
+    global _cached_index
+    with _lock:
+        _cached_index = None
+
+def _with_reload_on_miss(conn, resolve, ids_of):
+    """
+    以快取索引比對；若有找不到的資料且索引並非剛載入，重新載入一次再比對，
+    避免其他行程剛新增的工人因快取過期而被判定為找不到。
+    """
+    index = get_index(conn)
+    result = resolve(index)
+    if ids_of(result).isna().any() and time.monotonic() - index['built_at'] > 1:
+        result = resolve(get_index(conn, force_reload=True))
+    return result
+
+def _lookup(mapping: pd.Series, keys) -> pd.Series:
+    return pd.Series(mapping.reindex(keys).values, dtype=object)
+
+def resolve_identity(conn, employer: pd.Series, name: pd.Series, passport: pd.Series) -> pd.Series:
+    """
+    以 (雇主, 姓名, 護照) 完全比對 (去除前後空白，空護照視為 '')，用於 B04 費用匯入。
+    回傳與輸入同索引的 unique_id Series，找不到者為 None。
+    """
+    key = pd.MultiIndex.from_arrays([_text_key(employer), _text_key(name), _text_key(passport).replace('None', '')])
+
+    def _resolve(index):
+        return _lookup(index['identity'], key).set_axis(employer.index)
+    return _with_reload_on_miss(conn, _resolve, lambda ids: ids)
+
+def resolve_for_import(conn, employer: pd.Series, name: pd.Series, passport: pd.Series) -> tuple:
+    """
+    匯入檔 (住宿分配等) 的比對規則：
+    有護照時以 unique_id = "雇主_姓名_護照" 比對；沒有護照時，雇主+姓名必須恰好對應到一位工人。
+    輸入需已是去除前後空白的字串。回傳 (unique_id Series, 錯誤訊息 Series)，兩者皆與輸入同索引。
+    """
+    composite = employer + '_' + name + '_' + passport
+    has_passport = passport != ''
+    required_missing = (employer == '') | (name == '')
+
+    def _resolve(index):
+        by_composite = pd.Series(composite.isin(index['unique_ids']).values, index=employer.index)
+        name_key = pd.MultiIndex.from_arrays([employer, name])
+        name_count = pd.Series(index['by_name']['size'].reindex(name_key).fillna(0).astype(int).values, index=employer.index)
+        name_first = pd.Series(index['by_name']['first'].reindex(name_key).values, index=employer.index, dtype=object)
+
+        ids = pd.Series(None, index=employer.index, dtype=object)
+        ids = ids.mask(has_passport & by_composite, composite)
+        ids = ids.mask(~has_passport & (name_count == 1), name_first)
+        ids = ids.mask(required_missing, None)
+
+        errors = pd.Series('', index=employer.index, dtype=object)
+        errors = errors.mask(has_passport & ~by_composite, "找不到工人: " + composite)
+        errors = errors.mask(~has_passport & (name_count == 0), "找不到工人: " + employer + '_' + name)
+        errors = errors.mask(~has_passport & (name_count > 1), "找到 " + name_count.astype(str) + " 位同名工人，請提供護照號碼以作區分")
+        errors = errors.mask(required_missing, "雇主和姓名為必填欄位")
+        return ids, errors
+    return _with_reload_on_miss(conn, _resolve, lambda result: result[0].where(~required_missing, ''))
+
+def resolve_sync(fresh: pd.DataFrame, index: dict, row_logs: list) -> pd.DataFrame:
+    """
+    名冊同步的比對規則：unique_id → ARC → 護照 → 雇主+姓名(+交工日)。
+    先取第一個找到的候選人，再確認候選人的雇主與報表相同。
+    index 應由同步交易中讀到的工人資料以 build_index 建立，確保與交易內容一致。
+    回傳加上 resolved_id / is_matched 欄位的 fresh。需要記錄的比對日誌會依列位置加入 row_logs。
+    """
+    fresh = fresh.copy()
+    fresh_arc = _text_key(fresh['arc_number']) if 'arc_number' in fresh else pd.Series('', index=fresh.index)
+    fresh_passport = _text_key(fresh['passport_number']) if 'passport_number' in fresh else pd.Series('', index=fresh.index)
+    fresh_employer = _text_key(fresh['employer_name'])
+    fresh_name = _text_key(fresh['worker_name'])
+    fresh_start = _to_date_series(fresh['accommodation_start_date']) if 'accommodation_start_date' in fresh else pd.Series(pd.NaT, index=fresh.index)
+
+    direct_match = fresh['unique_id'].isin(index['unique_ids'])
+    arc_cand = fresh_arc.map(index['arc']).where(fresh_arc != '')
+    passport_cand = fresh_passport.map(index['passport']).where(fresh_passport != '')
+
+    # 雇主+姓名：統計同名人數，並找出交工日相符的候選人
+    by_name = index['by_name']
+    by_name_date = index['by_name_date']
+    name_key = pd.MultiIndex.from_arrays([fresh_employer, fresh_name])
+    potential_count = pd.Series(by_name['size'].reindex(name_key).fillna(0).astype(int).values, index=fresh.index)
+    single_id = pd.Series(by_name['first'].reindex(name_key).values, index=fresh.index)
+    single_db_start = pd.Series(by_name['start'].reindex(name_key).values, index=fresh.index)
+    date_key = pd.MultiIndex.from_arrays([fresh_employer, fresh_name, fresh_start])
+    date_count = pd.Series(by_name_date['size'].reindex(date_key).fillna(0).astype(int).values, index=fresh.index)
+    date_first = pd.Series(by_name_date['first'].reindex(date_key).values, index=fresh.index)
+    date_count = date_count.where(fresh_start.notna(), 0)
+
+    needs_name_match = ~direct_match & arc_cand.isna() & passport_cand.isna()
+    both_dates = fresh_start.notna() & single_db_start.notna()
+    single_exact = needs_name_match & (potential_count == 1) & both_dates & (fresh_start == single_db_start)
+    single_conflict = needs_name_match & (potential_count == 1) & both_dates & (fresh_start != single_db_start)
+    single_loose = needs_name_match & (potential_count == 1) & ~both_dates
+    multi_unique = needs_name_match & (potential_count > 1) & (date_count == 1)
+    multi_ambiguous = needs_name_match & (potential_count > 1) & (date_count != 1)
+
+    name_cand = pd.Series(None, index=fresh.index, dtype=object)
+    name_cand = name_cand.mask(single_exact | single_loose, single_id).mask(multi_unique, date_first)
+    reason = pd.Series('', index=fresh.index, dtype=object)
+    reason = reason.mask(single_exact, "姓名+雇主+交工日匹配").mask(single_loose, "姓名+雇主匹配(單一)").mask(multi_unique, "姓名+雇主+交工日(多名中唯一)")
+
+    candidate = arc_cand.combine_first(passport_cand).combine_first(name_cand)
+
+    # 防呆：候選人的雇主必須與報表相同
+    candidate_employer = candidate.map(index['employer_by_id'])
+    fallback_match = ~direct_match & candidate.notna() & (candidate_employer == fresh_employer)
+
+    fresh['resolved_id'] = fresh['unique_id'].where(~fallback_match, candidate)
+    fresh['is_matched'] = direct_match | fallback_match
+
+    positions = {idx: pos for pos, idx in enumerate(fresh.index)}
+    for idx in fresh.index[single_conflict]:
+        row_logs.append((positions[idx], 0, f"INFO: 同雇主同名 '{fresh_name[idx]}'，但交工日不同 (DB:{single_db_start[idx].date()} vs File:{fresh_start[idx].date()})，視為新人。"))
+    for idx in fresh.index[multi_ambiguous]:
+        row_logs.append((positions[idx], 0, f"INFO: 雇主'{fresh_employer[idx]}'下有多位'{fresh_name[idx]}'，無法透過交工日區分 (符合日期者有{date_count[idx]}人)，視為新進人員。"))
+    name_matched = fallback_match & arc_cand.isna() & passport_cand.isna()
+    for idx in fresh.index[name_matched]:
+        row_logs.append((positions[idx], 1, f"INFO: [{reason[idx]}] 關聯舊資料 ID: {candidate[idx]}。"))
+    return fresh
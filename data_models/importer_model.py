@@ -1,11 +1,11 @@
 import pandas as pd
 import database
-import json
-from data_processor import normalize_taiwan_address
-import numpy as np
-from datetime import date
-from dateutil.relativedelta import relativedelta
-from . import finance_model
+from datetime import date, timedelta
+from psycopg2.extras import execute_values
+from . import bulk_import
+from . import identity_resolver
+from . import analytics_model
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -19,1211 +19,604 @@ def _execute_query_to_dataframe(conn, query, params=None):
         columns = [desc[0] for desc in cursor.description]
         return pd.DataFrame(records, columns=columns)
 
-def clean_nan_for_json(data_dict):
-    """遞迴地將字典中的 NaN, NaT 等值轉換為 None。"""
-    for key, value in data_dict.items():
-        if isinstance(value, dict):
-            clean_nan_for_json(value)
-        elif pd.isna(value):
-            data_dict[key] = None
-    return data_dict
+# ==============================================================================
+# 以下各匯入功能皆為 bulk_import 的規格 (spec)：宣告欄位的轉換與驗證順序、比對鍵與寫入目標，
+# 由 bulk_import.run_import 整批完成驗證、外鍵比對、COPY 至暫存表與合併。
+# ==============================================================================
+
+def _lookup_in_dorm(conn, query: str, dorm_ids: pd.Series, numbers: pd.Series) -> pd.Series:
+    """以 (dorm_id, 編號) 整欄比對宿舍內的錶號或房號 (query 需回傳 id, dorm_id, number)，找不到為 NaN。"""
+    table = _execute_query_to_dataframe(conn, query)
+    if table.empty:
+        return pd.Series(None, index=dorm_ids.index, dtype=object)
+    table = table.astype({'dorm_id': 'int64', 'number': str}).drop_duplicates(['dorm_id', 'number'], keep='last')
+    keys = pd.DataFrame({'dorm_id': dorm_ids.fillna(-1).astype('int64').values, 'number': numbers.values})
+    return pd.Series(keys.merge(table, how='left', on=['dorm_id', 'number'])['id'].values, index=dorm_ids.index, dtype=object)
+
+def _resolve_in_dorm(frame, values, ctx, column: str, query: str, message: str):
+    """選填的錶號/房號欄位：有填寫但在該宿舍找不到時，回傳 message ({address}, {number}) 作為錯誤。"""
+    numbers = bulk_import.stripped_text(bulk_import.column_values(frame, column))
+    filled = numbers != ''
+    ids = _lookup_in_dorm(ctx['conn'], query, values['dorm_id'], numbers).where(filled)
+    errors = bulk_import.no_errors(frame.index)
+    missing = filled & ids.isna()
+    addresses = bulk_import.column_values(frame, '宿舍地址').astype(str).str.strip()
+    errors[missing] = [message.format(address=a, number=n) for a, n in zip(addresses[missing], numbers[missing])]
+    return pd.to_numeric(ids, errors='coerce').astype('Int64'), errors
+
+def _expense_meter_ids(frame, values, ctx):
+    return _resolve_in_dorm(
+        frame, values, ctx, '對應錶號', 'SELECT id, dorm_id, meter_number AS number FROM "Meters"',
+        "在宿舍 '{address}' 中找不到錶號為 '{number}' 的紀錄"
+    )
+
+def _refresh_imported_meter_anomalies(cursor):
+    """匯入的帳單所屬電水錶重新計算異常旗標。"""
+    cursor.execute(f'SELECT DISTINCT meter_id FROM {bulk_import.STAGING_TABLE} WHERE meter_id IS NOT NULL')
+    analytics_model.refresh_anomalies(cursor, [row['meter_id'] for row in cursor.fetchall()])
+
+EXPENSE_IMPORT = {
+    'label': '每月費用',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('meter_id', bulk_import.computed('INTEGER', _expense_meter_ids)),
+        ('bill_type', bulk_import.text('費用類型', default='')),
+        ('amount', bulk_import.integer('帳單金額', required=True)),
+        ('usage_amount', bulk_import.number('用量(度/噸)', invalid=None)),
+        ('bill_start_date', bulk_import.day('帳單起始日', required=True)),
+        ('bill_end_date', bulk_import.day('帳單結束日', required=True)),
+        ('payer', bulk_import.text('支付方', default='我司')),
+        ('is_pass_through', bulk_import.boolean('是否為代收代付')),
+        ('is_invoiced', bulk_import.boolean('是否已請款')),
+        ('notes', bulk_import.text('備註')),
+    ],
+    'unique': ['dorm_id', 'bill_type', 'bill_start_date', 'meter_id'],
+    'targets': [
+        {'table': 'UtilityBills', 'mode': 'upsert',
+         'key': ['dorm_id', 'bill_type', 'bill_start_date', bulk_import.null_safe('meter_id')]},
+    ],
+    'after_merge': _refresh_imported_meter_anomalies,
+}
 
 def batch_import_expenses(df: pd.DataFrame):
     """
-    【v1.4 修正版】批次匯入【每月/變動費用】的核心邏輯。
-    實現「有就更新，沒有就新增」(Upsert) 的功能，並修正讀取「用量」欄位的名稱。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-        
-    try:
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            meters_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, meter_number FROM "Meters"')
-            meters_map = {(row['dorm_id'], row['meter_number']): row['id'] for _, row in meters_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    original_address = row.get('宿舍地址')
-                    if not original_address or pd.isna(original_address):
-                        raise ValueError("宿舍地址為空")
-
-                    dorm_id = None
-                    addr_stripped = str(original_address).strip()
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    elif addr_stripped in normalized_addr_map:
-                        dorm_id = normalized_addr_map[addr_stripped]
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-                    
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {original_address}")
-
-                    meter_id = None
-                    meter_number = row.get('對應錶號')
-                    if meter_number and pd.notna(meter_number):
-                        meter_number = str(meter_number).strip()
-                        meter_key = (dorm_id, meter_number)
-                        if meter_key in meters_map:
-                            meter_id = meters_map[meter_key]
-                        else:
-                            raise ValueError(f"在宿舍 '{original_address}' 中找不到錶號為 '{meter_number}' 的紀錄")
-                    
-                    def to_bool(val):
-                        if pd.isna(val): return False
-                        return str(val).strip().upper() in ['TRUE', '1', 'Y', 'YES', '是']
-
-                    # 【核心修改】修正讀取的欄位名稱，移除「 (選填)」
-                    usage_val = pd.to_numeric(row.get('用量(度/噸)'), errors='coerce')
-                    usage_amount = usage_val if pd.notna(usage_val) else None
-                    
-                    notes_val = row.get('備註')
-                    notes = str(notes_val).strip() if pd.notna(notes_val) and str(notes_val).strip() else None
-
-                    details = {
-                        "dorm_id": dorm_id, "meter_id": meter_id,
-                        "bill_type": str(row.get('費用類型', '')).strip(),
-                        "amount": int(pd.to_numeric(row.get('帳單金額'), errors='coerce')),
-                        "usage_amount": usage_amount,
-                        "bill_start_date": pd.to_datetime(row.get('帳單起始日'), errors='coerce').strftime('%Y-%m-%d'),
-                        "bill_end_date": pd.to_datetime(row.get('帳單結束日'), errors='coerce').strftime('%Y-%m-%d'),
-                        "payer": str(row.get('支付方', '我司')).strip(),
-                        "is_pass_through": to_bool(row.get('是否為代收代付')),
-                        "is_invoiced": to_bool(row.get('是否已請款')),
-                        "notes": notes
-                    }
-                    
-                    query = 'SELECT id FROM "UtilityBills" WHERE dorm_id = %s AND bill_type = %s AND bill_start_date = %s'
-                    params = [details['dorm_id'], details['bill_type'], details['bill_start_date']]
-                    
-                    if meter_id:
-                        query += " AND meter_id = %s"
-                        params.append(meter_id)
-                    else:
-                        query += " AND meter_id IS NULL"
-                        
-                    cursor.execute(query, tuple(params))
-                    existing = cursor.fetchone()
-
-                    if existing:
-                        # 如果紀錄已存在，則執行 UPDATE 來覆蓋
-                        existing_id = existing['id']
-                        fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
-                        values = list(details.values()) + [existing_id]
-                        update_sql = f'UPDATE "UtilityBills" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                    else:
-                        # 如果紀錄不存在，則執行 INSERT 來新增
-                        columns = ', '.join(f'"{k}"' for k in details.keys())
-                        placeholders = ', '.join(['%s'] * len(details))
-                        insert_sql = f'INSERT INTO "UtilityBills" ({columns}) VALUES ({placeholders})'
-                        cursor.execute(insert_sql, tuple(details.values()))
-
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入每月費用時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-
-    return success_count, pd.DataFrame(failed_records)
+    【v2.0 批次版】批次匯入【每月/變動費用】的核心邏輯。
+    實現「有就更新，沒有就新增」(Upsert) 的功能；同一宿舍、費用類型、起始日與錶號視為同一筆帳單。
+    """
+    result = bulk_import.run_import(df, EXPENSE_IMPORT)
+    return result['success'], result['failed']
+
+ANNUAL_EXPENSE_REQUIRED = "必填欄位(費用項目,總金額)有缺漏或格式錯誤"
+
+ANNUAL_EXPENSE_IMPORT = {
+    'label': '年度費用',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('expense_item', bulk_import.text('費用項目', required=ANNUAL_EXPENSE_REQUIRED)),
+        ('total_amount', bulk_import.integer('總金額', required=ANNUAL_EXPENSE_REQUIRED, invalid=ANNUAL_EXPENSE_REQUIRED)),
+        ('payment_date', bulk_import.day('支付日期', required=True)),
+        ('amortization_start_month', bulk_import.month('攤提起始月', required=True)),
+        ('amortization_end_month', bulk_import.month('攤提結束月', required=True)),
+        ('notes', bulk_import.text('備註', default='')),
+    ],
+    'unique': ['dorm_id', 'expense_item', 'payment_date'],
+    'targets': [
+        {'table': 'AnnualExpenses', 'mode': 'upsert', 'key': ['dorm_id', 'expense_item', 'payment_date']},
+    ],
+}
 
 def batch_import_annual_expenses(df: pd.DataFrame):
     """
-    批次匯入【年度/長期】費用的核心邏輯 (已為 PostgreSQL 優化)。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # 【核心修改】讀取更多地址欄位，並建立多個 mapping
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            for index, row in df.iterrows():
-                try:
-                    original_address = row.get('宿舍地址')
-                    if not original_address or pd.isna(original_address):
-                        raise ValueError("宿舍地址為空")
-                        
-                    # 【核心修改】智慧型地址比對邏輯
-                    dorm_id = None
-                    addr_stripped = str(original_address).strip()
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    elif addr_stripped in normalized_addr_map:
-                        dorm_id = normalized_addr_map[addr_stripped]
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {original_address}")
-                        
-                    expense_item = row.get('費用項目')
-                    total_amount = pd.to_numeric(row.get('總金額'), errors='coerce')
-
-                    if not all([expense_item, pd.notna(total_amount)]):
-                        raise ValueError("必填欄位(費用項目,總金額)有缺漏或格式錯誤")
-                        
-                    details = {
-                        "dorm_id": dorm_id, "expense_item": str(expense_item).strip(),
-                        "payment_date": pd.to_datetime(row.get('支付日期')).strftime('%Y-%m-%d'),
-                        "total_amount": int(total_amount),
-                        "amortization_start_month": pd.to_datetime(row.get('攤提起始月')).strftime('%Y-%m'),
-                        "amortization_end_month": pd.to_datetime(row.get('攤提結束月')).strftime('%Y-%m'),
-                        "notes": str(row.get('備註', ''))
-                    }
-                    
-                    query = 'SELECT id FROM "AnnualExpenses" WHERE dorm_id = %s AND expense_item = %s AND payment_date = %s'
-                    cursor.execute(query, (dorm_id, details['expense_item'], details['payment_date']))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
-                        values = list(details.values()) + [existing['id']]
-                        update_sql = f'UPDATE "AnnualExpenses" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                    else:
-                        columns = ', '.join(f'"{k}"' for k in details.keys())
-                        placeholders = ', '.join(['%s'] * len(details))
-                        insert_sql = f'INSERT INTO "AnnualExpenses" ({columns}) VALUES ({placeholders})'
-                        cursor.execute(insert_sql, tuple(details.values()))
-
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入年度費用時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    【v2.0 批次版】批次匯入【年度/長期】費用的核心邏輯。
+    同一宿舍、費用項目與支付日期視為同一筆，已存在時更新。
+    """
+    result = bulk_import.run_import(df, ANNUAL_EXPENSE_IMPORT)
+    return result['success'], result['failed']
+
+def _permit_expense_items(frame, values, ctx):
+    items = bulk_import.stripped_text(bulk_import.column_values(frame, '申報項目'))
+    return ('建物申報-' + items).where(items != '', '建物申報').astype(object), None
+
+PERMIT_IMPORT = {
+    'label': '建物申報',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('record_type', bulk_import.constant('建物申報')),
+        ('details', bulk_import.json_object([
+            ('architect_name', bulk_import.as_is('建築師')),
+            ('gov_document_exists', bulk_import.boolean('政府是否發文', blank_value=None)),
+            ('next_declaration_start', bulk_import.day('下次申報起日期')),
+            ('next_declaration_end', bulk_import.day('下次申報迄日期')),
+            ('declaration_item', bulk_import.as_is('申報項目')),
+            ('area_legal', bulk_import.as_is('申報面積（合法）')),
+            ('area_total', bulk_import.as_is('申報面積（合法加違規）')),
+            ('amount_pre_tax', bulk_import.integer('金額（未稅）')),
+            ('usage_license_exists', bulk_import.boolean('使用執照有無', blank_value=None)),
+            ('property_deed_exists', bulk_import.boolean('權狀有無', blank_value=None)),
+            ('landlord_id_exists', bulk_import.boolean('房東證件有無', blank_value=None)),
+            ('improvements_made', bulk_import.boolean('現場是否改善', blank_value=None)),
+            ('insurance_exists', bulk_import.boolean('保險有無', blank_value=None)),
+            ('submission_date', bulk_import.day('申報文件送出日期')),
+            ('registered_mail_date', bulk_import.day('掛號憑證日期')),
+            ('certificate_received_date', bulk_import.day('收到憑證日期')),
+            ('invoice_date', bulk_import.day('請款日')),
+            ('approval_start_date', bulk_import.day('此次申報核准起日期')),
+            ('approval_end_date', bulk_import.day('此次申報核准迄日期')),
+        ])),
+        ('expense_item', bulk_import.computed('TEXT', _permit_expense_items)),
+        ('payment_date', bulk_import.day('支付日期')),
+        ('total_amount', bulk_import.integer('總金額（含稅）', required=True)),
+        ('amortization_start_month', bulk_import.month('攤提起始月')),
+        ('amortization_end_month', bulk_import.month('攤提結束月')),
+        # 重複判斷用：申報項目 + 此次申報核准起日期
+        ('declaration_item', bulk_import.text('申報項目')),
+        ('approval_start_date', bulk_import.day('此次申報核准起日期', required="「此次申報核准起日期」為判斷重複的必要欄位，不可為空")),
+    ],
+    'unique': ['dorm_id', 'declaration_item', 'approval_start_date'],
+    'duplicate_check': {
+        'table': 'ComplianceRecords',
+        'key': [
+            'dorm_id', 'record_type',
+            "t.details ->> 'declaration_item' = s.declaration_item",
+            "t.details ->> 'approval_start_date' = to_char(s.approval_start_date, 'YYYY-MM-DD')",
+        ],
+        'report': True,
+    },
+    'allocate': {'compliance_record_id': 'ComplianceRecords'},
+    'targets': [
+        {'table': 'ComplianceRecords', 'mode': 'insert',
+         'columns': {'id': 's.compliance_record_id', 'dorm_id': 's.dorm_id', 'record_type': 's.record_type', 'details': 's.details'}},
+        {'table': 'AnnualExpenses', 'mode': 'insert',
+         'columns': ['dorm_id', 'expense_item', 'payment_date', 'total_amount',
+                     'amortization_start_month', 'amortization_end_month', 'compliance_record_id']},
+    ],
+}
 
 def batch_import_building_permits(df: pd.DataFrame):
     """
-    【v1.1 修改版】批次匯入【建物申報】的核心邏輯。
-    新增重複檢查，若紀錄已存在則會跳過。
+    【v2.0 批次版】批次匯入【建物申報】的核心邏輯。
+    每列建立一筆合規紀錄與關聯的年度費用；同一宿舍、申報項目與核准起日的紀錄已存在時跳過。
+    回傳 (成功筆數, 失敗列, 跳過的重複列)。
+    """
+    result = bulk_import.run_import(df, PERMIT_IMPORT)
+    return result['success'], result['failed'], result['skipped']
+
+ACCOMMODATION_STAGING_TABLE = 'accommodation_import_staging'
+UNASSIGNED_ROOM_NUMBER = '[未分配房間]'
+
+def _resolve_import_workers(conn, df: pd.DataFrame):
+    """以共用的身分索引 (identity_resolver) 整批比對匯入檔中的工人，回傳 (unique_id Series, 錯誤訊息 Series)。"""
+    def _text_column(column):
+        return df[column].astype(str).str.strip() if column in df else pd.Series('', index=df.index)
+    return identity_resolver.resolve_for_import(conn, _text_column('雇主'), _text_column('姓名'), _text_column('護照號碼 (選填)'))
+
+def _parse_move_in_date(value):
+    """解析「入住日」欄位：空白回傳 None，無法解析時拋出 ValueError。"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)) or not value:
+        return None
+    return pd.to_datetime(value).date()
+
+def _prepare_accommodation_rows(conn, cursor, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    整批完成住宿匯入的前置比對：工人、宿舍地址、房號 (不存在的房間一次建立) 與入住日。
+    回傳與 df 同索引的 DataFrame，含 worker_id / new_room_id / bed_number / move_in_date / error。
+    """
+    rows = pd.DataFrame(index=df.index)
+    rows['worker_id'], worker_errors = _resolve_import_workers(conn, df)
+
+    address = df['實際住宿地址'] if '實際住宿地址' in df else pd.Series(None, index=df.index, dtype=object)
+    room_number = df['房號'].astype(str).str.strip() if '房號' in df else pd.Series('None', index=df.index)
+    address_missing = address.isna() | (address.astype(str) == '') | (room_number == '')
+    addr_stripped = address.astype(str).str.strip().where(~address_missing, '')
+
+    # 宿舍：以共用的地址對照表比對 (原始地址 → 正規化地址)
+    dorm_id = bulk_import.lookup_dorm_ids(conn, addr_stripped).where(~address_missing)
+
+    bed = df['床位編號 (選填)'] if '床位編號 (選填)' in df else pd.Series(None, index=df.index, dtype=object)
+    bed_text = bed.astype(str).str.strip()
+    rows['bed_number'] = bed_text.where(bed.notna() & (bed_text != ''), None).astype(object)
+
+    move_in = df['入住日 (換宿/指定日期時填寫)'] if '入住日 (換宿/指定日期時填寫)' in df else pd.Series(None, index=df.index, dtype=object)
+    parsed_dates, date_errors = {}, {}
+    for idx, value in move_in.items():
+        try:
+            parsed_dates[idx] = _parse_move_in_date(value)
+        except Exception as e:
+            date_errors[idx] = str(e)
+    rows['move_in_date'] = pd.Series(parsed_dates, index=df.index, dtype=object)
+
+    # 錯誤依原本逐筆檢查的順序決定優先權：工人 → 必填欄位 → 宿舍地址 → 入住日
+    error = pd.Series(date_errors, index=df.index, dtype=object).fillna('')
+    error = error.mask(address.notna() & dorm_id.isna() & ~address_missing, "找不到宿舍地址: " + address.astype(str))
+    error = error.mask(address_missing, "實際住宿地址和房號為必填欄位")
+    error = error.mask(rows['worker_id'].isna(), worker_errors.replace('', "無法確定唯一的工人紀錄"))
+    rows['error'] = error
+
+    # 房間：比對 (宿舍, 房號)，不存在的房間一次建立
+    rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
+    room_map = {(d, str(r)): i for i, d, r in zip(rooms_df.get('id', []), rooms_df.get('dorm_id', []), rooms_df.get('room_number', []))}
+    needs_room = rows['worker_id'].notna() & ~address_missing & dorm_id.notna()
+    room_keys = list(zip(dorm_id[needs_room].astype(int), room_number[needs_room]))
+    missing_rooms = sorted({key for key in room_keys if key not in room_map})
+    if missing_rooms:
+        created = execute_values(
+            cursor,
+            'INSERT INTO "Rooms" (dorm_id, room_number, capacity, gender_policy) VALUES %s RETURNING id, dorm_id, room_number',
+            [(d, r, 4, '可混住') for d, r in missing_rooms], fetch=True
+        )
+        room_map.update({(rec['dorm_id'], rec['room_number']): rec['id'] for rec in created})
+    rows['new_room_id'] = pd.Series([room_map[key] for key in room_keys], index=needs_room[needs_room].index, dtype=object).reindex(df.index)
+    return rows
+
+def _load_open_stays(conn, worker_ids: list) -> pd.DataFrame:
+    """一次取得多位工人目前 (尚未結束) 的最新一筆住宿紀錄，以 worker_unique_id 為索引。"""
+    query = """
+        SELECT DISTINCT ON (ah.worker_unique_id)
+            ah.worker_unique_id, ah.id AS history_id, ah.room_id, ah.bed_number, r.room_number
+        FROM "AccommodationHistory" ah
+        LEFT JOIN "Rooms" r ON r.id = ah.room_id
+        WHERE ah.worker_unique_id = ANY(%s) AND ah.end_date IS NULL
+        ORDER BY ah.worker_unique_id, ah.start_date DESC, ah.id DESC
+    """
+    stays = _execute_query_to_dataframe(conn, query, (worker_ids,))
+    if stays.empty:
+        stays = pd.DataFrame(columns=['worker_unique_id', 'history_id', 'room_id', 'bed_number', 'room_number'])
+    return stays.set_index('worker_unique_id')
+
+def _plan_accommodation_actions(wave: pd.DataFrame, stays: pd.DataFrame, mode: str, today) -> pd.DataFrame:
+    """
+    依匯入模式計算每列的動作 (每位工人在同一批中只出現一次)：
+      set_room / set_bed：更新現有紀錄的房間、床位；set_start_date：覆蓋現有紀錄的起始日；
+      close_date：結束現有紀錄的日期；insert_start：新增住宿紀錄的起始日；skip：房間與床位皆未變，跳過。
+    """
+    plan = wave.copy()
+    current = stays.reindex(plan['worker_id'])
+    plan['history_id'] = current['history_id'].values
+    has_stay = plan['history_id'].notna()
+    same_room = has_stay & pd.Series(current['room_id'].values == plan['new_room_id'].values, index=plan.index)
+    current_bed = current['bed_number'].astype(object).where(current['bed_number'].notna(), None).values
+    bed_changed = pd.Series([a != b for a, b in zip(current_bed, plan['bed_number'])], index=plan.index)
+    has_date = plan['move_in_date'].notna()
+    effective = plan['move_in_date'].where(has_date, today)
+    close_date = effective.map(lambda d: d - timedelta(days=1))
+
+    none = pd.Series(None, index=plan.index, dtype=object)
+    false = pd.Series(False, index=plan.index)
+    if mode == 'assign':
+        placeholder = has_stay & pd.Series(current['room_number'].astype(object).eq(UNASSIGNED_ROOM_NUMBER).values, index=plan.index) & ~has_date
+        bed_only = ~placeholder & same_room
+        move = ~placeholder & ~same_room
+        plan['set_room'] = placeholder
+        plan['set_bed'] = placeholder | (bed_only & bed_changed)
+        plan['skip'] = bed_only & ~bed_changed
+        plan['close_date'] = close_date.where(move & has_stay, None)
+        plan['insert_start'] = effective.where(move, None)
+        plan['set_start_date'] = none
+    elif mode == 'move':
+        plan['set_room'] = false
+        plan['set_bed'] = false
+        plan['skip'] = same_room
+        plan['close_date'] = close_date.where(~same_room & has_stay, None)
+        plan['insert_start'] = effective.where(~same_room, None)
+        plan['set_start_date'] = none
+    else: # overwrite
+        plan['set_room'] = has_stay
+        plan['set_bed'] = has_stay
+        plan['skip'] = false
+        plan['close_date'] = none
+        plan['insert_start'] = effective.where(~has_stay, None)
+        plan['set_start_date'] = plan['move_in_date'].where(has_stay & has_date, None)
+    return plan
+
+def _apply_accommodation_actions(cursor, plan: pd.DataFrame):
+    """把整批動作 COPY 進暫存表，再以三道 SQL 更新/新增住宿紀錄並標記 data_source。"""
+    plan = plan[~plan['skip']]
+    if plan.empty:
+        return
+    cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {ACCOMMODATION_STAGING_TABLE} (
+            worker_id TEXT, history_id INTEGER, new_room_id INTEGER, bed_number TEXT,
+            set_room BOOLEAN, set_bed BOOLEAN, set_start_date DATE, close_date DATE, insert_start DATE
+        ) ON COMMIT DROP
+    """)
+    cursor.execute(f'TRUNCATE {ACCOMMODATION_STAGING_TABLE}')
+    staged = plan.assign(history_id=pd.to_numeric(plan['history_id']).astype('Int64'),
+                         new_room_id=pd.to_numeric(plan['new_room_id']).astype('Int64'))
+    database.copy_dataframe(cursor, ACCOMMODATION_STAGING_TABLE, staged, [
+        'worker_id', 'history_id', 'new_room_id', 'bed_number', 'set_room', 'set_bed', 'set_start_date', 'close_date', 'insert_start'
+    ])
+    cursor.execute(f"""
+        UPDATE "AccommodationHistory" ah SET
+            room_id = CASE WHEN s.set_room THEN s.new_room_id ELSE ah.room_id END,
+            bed_number = CASE WHEN s.set_bed THEN s.bed_number ELSE ah.bed_number END,
+            start_date = COALESCE(s.set_start_date, ah.start_date),
+            end_date = COALESCE(s.close_date, ah.end_date)
+        FROM {ACCOMMODATION_STAGING_TABLE} s
+        WHERE ah.id = s.history_id AND (s.set_room OR s.set_bed OR s.set_start_date IS NOT NULL OR s.close_date IS NOT NULL)
+    """)
+    cursor.execute(f"""
+        INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number)
+        SELECT worker_id, new_room_id, insert_start, bed_number FROM {ACCOMMODATION_STAGING_TABLE}
+        WHERE insert_start IS NOT NULL
+    """)
+    cursor.execute(f"""
+        UPDATE "Workers" SET data_source = '手動調整'
+        WHERE unique_id IN (SELECT worker_id FROM {ACCOMMODATION_STAGING_TABLE})
+    """)
+
+def _run_accommodation_import(df: pd.DataFrame, mode: str, label: str):
+    """
+    【v2.0 批次版】住宿匯入 (assign / move / overwrite) 的共用引擎。
+    工人、宿舍與房間整批比對，目前住宿一次查詢，動作以 pandas 計算後批次寫入，
+    所有列在同一交易中完成。同一位工人出現在多列時，依列順序分批處理，結果與逐列處理相同。
+    回傳 (成功筆數, 失敗列 DataFrame (附「錯誤原因」))。
     """
-    success_count = 0
-    failed_records = []
-    skipped_records = []  # 新增一個列表來存放跳過的紀錄
     conn = database.get_db_connection()
     if not conn:
         error_df = df.copy()
         error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df, pd.DataFrame() # 修改回傳值
+        return 0, error_df
 
     try:
         with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    original_address = row.get('宿舍地址')
-                    if not original_address or pd.isna(original_address):
-                        raise ValueError("宿舍地址為空")
-
-                    dorm_id = None
-                    addr_stripped = str(original_address).strip()
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    elif addr_stripped in normalized_addr_map:
-                        dorm_id = normalized_addr_map[addr_stripped]
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-                    
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {original_address}")
-                    
-                    def to_bool(val):
-                        if pd.isna(val): return None
-                        return str(val).strip().upper() in ['TRUE', '1', 'Y', 'YES', '是']
-
-                    permit_details = {
-                        "architect_name": row.get('建築師'),
-                        "gov_document_exists": to_bool(row.get('政府是否發文')),
-                        "next_declaration_start": pd.to_datetime(row.get('下次申報起日期')).strftime('%Y-%m-%d') if pd.notna(row.get('下次申報起日期')) else None,
-                        "next_declaration_end": pd.to_datetime(row.get('下次申報迄日期')).strftime('%Y-%m-%d') if pd.notna(row.get('下次申報迄日期')) else None,
-                        "declaration_item": row.get('申報項目'),
-                        "area_legal": row.get('申報面積（合法）'),
-                        "area_total": row.get('申報面積（合法加違規）'),
-                        "amount_pre_tax": int(pd.to_numeric(row.get('金額（未稅）'), errors='coerce')) if pd.notna(row.get('金額（未稅）')) else None,
-                        "usage_license_exists": to_bool(row.get('使用執照有無')),
-                        "property_deed_exists": to_bool(row.get('權狀有無')),
-                        "landlord_id_exists": to_bool(row.get('房東證件有無')),
-                        "improvements_made": to_bool(row.get('現場是否改善')),
-                        "insurance_exists": to_bool(row.get('保險有無')),
-                        "submission_date": pd.to_datetime(row.get('申報文件送出日期')).strftime('%Y-%m-%d') if pd.notna(row.get('申報文件送出日期')) else None,
-                        "registered_mail_date": pd.to_datetime(row.get('掛號憑證日期')).strftime('%Y-%m-%d') if pd.notna(row.get('掛號憑證日期')) else None,
-                        "certificate_received_date": pd.to_datetime(row.get('收到憑證日期')).strftime('%Y-%m-%d') if pd.notna(row.get('收到憑證日期')) else None,
-                        "invoice_date": pd.to_datetime(row.get('請款日')).strftime('%Y-%m-%d') if pd.notna(row.get('請款日')) else None,
-                        "approval_start_date": pd.to_datetime(row.get('此次申報核准起日期')).strftime('%Y-%m-%d') if pd.notna(row.get('此次申報核准起日期')) else None,
-                        "approval_end_date": pd.to_datetime(row.get('此次申報核准迄日期')).strftime('%Y-%m-%d') if pd.notna(row.get('此次申報核准迄日期')) else None
-                    }
-
-                    expense_details = {
-                        "dorm_id": dorm_id,
-                        "expense_item": f"建物申報-{permit_details['declaration_item']}" if permit_details.get('declaration_item') else "建物申報",
-                        "payment_date": pd.to_datetime(row.get('支付日期')).strftime('%Y-%m-%d') if pd.notna(row.get('支付日期')) else None,
-                        "total_amount": int(pd.to_numeric(row.get('總金額（含稅）'), errors='coerce')) if pd.notna(row.get('總金額（含稅）')) else None,
-                        "amortization_start_month": pd.to_datetime(row.get('攤提起始月')).strftime('%Y-%m') if pd.notna(row.get('攤提起始月')) else None,
-                        "amortization_end_month": pd.to_datetime(row.get('攤提結束月')).strftime('%Y-%m') if pd.notna(row.get('攤提結束月')) else None,
-                    }
-
-                    # --- 【核心修改 1】新增重複檢查 ---
-                    approval_start_date_str = permit_details.get("approval_start_date")
-                    if not approval_start_date_str:
-                        raise ValueError("「此次申報核准起日期」為判斷重複的必要欄位，不可為空")
-
-                    check_query = """
-                        SELECT id FROM "ComplianceRecords"
-                        WHERE dorm_id = %s
-                          AND record_type = '建物申報'
-                          AND details ->> 'declaration_item' = %s
-                          AND details ->> 'approval_start_date' = %s
-                    """
-                    cursor.execute(check_query, (dorm_id, permit_details.get("declaration_item"), approval_start_date_str))
-                    
-                    if cursor.fetchone():
-                        row['錯誤原因'] = "資料重複，已跳過"
-                        skipped_records.append(row)
-                        continue # 跳到下一筆資料
-
-                    # --- 若不重複，才執行新增 ---
-                    cleaned_permit_details = clean_nan_for_json(permit_details)
-                    details_json = json.dumps(cleaned_permit_details, ensure_ascii=False)
-
-                    compliance_sql = 'INSERT INTO "ComplianceRecords" (dorm_id, record_type, details) VALUES (%s, %s, %s) RETURNING id;'
-                    cursor.execute(compliance_sql, (dorm_id, '建物申報', details_json))
-                    new_compliance_id = cursor.fetchone()['id']
-
-                    expense_details['compliance_record_id'] = new_compliance_id
-                    expense_columns = ', '.join(f'"{k}"' for k in expense_details.keys())
-                    expense_placeholders = ', '.join(['%s'] * len(expense_details))
-                    expense_sql = f'INSERT INTO "AnnualExpenses" ({expense_columns}) VALUES ({expense_placeholders})'
-                    cursor.execute(expense_sql, tuple(expense_details.values()))
-                    
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
+            rows = _prepare_accommodation_rows(conn, cursor, df)
+            valid = rows[rows['error'] == '']
+            today = date.today()
+            success_count = 0
+            # 每位工人第 n 次出現的列放在第 n 批，讓後面的列看得到前面的列寫入的結果
+            occurrence = valid.groupby('worker_id').cumcount()
+            for wave_no in range(int(occurrence.max()) + 1 if not valid.empty else 0):
+                wave = valid[occurrence == wave_no]
+                stays = _load_open_stays(conn, wave['worker_id'].tolist())
+                plan = _plan_accommodation_actions(wave, stays, mode, today)
+                _apply_accommodation_actions(cursor, plan)
+                success_count += int((~plan['skip']).sum())
         conn.commit()
+        occupancy_index.invalidate()
+        print(f"INFO: 住宿匯入({label})完成，成功 {success_count} 筆，失敗 {int((rows['error'] != '').sum())} 筆。")
+        failed_df = df[rows['error'] != ''].copy()
+        failed_df['錯誤原因'] = rows.loc[failed_df.index, 'error']
+        return success_count, failed_df
     except Exception as e:
         if conn: conn.rollback()
-        print(f"批次匯入建物申報時發生嚴重錯誤: {e}")
+        print(f"批次匯入住宿({label})時發生嚴重錯誤: {e}")
+        error_df = df.copy()
+        error_df['錯誤原因'] = f"系統層級錯誤: {e}"
+        return 0, error_df
     finally:
         if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records), pd.DataFrame(skipped_records) # 修改回傳值
 
 def batch_import_accommodation(df: pd.DataFrame):
     """
-    【v1.7 佔位房號修正版】批次匯入【住宿分配/異動】的核心邏輯。
-    如果最新紀錄是 '[未分配房間]' 且未指定入住日，則直接更新該紀錄。
+    【v2.0 批次版】批次匯入【住宿分配/異動】的核心邏輯。
+    如果最新紀錄是 '[未分配房間]' 且未指定入住日，則直接更新該紀錄；
+    房間相同時只更新床位 (床位也相同則跳過)；否則結束舊紀錄並新增一筆新紀錄。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        from datetime import date, timedelta
-
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-
-            rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
-            room_map = {(r['dorm_id'], str(r['room_number'])): r['id'] for _, r in rooms_df.iterrows()}
-            room_id_to_number_map = {r['id']: r['room_number'] for _, r in rooms_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    employer = str(row.get('雇主', '')).strip()
-                    name = str(row.get('姓名', '')).strip()
-                    passport = str(row.get('護照號碼 (選填)', '')).strip()
-                    if not employer or not name:
-                        raise ValueError("雇主和姓名為必填欄位")
-
-                    worker_id = None
-                    # ... (查找 worker_id 的邏輯) ...
-                    if passport:
-                        unique_id = f"{employer}_{name}_{passport}"
-                        cursor.execute('SELECT unique_id FROM "Workers" WHERE unique_id = %s', (unique_id,))
-                        worker_record = cursor.fetchone()
-                        if worker_record:
-                            worker_id = worker_record['unique_id']
-                        else:
-                             raise ValueError(f"找不到工人: {unique_id}")
-                    else:
-                        cursor.execute(
-                            'SELECT unique_id FROM "Workers" WHERE employer_name = %s AND worker_name = %s',
-                            (employer, name)
-                        )
-                        workers_found = cursor.fetchall()
-                        if len(workers_found) == 1:
-                            worker_id = workers_found[0]['unique_id']
-                        elif len(workers_found) == 0:
-                            raise ValueError(f"找不到工人: {employer}_{name}")
-                        else:
-                            raise ValueError(f"找到 {len(workers_found)} 位同名工人，請提供護照號碼以作區分")
-
-                    if not worker_id:
-                        raise ValueError("無法確定唯一的工人紀錄")
-
-                    address = row.get('實際住宿地址')
-                    room_number_str = str(row.get('房號')).strip()
-                    if not address or pd.isna(address) or not room_number_str:
-                        raise ValueError("實際住宿地址和房號為必填欄位")
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id:
-                        raise ValueError(f"找不到宿舍地址: {address}")
-                    room_key = (dorm_id, room_number_str)
-                    new_room_id = room_map.get(room_key)
-                    if not new_room_id:
-                        room_details = {'dorm_id': dorm_id, 'room_number': room_number_str, 'capacity': 4, 'gender_policy': '可混住'}
-                        cols = ', '.join(f'"{k}"' for k in room_details.keys())
-                        vals = ', '.join(['%s'] * len(room_details))
-                        cursor.execute(f'INSERT INTO "Rooms" ({cols}) VALUES ({vals}) RETURNING id', tuple(room_details.values()))
-                        new_room_id = cursor.fetchone()['id']
-                        room_map[room_key] = new_room_id
-                        # --- 新增：同時更新反向映射 ---
-                        room_id_to_number_map[new_room_id] = room_number_str
-                        # --- 新增結束 ---
-
-                    bed_number_val = row.get('床位編號 (選填)')
-                    bed_number = str(bed_number_val).strip() if pd.notna(bed_number_val) and str(bed_number_val).strip() else None
-
-
-                    move_in_date_input = row.get('入住日 (換宿/指定日期時填寫)')
-
-                    # --- 【核心修改點 1】查詢時包含 room_number (雖然我們有 map 了，但 JOIN 比較保險) ---
-                    cursor.execute("""
-                        SELECT ah.id, ah.room_id, ah.start_date
-                        FROM "AccommodationHistory" ah
-                        WHERE ah.worker_unique_id = %s AND ah.end_date IS NULL
-                        ORDER BY ah.start_date DESC, ah.id DESC LIMIT 1
-                    """, (worker_id,))
-                    latest_history = cursor.fetchone()
-
-                    # --- 【核心修改點 2】加入判斷邏輯 ---
-                    should_update_placeholder = False
-                    if latest_history:
-                        latest_room_id = latest_history['room_id']
-                        latest_room_number = room_id_to_number_map.get(latest_room_id)
-                        # 條件：最新紀錄存在 且 是佔位房號 且 Excel未指定入住日
-                        if latest_room_number == '[未分配房間]' and (pd.isna(move_in_date_input) or not move_in_date_input):
-                            should_update_placeholder = True
-
-                    if should_update_placeholder:
-                        # --- 直接更新佔位紀錄 ---
-                        cursor.execute(
-                            'UPDATE "AccommodationHistory" SET room_id = %s, bed_number = %s WHERE id = %s',
-                            (new_room_id, bed_number, latest_history['id'])
-                        )
-                        print(f"INFO: Worker {worker_id} - Updated placeholder room to {new_room_id}") # 增加日誌
-
-                    elif latest_history and latest_history['room_id'] == new_room_id:
-                        # --- 如果房間沒變，檢查床位是否有變 ---
-                        cursor.execute('SELECT bed_number FROM "AccommodationHistory" WHERE id = %s', (latest_history['id'],))
-                        current_bed = cursor.fetchone()['bed_number']
-                        if current_bed != bed_number:
-                            cursor.execute('UPDATE "AccommodationHistory" SET bed_number = %s WHERE id = %s', (bed_number, latest_history['id']))
-                            print(f"INFO: Worker {worker_id} - Updated bed number in room {new_room_id} to {bed_number}") # 增加日誌
-                        else:
-                            # 房間和床位都沒變，跳過
-                            continue
-
-                    else:
-                        # --- 維持原本的換宿邏輯 ---
-                        effective_date = pd.to_datetime(move_in_date_input).date() if pd.notna(move_in_date_input) and move_in_date_input else date.today()
-                        if latest_history:
-                            end_date = effective_date - timedelta(days=1)
-                            cursor.execute(
-                                'UPDATE "AccommodationHistory" SET end_date = %s WHERE id = %s',
-                                (end_date, latest_history['id'])
-                            )
-
-                        cursor.execute(
-                            'INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number) VALUES (%s, %s, %s, %s)',
-                            (worker_id, new_room_id, effective_date, bed_number)
-                        )
-                        print(f"INFO: Worker {worker_id} - Created new accommodation record for room {new_room_id}") # 增加日誌
-
-                    # 更新 Workers 表的 data_source 標記 (這部分邏輯不變)
-                    cursor.execute('UPDATE "Workers" SET data_source = %s WHERE unique_id = %s', ('手動調整', worker_id))
-                    success_count += 1
-
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入住宿資料時發生嚴重錯誤: {e}")
-        # 將剩餘未處理的行標記為失敗
-        start_index = len(failed_records) # Index where processing stopped due to error
-        remaining_rows_df = df.iloc[start_index:]
-        if not remaining_rows_df.empty:
-            remaining_rows_list = remaining_rows_df.to_dict('records')
-            for row in remaining_rows_list:
-                row['錯誤原因'] = f"系統層級錯誤: {e}"
-            failed_records.extend(remaining_rows_list)
-    finally:
-        if conn: conn.close()
-
-    return success_count, pd.DataFrame(failed_records)
+    return _run_accommodation_import(df, 'assign', '分配')
 
 def batch_import_accommodation_move(df: pd.DataFrame):
     """
     批次匯入【住宿異動 (換宿)】。
-    此邏輯會結束舊紀錄，並新增一筆新紀錄。
+    此邏輯會結束舊紀錄，並新增一筆新紀錄 (房間相同則跳過)。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-        
-    try:
-        from datetime import date, timedelta
-
-        with conn.cursor() as cursor:
-            # --- 預載資料 (Address, Room maps) ---
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
-            room_map = {(r['dorm_id'], str(r['room_number'])): r['id'] for _, r in rooms_df.iterrows()}
-            # --- 預載結束 ---
-
-            for index, row in df.iterrows():
-                try:
-                    # --- 查找 worker_id (共用邏輯) ---
-                    employer = str(row.get('雇主', '')).strip()
-                    name = str(row.get('姓名', '')).strip()
-                    passport = str(row.get('護照號碼 (選填)', '')).strip()
-                    if not employer or not name: raise ValueError("雇主和姓名為必填欄位")
-                    worker_id = None
-                    if passport:
-                        unique_id = f"{employer}_{name}_{passport}"
-                        cursor.execute('SELECT unique_id FROM "Workers" WHERE unique_id = %s', (unique_id,))
-                        worker_record = cursor.fetchone()
-                        if worker_record: worker_id = worker_record['unique_id']
-                        else: raise ValueError(f"找不到工人: {unique_id}")
-                    else:
-                        cursor.execute('SELECT unique_id FROM "Workers" WHERE employer_name = %s AND worker_name = %s', (employer, name))
-                        workers_found = cursor.fetchall()
-                        if len(workers_found) == 1: worker_id = workers_found[0]['unique_id']
-                        elif len(workers_found) == 0: raise ValueError(f"找不到工人: {employer}_{name}")
-                        else: raise ValueError(f"找到 {len(workers_found)} 位同名工人，請提供護照號碼以作區分")
-                    if not worker_id: raise ValueError("無法確定唯一的工人紀錄")
-                    # --- 查找 worker_id 結束 ---
-
-                    # --- 查找 new_room_id (共用邏輯) ---
-                    address = row.get('實際住宿地址')
-                    room_number_str = str(row.get('房號')).strip()
-                    if not address or pd.isna(address) or not room_number_str: raise ValueError("實際住宿地址和房號為必填欄位")
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id: raise ValueError(f"找不到宿舍地址: {address}")
-                    room_key = (dorm_id, room_number_str)
-                    new_room_id = room_map.get(room_key)
-                    if not new_room_id:
-                        room_details = {'dorm_id': dorm_id, 'room_number': room_number_str, 'capacity': 4, 'gender_policy': '可混住'}
-                        cols = ', '.join(f'"{k}"' for k in room_details.keys()); vals = ', '.join(['%s'] * len(room_details))
-                        cursor.execute(f'INSERT INTO "Rooms" ({cols}) VALUES ({vals}) RETURNING id', tuple(room_details.values()))
-                        new_room_id = cursor.fetchone()['id']; room_map[room_key] = new_room_id
-                    # --- 查找 new_room_id 結束 ---
-                    
-                    bed_number_val = row.get('床位編號 (選填)')
-                    bed_number = str(bed_number_val).strip() if pd.notna(bed_number_val) and str(bed_number_val).strip() else None
-
-                    # --- "Move" (異動) 邏輯 ---
-                    move_in_date_input = row.get('入住日 (換宿/指定日期時填寫)')
-                    effective_date = pd.to_datetime(move_in_date_input).date() if pd.notna(move_in_date_input) and move_in_date_input else date.today()
-
-                    cursor.execute(
-                        'SELECT ah.id, ah.room_id FROM "AccommodationHistory" ah WHERE ah.worker_unique_id = %s AND ah.end_date IS NULL ORDER BY ah.start_date DESC, ah.id DESC LIMIT 1',
-                        (worker_id,)
-                    )
-                    latest_history = cursor.fetchone()
-
-                    if latest_history and latest_history['room_id'] == new_room_id:
-                        continue # 房間相同，跳過
-                    
-                    if latest_history:
-                        end_date_for_old_record = effective_date - timedelta(days=1)
-                        cursor.execute(
-                            'UPDATE "AccommodationHistory" SET end_date = %s WHERE id = %s', 
-                            (end_date_for_old_record, latest_history['id'])
-                        )
-                    
-                    cursor.execute(
-                        'INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number) VALUES (%s, %s, %s, %s)',
-                        (worker_id, new_room_id, effective_date, bed_number)
-                    )
-                    # --- 邏輯結束 ---
-                    
-                    cursor.execute('UPDATE "Workers" SET data_source = %s WHERE unique_id = %s', ('手動調整', worker_id))
-                    success_count += 1
-                
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
+    return _run_accommodation_import(df, 'move', '異動')
 
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入住宿(異動)時發生嚴重錯誤: {e}")
-        # 處理系統層級錯誤
-        start_index = len(failed_records)
-        remaining_rows_df = df.iloc[start_index:]
-        if not remaining_rows_df.empty:
-            remaining_rows_list = remaining_rows_df.to_dict('records')
-            for row in remaining_rows_list:
-                row['錯誤原因'] = f"系統層級錯誤: {e}"
-            failed_records.extend(remaining_rows_list)
-    finally:
-        if conn: conn.close()
-    return success_count, pd.DataFrame(failed_records)
-
-
-# --- 【核心修改 2】新增 "Overwrite" (覆蓋) 函式 ---
 def batch_import_accommodation_overwrite(df: pd.DataFrame):
     """
     批次匯入【住宿覆蓋 (修正)】。
-    此邏輯會直接更新最新一筆紀錄的 room_id, bed_number, 以及 (可選的) start_date。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-        
-    try:
-        from datetime import date, timedelta
-
-        with conn.cursor() as cursor:
-            # --- 預載資料 (Address, Room maps) ---
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
-            room_map = {(r['dorm_id'], str(r['room_number'])): r['id'] for _, r in rooms_df.iterrows()}
-            # --- 預載結束 ---
-
-            for index, row in df.iterrows():
-                try:
-                    # --- 查找 worker_id (共用邏輯) ---
-                    employer = str(row.get('雇主', '')).strip()
-                    name = str(row.get('姓名', '')).strip()
-                    passport = str(row.get('護照號碼 (選填)', '')).strip()
-                    if not employer or not name: raise ValueError("雇主和姓名為必填欄位")
-                    worker_id = None
-                    if passport:
-                        unique_id = f"{employer}_{name}_{passport}"
-                        cursor.execute('SELECT unique_id FROM "Workers" WHERE unique_id = %s', (unique_id,))
-                        worker_record = cursor.fetchone()
-                        if worker_record: worker_id = worker_record['unique_id']
-                        else: raise ValueError(f"找不到工人: {unique_id}")
-                    else:
-                        cursor.execute('SELECT unique_id FROM "Workers" WHERE employer_name = %s AND worker_name = %s', (employer, name))
-                        workers_found = cursor.fetchall()
-                        if len(workers_found) == 1: worker_id = workers_found[0]['unique_id']
-                        elif len(workers_found) == 0: raise ValueError(f"找不到工人: {employer}_{name}")
-                        else: raise ValueError(f"找到 {len(workers_found)} 位同名工人，請提供護照號碼以作區分")
-                    if not worker_id: raise ValueError("無法確定唯一的工人紀錄")
-                    # --- 查找 worker_id 結束 ---
-
-                    # --- 查找 new_room_id (共用邏輯) ---
-                    address = row.get('實際住宿地址')
-                    room_number_str = str(row.get('房號')).strip()
-                    if not address or pd.isna(address) or not room_number_str: raise ValueError("實際住宿地址和房號為必填欄位")
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id: raise ValueError(f"找不到宿舍地址: {address}")
-                    room_key = (dorm_id, room_number_str)
-                    new_room_id = room_map.get(room_key)
-                    if not new_room_id:
-                        room_details = {'dorm_id': dorm_id, 'room_number': room_number_str, 'capacity': 4, 'gender_policy': '可混住'}
-                        cols = ', '.join(f'"{k}"' for k in room_details.keys()); vals = ', '.join(['%s'] * len(room_details))
-                        cursor.execute(f'INSERT INTO "Rooms" ({cols}) VALUES ({vals}) RETURNING id', tuple(room_details.values()))
-                        new_room_id = cursor.fetchone()['id']; room_map[room_key] = new_room_id
-                    # --- 查找 new_room_id 結束 ---
-                    
-                    bed_number_val = row.get('床位編號 (選填)')
-                    bed_number = str(bed_number_val).strip() if pd.notna(bed_number_val) and str(bed_number_val).strip() else None
-                    
-                    # --- "Overwrite" (覆蓋) 邏輯 ---
-                    move_in_date_input = row.get('入住日 (換宿/指定日期時填寫)')
-                    effective_date_from_excel = pd.to_datetime(move_in_date_input).date() if pd.notna(move_in_date_input) and move_in_date_input else None
-
-                    cursor.execute(
-                        'SELECT ah.id, ah.room_id FROM "AccommodationHistory" ah WHERE ah.worker_unique_id = %s AND ah.end_date IS NULL ORDER BY ah.start_date DESC, ah.id DESC LIMIT 1',
-                        (worker_id,)
-                    )
-                    latest_history = cursor.fetchone()
-                    
-                    if not latest_history:
-                        # 如果沒有最新紀錄 (例如新員工)，則執行 "新增"
-                        start_date = effective_date_from_excel if effective_date_from_excel else date.today()
-                        cursor.execute(
-                            'INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number) VALUES (%s, %s, %s, %s)',
-                            (worker_id, new_room_id, start_date, bed_number)
-                        )
-                    else:
-                        # 如果有最新紀錄，則執行 "更新"
-                        latest_history_id = latest_history['id']
-                        
-                        # 準備要更新的欄位
-                        updates = {"room_id": new_room_id, "bed_number": bed_number}
-                        # 只有當 Excel 中明確提供了日期時，才更新 start_date
-                        if effective_date_from_excel:
-                            updates["start_date"] = effective_date_from_excel
-                        
-                        # 組合 SQL
-                        fields = ', '.join([f'"{key}" = %s' for key in updates.keys()])
-                        values = list(updates.values()) + [latest_history_id]
-                        update_sql = f'UPDATE "AccommodationHistory" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                    # --- 邏輯結束 ---
-
-                    cursor.execute('UPDATE "Workers" SET data_source = %s WHERE unique_id = %s', ('手動調整', worker_id))
-                    success_count += 1
-                
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入住宿(覆蓋)時發生嚴重錯誤: {e}")
-        # 處理系統層級錯誤
-        start_index = len(failed_records)
-        remaining_rows_df = df.iloc[start_index:]
-        if not remaining_rows_df.empty:
-            remaining_rows_list = remaining_rows_df.to_dict('records')
-            for row in remaining_rows_list:
-                row['錯誤原因'] = f"系統層級錯誤: {e}"
-            failed_records.extend(remaining_rows_list)
-    finally:
-        if conn: conn.close()
-    return success_count, pd.DataFrame(failed_records)
+    此邏輯會直接更新最新一筆紀錄的 room_id, bed_number, 以及 (可選的) start_date；
+    沒有住宿紀錄時則新增一筆。
+    """
+    return _run_accommodation_import(df, 'overwrite', '覆蓋')
+
+LEASE_IMPORT = {
+    'label': '房租合約',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('vendor_id', bulk_import.vendor('房東/廠商', not_found="在廠商資料庫中找不到廠商: '{value}'，請先新增。")),
+        ('contract_item', bulk_import.text('合約項目', default='房租')),
+        ('lease_start_date', bulk_import.day('合約起始日')),
+        ('lease_end_date', bulk_import.day('合約截止日')),
+        ('monthly_rent', bulk_import.integer('月租金')),
+        ('deposit', bulk_import.integer('押金')),
+        ('utilities_included', bulk_import.boolean('租金含水電')),
+        ('notes', bulk_import.text('備註', default='')),
+    ],
+    'unique': ['dorm_id', 'contract_item', 'lease_start_date', 'monthly_rent'],
+    'duplicate_check': {'table': 'Leases', 'key': ['dorm_id', 'contract_item', 'lease_start_date', 'monthly_rent'], 'report': True},
+    'targets': [{'table': 'Leases', 'mode': 'insert'}],
+}
 
 def batch_import_leases(df: pd.DataFrame):
     """
-    【v1.1 修改版】批次匯入【房租合約】的核心邏輯。
-    新增回傳重複的紀錄。
-    """
-    success_count = 0
-    failed_records = []
-    skipped_records = [] 
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df, pd.DataFrame()
-
-    try:
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            # --- 【核心修改 1】預載廠商資料 ---
-            vendors_df = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name FROM "Vendors"')
-            vendor_map = {v['vendor_name']: v['id'] for _, v in vendors_df.iterrows()}
-            
-            for index, row in df.iterrows():
-                try:
-                    address = row.get('宿舍地址')
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-                        
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {address}")
-
-                    # --- 【核心修改 2】找不到廠商時，明確拋出錯誤 ---
-                    vendor_id = None
-                    vendor_name = row.get('房東/廠商')
-                    if pd.notna(vendor_name) and str(vendor_name).strip():
-                        vendor_name_stripped = str(vendor_name).strip()
-                        vendor_id = vendor_map.get(vendor_name_stripped)
-                        # 如果 Excel 中有填寫廠商，但在資料庫找不到，就報錯
-                        if not vendor_id:
-                            raise ValueError(f"在廠商資料庫中找不到廠商: '{vendor_name_stripped}'，請先新增。")
-
-                    def to_bool(val):
-                        if pd.isna(val): return False
-                        return str(val).strip().upper() in ['TRUE', '1', 'Y', 'YES', '是']
-                    
-                    # --- 【核心修改 3】將新欄位加入 details ---
-                    details = {
-                        "dorm_id": dorm_id,
-                        "vendor_id": vendor_id, # <-- 新增
-                        "contract_item": row.get('合約項目', '房租'),
-                        "lease_start_date": pd.to_datetime(row.get('合約起始日')).strftime('%Y-%m-%d') if pd.notna(row.get('合約起始日')) else None,
-                        "lease_end_date": pd.to_datetime(row.get('合約截止日')).strftime('%Y-%m-%d') if pd.notna(row.get('合約截止日')) else None,
-                        "monthly_rent": int(pd.to_numeric(row.get('月租金'), errors='coerce')) if pd.notna(row.get('月租金')) else None,
-                        "deposit": int(pd.to_numeric(row.get('押金'), errors='coerce')) if pd.notna(row.get('押金')) else None,
-                        "utilities_included": to_bool(row.get('租金含水電')),
-                        "notes": str(row.get('備註', '')) # <-- 新增
-                    }
-                    
-                    cursor.execute(
-                        'SELECT id FROM "Leases" WHERE dorm_id = %s AND contract_item = %s AND lease_start_date = %s AND monthly_rent = %s',
-                        (details['dorm_id'], details['contract_item'], details['lease_start_date'], details['monthly_rent'])
-                    )
-                    
-                    if cursor.fetchone():
-                        # --- 將跳過的紀錄加入 skipped_records ---
-                        row['錯誤原因'] = "資料重複，已跳過"
-                        skipped_records.append(row)
-                        continue
-
-                    columns = ', '.join(f'"{k}"' for k in details.keys())
-                    placeholders = ', '.join(['%s'] * len(details))
-                    sql = f'INSERT INTO "Leases" ({columns}) VALUES ({placeholders})'
-                    cursor.execute(sql, tuple(details.values()))
-                    success_count += 1
-                
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入房租合約時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    # --- 回傳三個結果 ---
-    return success_count, pd.DataFrame(failed_records), pd.DataFrame(skipped_records)
+    【v2.0 批次版】批次匯入【房租合約】的核心邏輯。
+    同一宿舍、合約項目、起始日與月租金的合約已存在時跳過，並回傳重複的紀錄。
+    """
+    result = bulk_import.run_import(df, LEASE_IMPORT)
+    return result['success'], result['failed'], result['skipped']
+
+def _amortization_start_month(frame, values, ctx):
+    """攤提起始月：未填「攤提起始日」時以支付日期為準。"""
+    raw = bulk_import.column_values(frame, '攤提起始日')
+    blank = bulk_import.is_blank(raw)
+    parsed = bulk_import.parse_dates(raw, blank)
+    start = parsed.fillna(pd.to_datetime(values['payment_date']))
+    errors = bulk_import.no_errors(frame.index)
+    errors[~blank & parsed.isna()] = "「攤提起始日」格式錯誤"
+    errors[(errors == '') & start.isna()] = "「攤提起始日」與「支付日期」至少需填寫一項"
+    return start.dt.strftime('%Y-%m').astype(object).where(start.notna(), None), errors
+
+def _amortization_end_month(frame, values, ctx):
+    """攤提結束月 = 攤提起始月 + (攤提月數 - 1) 個月，攤提月數預設 12。"""
+    periods, errors = bulk_import.integer('攤提月數', default=12)['convert'](frame, values, ctx)
+    start = pd.to_datetime(values['amortization_start_month'], format='%Y-%m', errors='coerce')
+    month_index = (start.dt.year * 12 + start.dt.month - 1 + periods.astype('float64') - 1)
+    end = pd.to_datetime(dict(year=month_index // 12, month=month_index % 12 + 1, day=1), errors='coerce')
+    return end.dt.strftime('%Y-%m').astype(object).where(end.notna(), None), errors
+
+FIRE_SAFETY_IMPORT = {
+    'label': '消防安檢',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('payment_date', bulk_import.day('支付日期')),
+        ('total_amount', bulk_import.integer('支付總金額', default=0)),
+        ('amortization_start_month', bulk_import.computed('TEXT', _amortization_start_month)),
+        ('amortization_end_month', bulk_import.computed('TEXT', _amortization_end_month)),
+        ('record_type', bulk_import.constant('消防安檢')),
+        ('details', bulk_import.json_object([
+            ('vendor', bulk_import.as_is('支出對象/廠商')),
+            ('declaration_item', bulk_import.as_is('申報項目')),
+            ('submission_date', bulk_import.day('申報文件送出日期')),
+            ('registered_mail_date', bulk_import.day('掛號憑證日期')),
+            ('certificate_date', bulk_import.day('收到憑證日期')),
+            ('next_declaration_start', bulk_import.day('下次申報起始日期')),
+            ('next_declaration_end', bulk_import.day('下次申報結束日期')),
+            ('approval_start_date', bulk_import.day('此次申報核准起始日期')),
+            ('approval_end_date', bulk_import.day('此次申報核准結束日期')),
+            # 提醒功能 (reminder_model) 以 next_check_date 查詢下次檢查日
+            ('next_check_date', bulk_import.day('下次申報起始日期')),
+        ])),
+        ('expense_item', bulk_import.text('申報項目', default='消防安檢')),
+    ],
+    'unique': ['dorm_id', 'payment_date', 'total_amount', 'expense_item'],
+    'duplicate_check': {
+        'table': 'AnnualExpenses',
+        'key': ['dorm_id', 'payment_date', 'total_amount', "t.expense_item = '消防安檢'"],
+        'report': True,
+    },
+    'allocate': {'compliance_record_id': 'ComplianceRecords'},
+    'targets': [
+        {'table': 'ComplianceRecords', 'mode': 'insert',
+         'columns': {'id': 's.compliance_record_id', 'dorm_id': 's.dorm_id', 'record_type': 's.record_type', 'details': 's.details'}},
+        {'table': 'AnnualExpenses', 'mode': 'insert', 'where': 's.total_amount > 0',
+         'columns': ['dorm_id', 'expense_item', 'payment_date', 'total_amount',
+                     'amortization_start_month', 'amortization_end_month', 'compliance_record_id']},
+    ],
+}
 
 def batch_import_fire_safety(df: pd.DataFrame):
     """
-    批次匯入【消防安檢】的核心邏輯。
-    """
-    success_count = 0
-    failed_records = []
-    skipped_records = []
-    # finance_model.add_compliance_record 函式需要從 data_models 導入
-    from . import finance_model
-
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df, pd.DataFrame()
-
-    try:
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            for index, row in df.iterrows():
-                try:
-                    address = row.get('宿舍地址')
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-                    
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {address}")
-
-                    # 將 Excel 日期轉換為字串，處理空值
-                    def format_date(date_val):
-                        if pd.isna(date_val): return None
-                        return pd.to_datetime(date_val).strftime('%Y-%m-%d')
-
-                    payment_date = pd.to_datetime(row.get('支付日期')).date() if pd.notna(row.get('支付日期')) else None
-                    total_amount = int(pd.to_numeric(row.get('支付總金額'), errors='coerce')) if pd.notna(row.get('支付總金額')) else 0
-                    
-                    # 檢查重複：如果同一宿舍、同一支付日期、同一金額的消防安檢已存在，則跳過
-                    cursor.execute(
-                        'SELECT id FROM "AnnualExpenses" WHERE dorm_id = %s AND payment_date = %s AND total_amount = %s AND expense_item = %s',
-                        (dorm_id, payment_date, total_amount, '消防安檢')
-                    )
-                    if cursor.fetchone():
-                        row['錯誤原因'] = "資料重複，已跳過"
-                        skipped_records.append(row)
-                        continue
-
-                    amort_start = pd.to_datetime(row.get('攤提起始日')).date() if pd.notna(row.get('攤提起始日')) else payment_date
-                    amort_period = int(pd.to_numeric(row.get('攤提月數'), errors='coerce')) if pd.notna(row.get('攤提月數')) else 12
-                    amort_end_obj = amort_start + relativedelta(months=amort_period - 1)
-                    
-                    # 準備傳遞給後端函式的資料
-                    record_details = {"dorm_id": dorm_id, "details": {
-                        "vendor": row.get('支出對象/廠商'),
-                        "declaration_item": row.get('申報項目'),
-                        "submission_date": format_date(row.get('申報文件送出日期')),
-                        "registered_mail_date": format_date(row.get('掛號憑證日期')),
-                        "certificate_date": format_date(row.get('收到憑證日期')),
-                        "next_declaration_start": format_date(row.get('下次申報起始日期')),
-                        "next_declaration_end": format_date(row.get('下次申報結束日期')),
-                        "approval_start_date": format_date(row.get('此次申報核准起始日期')),
-                        "approval_end_date": format_date(row.get('此次申報核准結束日期')),
-                    }}
-                    
-                    expense_details = {
-                        "dorm_id": dorm_id,
-                        "expense_item": str(row.get('申報項目')).strip() or '消防安檢',
-                        "payment_date": payment_date,
-                        "total_amount": total_amount,
-                        "amortization_start_month": amort_start.strftime('%Y-%m'),
-                        "amortization_end_month": amort_end_obj.strftime('%Y-%m')
-                    }
-
-                    # 呼叫通用的 add_compliance_record 函式
-                    success, message, _ = finance_model.add_compliance_record('消防安檢', record_details, expense_details)
-                    if success:
-                        success_count += 1
-                    else:
-                        raise Exception(message)
-
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
-        # 注意：這裡不執行 conn.commit()，因為 add_compliance_record 內部已經處理了交易
-    except Exception as e:
-        # conn.rollback() 已在 add_compliance_record 內部處理
-        print(f"批次匯入消防安檢時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-
-    return success_count, pd.DataFrame(failed_records), pd.DataFrame(skipped_records)
+    【v2.0 批次版】批次匯入【消防安檢】的核心邏輯。
+    每列建立一筆合規紀錄，金額大於 0 時一併建立攤提費用；同一宿舍、支付日期與金額的消防安檢已存在時跳過。
+    """
+    result = bulk_import.run_import(df, FIRE_SAFETY_IMPORT)
+    return result['success'], result['failed'], result['skipped']
+
+def _income_room_ids(frame, values, ctx):
+    return _resolve_in_dorm(
+        frame, values, ctx, '房號 (選填)', 'SELECT id, dorm_id, room_number AS number FROM "Rooms"',
+        "在宿舍 '{address}' 中找不到房號 '{number}'"
+    )
+
+OTHER_INCOME_REQUIRED = "必填欄位(收入項目, 收入金額, 收入日期)有缺漏或格式錯誤"
+
+OTHER_INCOME_IMPORT = {
+    'label': '其他收入',
+    'fields': [
+        ('dorm_id', bulk_import.dorm()),
+        ('room_id', bulk_import.computed('INTEGER', _income_room_ids)),
+        ('income_item', bulk_import.text('收入項目', required=OTHER_INCOME_REQUIRED)),
+        ('amount', bulk_import.integer('收入金額', required=OTHER_INCOME_REQUIRED, invalid=OTHER_INCOME_REQUIRED)),
+        ('transaction_date', bulk_import.day('收入日期', required=OTHER_INCOME_REQUIRED, invalid=OTHER_INCOME_REQUIRED)),
+        ('notes', bulk_import.text('備註', default='')),
+    ],
+    'unique': ['dorm_id', 'income_item', 'transaction_date'],
+    'targets': [
+        {'table': 'OtherIncome', 'mode': 'upsert', 'key': ['dorm_id', 'income_item', 'transaction_date']},
+    ],
+}
 
 def batch_import_other_income(df: pd.DataFrame):
     """
-    【v1.2 房號報錯修正版】批次匯入【其他收入】的核心邏輯。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
-            room_map = {(r['dorm_id'], str(r['room_number'])): r['id'] for _, r in rooms_df.iterrows()}
-            
-            for index, row in df.iterrows():
-                try:
-                    original_address = row.get('宿舍地址')
-                    if not original_address or pd.isna(original_address):
-                        raise ValueError("宿舍地址為空")
-                        
-                    dorm_id = None
-                    addr_stripped = str(original_address).strip()
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    elif addr_stripped in normalized_addr_map:
-                        dorm_id = normalized_addr_map[addr_stripped]
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {original_address}")
-                        
-                    room_id = None
-                    room_number_val = row.get('房號 (選填)')
-                    if pd.notna(room_number_val) and str(room_number_val).strip():
-                        room_number_str = str(room_number_val).strip()
-                        room_key = (dorm_id, room_number_str)
-                        if room_key in room_map:
-                            room_id = room_map[room_key]
-                        else:
-                            # --- 如果找不到房號，就直接拋出錯誤 ---
-                            raise ValueError(f"在宿舍 '{original_address}' 中找不到房號 '{room_number_str}'")
-                            
-                    income_item = row.get('收入項目')
-                    amount = pd.to_numeric(row.get('收入金額'), errors='coerce')
-                    transaction_date = pd.to_datetime(row.get('收入日期'), errors='coerce')
-
-                    if not all([income_item, pd.notna(amount), pd.notna(transaction_date)]):
-                        raise ValueError("必填欄位(收入項目, 收入金額, 收入日期)有缺漏或格式錯誤")
-                        
-                    details = {
-                        "dorm_id": dorm_id,
-                        "room_id": room_id,
-                        "income_item": str(income_item).strip(),
-                        "transaction_date": transaction_date.strftime('%Y-%m-%d'),
-                        "amount": int(amount),
-                        "notes": str(row.get('備註', ''))
-                    }
-                    
-                    query = 'SELECT id FROM "OtherIncome" WHERE dorm_id = %s AND income_item = %s AND transaction_date = %s'
-                    cursor.execute(query, (dorm_id, details['income_item'], details['transaction_date']))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
-                        values = list(details.values()) + [existing['id']]
-                        update_sql = f'UPDATE "OtherIncome" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                    else:
-                        columns = ', '.join(f'"{k}"' for k in details.keys())
-                        placeholders = ', '.join(['%s'] * len(details))
-                        insert_sql = f'INSERT INTO "OtherIncome" ({columns}) VALUES ({placeholders})'
-                        cursor.execute(insert_sql, tuple(details.values()))
-
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入其他收入時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    【v2.0 批次版】批次匯入【其他收入】的核心邏輯。
+    同一宿舍、收入項目與收入日期視為同一筆，已存在時更新；填寫的房號不存在時報錯。
+    """
+    result = bulk_import.run_import(df, OTHER_INCOME_IMPORT)
+    return result['success'], result['failed']
+
+def _room_capacity_required(frame, values, ctx):
+    errors = bulk_import.no_errors(frame.index)
+    errors[values['room_number'].notna() & values['capacity'].isna()] = "「容量」為必填欄位"
+    return errors
+
+DORM_ROOM_IMPORT = {
+    'label': '宿舍與房間',
+    'fields': [
+        ('dorm_id', bulk_import.dorm(not_found="宿舍地址不存在: '{value}'")),
+        ('room_number', bulk_import.text('房號')),
+        ('capacity', bulk_import.integer('容量')),
+        (None, bulk_import.check(_room_capacity_required)),
+        ('gender_policy', bulk_import.text('性別限制', default='可混住')),
+        ('nationality_policy', bulk_import.text('國籍限制', default='不限')),
+        ('room_notes', bulk_import.text('房間備註')),
+    ],
+    # 沒有房號的列只用來確認宿舍存在，不寫入房間
+    'skip_when': lambda frame, values: values['room_number'].isna(),
+    'unique': ['dorm_id', 'room_number'],
+    'targets': [{'table': 'Rooms', 'mode': 'upsert', 'key': ['dorm_id', 'room_number']}],
+}
 
 def batch_import_dorms_and_rooms(df: pd.DataFrame):
     """
-    【v1.1 修正版】批次匯入宿舍與房間的基本資料。
+    【v2.0 批次版】批次匯入宿舍與房間的基本資料。
     採用「有就更新，沒有就新增」的邏輯。如果宿舍地址不存在，則直接報錯跳過。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # 預載現有宿舍與房間資料以供比對
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            rooms_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, room_number FROM "Rooms"')
-            room_map = {(r['dorm_id'], str(r['room_number'])): r['id'] for _, r in rooms_df.iterrows()}
-
-            # 使用 groupby 確保我們先處理完一個宿舍的所有房間再到下一個
-            for address, group in df.groupby('宿舍地址'):
-                dorm_id = None
-                try:
-                    # --- 步驟 1: 嚴格查找宿舍 ---
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped)
-                    
-                    if not dorm_id:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        dorm_id = normalized_addr_map.get(normalized_input)
-
-                    # --- 如果找不到 dorm_id，就拋出錯誤，而不是建立新的 ---
-                    if not dorm_id:
-                        raise ValueError(f"宿舍地址不存在: '{addr_stripped}'")
-
-                    # --- 步驟 2: 遍歷該宿舍下的所有房間 ---
-                    for _, row in group.iterrows():
-                        try:
-                            room_number = row.get('房號')
-                            if not room_number or pd.isna(room_number):
-                                continue # 如果沒有房號，就只處理宿舍，跳過這行
-
-                            room_number_str = str(room_number).strip()
-                            room_details = {
-                                'capacity': int(pd.to_numeric(row.get('容量'), errors='coerce', downcast='integer')),
-                                'gender_policy': row.get('性別限制', '可混住'),
-                                'nationality_policy': row.get('國籍限制', '不限'),
-                                'room_notes': row.get('房間備註')
-                            }
-
-                            room_key = (dorm_id, room_number_str)
-                            existing_room_id = room_map.get(room_key)
-
-                            if existing_room_id:
-                                # 更新現有房間
-                                fields = ', '.join([f'"{key}" = %s' for key in room_details.keys()])
-                                values = list(room_details.values()) + [existing_room_id]
-                                cursor.execute(f'UPDATE "Rooms" SET {fields} WHERE id = %s', tuple(values))
-                            else:
-                                # 新增房間
-                                room_details['dorm_id'] = dorm_id
-                                room_details['room_number'] = room_number_str
-                                columns = ', '.join(f'"{k}"' for k in room_details.keys())
-                                placeholders = ', '.join(['%s'] * len(room_details))
-                                cursor.execute(f'INSERT INTO "Rooms" ({columns}) VALUES ({placeholders}) RETURNING id', tuple(room_details.values()))
-                                new_room_id = cursor.fetchone()['id']
-                                room_map[room_key] = new_room_id # 更新 map
-                            
-                            success_count += 1
-                        except Exception as row_error:
-                            # 這是處理單一房間匯入失敗的狀況
-                            failed_row = row.copy()
-                            failed_row['錯誤原因'] = str(row_error)
-                            failed_records.append(failed_row)
-                            
-                except Exception as group_error:
-                    # 這是處理整個宿舍（地址）層級失敗的狀況
-                    for _, failed_row_in_group in group.iterrows():
-                        failed_row = failed_row_in_group.copy()
-                        failed_row['錯誤原因'] = str(group_error)
-                        failed_records.append(failed_row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入宿舍與房間時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    result = bulk_import.run_import(df, DORM_ROOM_IMPORT)
+    return result['success'], result['failed']
+
+def _vendor_name_or_category(frame, values, ctx):
+    errors = bulk_import.no_errors(frame.index)
+    errors[(values['vendor_name'] == '') & (values['service_category'] == '')] = "「廠商名稱」和「服務項目」至少需要一項"
+    return errors
+
+VENDOR_IMPORT = {
+    'label': '廠商資料',
+    'fields': [
+        ('service_category', bulk_import.text('服務項目', default='')),
+        ('vendor_name', bulk_import.text('廠商名稱', default='')),
+        (None, bulk_import.check(_vendor_name_or_category)),
+        ('contact_person', bulk_import.text('聯絡人', default='')),
+        ('phone_number', bulk_import.text('聯絡電話', default='')),
+        ('tax_id', bulk_import.text('統一編號', default='')),
+        ('remittance_info', bulk_import.text('匯款資訊', default='')),
+        ('notes', bulk_import.text('備註', default='')),
+    ],
+    'unique': ['vendor_name', 'service_category'],
+    'targets': [{'table': 'Vendors', 'mode': 'upsert', 'key': ['vendor_name', 'service_category']}],
+    'invalidates': True,
+}
 
 def batch_import_vendors(df: pd.DataFrame):
     """
-    批次匯入廠商聯絡資料。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # --- 【核心修改 1】更新欄位對應 ---
-            column_mapping = {
-                "服務項目": "service_category",
-                "廠商名稱": "vendor_name",
-                "聯絡人": "contact_person",
-                "聯絡電話": "phone_number",
-                "統一編號": "tax_id", # <-- 新增
-                "匯款資訊": "remittance_info" # <-- 新增
-            }
-            df.rename(columns=column_mapping, inplace=True)
-
-            for index, row in df.iterrows():
-                try:
-                    # 取得必要的欄位值，並清除前後空白
-                    vendor_name = str(row.get('vendor_name', '')).strip()
-                    service_category = str(row.get('service_category', '')).strip()
-
-                    if not vendor_name and not service_category:
-                        raise ValueError("「廠商名稱」和「服務項目」至少需要一項")
-                    
-                    # --- 【核心修改 2】將新欄位加入 details 字典 ---
-                    details = {
-                        'service_category': service_category,
-                        'vendor_name': vendor_name,
-                        'contact_person': str(row.get('contact_person', '')).strip(),
-                        'phone_number': str(row.get('phone_number', '')).strip(),
-                        'tax_id': str(row.get('tax_id', '')).strip(), # <-- 新增
-                        'remittance_info': str(row.get('remittance_info', '')).strip(), # <-- 新增
-                        'notes': str(row.get('備註', '')).strip()
-                    }
-
-                    # 判斷：如果廠商名稱和服務項目都相同，就視為同一筆資料
-                    cursor.execute(
-                        'SELECT id FROM "Vendors" WHERE vendor_name = %s AND service_category = %s',
-                        (details['vendor_name'], details['service_category'])
-                    )
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        # 更新現有廠商
-                        existing_id = existing['id']
-                        fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
-                        values = list(details.values()) + [existing_id]
-                        update_sql = f'UPDATE "Vendors" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                    else:
-                        # 新增廠商
-                        columns = ', '.join(f'"{k}"' for k in details.keys())
-                        placeholders = ', '.join(['%s'] * len(details))
-                        insert_sql = f'INSERT INTO "Vendors" ({columns}) VALUES ({placeholders})'
-                        cursor.execute(insert_sql, tuple(details.values()))
-
-                    success_count += 1
-                except Exception as row_error:
-                    # 如果單筆資料處理失敗，記錄下來
-                    original_row = row.rename(index={v: k for k, v in column_mapping.items()})
-                    original_row['錯誤原因'] = str(row_error)
-                    failed_records.append(original_row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入廠商資料時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    批次匯入廠商聯絡資料。廠商名稱與服務項目皆相同時視為同一筆，已存在時更新。
+    """
+    result = bulk_import.run_import(df, VENDOR_IMPORT)
+    return result['success'], result['failed']
+
+MAINTENANCE_IMPORT = {
+    'label': '維修紀錄',
+    'fields': [
+        ('dorm_id', bulk_import.dorm(not_found="找不到宿舍地址: '{value}'")),
+        ('vendor_id', bulk_import.vendor('維修廠商')),
+        ('status', bulk_import.text('狀態', default='已完成')),
+        ('notification_date', bulk_import.day('收到通知日期')),
+        ('reported_by', bulk_import.text('公司內部通知人')),
+        ('item_type', bulk_import.text('項目類型')),
+        ('description', bulk_import.text('修理細項說明')),
+        ('contacted_vendor_date', bulk_import.day('聯絡廠商日期')),
+        ('key_info', bulk_import.text('鑰匙')),
+        ('completion_date', bulk_import.day('廠商回報完成日期')),
+        ('cost', bulk_import.integer('維修費用')),
+        ('payer', bulk_import.text('付款人')),
+        ('invoice_date', bulk_import.day('請款日期')),
+        ('invoice_info', bulk_import.text('發票')),
+        ('notes', bulk_import.text('備註')),
+    ],
+    # 同一宿舍、同一說明與通知日期的紀錄已存在時直接略過 (不列入失敗)
+    'unique': ['dorm_id', 'description', 'notification_date'],
+    'duplicate_check': {'table': 'MaintenanceLog', 'key': ['dorm_id', 'description', 'notification_date']},
+    'targets': [{'table': 'MaintenanceLog', 'mode': 'insert'}],
+}
 
 # 【核心修改 1】新增一個專門用來「新增」維修紀錄的函式
 def batch_insert_maintenance_logs(df: pd.DataFrame):
@@ -1231,154 +624,56 @@ def batch_insert_maintenance_logs(df: pd.DataFrame):
     批次【新增】維修追蹤紀錄。
     如果紀錄已存在 (根據內容判斷)，則會跳過。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            vendors_df = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name FROM "Vendors"')
-            vendor_map = {v['vendor_name']: v['id'] for _, v in vendors_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    address = row.get('宿舍地址')
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-                    addr_stripped = str(address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    if not dorm_id:
-                        raise ValueError(f"找不到宿舍地址: '{addr_stripped}'")
-
-                    vendor_id = None
-                    vendor_name = row.get('維修廠商')
-                    if pd.notna(vendor_name) and str(vendor_name).strip():
-                        vendor_id = vendor_map.get(str(vendor_name).strip())
-
-                    details = {
-                        'dorm_id': dorm_id,
-                        'vendor_id': vendor_id,
-                        'status': row.get('狀態', '已完成'),
-                        'notification_date': pd.to_datetime(row.get('收到通知日期')).date() if pd.notna(row.get('收到通知日期')) else None,
-                        'reported_by': row.get('公司內部通知人'),
-                        'item_type': row.get('項目類型'),
-                        'description': row.get('修理細項說明'),
-                        'contacted_vendor_date': pd.to_datetime(row.get('聯絡廠商日期')).date() if pd.notna(row.get('聯絡廠商日期')) else None,
-                        'key_info': row.get('鑰匙'),
-                        'completion_date': pd.to_datetime(row.get('廠商回報完成日期')).date() if pd.notna(row.get('廠商回報完成日期')) else None,
-                        'cost': int(pd.to_numeric(row.get('維修費用'), errors='coerce')) if pd.notna(row.get('維修費用')) else None,
-                        'payer': row.get('付款人'),
-                        'invoice_date': pd.to_datetime(row.get('請款日期')).date() if pd.notna(row.get('請款日期')) else None,
-                        'invoice_info': row.get('發票'),
-                        'notes': row.get('備註')
-                    }
-                    
-                    cursor.execute(
-                        'SELECT id FROM "MaintenanceLog" WHERE dorm_id = %s AND description = %s AND notification_date = %s',
-                        (details['dorm_id'], details['description'], details['notification_date'])
-                    )
-                    if cursor.fetchone():
-                        continue
-
-                    columns = ', '.join(f'"{k}"' for k in details.keys())
-                    placeholders = ', '.join(['%s'] * len(details))
-                    sql = f'INSERT INTO "MaintenanceLog" ({columns}) VALUES ({placeholders})'
-                    cursor.execute(sql, tuple(v for v in details.values()))
-
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次新增維修紀錄時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    result = bulk_import.run_import(df, MAINTENANCE_IMPORT)
+    return result['success'], result['failed']
+
+MAINTENANCE_ID_REQUIRED = "Excel 中缺少 ID 欄位，無法進行更新。請下載最新的待更新檔案。"
+MAINTENANCE_UPDATE_COLUMNS = [
+    'vendor_id', 'status', 'reported_by', 'item_type', 'description', 'contacted_vendor_date', 'key_info',
+    'completion_date', 'cost', 'payer', 'invoice_date', 'invoice_info', 'notes',
+]
+
+def _maintenance_id_nonzero(frame, values, ctx):
+    errors = bulk_import.no_errors(frame.index)
+    errors[(values['id'] == 0).fillna(False)] = MAINTENANCE_ID_REQUIRED
+    return errors
+
+MAINTENANCE_UPDATE_IMPORT = {
+    'label': '維修紀錄更新',
+    'fields': [
+        ('id', bulk_import.integer('ID', required=MAINTENANCE_ID_REQUIRED, invalid=MAINTENANCE_ID_REQUIRED)),
+        (None, bulk_import.check(_maintenance_id_nonzero)),
+        ('vendor_id', bulk_import.vendor('維修廠商')),
+        ('status', bulk_import.text('狀態')),
+        ('reported_by', bulk_import.text('公司內部通知人')),
+        ('item_type', bulk_import.text('項目類型')),
+        ('description', bulk_import.text('修理細項說明')),
+        ('contacted_vendor_date', bulk_import.day('聯絡廠商日期')),
+        ('key_info', bulk_import.text('鑰匙')),
+        ('completion_date', bulk_import.day('廠商回報完成日期')),
+        ('cost', bulk_import.integer('維修費用')),
+        ('payer', bulk_import.text('付款人')),
+        ('invoice_date', bulk_import.day('請款日期')),
+        ('invoice_info', bulk_import.text('發票')),
+        ('notes', bulk_import.text('備註')),
+    ],
+    # 沒有任何要更新的欄位時略過該列
+    'skip_when': lambda frame, values: values[MAINTENANCE_UPDATE_COLUMNS].isna().all(axis=1),
+    'unique': ['id'],
+    'combine_duplicates': True,
+    'targets': [
+        {'table': 'MaintenanceLog', 'mode': 'update', 'key': ['id'], 'coalesce': True,
+         'not_found': "在資料庫中找不到對應的維修 ID: {id}"},
+    ],
+}
 
 def batch_update_maintenance_logs(df: pd.DataFrame):
     """
     批次【更新】維修追蹤紀錄。
-    只會根據提供的 ID 更新現有紀錄，不會新增。
+    只會根據提供的 ID 更新現有紀錄 (只更新有填寫的欄位)，不會新增。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            vendors_df = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name FROM "Vendors"')
-            vendor_map = {v['vendor_name']: v['id'] for _, v in vendors_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    log_id = int(pd.to_numeric(row.get('ID'), errors='coerce'))
-                    if not log_id:
-                        raise ValueError("Excel 中缺少 ID 欄位，無法進行更新。請下載最新的待更新檔案。")
-
-                    vendor_id = None
-                    vendor_name = row.get('維修廠商')
-                    if pd.notna(vendor_name) and str(vendor_name).strip():
-                        vendor_name_stripped = str(vendor_name).strip()
-                        vendor_id = vendor_map.get(vendor_name_stripped)
-
-                    details = {
-                        'vendor_id': vendor_id,
-                        'status': row.get('狀態'),
-                        'reported_by': row.get('公司內部通知人'),
-                        'item_type': row.get('項目類型'),
-                        'description': row.get('修理細項說明'),
-                        'contacted_vendor_date': pd.to_datetime(row.get('聯絡廠商日期')).date() if pd.notna(row.get('聯絡廠商日期')) else None,
-                        'key_info': row.get('鑰匙'),
-                        'completion_date': pd.to_datetime(row.get('廠商回報完成日期')).date() if pd.notna(row.get('廠商回報完成日期')) else None,
-                        'cost': int(pd.to_numeric(row.get('維修費用'), errors='coerce')) if pd.notna(row.get('維修費用')) else None,
-                        'payer': row.get('付款人'),
-                        'invoice_date': pd.to_datetime(row.get('請款日期')).date() if pd.notna(row.get('請款日期')) else None,
-                        'invoice_info': row.get('發票'),
-                        'notes': row.get('備註')
-                    }
-                    
-                    update_details = {k: v for k, v in details.items() if pd.notna(v)}
-
-                    if not update_details:
-                        continue
-
-                    fields = ', '.join([f'"{key}" = %s' for key in update_details.keys()])
-                    values = list(update_details.values()) + [log_id]
-                    sql = f'UPDATE "MaintenanceLog" SET {fields} WHERE id = %s'
-                    cursor.execute(sql, tuple(values))
-
-                    if cursor.rowcount == 0:
-                        raise ValueError(f"在資料庫中找不到對應的維修 ID: {log_id}")
-
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次更新維修紀錄時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    result = bulk_import.run_import(df, MAINTENANCE_UPDATE_IMPORT)
+    return result['success'], result['failed']
 
 def export_maintenance_logs_for_update():
     """匯出所有尚未歸檔的維修紀錄，用於批次更新。"""
@@ -1413,268 +708,119 @@ def export_maintenance_logs_for_update():
     finally:
         if conn: conn.close()
 
+def _equipment_record_types(frame, values, ctx):
+    """首次合規紀錄的類型：「{設備分類}檢測」，未填分類時為「合規檢測」。"""
+    categories = values['equipment_category'].fillna('')
+    return (categories + '檢測').where(categories != '', '合規檢測').astype(object), None
+
+def _equipment_compliance_items(frame, values, ctx):
+    return ('首次' + values['record_type']).astype(object), None
+
+EQUIPMENT_COLUMNS = [
+    'dorm_id', 'vendor_id', 'equipment_name', 'equipment_category', 'location', 'brand_model', 'serial_number',
+    'purchase_cost', 'installation_date', 'maintenance_interval_months', 'compliance_interval_months',
+    'last_maintenance_date', 'next_maintenance_date', 'status', 'notes',
+]
+
+# 合規紀錄所關聯的設備 (於同一批次中剛新增或更新的設備)
+EQUIPMENT_ID_SQL = """(
+    SELECT e.id FROM "DormitoryEquipment" e
+    WHERE e.dorm_id = s.dorm_id AND e.equipment_name = s.equipment_name
+      AND COALESCE(e.location, '') = COALESCE(s.location, '')
+    ORDER BY e.id DESC LIMIT 1
+)"""
+
+EQUIPMENT_IMPORT = {
+    'label': '設備',
+    'fields': [
+        ('dorm_id', bulk_import.dorm(missing="宿舍地址為必填欄位")),
+        ('equipment_name', bulk_import.text('設備名稱', required="設備名稱為必填欄位")),
+        ('vendor_id', bulk_import.vendor('供應廠商', not_found="在廠商資料庫中找不到廠商: '{value}'，請先新增或確認名稱是否完全相符。")),
+        ('equipment_category', bulk_import.text('設備分類')),
+        ('location', bulk_import.text('位置')),
+        ('brand_model', bulk_import.text('品牌/型號')),
+        ('serial_number', bulk_import.text('序號/批號')),
+        ('purchase_cost', bulk_import.integer('採購金額')),
+        ('installation_date', bulk_import.day('安裝/啟用日期')),
+        ('maintenance_interval_months', bulk_import.integer('一般保養週期(月)')),
+        ('compliance_interval_months', bulk_import.integer('合規檢測週期(月)')),
+        ('last_maintenance_date', bulk_import.day('上次保養日期')),
+        ('next_maintenance_date', bulk_import.day('下次保養/檢查日期')),
+        ('status', bulk_import.text('狀態', default='正常')),
+        ('notes', bulk_import.text('備註')),
+        # 首次合規檢測 (選填)：建立合規紀錄，有費用時一併建立年度費用
+        ('first_compliance_date', bulk_import.day('首次合規檢測日期')),
+        ('compliance_month', bulk_import.month('首次合規檢測日期')),
+        ('compliance_cost', bulk_import.integer('首次合規檢測費用')),
+        ('record_type', bulk_import.computed('TEXT', _equipment_record_types)),
+        ('compliance_item', bulk_import.computed('TEXT', _equipment_compliance_items)),
+        ('compliance_details', bulk_import.json_object([
+            ('declaration_item', bulk_import.computed('TEXT', _equipment_compliance_items)),
+            ('certificate_date', bulk_import.day('首次合規檢測日期')),
+            ('next_declaration_start', bulk_import.day('下次合規檢測日期')),
+        ])),
+    ],
+    'unique': ['dorm_id', 'equipment_name', 'location'],
+    'allocate': {'compliance_record_id': 'ComplianceRecords'},
+    'targets': [
+        {'table': 'DormitoryEquipment', 'mode': 'upsert', 'columns': EQUIPMENT_COLUMNS,
+         'key': ['dorm_id', 'equipment_name', "COALESCE(t.location, '') = COALESCE(s.location, '')"]},
+        {'table': 'ComplianceRecords', 'mode': 'insert', 'where': 's.first_compliance_date IS NOT NULL',
+         'columns': {'id': 's.compliance_record_id', 'dorm_id': 's.dorm_id', 'equipment_id': EQUIPMENT_ID_SQL,
+                     'record_type': 's.record_type', 'details': 's.compliance_details'}},
+        {'table': 'AnnualExpenses', 'mode': 'insert', 'where': 's.first_compliance_date IS NOT NULL AND s.compliance_cost > 0',
+         'columns': {'dorm_id': 's.dorm_id', 'expense_item': 's.compliance_item', 'payment_date': 's.first_compliance_date',
+                     'total_amount': 's.compliance_cost', 'amortization_start_month': 's.compliance_month',
+                     'amortization_end_month': 's.compliance_month', 'compliance_record_id': 's.compliance_record_id'}},
+    ],
+}
+
 def batch_import_equipment(df: pd.DataFrame):
     """
-    【v2.0 廠商關聯版】批次匯入【設備】的核心邏輯。
-    可同時建立設備、採購費用、首次合規紀錄，並關聯供應廠商。
-    """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # --- 【核心修改 1】預先載入所有需要的資料以供比對 ---
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            equip_df = _execute_query_to_dataframe(conn, 'SELECT id, dorm_id, equipment_name, location FROM "DormitoryEquipment"')
-            equip_map = {(row['dorm_id'], row['equipment_name'], str(row['location'] or '')): row['id'] for _, row in equip_df.iterrows()}
-
-            vendors_df = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name FROM "Vendors"')
-            vendor_map = {v['vendor_name']: v['id'] for _, v in vendors_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    original_address = row.get('宿舍地址')
-                    if pd.isna(original_address) or not str(original_address).strip():
-                        raise ValueError("宿舍地址為必填欄位")
-
-                    addr_stripped = str(original_address).strip()
-                    dorm_id = original_addr_map.get(addr_stripped) or normalized_addr_map.get(normalize_taiwan_address(addr_stripped)['full'])
-                    
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: {original_address}")
-
-                    equipment_name = row.get('設備名稱')
-                    if pd.isna(equipment_name) or not str(equipment_name).strip():
-                        raise ValueError("設備名稱為必填欄位")
-                    
-                    # --- 【核心修改 2】處理供應廠商欄位 ---
-                    vendor_id = None
-                    vendor_name = row.get('供應廠商')
-                    if pd.notna(vendor_name) and str(vendor_name).strip():
-                        vendor_name_stripped = str(vendor_name).strip()
-                        vendor_id = vendor_map.get(vendor_name_stripped)
-                        if not vendor_id:
-                            raise ValueError(f"在廠商資料庫中找不到廠商: '{vendor_name_stripped}'，請先新增或確認名稱是否完全相符。")
-
-                    def to_int_or_none(val):
-                        if pd.isna(val) or val == '': return None
-                        return int(val)
-                    
-                    def to_date_or_none(val):
-                        if pd.isna(val): return None
-                        return pd.to_datetime(val).date()
-
-                    details = {
-                        "dorm_id": dorm_id,
-                        "vendor_id": vendor_id, # 將 vendor_id 加入
-                        "equipment_name": str(equipment_name).strip(),
-                        "equipment_category": str(row.get('設備分類', '')).strip() or None,
-                        "location": str(row.get('位置', '')).strip() or None,
-                        "brand_model": str(row.get('品牌/型號', '')).strip() or None,
-                        "serial_number": str(row.get('序號/批號', '')).strip() or None,
-                        "purchase_cost": to_int_or_none(row.get('採購金額')),
-                        "installation_date": to_date_or_none(row.get('安裝/啟用日期')),
-                        "maintenance_interval_months": to_int_or_none(row.get('一般保養週期(月)')),
-                        "compliance_interval_months": to_int_or_none(row.get('合規檢測週期(月)')),
-                        "last_maintenance_date": to_date_or_none(row.get('上次保養日期')),
-                        "next_maintenance_date": to_date_or_none(row.get('下次保養/檢查日期')),
-                        "status": str(row.get('狀態', '正常')).strip(),
-                        "notes": str(row.get('備註', '')).strip() or None
-                    }
-
-                    lookup_key = (dorm_id, details['equipment_name'], details['location'] or '')
-                    existing_id = equip_map.get(lookup_key)
-                    
-                    new_equipment_id = None
-                    if existing_id:
-                        fields = ', '.join([f'"{key}" = %s' for key in details.keys()])
-                        values = list(details.values()) + [existing_id]
-                        update_sql = f'UPDATE "DormitoryEquipment" SET {fields} WHERE id = %s'
-                        cursor.execute(update_sql, tuple(values))
-                        new_equipment_id = existing_id
-                    else:
-                        columns = ', '.join(f'"{k}"' for k in details.keys())
-                        placeholders = ', '.join(['%s'] * len(details))
-                        insert_sql = f'INSERT INTO "DormitoryEquipment" ({columns}) VALUES ({placeholders}) RETURNING id'
-                        cursor.execute(insert_sql, tuple(details.values()))
-                        new_equipment_id = cursor.fetchone()['id']
-                    
-                    first_compliance_date = to_date_or_none(row.get('首次合規檢測日期'))
-                    compliance_cost = to_int_or_none(row.get('首次合規檢測費用'))
-
-                    if first_compliance_date:
-                        record_type = f"{details['equipment_category']}檢測" if details['equipment_category'] else "合規檢測"
-                        record_details = {
-                            "dorm_id": dorm_id, "equipment_id": new_equipment_id,
-                            "details": {
-                                "declaration_item": f"首次{record_type}",
-                                "certificate_date": first_compliance_date,
-                                "next_declaration_start": to_date_or_none(row.get('下次合規檢測日期'))
-                            }
-                        }
-                        expense_details = None
-                        if compliance_cost and compliance_cost > 0:
-                            expense_details = {
-                                "dorm_id": dorm_id, "expense_item": f"首次{record_type}",
-                                "payment_date": first_compliance_date, "total_amount": compliance_cost,
-                                "amortization_start_month": first_compliance_date.strftime('%Y-%m'),
-                                "amortization_end_month": first_compliance_date.strftime('%Y-%m')
-                            }
-                        
-                        comp_success, comp_message, _ = finance_model.add_compliance_record(record_type, record_details, expense_details)
-                        if not comp_success:
-                             raise Exception(f"設備已處理，但建立首次合規紀錄失敗: {comp_message}")
-                    
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-        
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入設備時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
+    【v3.0 批次版】批次匯入【設備】的核心邏輯。
+    同一宿舍、設備名稱與位置視為同一台設備 (有就更新，沒有就新增)，並關聯供應廠商；
+    有填寫首次合規檢測日期時，一併建立合規紀錄與檢測費用。
+    """
+    result = bulk_import.run_import(df, EQUIPMENT_IMPORT)
+    return result['success'], result['failed']
+
+INVOICE_INFO_IMPORT = {
+    'label': '發票資訊',
+    'fields': [
+        ('dorm_id', bulk_import.dorm(not_found="在資料庫中找不到對應的宿舍地址: '{value}'")),
+        ('invoice_info', bulk_import.text('發票抬頭/統編', default='')),
+    ],
+    'unique': ['dorm_id'],
+    'targets': [
+        {'table': 'Dormitories', 'mode': 'update', 'columns': ['invoice_info'], 'key': ['t.id = s.dorm_id'],
+         'not_found': "在資料庫中找不到對應的宿舍 ID: {dorm_id}"},
+    ],
+}
 
 def batch_import_invoice_info(df: pd.DataFrame):
     """
     批次匯入或更新宿舍的發票資訊。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # 預載現有宿舍資料以供比對
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    address = row.get('宿舍地址')
-                    invoice_info = row.get('發票抬頭/統編')
-                    
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-                    
-                    dorm_id = None
-                    addr_stripped = str(address).strip()
-                    
-                    # 優先比對原始地址
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    # 若找不到，再嘗試比對正規化後的地址
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: '{addr_stripped}'")
-
-                    # 執行更新
-                    update_sql = 'UPDATE "Dormitories" SET "invoice_info" = %s WHERE id = %s'
-                    cursor.execute(update_sql, (str(invoice_info or '').strip(), dorm_id))
-                    
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入發票資訊時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
-
-# in data_models/importer_model.py
+    result = bulk_import.run_import(df, INVOICE_INFO_IMPORT)
+    return result['success'], result['failed']
+
+LANDLORD_INFO_IMPORT = {
+    'label': '房東資訊',
+    'fields': [
+        ('dorm_id', bulk_import.dorm(not_found="在資料庫中找不到對應的宿舍地址: '{value}'")),
+        # 只比對服務項目為 "房東" 的廠商；未填寫時清除宿舍的房東
+        ('landlord_id', bulk_import.vendor('房東', category='房東', not_found="在廠商資料中找不到服務項目為 '房東' 且名稱為 '{value}' 的紀錄。")),
+    ],
+    'unique': ['dorm_id'],
+    'targets': [
+        {'table': 'Dormitories', 'mode': 'update', 'columns': ['landlord_id'], 'key': ['t.id = s.dorm_id'],
+         'not_found': "在資料庫中找不到對應的宿舍 ID: {dorm_id}"},
+    ],
+}
 
 def batch_import_landlord_info(df: pd.DataFrame):
     """
     批次匯入或更新宿舍與房東的關聯。
     """
-    success_count = 0
-    failed_records = []
-    conn = database.get_db_connection()
-    if not conn:
-        error_df = df.copy()
-        error_df['錯誤原因'] = "無法連接到資料庫"
-        return 0, error_df
-
-    try:
-        with conn.cursor() as cursor:
-            # 預載宿舍和房東(Vendors)資料以供比對
-            dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address, normalized_address FROM "Dormitories"')
-            original_addr_map = {d['original_address']: d['id'] for _, d in dorms_df.iterrows()}
-            normalized_addr_map = {d['normalized_address']: d['id'] for _, d in dorms_df.iterrows()}
-            
-            # 只載入服務項目為 "房東" 的廠商
-            vendors_df = _execute_query_to_dataframe(conn, 'SELECT id, vendor_name FROM "Vendors" WHERE service_category = %s', ('房東',))
-            vendor_map = {v['vendor_name']: v['id'] for _, v in vendors_df.iterrows()}
-
-            for index, row in df.iterrows():
-                try:
-                    address = row.get('宿舍地址')
-                    landlord_name = row.get('房東')
-                    
-                    if not address or pd.isna(address):
-                        raise ValueError("宿舍地址為空")
-                    
-                    # 查找宿舍 ID
-                    dorm_id = None
-                    addr_stripped = str(address).strip()
-                    if addr_stripped in original_addr_map:
-                        dorm_id = original_addr_map[addr_stripped]
-                    else:
-                        normalized_input = normalize_taiwan_address(addr_stripped)['full']
-                        if normalized_input in normalized_addr_map:
-                            dorm_id = normalized_addr_map[normalized_input]
-
-                    if not dorm_id:
-                        raise ValueError(f"在資料庫中找不到對應的宿舍地址: '{addr_stripped}'")
-
-                    # 查找房東 ID
-                    landlord_id = None
-                    if pd.notna(landlord_name) and str(landlord_name).strip():
-                        landlord_name_stripped = str(landlord_name).strip()
-                        landlord_id = vendor_map.get(landlord_name_stripped)
-                        if not landlord_id:
-                            raise ValueError(f"在廠商資料中找不到服務項目為 '房東' 且名稱為 '{landlord_name_stripped}' 的紀錄。")
-                    
-                    # 執行更新
-                    update_sql = 'UPDATE "Dormitories" SET "landlord_id" = %s WHERE id = %s'
-                    cursor.execute(update_sql, (landlord_id, dorm_id))
-                    
-                    success_count += 1
-                except Exception as row_error:
-                    row['錯誤原因'] = str(row_error)
-                    failed_records.append(row)
-
-        conn.commit()
-    except Exception as e:
-        if conn: conn.rollback()
-        print(f"批次匯入房東資訊時發生嚴重錯誤: {e}")
-    finally:
-        if conn: conn.close()
-            
-    return success_count, pd.DataFrame(failed_records)
\ No newline at end of file
+    result = bulk_import.run_import(df, LANDLORD_INFO_IMPORT)
+    return result['success'], result['failed']
@@ -0,0 +1,98 @@
+# data_models/interval_engine.py
+# 住宿區間的聯集與重疊天數計算 (以 NumPy 整欄運算，取代逐日加入 set 的寫法)。
+# 日期一律轉為「自 1970-01-01 起的天數」整數，區間為頭尾皆含的 [start, end]；
+# 未離住 (end_date 為空) 視為住到 9999-12-31。
+#
+#   merge_intervals(df, keys)          將同一 key (例如同一位員工) 的多段住宿合併為不重疊、依序排列的區間
+#                                      (同日換房/換床的重疊或相鄰區間會合併，不會重複計算天數)
+#   overlap_days(intervals, windows)   每個 key 在每個計算區間 (帳單期間、報表區間) 內的實際居住天數；
+#                                      以 on 指定分組欄位 (例如報表編號) 時，可一次計算多組帳單
+#   prorate(amounts, days, totals)     依天數比例分攤金額
+
+import numpy as np
+import pandas as pd
+
+OPEN_END = np.datetime64('9999-12-31', 'D').astype(np.int64)
+
+def to_days(values, fill=None) -> np.ndarray:
+    """
+    將日期 (date、Timestamp、'YYYY-MM-DD' 字串或 datetime64) 轉為天數整數陣列。
+    空值以 fill (天數整數) 取代；未提供 fill 時空值會變成極小的整數，呼叫端需自行排除。
+    """
+    if isinstance(values, (pd.Series, pd.Index)):
+        values = values.tolist()
+    dates = np.array(values, dtype='datetime64[D]')
+    days = dates.astype(np.int64)
+    if fill is not None:
+        days = np.where(np.isnat(dates), fill, days)
+    return days
+
+def from_days(days) -> np.ndarray:
+    """天數整數陣列轉回 datetime64[D]。"""
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]')
+
+def merge_intervals(frame: pd.DataFrame, keys: list, start: str = 'start_date', end: str = 'end_date') -> pd.DataFrame:
+    """
+    依 keys 分組，將每組的 [start, end] 區間合併為不重疊的區間 (重疊或相鄰即合併)。
+    回傳欄位：keys + start, end (天數整數)，依 keys、start 排序。起日晚於迄日的區間會被忽略。
+    """
+    columns = list(keys) + ['start', 'end']
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+
+    starts = to_days(frame[start])
+    ends = to_days(frame[end], fill=OPEN_END)
+    codes = frame.groupby(list(keys), sort=True, dropna=False).ngroup().to_numpy()
+
+    valid = starts <= ends
+    starts, ends, codes, rows = starts[valid], ends[valid], codes[valid], np.flatnonzero(valid)
+    if len(rows) == 0:
+        return pd.DataFrame(columns=columns)
+
+    order = np.lexsort((starts, codes))
+    starts, ends, codes, rows = starts[order], ends[order], codes[order], rows[order]
+
+    # 每組內「目前為止最晚的迄日」：把組別編號乘上足夠大的倍數後做累積最大值，數值就不會跨組
+    base = min(starts.min(), ends.min())
+    span = int(ends.max() - base) + 2
+    running_end = np.maximum.accumulate(codes * span + (ends - base)) - codes * span + base
+
+    new_block = np.ones(len(starts), dtype=bool)
+    new_block[1:] = (codes[1:] != codes[:-1]) | (starts[1:] > running_end[:-1] + 1)
+    block_starts = np.flatnonzero(new_block)
+
+    merged = frame.iloc[rows[block_starts]][list(keys)].reset_index(drop=True)
+    merged['start'] = starts[block_starts]
+    merged['end'] = np.maximum.reduceat(ends, block_starts)
+    return merged
+
+def overlap_days(intervals: pd.DataFrame, windows: pd.DataFrame, keys: list, on: list = None) -> pd.DataFrame:
+    """
+    計算每個 key 在每個計算區間內的居住天數。
+    intervals 為 merge_intervals 的結果；windows 需含 window (區間編號)、window_start、window_end (天數整數)。
+    on 為兩者共有的分組欄位：只有同組的住宿與區間才配對 (一次計算多份報表)；未指定時全部配對。
+    回傳欄位：(on +) keys + window, days，包含天數為 0 的配對。
+    """
+    on = list(on or [])
+    group_columns = on + [k for k in keys if k not in on] + ['window']
+    if intervals.empty or windows.empty:
+        return pd.DataFrame(columns=group_columns + ['days'])
+
+    window_columns = on + ['window', 'window_start', 'window_end']
+    if on:
+        pairs = intervals.merge(windows[window_columns], on=on, how='inner')
+    else:
+        pairs = intervals.merge(windows[window_columns], how='cross')
+
+    lo = np.maximum(pairs['start'].to_numpy(np.int64), pairs['window_start'].to_numpy(np.int64))
+    hi = np.minimum(pairs['end'].to_numpy(np.int64), pairs['window_end'].to_numpy(np.int64))
+    pairs['days'] = np.clip(hi - lo + 1, 0, None)
+    return pairs.groupby(group_columns, sort=False, dropna=False)['days'].sum().reset_index()
+
+def prorate(amounts, days, totals) -> np.ndarray:
+    """依 days / totals 的比例分攤 amounts (逐元素)；totals 為 0 的項目分攤為 0。"""
+    amounts = np.asarray(amounts, dtype=float)
+    days = np.asarray(days, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, days * (amounts / totals), 0.0)
@@ -0,0 +1,177 @@
+# data_models/occupancy_index.py
+# 房間住宿狀況的共用索引：空床位搜尋、床位報表與住宿總覽不必各自以 DISTINCT ON 重新推導「目前住誰」。
+# 一次載入所有房間，以及「今天 (含) 之後仍有效」的住宿紀錄 (數量約等於在住人數)，之後：
+#   stays_on(day)        該日在住的住宿紀錄 (每筆住宿一列，含移工姓名、性別、國籍、雇主、床位)
+#   room_occupancy(day)  每個房間一列：在住人數、性別、住戶摘要、剩餘床位
+# 查詢日期在今天 (含) 之後時直接由快取計算；更早的日期改為即時查詢資料庫 (不快取)。
+#
+# 快取在同一行程中共用：新增、修改、刪除住宿紀錄、移工或房間的函式需呼叫 invalidate()。
+# 其他行程 (例如排程同步) 的寫入由 CACHE_TTL 兜底；跨日後也會自動重新載入。
+
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+import psycopg2.extensions
+
+import database
+
+# 快取索引的最長使用時間 (秒)
+CACHE_TTL = 60
+UNASSIGNED_ROOM = '[未分配房間]'
+
+ROOMS_QUERY = """
+    SELECT
+        r.id AS room_id, r.dorm_id, r.room_number, r.capacity,
+        r.gender_policy, r.nationality_policy, r.room_notes, r.area_sq_meters,
+        d.original_address, d.city, d.district, d.primary_manager
+    FROM "Rooms" r
+    JOIN "Dormitories" d ON r.dorm_id = d.id
+"""
+
+STAYS_QUERY = """
+    SELECT
+        ah.id AS stay_id, ah.room_id, ah.worker_unique_id,
+        ah.start_date, ah.end_date, ah.bed_number,
+        w.worker_name, w.gender, w.nationality, w.employer_name,
+        w.special_status, w.accommodation_end_date
+    FROM "AccommodationHistory" ah
+    JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
+    WHERE ah.room_id IS NOT NULL
+      AND (ah.end_date IS NULL OR ah.end_date >= %(day)s)
+"""
+
+_lock = threading.Lock()
+_cached_index = None
+
+def _execute_query_to_dataframe(conn, query, params=None):
+    """一個輔助函式，用來手動執行查詢並回傳 DataFrame (使用回傳 tuple 的一般游標，大量列時較快)。"""
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute(query, params)
+        records = cursor.fetchall()
+        if not records:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            return pd.DataFrame([], columns=columns)
+
+        columns = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(records, columns=columns)
+
+def _load_stays(conn, day: date) -> pd.DataFrame:
+    stays = _execute_query_to_dataframe(conn, STAYS_QUERY, {'day': day})
+    for column in ['start_date', 'end_date', 'accommodation_end_date']:
+        stays[column] = pd.to_datetime(stays[column])
+    return stays.sort_values('stay_id', kind='stable').reset_index(drop=True)
+
+def load_index(conn, day: date = None) -> dict:
+    """從資料庫載入房間與 day (預設今天) 之後仍有效的住宿紀錄 (不經過快取)。"""
+    day = day or date.today()
+    return {
+        'built_at': time.monotonic(),
+        'as_of': day,
+        'rooms': _execute_query_to_dataframe(conn, ROOMS_QUERY),
+        'stays': _load_stays(conn, day),
+        'summaries': {},
+    }
+
+def _with_connection(func):
+    conn = database.get_db_connection()
+    if not conn:
+        return None
+    try:
+        return func(conn)
+    finally:
+        conn.close()
+
+def get_index(conn=None, force_reload: bool = False) -> dict:
+    """
+    取得快取的索引；尚未建立、已逾時、已跨日或 force_reload 時重新載入 (未提供 conn 時自行連線)。
+    無法連線時回傳 None。
+    """
+    global _cached_index
+    with _lock:
+        index = _cached_index
+    stale = (index is None or index['as_of'] != date.today()
+             or time.monotonic() - index['built_at'] > CACHE_TTL)
+    if force_reload or stale:
+        index = load_index(conn) if conn else _with_connection(load_index)
+        if index is None:
+            return None
+        with _lock:
+            _cached_index = index
+    return index
+
+def invalidate():
+    """清除快取的索引。異動住宿紀錄、移工資料 (姓名、性別、狀態等) 或房間 (容量、性別政策) 後呼叫。"""
+    global _cached_index
+    with _lock:
+        _cached_index = None
+
+def _source(day: date, conn=None):
+    """回傳 (房間, 住宿紀錄)：今天 (含) 之後的日期用快取，更早的日期即時查詢。"""
+    index = get_index(conn)
+    if index is None:
+        return None, None
+    if day >= index['as_of']:
+        return index['rooms'], index['stays']
+    stays = _load_stays(conn, day) if conn else _with_connection(lambda c: _load_stays(c, day))
+    return index['rooms'], stays
+
+def stays_on(day: date = None, conn=None, end_inclusive: bool = True) -> pd.DataFrame:
+    """
+    day 當天在住的住宿紀錄 (起始日 <= day，且退宿日為空或 >= day)。
+    end_inclusive=False 時退宿當天不算在住 (退宿日 > day)。
+    """
+    day = day or date.today()
+    _, stays = _source(day, conn)
+    if stays is None:
+        return pd.DataFrame()
+    target = pd.Timestamp(day)
+    ended = stays['end_date'] >= target if end_inclusive else stays['end_date'] > target
+    return stays[(stays['start_date'] <= target) & (stays['end_date'].isna() | ended)]
+
+def summarize_rooms(rooms: pd.DataFrame, stays: pd.DataFrame) -> pd.DataFrame:
+    """
+    依住宿紀錄彙總每個房間：headcount (在住筆數)、genders (出現過的性別，依住宿順序)、
+    has_male / has_female、occupants (「雇主-國籍(性別)」以逗號串接)、open_beds (容量 - 在住人數)。
+    """
+    summary = rooms.copy()
+    room_ids = stays['room_id']
+    labels = (stays['employer_name'].astype(str) + '-' + stays['nationality'].astype(str)
+              + '(' + stays['gender'].astype(str) + ')')
+    distinct_genders = stays.drop_duplicates(['room_id', 'gender'])
+    per_room = pd.DataFrame({
+        'headcount': room_ids.groupby(room_ids, sort=False).size(),
+        'genders': distinct_genders.groupby('room_id', sort=False)['gender'].agg(list),
+        'has_male': (stays['gender'] == '男').groupby(room_ids, sort=False).any(),
+        'has_female': (stays['gender'] == '女').groupby(room_ids, sort=False).any(),
+        'occupants': labels.groupby(room_ids, sort=False).agg(', '.join),
+    })
+    summary = summary.merge(per_room, left_on='room_id', right_index=True, how='left')
+    summary['headcount'] = summary['headcount'].fillna(0).astype(int)
+    summary['genders'] = summary['genders'].map(lambda value: value if isinstance(value, list) else [])
+    summary['occupants'] = summary['occupants'].fillna('')
+    summary['has_male'] = summary['has_male'].eq(True)
+    summary['has_female'] = summary['has_female'].eq(True)
+    summary['open_beds'] = pd.to_numeric(summary['capacity'], errors='coerce').fillna(0).astype(int) - summary['headcount']
+    return summary
+
+def room_occupancy(day: date = None, conn=None) -> pd.DataFrame:
+    """
+    每個房間在 day (預設今天) 的住宿狀況 (欄位見 summarize_rooms，另含房間與宿舍資料)。
+    快取範圍內的日期會保留計算結果，同一天重複查詢不需重新彙總。
+    """
+    day = day or date.today()
+    index = get_index(conn)
+    if index is None:
+        return pd.DataFrame()
+    if day >= index['as_of']:
+        with _lock:
+            cached = index['summaries'].get(day)
+        if cached is not None:
+            return cached.copy()
+    summary = summarize_rooms(index['rooms'], stays_on(day, conn))
+    if day >= index['as_of']:
+        with _lock:
+            index['summaries'][day] = summary
+    return summary.copy()
@@ -1,8 +1,15 @@
 # /data_models/placement_model.py
 
 import pandas as pd
-import database
+from collections import Counter
 from datetime import date # 引入 date 模組
+from . import occupancy_index
+from . import room_assignment_model
+
+# 各性別可入住的房間性別政策
+GENDER_POLICY_OPTIONS = {'女': ['僅限女性', '可混住'], '男': ['僅限男性', '可混住']}
+OPPOSITE_GENDER = {'女': '男', '男': '女'}
+SINGLE_NATIONALITY_POLICY = '單一國籍'
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -12,135 +19,355 @@ def _execute_query_to_dataframe(conn, query, params=None):
         if not records:
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
             return pd.DataFrame([], columns=columns)
-        
+
         columns = [desc[0] for desc in cursor.description]
         return pd.DataFrame(records, columns=columns)
 
+def _filter_rooms(rooms_df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """我司管理、容量大於 0 的正式房間，並套用 宿舍ID、縣市、區域 的混合篩選 (OR 邏輯)。"""
+    rooms_df = rooms_df[
+        (rooms_df['primary_manager'] == '我司')
+        & (pd.to_numeric(rooms_df['capacity'], errors='coerce') > 0)
+        & (rooms_df['room_number'] != occupancy_index.UNASSIGNED_ROOM)
+    ]
+
+    dorm_ids = filters.get("dorm_ids")
+    cities = filters.get("cities")
+    districts = filters.get("districts")
+
+    # --- 動態篩選條件 (OR 邏輯) ---
+    # 邏輯：如果有選任何條件，則列出 (符合宿舍ID OR 符合縣市 OR 符合區域) 的房間
+    # 如果都沒選，則列出全部
+    if dorm_ids or cities or districts:
+        matched = pd.Series(False, index=rooms_df.index)
+        if dorm_ids:
+            matched |= rooms_df['dorm_id'].isin(list(dorm_ids))
+        if cities:
+            matched |= rooms_df['city'].isin(list(cities))
+        if districts:
+            matched |= rooms_df['district'].isin(list(districts))
+        rooms_df = rooms_df[matched]
+    return rooms_df
+
 def find_available_rooms(filters: dict):
     """
-    【v2.2 區域篩選 & 容量過濾版】根據篩選條件查找空床位。
+    【v3.0 住宿索引版】根據篩選條件查找空床位。
     1. 排除 capacity = 0 的房間。
     2. 支援 宿舍ID、縣市、區域 的混合篩選 (邏輯為 OR，只要符合其中一項條件即列出)。
+    各房間的在住人數、性別與住戶摘要由 occupancy_index 一次彙總 (同一天的查詢共用快取)，
+    性別是否適合以整欄條件判斷，不再逐房間篩選住戶。
     """
     gender_to_place = filters.get("gender")
     query_date = filters.get("query_date", date.today())
-    
-    # 取得篩選條件
-    dorm_ids = filters.get("dorm_ids")
-    cities = filters.get("cities")
-    districts = filters.get("districts")
 
     if not gender_to_place:
         return pd.DataFrame()
 
-    conn = database.get_db_connection()
-    if not conn: return pd.DataFrame()
-    try:
-        # 步驟 1: 查詢所有符合條件的房間
-        base_query = """
-            SELECT
-                r.id as room_id, d.original_address, r.room_number,
-                r.capacity, r.gender_policy, r.nationality_policy, r.room_notes,
-                d.city, d.district
-            FROM "Rooms" r
-            JOIN "Dormitories" d ON r.dorm_id = d.id
-            WHERE d.primary_manager = '我司'
-              AND r.capacity > 0 -- 【核心修改】排除容量為 0 的房間 (如停車場)
-        """
-        params = []
-        
-        # --- 構建動態篩選條件 (OR 邏輯) ---
-        # 邏輯：如果有選任何條件，則列出 (符合宿舍ID OR 符合縣市 OR 符合區域) 的房間
-        # 如果都沒選，則列出全部
-        conditions = []
-        
-        if dorm_ids:
-            conditions.append("d.id = ANY(%s)")
-            params.append(list(dorm_ids))
-            
-        if cities:
-            conditions.append("d.city = ANY(%s)")
-            params.append(list(cities))
-            
-        if districts:
-            conditions.append("d.district = ANY(%s)")
-            params.append(list(districts))
-            
-        if conditions:
-            base_query += " AND (" + " OR ".join(conditions) + ")"
-        # ----------------------------------
-
-        rooms_df = _execute_query_to_dataframe(conn, base_query, tuple(params))
-        if rooms_df.empty:
-            return pd.DataFrame()
-
-        # 步驟 2: 查詢當下的佔用狀況 (維持不變)
-        # 為了效能，我們只查詢上述房間內的住戶
-        target_room_ids = rooms_df['room_id'].tolist()
-        
-        workers_query = """
-            SELECT 
-                ah.room_id, 
-                w.employer_name, 
-                w.nationality, 
-                w.gender 
-            FROM "AccommodationHistory" ah
-            JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
-            WHERE 
-                ah.room_id = ANY(%s)
-                AND ah.start_date <= %s
-                AND (ah.end_date IS NULL OR ah.end_date >= %s)
-        """
-        workers_df = _execute_query_to_dataframe(conn, workers_query, (target_room_ids, query_date, query_date))
-        
-        # 後續 Pandas 計算邏輯維持不變
-        if not workers_df.empty:
-            occupancy = workers_df.groupby('room_id').size().rename('current_occupants')
-            rooms_df = rooms_df.merge(occupancy, left_on='room_id', right_index=True, how='left')
-        else:
-            rooms_df['current_occupants'] = 0
-
-        rooms_df['current_occupants'] = rooms_df['current_occupants'].fillna(0).astype(int)
-        
-        rooms_df['vacancies'] = rooms_df['capacity'] - rooms_df['current_occupants']
-        available_rooms_df = rooms_df[rooms_df['vacancies'] > 0].copy()
-        
-        if not workers_df.empty:
-            room_gender_info = workers_df.groupby('room_id')['gender'].unique().apply(list).rename('current_genders')
-            available_rooms_df = available_rooms_df.merge(room_gender_info, on='room_id', how='left')
-        else:
-            available_rooms_df['current_genders'] = [[] for _ in range(len(available_rooms_df))]
-        
-        available_rooms_df['current_genders'] = available_rooms_df['current_genders'].apply(lambda d: d if isinstance(d, list) else [])
-
-        suitable_rooms = []
-        for _, room in available_rooms_df.iterrows():
-            is_suitable = False
-            current_genders = room.get('current_genders', [])
-
-            if not current_genders: 
-                 is_suitable = True
-            elif gender_to_place == '女':
-                if '男' not in current_genders and room['gender_policy'] in ['僅限女性', '可混住']:
-                    is_suitable = True
-            elif gender_to_place == '男':
-                if '女' not in current_genders and room['gender_policy'] in ['僅限男性', '可混住']:
-                    is_suitable = True
-
-            if is_suitable:
-                current_occupants_list = workers_df[workers_df['room_id'] == room['room_id']]
-                occupant_details = ", ".join([f"{w['employer_name']}-{w['nationality']}({w['gender']})" for _, w in current_occupants_list.iterrows()]) or "無 (空房)"
-                suitable_rooms.append({
-                    "宿舍地址": room['original_address'], 
-                    "縣市": room['city'],      # 顯示縣市
-                    "區域": room['district'],  # 顯示區域
-                    "房號": room['room_number'],
-                    "空床位數": room['vacancies'], 
-                    "房間性別政策": room['gender_policy'],
-                    "房內現住人員": occupant_details, 
-                    "房間備註": room['room_notes']
-                })
-        
-        return pd.DataFrame(suitable_rooms)
-    finally:
-        if conn: conn.close()
\ No newline at end of file
+    rooms_df = occupancy_index.room_occupancy(query_date)
+    if rooms_df.empty:
+        return pd.DataFrame()
+    rooms_df = _filter_rooms(rooms_df, filters)
+
+    # 有空床位，且 (空房，或房內沒有異性且房間政策允許)
+    opposite = {'女': 'has_male', '男': 'has_female'}
+    suitable = rooms_df['headcount'] == 0
+    if gender_to_place in opposite:
+        suitable |= ~rooms_df[opposite[gender_to_place]] & rooms_df['gender_policy'].isin(GENDER_POLICY_OPTIONS[gender_to_place])
+    suitable_rooms = rooms_df[(rooms_df['open_beds'] > 0) & suitable]
+    if suitable_rooms.empty:
+        return pd.DataFrame()
+
+    suitable_rooms = suitable_rooms.sort_values(['original_address', 'room_number'], kind='stable')
+    return pd.DataFrame({
+        "宿舍地址": suitable_rooms['original_address'],
+        "縣市": suitable_rooms['city'],      # 顯示縣市
+        "區域": suitable_rooms['district'],  # 顯示區域
+        "房號": suitable_rooms['room_number'],
+        "空床位數": suitable_rooms['open_beds'],
+        "房間性別政策": suitable_rooms['gender_policy'],
+        "房內現住人員": suitable_rooms['occupants'].where(suitable_rooms['occupants'] != '', "無 (空房)"),
+        "房間備註": suitable_rooms['room_notes'],
+    }).reset_index(drop=True)
+
+# ---------------------------------------------------------------------------
+# 批次安排床位
+# ---------------------------------------------------------------------------
+# 一次為一批新進人員 (通常 20~60 人) 排出完整的房間分配：
+#   1. 貪婪排入：依「雇主+性別」分組，大組先排。keep_employer_together 時整組優先放進
+#      同一間宿舍 (能整組容納的宿舍中剩餘床位最少者，即 best-fit)；每位人員優先選擇
+#      已有同雇主、同國籍的房間，再來是已有人住的房間 (保留空房給其他性別)，最後才開新房間；
+#      同條件下先用限定同性別的房間，可混住的房間留到最後。
+#   2. 修補：排不進去的人員，嘗試把擋住某個原本空房的「本批已排入人員」(異性或不同國籍)
+#      改排到其他房間，騰出該房間；所有被移動的人都有位置才採用，否則復原。
+# 已在住的人員不會被移動；計畫只涉及本批人員。
+
+def _build_room_states(rooms_df: pd.DataFrame, stays_df: pd.DataFrame) -> list:
+    """將房間彙總轉為可增減的狀態 (性別、國籍、雇主以 Counter 計數，方便修補時移出)。"""
+    stays_df = stays_df[stays_df['room_id'].isin(rooms_df['room_id'])]
+    by_room = {room_id: group for room_id, group in stays_df.groupby('room_id', sort=False)}
+    states = []
+    for room in rooms_df.itertuples(index=False):
+        residents = by_room.get(room.room_id)
+        has_residents = residents is not None and not residents.empty
+        states.append({
+            'room_id': room.room_id,
+            'dorm_id': room.dorm_id,
+            'address': room.original_address,
+            'room_number': room.room_number,
+            'gender_policy': room.gender_policy,
+            'nationality_policy': room.nationality_policy,
+            'open_beds': int(room.open_beds),
+            'residents': int(room.headcount),
+            'genders': Counter(residents['gender'].dropna()) if has_residents else Counter(),
+            'nationalities': Counter(residents['nationality'].dropna()) if has_residents else Counter(),
+            'employers': Counter(residents['employer_name'].dropna()) if has_residents else Counter(),
+            'planned': [],
+        })
+    return states
+
+def _room_accepts(room: dict, worker: dict, strict_gender_policy: bool) -> bool:
+    """房間目前 (含本批已排入的人員) 是否可再接受這位人員。"""
+    if room['open_beds'] <= 0:
+        return False
+    gender = worker['gender']
+    opposite = OPPOSITE_GENDER.get(gender)
+    # 未填性別的人員沒有「異性」，不做性別衝突檢查 (否則會和房內其他未填性別者互相排斥)
+    if opposite is not None and room['genders'][opposite] > 0:
+        return False
+    occupied = room['residents'] > 0 or room['planned']
+    policy_ok = room['gender_policy'] in GENDER_POLICY_OPTIONS.get(gender, ['可混住'])
+    # 與 find_available_rooms 相同：不強制性別政策時，空房不論政策皆可入住
+    if not policy_ok and (strict_gender_policy or occupied):
+        return False
+    if room['nationality_policy'] == SINGLE_NATIONALITY_POLICY:
+        nationalities = +room['nationalities']
+        if nationalities and worker['nationality'] not in nationalities:
+            return False
+    return True
+
+def _place(room: dict, worker: dict):
+    room['open_beds'] -= 1
+    room['genders'][worker['gender']] += 1
+    room['nationalities'][worker['nationality']] += 1
+    room['employers'][worker['employer_name']] += 1
+    room['planned'].append(worker)
+
+def _unplace(room: dict, worker: dict):
+    room['open_beds'] += 1
+    room['genders'][worker['gender']] -= 1
+    room['nationalities'][worker['nationality']] -= 1
+    room['employers'][worker['employer_name']] -= 1
+    room['planned'].remove(worker)
+
+def _room_rank(room: dict, worker: dict, remaining: int, dorm_rank: dict):
+    """
+    排序鍵 (越小越優先)：指定宿舍 → 同雇主 → 同國籍 → 已有人住 → 限定同性別的房間 (保留可混住的房間)
+    → 剛好放得下剩餘人數 (best-fit)。
+    """
+    occupied = room['residents'] > 0 or bool(room['planned'])
+    fits = room['open_beds'] >= remaining
+    return (
+        dorm_rank.get(room['dorm_id'], len(dorm_rank)),
+        room['employers'][worker['employer_name']] <= 0,
+        room['nationalities'][worker['nationality']] <= 0,
+        not occupied,
+        room['gender_policy'] not in GENDER_POLICY_OPTIONS.get(worker['gender'], [])[:1],
+        not fits,
+        room['open_beds'] if fits else -room['open_beds'],
+        room['address'] or '',
+        room['room_number'] or '',
+    )
+
+def _best_room(states: list, worker: dict, remaining: int, dorm_rank: dict, strict_gender_policy: bool, exclude=None):
+    candidates = [room for room in states if room is not exclude and _room_accepts(room, worker, strict_gender_policy)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda room: _room_rank(room, worker, remaining, dorm_rank))
+
+def _rank_dorms(states: list, worker: dict, size: int, strict_gender_policy: bool) -> dict:
+    """
+    整組同住時的宿舍優先順序：能整組容納的宿舍優先 (已有同雇主者優先，其次剩餘床位最少)，
+    其餘依可用床位多寡排列，放不下的人員依序溢出到下一間。
+    """
+    capacity, same_employer = Counter(), Counter()
+    for room in states:
+        if _room_accepts(room, worker, strict_gender_policy):
+            capacity[room['dorm_id']] += room['open_beds']
+        same_employer[room['dorm_id']] += room['employers'][worker['employer_name']]
+    ordered = sorted(
+        capacity,
+        key=lambda dorm_id: (
+            capacity[dorm_id] < size,
+            same_employer[dorm_id] <= 0,
+            capacity[dorm_id] if capacity[dorm_id] >= size else -capacity[dorm_id],
+            dorm_id,
+        )
+    )
+    return {dorm_id: rank for rank, dorm_id in enumerate(ordered)}
+
+def _repair(states: list, worker: dict, strict_gender_policy: bool) -> bool:
+    """
+    為排不進去的人員騰出房間：找一間沒有既有住戶、政策允許此人員、但被本批已排入人員擋住
+    (異性、不同國籍或已滿) 的房間，把擋住的人改排到其他房間。全部有位置才採用並回傳 True。
+    """
+    blocked_rooms = sorted(
+        (room for room in states if room['residents'] == 0 and room['planned']),
+        key=lambda room: (len(room['planned']), room['address'] or '', room['room_number'] or '')
+    )
+    for room in blocked_rooms:
+        # 騰空後的房間必須能接受此人員
+        if not _accepts_when_empty(room, worker, strict_gender_policy):
+            continue
+        conflicting = [p for p in room['planned'] if _conflicts(p, worker, room)]
+        movers = conflicting if conflicting else ([room['planned'][-1]] if room['open_beds'] <= 0 else [])
+        if not movers:
+            continue
+
+        for mover in movers:
+            _unplace(room, mover)
+        if not _room_accepts(room, worker, strict_gender_policy):
+            for mover in movers:
+                _place(room, mover)
+            continue
+        _place(room, worker)
+
+        moved = []
+        for mover in movers:
+            target = _best_room(states, mover, 1, {}, strict_gender_policy, exclude=room)
+            if target is None:
+                break
+            _place(target, mover)
+            moved.append((target, mover))
+        if len(moved) == len(movers):
+            for _, mover in moved:
+                mover['repaired'] = True
+            return True
+
+        # 復原
+        for target, mover in moved:
+            _unplace(target, mover)
+        _unplace(room, worker)
+        for mover in movers:
+            _place(room, mover)
+    return False
+
+def _accepts_when_empty(room: dict, worker: dict, strict_gender_policy: bool) -> bool:
+    if not strict_gender_policy:
+        return True
+    return room['gender_policy'] in GENDER_POLICY_OPTIONS.get(worker['gender'], ['可混住'])
+
+def _conflicts(placed: dict, worker: dict, room: dict) -> bool:
+    opposite = OPPOSITE_GENDER.get(worker['gender'])
+    if opposite is not None and opposite == placed['gender']:
+        return True
+    return room['nationality_policy'] == SINGLE_NATIONALITY_POLICY and placed['nationality'] != worker['nationality']
+
+def plan_batch_placement(workers_df: pd.DataFrame, constraints: dict):
+    """
+    為一批人員排出床位計畫 (不寫入資料庫)。
+    workers_df 需含 ah_id, worker_unique_id, worker_name, gender, nationality, employer_name
+    (即 room_assignment_model.get_unassigned_workers_for_placement 的結果)。
+    constraints:
+      query_date              以哪一天的在住狀況計算空床位 (預設今天)
+      dorm_ids/cities/districts  地點範圍 (OR 邏輯，同 find_available_rooms)
+      strict_gender_policy    是否嚴格遵守房間性別政策 (預設 True；False 時空房不論政策皆可入住)
+      keep_employer_together  同雇主、同性別的人員是否盡量排在同一間宿舍 (預設 True)
+    回傳 (plan_df, unplaced_df)。
+    """
+    plan_columns = ['ah_id', 'worker_unique_id', 'room_id', 'dorm_id', '姓名', '雇主', '性別', '國籍', '宿舍地址', '房號', '說明']
+    if workers_df is None or workers_df.empty:
+        return pd.DataFrame(columns=plan_columns), pd.DataFrame()
+
+    query_date = constraints.get("query_date") or date.today()
+    strict_gender_policy = constraints.get("strict_gender_policy", True)
+    keep_together = constraints.get("keep_employer_together", True)
+
+    rooms_df = occupancy_index.room_occupancy(query_date)
+    if rooms_df.empty:
+        return pd.DataFrame(columns=plan_columns), workers_df.assign(原因="找不到任何房間資料")
+    rooms_df = _filter_rooms(rooms_df, constraints)
+    rooms_df = rooms_df[rooms_df['open_beds'] > 0].sort_values(['original_address', 'room_number'], kind='stable')
+    states = _build_room_states(rooms_df, occupancy_index.stays_on(query_date))
+
+    workers = workers_df.to_dict('records')
+    for worker in workers:
+        for key in ['gender', 'nationality', 'employer_name']:
+            worker[key] = worker.get(key) if pd.notna(worker.get(key)) else None
+
+    # 依 雇主+性別 分組，大組先排；組內依國籍排序，讓同國籍的人連續入住同一房間
+    groups = {}
+    for worker in workers:
+        groups.setdefault((worker['employer_name'], worker['gender']), []).append(worker)
+    ordered_groups = sorted(groups.values(), key=lambda members: (-len(members), str(members[0]['employer_name']), str(members[0]['gender'])))
+
+    unplaced = []
+    for members in ordered_groups:
+        members = sorted(members, key=lambda w: str(w['nationality']))
+        dorm_rank = _rank_dorms(states, members[0], len(members), strict_gender_policy) if keep_together else {}
+        for position, worker in enumerate(members):
+            room = _best_room(states, worker, len(members) - position, dorm_rank, strict_gender_policy)
+            if room is None:
+                unplaced.append(worker)
+            else:
+                _place(room, worker)
+
+    # 修補：逐一為排不進去的人員騰出房間
+    still_unplaced = []
+    for worker in unplaced:
+        room = _best_room(states, worker, 1, {}, strict_gender_policy)
+        if room is not None:
+            _place(room, worker)
+        elif not _repair(states, worker, strict_gender_policy):
+            still_unplaced.append(worker)
+
+    plan = []
+    for room in states:
+        for worker in room['planned']:
+            notes = []
+            if room['residents'] == 0:
+                notes.append("原為空房")
+            if room['employers'][worker['employer_name']] > 1:
+                notes.append("與同雇主同住")
+            if worker.get('repaired'):
+                notes.append("經調整後排入")
+            plan.append({
+                'ah_id': worker['ah_id'],
+                'worker_unique_id': worker['worker_unique_id'],
+                'room_id': room['room_id'],
+                'dorm_id': room['dorm_id'],
+                '姓名': worker.get('worker_name'),
+                '雇主': worker['employer_name'],
+                '性別': worker['gender'],
+                '國籍': worker['nationality'],
+                '宿舍地址': room['address'],
+                '房號': room['room_number'],
+                '說明': '、'.join(notes),
+            })
+
+    plan_df = pd.DataFrame(plan, columns=plan_columns)
+    if not plan_df.empty:
+        plan_df = plan_df.sort_values(['宿舍地址', '房號', '雇主', '姓名'], kind='stable').reset_index(drop=True)
+    unplaced_df = pd.DataFrame(still_unplaced, columns=workers_df.columns)
+    if not unplaced_df.empty:
+        unplaced_df['原因'] = "範圍內沒有符合性別/國籍限制的空床位"
+    return plan_df, unplaced_df
+
+def apply_batch_placement(plan_df: pd.DataFrame, protection_level: str, new_start_date=None):
+    """
+    將 plan_batch_placement 的計畫寫入資料庫 (透過 room_assignment_model.batch_update_assignments，
+    直接更新各人員目前的 [未分配房間] 紀錄)。new_start_date 留空則沿用原入住日。
+    回傳 (成功筆數, 失敗筆數, 訊息)。
+    """
+    if plan_df is None or plan_df.empty:
+        return 0, 0, "沒有需要更新的資料。"
+    updates = [
+        {
+            'ah_id': int(row.ah_id),
+            'worker_id': row.worker_unique_id,
+            'new_room_id': int(row.room_id),
+            'new_bed_number': None,
+            'new_start_date': new_start_date,
+        }
+        for row in plan_df.itertuples(index=False)
+    ]
+    return room_assignment_model.batch_update_assignments(updates, protection_level)
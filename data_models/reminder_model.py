@@ -1,12 +1,13 @@
 # 檔案路徑: data_models/reminder_model.py
 
 import pandas as pd
+import psycopg2.extensions
 import database
 from datetime import datetime, timedelta
 
 def _execute_query_to_dataframe(conn, query, params=None):
-    """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
-    with conn.cursor() as cursor:
+    """一個輔助函式，用來手動執行查詢並回傳 DataFrame (使用回傳 tuple 的一般游標，大量列時較快)。"""
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
         cursor.execute(query, params)
         records = cursor.fetchall()
         if not records:
@@ -16,146 +17,80 @@ def _execute_query_to_dataframe(conn, query, params=None):
         columns = [desc[0] for desc in cursor.description]
         return pd.DataFrame(records, columns=columns)
 
-def get_upcoming_reminders(days_ahead: int = 90):
+# get_upcoming_reminders 回傳的各類提醒：鍵 -> ("DueItems" 的 source, 到期日欄位名稱, 輸出欄位)
+# 到期日欄位為 None 的來源，其日期欄位直接取自 details 的原始文字 (與頁面原本顯示的一致)。
+REMINDER_SOURCES = {
+    "leases": ('lease', "到期日", ["宿舍地址", "到期日", "月租金"]),
+    "workers": ('worker', "工作期限到期日", ["宿舍地址", "雇主", "姓名", "工作期限到期日"]),
+    "equipment": ('equipment', "下次保養/檢查日", ["宿舍地址", "設備名稱", "位置", "下次保養/檢查日"]),
+    "insurance": ('insurance', "保險到期日", ["宿舍地址", "年度保險費", "保險到期日"]),
+    "compliance": ('compliance', "下次申報/檢查日", ["宿舍地址", "申報類型", "申報項目", "下次申報/檢查日"]),
+    "cleaning_schedules": ('cleaning', None, ["宿舍地址", "清掃類型", "下次預計日期", "上次完成日期"]),
+    "building_safety": ('building_safety', None, ["宿舍地址", "申報類型", "上次申報日", "下次開始日", "截止日期", "配合廠商"]),
+}
+
+def get_due_items(start_date, end_date, sources: list = None) -> pd.DataFrame:
     """
-    【v1.2 修改版】查詢所有在指定天數內到期或已過期的項目。
-    支援負數天數查詢。
+    查詢 start_date ~ end_date (含) 之間到期的所有項目 (統一檢視表 "DueItems"，一次範圍查詢)。
+    sources 可限定來源 (lease / worker / equipment / insurance / compliance / cleaning / building_safety)。
+    回傳欄位：source, ref_id, dorm_id, dorm_address, due_date, label, extra。
     """
     conn = database.get_db_connection()
-    if not conn: 
-        return {
-            "leases": pd.DataFrame(), "workers": pd.DataFrame(),
-            "equipment": pd.DataFrame(), "insurance": pd.DataFrame(),
-            "compliance": pd.DataFrame()
-        }
-
+    if not conn:
+        return pd.DataFrame()
     try:
-        today_date = datetime.now().date()
-        
-        # --- 【核心修改】根據 days_ahead 的正負來決定查詢的起始日和結束日 ---
-        if days_ahead >= 0:
-            # 查詢未來
-            start_date = today_date
-            end_date = today_date + timedelta(days=days_ahead)
-        else:
-            # 查詢過去 (過期項目)
-            start_date = today_date + timedelta(days=days_ahead) # 這會是一個過去的日期
-            end_date = today_date
-        
-        # 1. 查詢租賃合約
-        lease_query = """
-            SELECT d.original_address AS "宿舍地址", l.lease_end_date AS "到期日", l.monthly_rent AS "月租金"
-            FROM "Leases" l JOIN "Dormitories" d ON l.dorm_id = d.id
-            WHERE l.lease_end_date BETWEEN %s AND %s ORDER BY l.lease_end_date ASC
-        """
-        leases_df = _execute_query_to_dataframe(conn, lease_query, (start_date, end_date))
-
-        # 2. 查詢移工工作期限
-        worker_query = """
-            SELECT 
-                d.original_address AS "宿舍地址", w.employer_name AS "雇主",
-                w.worker_name AS "姓名", w.work_permit_expiry_date AS "工作期限到期日"
-            FROM "Workers" w
-            LEFT JOIN "AccommodationHistory" ah ON w.unique_id = ah.worker_unique_id AND ah.end_date IS NULL
-            LEFT JOIN "Rooms" r ON ah.room_id = r.id
-            LEFT JOIN "Dormitories" d ON r.dorm_id = d.id
-            WHERE w.work_permit_expiry_date BETWEEN %s AND %s
-            ORDER BY w.work_permit_expiry_date ASC
-        """
-        workers_df = _execute_query_to_dataframe(conn, worker_query, (start_date, end_date))
-
-        # 3. 查詢設備
-        equipment_query = """
-            SELECT 
-                d.original_address AS "宿舍地址", e.equipment_name AS "設備名稱",
-                e.location AS "位置", e.next_maintenance_date AS "下次保養/檢查日"
-            FROM "DormitoryEquipment" e JOIN "Dormitories" d ON e.dorm_id = d.id
-            WHERE e.next_maintenance_date BETWEEN %s AND %s ORDER BY e.next_maintenance_date ASC
-        """
-        equipment_df = _execute_query_to_dataframe(conn, equipment_query, (start_date, end_date))
-
-        # 4. 查詢宿舍保險
-        insurance_query = """
-            SELECT original_address AS "宿舍地址", insurance_fee AS "年度保險費", insurance_end_date AS "保險到期日"
-            FROM "Dormitories" WHERE insurance_end_date BETWEEN %s AND %s ORDER BY insurance_end_date ASC
-        """
-        insurance_df = _execute_query_to_dataframe(conn, insurance_query, (start_date, end_date))
-        
-        # --- 5. 查詢合規紀錄 (排除清掃紀錄) ---
-        compliance_query = """
-            WITH ComplianceNextDate AS (
-                SELECT
-                    id, dorm_id, record_type, details,
-                    COALESCE(
-                        (details ->> 'next_check_date')::date,
-                        (details ->> 'next_declaration_start')::date
-                    ) as next_date
-                FROM "ComplianceRecords"
-                -- *** 排除清掃類型的紀錄 ***
-                WHERE record_type NOT IN ('宿舍簡易清掃', '宿舍大掃除')
-            )
-            SELECT
-                d.original_address AS "宿舍地址",
-                cr.record_type AS "申報類型",
-                cr.details ->> 'declaration_item' AS "申報項目",
-                cr.next_date AS "下次申報/檢查日"
-            FROM ComplianceNextDate cr
-            JOIN "Dormitories" d ON cr.dorm_id = d.id
-            WHERE cr.next_date BETWEEN %s AND %s
-            ORDER BY "下次申報/檢查日" ASC;
+        query = """
+            SELECT source, ref_id, dorm_id, dorm_address, due_date, label, extra
+            FROM "DueItems"
+            WHERE due_date BETWEEN %(start_date)s AND %(end_date)s
         """
-        compliance_df = _execute_query_to_dataframe(conn, compliance_query, (start_date, end_date))
+        params = {'start_date': start_date, 'end_date': end_date}
+        if sources:
+            query += " AND source = ANY(%(sources)s)"
+            params['sources'] = list(sources)
+        query += " ORDER BY source, due_date, ref_id"
+        return _execute_query_to_dataframe(conn, query, params)
+    finally:
+        conn.close()
 
-        # --- 6. 獨立查詢清掃排程提醒 ---
-        cleaning_query = """
-            SELECT
-                d.original_address AS "宿舍地址",
-                cr.record_type AS "清掃類型",
-                cr.details ->> 'next_schedule_date' AS "下次預計日期",
-                cr.details ->> 'last_completion_date' AS "上次完成日期"
-            FROM "ComplianceRecords" cr
-            JOIN "Dormitories" d ON cr.dorm_id = d.id
-            WHERE cr.record_type IN ('宿舍簡易清掃', '宿舍大掃除')
-              AND (cr.details ->> 'next_schedule_date')::date BETWEEN %s AND %s
-            ORDER BY "下次預計日期" ASC;
-        """
-        cleaning_df = _execute_query_to_dataframe(conn, cleaning_query, (start_date, end_date))
+def get_upcoming_reminders(days_ahead: int = 90):
+    """
+    【v2.0 統一檢視表版】查詢所有在指定天數內到期或已過期的項目。
+    支援負數天數查詢。所有來源以 "DueItems" 一次範圍查詢取得後，再依來源分成各自的表格。
+    """
+    today_date = datetime.now().date()
 
-# --- 建築物公共安全申報 (整合您的查詢邏輯) ---
-        building_query = """
-            SELECT 
-                d.original_address AS "宿舍地址",
-                cr.record_type AS "申報類型",
-                cr.details->>'submission_date' AS "上次申報日",
-                cr.details->>'next_declaration_start' AS "下次開始日",
-                cr.details->>'next_declaration_end' AS "截止日期",
-                cr.details->>'architect_name' AS "配合廠商"
-            FROM "ComplianceRecords" cr
-            JOIN "Dormitories" d ON cr.dorm_id = d.id
-            WHERE cr.record_type IN ('建物申報', '建築物公共安全申報')
-              AND (cr.details->>'next_declaration_end')::date BETWEEN %s AND %s
-            ORDER BY (cr.details->>'next_declaration_end')::date ASC
-        """
-        building_df = _execute_query_to_dataframe(conn, building_query, (start_date, end_date))
+    # --- 【核心修改】根據 days_ahead 的正負來決定查詢的起始日和結束日 ---
+    if days_ahead >= 0:
+        # 查詢未來
+        start_date = today_date
+        end_date = today_date + timedelta(days=days_ahead)
+    else:
+        # 查詢過去 (過期項目)
+        start_date = today_date + timedelta(days=days_ahead) # 這會是一個過去的日期
+        end_date = today_date
 
-        return {
-            "leases": leases_df, "workers": workers_df,
-            "equipment": equipment_df, "insurance": insurance_df,
-            "compliance": compliance_df,
-            "cleaning_schedules": cleaning_df,
-            "building_safety": building_df,
-        }
-        
+    try:
+        due_df = get_due_items(start_date, end_date)
     except Exception as e:
         print(f"ERROR: 執行提醒查詢時發生錯誤: {e}")
+        due_df = None
+    if due_df is None or (due_df.empty and len(due_df.columns) == 0):
         return {
             "leases": pd.DataFrame(), "workers": pd.DataFrame(),
             "equipment": pd.DataFrame(), "insurance": pd.DataFrame(),
             "compliance": pd.DataFrame()
         }
-    finally:
-        if conn:
-            conn.close()
+
+    reminders = {}
+    for key, (source, due_column, columns) in REMINDER_SOURCES.items():
+        rows = due_df[due_df['source'] == source]
+        records = [
+            {"宿舍地址": address, **(extra or {}), **({due_column: due_date} if due_column else {})}
+            for address, due_date, extra in zip(rows['dorm_address'], rows['due_date'], rows['extra'])
+        ]
+        reminders[key] = pd.DataFrame(records, columns=columns)
+    return reminders
 
 def get_building_safety_reminders():
     """專門獲取建築物公共安全申報的提醒資料，對齊 Google 同步欄位"""
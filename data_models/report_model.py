@@ -1,5 +1,8 @@
 import pandas as pd
+import numpy as np
 import database
+import excel_export
+from . import interval_engine
 from datetime import datetime, date
 import json
 import os
@@ -32,6 +35,20 @@ def _execute_query_to_dataframe(conn, query, params=None):
         columns = [desc[0] for desc in cursor.description]
         return pd.DataFrame(records, columns=columns)
 
+def _merge_worker_display_dates(stays_df: pd.DataFrame, attributes: list, keys: list = None) -> pd.DataFrame:
+    """
+    將同一位員工 (同一 keys) 的多筆住宿紀錄合併為一列，依 keys 排序：
+    基本資料取第一筆；start_date 取最早入住日；任一筆仍在住則 end_date 為 None，否則取最晚離住日。
+    """
+    keys = keys or ['unique_id']
+    grouped = stays_df.groupby(keys, sort=True)
+    merged = stays_df.drop_duplicates(keys).set_index(keys)[attributes].sort_index()
+    merged['start_date'] = grouped['start_date'].min()
+    still_living = stays_df['end_date'].isna().groupby([stays_df[k] for k in keys]).any()
+    last_end = stays_df.dropna(subset=['end_date']).groupby(keys)['end_date'].max()
+    merged['end_date'] = last_end.reindex(merged.index).astype(object).where(~still_living.reindex(merged.index), None)
+    return merged.reset_index()
+
 def get_dorm_report_data(dorm_id: int, year_month: str):
     """
     【v3.4 費用區間修正版】查詢宿舍在指定月份的住宿人員詳細資料。
@@ -39,8 +56,16 @@ def get_dorm_report_data(dorm_id: int, year_month: str):
          若該員工當月無費用，則顯示 0，不再回溯抓取舊資料。
     """
     if not dorm_id: return pd.DataFrame()
+    return get_dorm_reports_data([dorm_id], year_month).get(dorm_id, pd.DataFrame())
+
+def get_dorm_reports_data(dorm_ids: list, year_month: str) -> dict:
+    """
+    【v3.5 批次版】一次查詢多間宿舍在指定月份的住宿人員詳細資料 (供月底批次報表使用)。
+    回傳 {宿舍ID: 報表 DataFrame}，每間宿舍的內容與 get_dorm_report_data 相同；沒有在住人員的宿舍不會出現。
+    """
+    if not dorm_ids: return {}
     conn = database.get_db_connection()
-    if not conn: return pd.DataFrame()
+    if not conn: return {}
         
     try:
         # 1. SQL 查詢
@@ -62,6 +87,7 @@ def get_dorm_report_data(dorm_id: int, year_month: str):
                 GROUP BY fh.worker_unique_id, fh.fee_type
             )
             SELECT
+                r.dorm_id,
                 r.room_number AS "房號",
                 w.worker_name AS "姓名",
                 w.employer_name AS "雇主",
@@ -81,7 +107,7 @@ def get_dorm_report_data(dorm_id: int, year_month: str):
             -- 關聯費用 (使用新的 TargetMonthFees)
             LEFT JOIN TargetMonthFees tmf ON w.unique_id = tmf.worker_unique_id
             
-            WHERE r.dorm_id = %(dorm_id)s
+            WHERE r.dorm_id = ANY(%(dorm_ids)s)
             -- 住宿期間與查詢月份有重疊
             AND ah.start_date <= dp.month_end
             AND (ah.end_date IS NULL OR ah.end_date >= dp.month_start)
@@ -89,58 +115,68 @@ def get_dorm_report_data(dorm_id: int, year_month: str):
             ORDER BY r.room_number, w.worker_name
         """
         
-        params = {"dorm_id": dorm_id, "year_month": year_month}
-        raw_df = _execute_query_to_dataframe(conn, query, params)
-        
-        if raw_df.empty:
-            return pd.DataFrame()
-
-        # 2. 資料處理與轉置 (Pivot)
-        raw_df['fee_type'] = raw_df['fee_type'].fillna('__NO_FEE__')
-        raw_df['amount'] = raw_df['amount'].fillna(0)
-        
-        # 填補基本資料空值
-        fill_values = {
-            "房號": "", "姓名": "", "雇主": "", 
-            "性別": "", "國籍": "", 
-            "特殊狀況": "", "備註": ""
+        params = {"dorm_ids": [int(i) for i in dorm_ids], "year_month": year_month}
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            columns = [desc[0] for desc in cursor.description][1:]
+            records_by_dorm = {}
+            for record in cursor.fetchall():
+                records_by_dorm.setdefault(record['dorm_id'], []).append([record[c] for c in columns])
+
+        # 每間宿舍各自建立 DataFrame (欄位型別與單獨查詢時一致)
+        return {
+            dorm_id: _pivot_dorm_report(pd.DataFrame(records, columns=columns))
+            for dorm_id, records in records_by_dorm.items()
         }
-        raw_df = raw_df.fillna(value=fill_values)
-        
-        index_cols = ["房號", "姓名", "雇主", "性別", "國籍", "特殊狀況", "備註"]
-        
-        pivot_df = raw_df.pivot_table(
-            index=index_cols,
-            columns='fee_type',
-            values='amount',
-            aggfunc='sum',
-            fill_value=0
-        ).reset_index()
-        
-        if '__NO_FEE__' in pivot_df.columns:
-            pivot_df.drop(columns=['__NO_FEE__'], inplace=True)
-            
-        # 3. 排序與加總
-        fee_cols = [c for c in pivot_df.columns if c not in index_cols]
-        config = get_fee_config()
-        ordered_types = config.get("internal_types", [])
-        
-        def sort_key(col_name):
-            if col_name in ordered_types: return ordered_types.index(col_name)
-            return 999
-
-        fee_cols = sorted(fee_cols, key=sort_key)
-        pivot_df['總收租'] = pivot_df[fee_cols].sum(axis=1)
-        
-        final_cols = index_cols + fee_cols + ['總收租']
-        return pivot_df[final_cols]
         
     except Exception as e:
         print(f"查詢宿舍報表資料時發生錯誤: {e}")
-        return pd.DataFrame()
+        return {}
     finally:
         if conn: conn.close()
 
+def _pivot_dorm_report(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """將單一宿舍的住宿/費用明細轉置為每人一列、每種費用一欄，並加上總收租。"""
+    # 2. 資料處理與轉置 (Pivot)
+    raw_df['fee_type'] = raw_df['fee_type'].fillna('__NO_FEE__')
+    raw_df['amount'] = raw_df['amount'].fillna(0)
+    
+    # 填補基本資料空值
+    fill_values = {
+        "房號": "", "姓名": "", "雇主": "", 
+        "性別": "", "國籍": "", 
+        "特殊狀況": "", "備註": ""
+    }
+    raw_df = raw_df.fillna(value=fill_values)
+    
+    index_cols = ["房號", "姓名", "雇主", "性別", "國籍", "特殊狀況", "備註"]
+    
+    pivot_df = raw_df.pivot_table(
+        index=index_cols,
+        columns='fee_type',
+        values='amount',
+        aggfunc='sum',
+        fill_value=0
+    ).reset_index()
+    
+    if '__NO_FEE__' in pivot_df.columns:
+        pivot_df.drop(columns=['__NO_FEE__'], inplace=True)
+        
+    # 3. 排序與加總
+    fee_cols = [c for c in pivot_df.columns if c not in index_cols]
+    config = get_fee_config()
+    ordered_types = config.get("internal_types", [])
+    
+    def sort_key(col_name):
+        if col_name in ordered_types: return ordered_types.index(col_name)
+        return 999
+
+    fee_cols = sorted(fee_cols, key=sort_key)
+    pivot_df['總收租'] = pivot_df[fee_cols].sum(axis=1)
+    
+    final_cols = index_cols + fee_cols + ['總收租']
+    return pivot_df[final_cols]
+
 def get_monthly_exception_report(year_month: str):
     """
     【v2.0 修改版】查詢指定月份中，所有「當月離住」或「有特殊狀況」的人員。
@@ -241,17 +277,16 @@ def get_utility_bills_for_selection(dorm_ids, start_date, end_date):
 
 def get_custom_utility_report_data(dorm_id: int, employer_name: str, selected_bill_ids: list):
     """
-    【v2.3 完整歷史修正版】根據使用者選擇的帳單 ID，產生客製化水電費分攤報表。
+    【v2.4 區間運算版】根據使用者選擇的帳單 ID，產生客製化水電費分攤報表。
     邏輯修正：解決「帳單截止後才換床」導致被誤判為離住的問題。
     方法：先篩選出期間內有居住的人員，再撈取這些人在該宿舍的「所有」歷史紀錄來判斷狀態。
+    每位員工的住宿先合併為不重疊區間，再以 interval_engine 一次計算所有帳單期間的居住天數。
     """
     conn = database.get_db_connection()
     if not conn or not selected_bill_ids:
         return None, None, None
 
     try:
-        from datetime import date, timedelta # 確保引入時間計算模組
-
         dorm_details = _execute_query_to_dataframe(conn, 'SELECT original_address, dorm_name FROM "Dormitories" WHERE id = %s', (dorm_id,)).iloc[0]
 
         # 1. 查詢帳單
@@ -299,71 +334,33 @@ def get_custom_utility_report_data(dorm_id: int, employer_name: str, selected_bi
         if workers_df.empty:
             return dorm_details, bills_df, pd.DataFrame()
             
-        results = []
-        
-        # 3. 針對每位員工進行資料合併與計算
-        for unique_id, group in workers_df.groupby('unique_id'):
-            first_rec = group.iloc[0]
-            worker_row = { 
-                "姓名": first_rec['worker_name'], 
-                "母語姓名": first_rec['native_name'] 
-            }
-            
-            # 顯示用的起訖日
-            # 入住日：取最早
-            merged_start = pd.to_datetime(group['start_date']).min()
-            worker_row["入住日期"] = merged_start.strftime('%Y-%m-%d')
-            
-            # 離住日：若「任何一筆」紀錄還在住 (end_date is null)，就代表他在住
-            if group['end_date'].isnull().any():
-                worker_row["離住日期"] = "" 
-            else:
-                # 否則取最後一天
-                merged_end = pd.to_datetime(group['end_date']).max()
-                worker_row["離住日期"] = merged_end.strftime('%Y-%m-%d')
-
-            # 計算每張帳單的居住天數 (使用 Set 去重)
-            for _, bill in bills_df.iterrows():
-                bill_col_name = f"{bill['bill_type']}_{bill['bill_id']}"
-                
-                b_start = pd.to_datetime(bill['bill_start_date']).date()
-                b_end = pd.to_datetime(bill['bill_end_date']).date()
-                
-                occupied_dates = set()
-                
-                for _, row in group.iterrows():
-                    seg_start = pd.to_datetime(row['start_date']).date()
-                    seg_end_val = row['end_date']
-                    seg_end = pd.to_datetime(seg_end_val).date() if pd.notna(seg_end_val) else date(9999, 12, 31)
-                    
-                    # 計算交集
-                    overlap_start = max(seg_start, b_start)
-                    overlap_end = min(seg_end, b_end)
-                    
-                    if overlap_start <= overlap_end:
-                        curr = overlap_start
-                        while curr <= overlap_end:
-                            occupied_dates.add(curr)
-                            curr += timedelta(days=1)
-                
-                worker_row[f"{bill_col_name}_days"] = len(occupied_dates)
-            
-            results.append(worker_row)
-
-        details_df = pd.DataFrame(results)
+        # 3. 合併每位員工的住宿區間，一次算出每張帳單期間內的實際居住天數 (換房/換床同日不重複計算)
+        details_df = _merge_worker_display_dates(workers_df, ['worker_name', 'native_name'])
+        details_df = details_df.rename(columns={'worker_name': "姓名", 'native_name': "母語姓名"})
+        details_df["入住日期"] = pd.to_datetime(details_df.pop('start_date')).dt.strftime('%Y-%m-%d')
+        details_df["離住日期"] = pd.to_datetime(details_df.pop('end_date')).dt.strftime('%Y-%m-%d').fillna("")
+
+        bill_columns = bills_df['bill_type'].astype(str) + '_' + bills_df['bill_id'].astype(str)
+        windows = pd.DataFrame({
+            'window': bill_columns,
+            'window_start': interval_engine.to_days(bills_df['bill_start_date']),
+            'window_end': interval_engine.to_days(bills_df['bill_end_date']),
+        })
+        intervals = interval_engine.merge_intervals(workers_df, ['unique_id'])
+        days = interval_engine.overlap_days(intervals, windows, ['unique_id'])
+        days_matrix = days.pivot(index='unique_id', columns='window', values='days')
+        days_matrix = days_matrix.reindex(index=details_df['unique_id'], columns=bill_columns.unique()).fillna(0).astype(int)
+        for column in days_matrix.columns:
+            details_df[f"{column}_days"] = days_matrix[column].to_numpy()
+        details_df = details_df.drop(columns=['unique_id'])
 
         # 4. 計算費用
-        for _, bill in bills_df.iterrows():
-            bill_col_name = f"{bill['bill_type']}_{bill['bill_id']}"
-            
-            if f"{bill_col_name}_days" in details_df.columns:
-                total_days_for_bill = details_df[f"{bill_col_name}_days"].sum()
-                
-                if total_days_for_bill > 0:
-                    cost_per_day = bill['amount'] / total_days_for_bill
-                    details_df[f"{bill_col_name}_fee"] = details_df[f"{bill_col_name}_days"] * cost_per_day
-                else:
-                    details_df[f"{bill_col_name}_fee"] = 0
+        for bill, bill_col_name in zip(bills_df.itertuples(index=False), bill_columns):
+            total_days_for_bill = details_df[f"{bill_col_name}_days"].sum()
+            if total_days_for_bill > 0:
+                details_df[f"{bill_col_name}_fee"] = interval_engine.prorate(bill.amount, details_df[f"{bill_col_name}_days"], total_days_for_bill)
+            else:
+                details_df[f"{bill_col_name}_fee"] = 0
         
         return dorm_details, bills_df, details_df
 
@@ -587,205 +584,212 @@ def get_employer_profit_loss_report(employer_names: list, year_month: str):
     finally:
         if conn: conn.close()
 
-def get_excess_utility_report_data(
-    dorm_ids: list, 
-    employer_names: list, 
-    bill_ids: list, 
-    fixed_subsidy: int, 
-    include_external_workers: bool,
-    calculation_mode: str = 'bill', 
-    report_start_date=None, 
-    report_end_date=None
-):
+EXCESS_STAYS_QUERY = """
+    SELECT
+        r.dorm_id, w.unique_id, w.worker_name, w.employer_name, w.native_name,
+        w.passport_number, w.nationality, w.gender, w.special_status,
+        ah.start_date, ah.end_date
+    FROM "AccommodationHistory" ah
+    JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
+    JOIN "Rooms" r ON ah.room_id = r.id
+    WHERE r.dorm_id = ANY(%s)
+      AND ah.start_date <= %s::date
+      AND (ah.end_date IS NULL OR ah.end_date >= %s::date)
+"""
+
+EXCESS_WORKER_COLUMNS = ['employer_name', 'worker_name', 'native_name', 'passport_number', 'nationality', 'gender']
+
+def _as_list(value):
+    return list(value if isinstance(value, list) else [value])
+
+def _excess_calc_range(job: dict, bills_df: pd.DataFrame):
+    """回傳 (計算起日, 計算迄日, 水電費總額)。依帳單模式取帳單全額；依日期區間模式按重疊天數比例縮減帳單金額。"""
+    if job.get('calculation_mode', 'bill') == 'date_range':
+        calc_start = job.get('report_start_date') or bills_df['bill_start_date'].min()
+        calc_end = job.get('report_end_date') or bills_df['bill_end_date'].max()
+
+        b_start = interval_engine.to_days(bills_df['bill_start_date'])
+        b_end = interval_engine.to_days(bills_df['bill_end_date'])
+        total_bill_days = b_end - b_start + 1
+        overlap = np.minimum(b_end, interval_engine.to_days([calc_end])[0]) - np.maximum(b_start, interval_engine.to_days([calc_start])[0]) + 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(total_bill_days > 0, overlap / total_bill_days, 0)
+        contributions = bills_df['amount'].to_numpy() * ratio
+        # 依帳單順序逐筆加總 (與逐筆計算的結果完全一致)
+        total_utility_cost = sum(contributions[overlap > 0].tolist(), 0)
+        return calc_start, calc_end, total_utility_cost
+
+    return bills_df['bill_start_date'].min(), bills_df['bill_end_date'].max(), bills_df['amount'].sum()
+
+def get_excess_utility_reports(jobs: dict) -> dict:
     """
-    【v2.5 合併修正版】產生超額水電費分攤報表。
-    修正：針對「同日換宿/換床」的員工，將多筆歷史紀錄合併為單一人員計算。
-    1. 避免 12/15 在舊房與新房重複計算天數。
-    2. 正確判斷「最終離住日」（若新房還在住，報表就不會顯示離住）。
+    【v3.0 批次區間運算版】一次產生多份超額水電費分攤報表 (例如月底為每間宿舍各產生一份)。
+    jobs 為 {報表鍵: 參數字典}，參數同 get_excess_utility_report_data 的各引數
+    (dorm_ids, employer_names, bill_ids, fixed_subsidy, include_external_workers,
+     calculation_mode, report_start_date, report_end_date)。
+    宿舍、帳單與住宿紀錄各只查詢一次；所有報表的住宿區間合併與居住天數以 interval_engine 一起計算。
+    回傳 {報表鍵: (宿舍地址列表, 帳單, 明細, 應收總額, 超額總額)}，與單份報表的回傳值相同。
     """
-    if not dorm_ids or not employer_names or not bill_ids:
-        return None, None, None, None, None
+    results = {key: (None, None, None, None, None) for key in jobs}
+    jobs = {
+        key: dict(job) for key, job in jobs.items()
+        if job.get('dorm_ids') and job.get('employer_names') and job.get('bill_ids')
+    }
+    if not jobs:
+        return results
 
     conn = database.get_db_connection()
-    if not conn: return None, None, None, None, None
+    if not conn: return results
 
     try:
-        from datetime import date, timedelta # 引入時間計算模組
-
         # 型別轉換 (確保是 list)
-        safe_dorm_ids = list(int(i) for i in (dorm_ids if isinstance(dorm_ids, list) else [dorm_ids]))
-        safe_bill_ids = list(int(i) for i in (bill_ids if isinstance(bill_ids, list) else [bill_ids]))
-        safe_employer_names = list(employer_names if isinstance(employer_names, list) else [employer_names])
-
-        # 1. 獲取宿舍基本信息
-        dorm_query = 'SELECT original_address FROM "Dormitories" WHERE id = ANY(%s)'
-        dorm_details_df = _execute_query_to_dataframe(conn, dorm_query, (safe_dorm_ids,))
-        dorm_address_list = dorm_details_df['original_address'].tolist()
-        
-        # 2. 獲取帳單
-        bills_query = """
+        for job in jobs.values():
+            job['dorm_ids'] = [int(i) for i in _as_list(job['dorm_ids'])]
+            job['bill_ids'] = [int(i) for i in _as_list(job['bill_ids'])]
+            job['employer_names'] = _as_list(job['employer_names'])
+        all_dorm_ids = sorted({i for job in jobs.values() for i in job['dorm_ids']})
+        all_bill_ids = sorted({i for job in jobs.values() for i in job['bill_ids']})
+
+        # 1. 宿舍與帳單 (所有報表一起查詢)
+        dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, original_address FROM "Dormitories" WHERE id = ANY(%s)', (all_dorm_ids,))
+        all_bills_df = _execute_query_to_dataframe(conn, """
             SELECT id as bill_id, bill_type, bill_start_date, bill_end_date, amount
             FROM "UtilityBills"
             WHERE id = ANY(%s) AND (bill_type = '水費' OR bill_type = '電費')
             ORDER BY bill_type, bill_start_date;
-        """
-        bills_df = _execute_query_to_dataframe(conn, bills_query, (safe_bill_ids,))
-        
-        if bills_df.empty:
-            return dorm_address_list, pd.DataFrame(), pd.DataFrame(), None, None
-
-        # --- 計算區間與總金額邏輯 ---
-        calc_start = None
-        calc_end = None
-        total_utility_cost = 0
-        
-        if calculation_mode == 'date_range':
-            # 模式 A：依日期區間 (需按比例分攤帳單金額)
-            calc_start = report_start_date if report_start_date else bills_df['bill_start_date'].min()
-            calc_end = report_end_date if report_end_date else bills_df['bill_end_date'].max()
-            
-            for _, bill in bills_df.iterrows():
-                b_start = pd.to_datetime(bill['bill_start_date']).date()
-                b_end = pd.to_datetime(bill['bill_end_date']).date()
-                b_amount = bill['amount']
-                
-                total_bill_days = (b_end - b_start).days + 1
-                overlap_start = max(b_start, calc_start)
-                overlap_end = min(b_end, calc_end)
-                
-                if overlap_start <= overlap_end:
-                    overlap_days = (overlap_end - overlap_start).days + 1
-                    ratio = overlap_days / total_bill_days if total_bill_days > 0 else 0
-                    total_utility_cost += b_amount * ratio
-        else:
-            # 模式 B：依帳單 (全額)
-            calc_start = bills_df['bill_start_date'].min()
-            calc_end = bills_df['bill_end_date'].max()
-            total_utility_cost = bills_df['amount'].sum()
-
-        # 3. 獲取「計算區間內」的所有相關住宿紀錄
-        external_filter_sql = ""
-        if not include_external_workers:
-            external_filter_sql = " AND (w.special_status IS NULL OR w.special_status NOT ILIKE '%%掛宿外住%%')" 
-            
-        # 這裡只撈取原始資料，不計算 lived_days，改由 Python 統一合併計算
-        worker_raw_query = f"""
-            SELECT
-                w.unique_id, w.worker_name, w.employer_name, w.native_name, 
-                w.passport_number, w.nationality, w.gender,
-                ah.start_date, ah.end_date
-            FROM "AccommodationHistory" ah
-            JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
-            JOIN "Rooms" r ON ah.room_id = r.id
-            WHERE r.dorm_id = ANY(%s)
-              AND ah.start_date <= %s::date
-              AND (ah.end_date IS NULL OR ah.end_date >= %s::date)
-              {external_filter_sql}
-        """
-        raw_records_df = _execute_query_to_dataframe(conn, worker_raw_query, (safe_dorm_ids, calc_end, calc_start))
-        
-        if raw_records_df.empty:
-            return dorm_address_list, bills_df, pd.DataFrame(), 0.0, 0.0
-
-        # 4. 【核心修改】合併同一位員工的紀錄並計算不重複天數
-        merged_results = []
-        
-        # 依 unique_id 分組
-        for unique_id, group in raw_records_df.groupby('unique_id'):
-            first_row = group.iloc[0] # 取基本資料
-            
-            # 使用 Set (集合) 計算該員工在 calc_start ~ calc_end 期間的實際居住天數
-            # 這能完美解決 "換房當天被重複計算" 的問題
-            occupied_dates = set()
-            
-            for _, row in group.iterrows():
-                # 該段歷史的區間
-                seg_start = pd.to_datetime(row['start_date']).date()
-                seg_end_val = row['end_date']
-                seg_end = pd.to_datetime(seg_end_val).date() if pd.notna(seg_end_val) else date(9999, 12, 31)
-                
-                # 計算與「報表計算區間」的交集
-                overlap_start = max(seg_start, calc_start)
-                overlap_end = min(seg_end, calc_end)
-                
-                if overlap_start <= overlap_end:
-                    curr = overlap_start
-                    while curr <= overlap_end:
-                        occupied_dates.add(curr)
-                        curr += timedelta(days=1)
-            
-            lived_days = len(occupied_dates)
-            if lived_days == 0: continue # 理論上不會發生，以防萬一
-
-            # 決定顯示用的起訖日
-            # 入住日：這段期間最早的紀錄
-            display_start = group['start_date'].min()
-            
-            # 離住日：若任一筆紀錄是「在住」(end_date is Null)，則視為在住；否則取最晚日期
-            is_still_living = group['end_date'].isnull().any()
-            if is_still_living:
-                display_end = None
-            else:
-                display_end = group['end_date'].max()
-
-            merged_results.append({
-                'unique_id': unique_id,
-                'worker_name': first_row['worker_name'],
-                'employer_name': first_row['employer_name'],
-                'native_name': first_row['native_name'],
-                'passport_number': first_row['passport_number'],
-                'nationality': first_row['nationality'],
-                'gender': first_row['gender'],
-                'start_date': display_start,
-                'end_date': display_end,
-                'lived_days': lived_days
+        """, (all_bill_ids,))
+
+        # 2. 各報表的計算區間與水電費總額
+        contexts = {}
+        for key, job in jobs.items():
+            dorm_address_list = dorms_df.loc[dorms_df['id'].isin(job['dorm_ids']), 'original_address'].tolist() if not dorms_df.empty else []
+            bills_df = all_bills_df[all_bills_df['bill_id'].isin(job['bill_ids'])].reset_index(drop=True) if not all_bills_df.empty else all_bills_df
+            if bills_df.empty:
+                results[key] = (dorm_address_list, pd.DataFrame(), pd.DataFrame(), None, None)
+                continue
+            calc_start, calc_end, total_utility_cost = _excess_calc_range(job, bills_df)
+            contexts[key] = {
+                'addresses': dorm_address_list, 'bills': bills_df,
+                'start': calc_start, 'end': calc_end, 'total_cost': total_utility_cost,
+            }
+        if not contexts:
+            return results
+
+        # 3. 所有報表涵蓋範圍內的住宿紀錄 (只撈取原始資料，由 interval_engine 合併計算)
+        stays_df = _execute_query_to_dataframe(conn, EXCESS_STAYS_QUERY, (
+            sorted({i for key in contexts for i in jobs[key]['dorm_ids']}),
+            max(ctx['end'] for ctx in contexts.values()),
+            min(ctx['start'] for ctx in contexts.values()),
+        ))
+        if stays_df.empty:
+            for key, ctx in contexts.items():
+                results[key] = (ctx['addresses'], ctx['bills'], pd.DataFrame(), 0.0, 0.0)
+            return results
+        starts = interval_engine.to_days(stays_df['start_date'])
+        ends = interval_engine.to_days(stays_df['end_date'], fill=interval_engine.OPEN_END)
+        external = stays_df['special_status'].fillna('').str.contains('掛宿外住', case=False, regex=False).to_numpy()
+
+        job_stays = []
+        windows = []
+        for key, ctx in contexts.items():
+            job = jobs[key]
+            window_start = interval_engine.to_days([ctx['start']])[0]
+            window_end = interval_engine.to_days([ctx['end']])[0]
+            mask = stays_df['dorm_id'].isin(job['dorm_ids']).to_numpy() & (starts <= window_end) & (ends >= window_start)
+            if not job.get('include_external_workers'):
+                mask &= ~external
+            selected = stays_df[mask]
+            if selected.empty:
+                results[key] = (ctx['addresses'], ctx['bills'], pd.DataFrame(), 0.0, 0.0)
+                continue
+            job_stays.append(selected.assign(job=len(windows)))
+            windows.append({'job': len(windows), 'key': key, 'window': 0, 'window_start': window_start, 'window_end': window_end})
+        if not windows:
+            return results
+
+        # 4. 合併同一位員工的紀錄 (同日換宿/換床不重複計算)，一次算出所有報表的居住天數
+        job_stays_df = pd.concat(job_stays, ignore_index=True)
+        windows_df = pd.DataFrame(windows)
+        intervals = interval_engine.merge_intervals(job_stays_df, ['job', 'unique_id'])
+        lived = interval_engine.overlap_days(intervals, windows_df, ['job', 'unique_id'], on=['job'])
+        workers_df = _merge_worker_display_dates(job_stays_df, EXCESS_WORKER_COLUMNS, keys=['job', 'unique_id'])
+        workers_df = workers_df.merge(lived[['job', 'unique_id', 'days']], on=['job', 'unique_id'], how='left')
+        workers_df['days'] = workers_df['days'].fillna(0).astype(int)
+
+        avg_days_per_month = 30.4375
+        for job_number, group in workers_df.groupby('job', sort=True):
+            key = windows_df.loc[job_number, 'key']
+            ctx, job = contexts[key], jobs[key]
+            worker_days_df = group[group['days'] > 0].drop(columns=['job']).rename(columns={'days': 'lived_days'})
+            worker_days_df = worker_days_df.reset_index(drop=True)
+            if worker_days_df.empty:
+                results[key] = (ctx['addresses'], ctx['bills'], pd.DataFrame(), 0.0, 0.0)
+                continue
+
+            # 5. 計算費用 (分攤)
+            total_dorm_days = worker_days_df['lived_days'].sum()
+            expected_total_subsidy = total_dorm_days * (job.get('fixed_subsidy', 0) / avg_days_per_month)
+            total_excess_cost = ctx['total_cost'] - expected_total_subsidy
+
+            charge_per_day = 0.0
+            if total_dorm_days > 0 and total_excess_cost > 0:
+                charge_per_day = total_excess_cost / total_dorm_days
+
+            # 6. 應用到每位員工
+            worker_days_df['daily_charge'] = charge_per_day
+            worker_days_df['final_bill_amount'] = (worker_days_df['lived_days'] * worker_days_df['daily_charge']).round().astype(int)
+
+            # 7. 彙總目標雇主 (篩選)
+            target_employer_df = worker_days_df[worker_days_df['employer_name'].isin(job['employer_names'])].copy()
+            if target_employer_df.empty:
+                results[key] = (ctx['addresses'], ctx['bills'], pd.DataFrame(), 0.0, total_excess_cost)
+                continue
+
+            # 8. 整理輸出欄位
+            report_df = target_employer_df[[
+                'employer_name', 'worker_name', 'native_name',
+                'passport_number', 'nationality', 'gender',
+                'start_date', 'end_date', 'lived_days', 'final_bill_amount'
+            ]].rename(columns={
+                'employer_name': '雇主', 'worker_name': '姓名', 'native_name': '英文姓名',
+                'passport_number': '護照號碼', 'nationality': '國籍', 'gender': '性別',
+                'start_date': '入住日期', 'end_date': '離住日期', 'lived_days': '居住天數',
+                'final_bill_amount': '應收水電費'
             })
+            results[key] = (ctx['addresses'], ctx['bills'], report_df, report_df['應收水電費'].sum(), total_excess_cost)
 
-        worker_days_df = pd.DataFrame(merged_results)
+        return results
 
-        # 5. 計算費用 (分攤)
-        total_dorm_days = worker_days_df['lived_days'].sum()
-        avg_days_per_month = 30.4375 
-        
-        expected_total_subsidy = total_dorm_days * (fixed_subsidy / avg_days_per_month)
-        total_excess_cost = total_utility_cost - expected_total_subsidy
-        
-        charge_per_day = 0.0
-        if total_dorm_days > 0 and total_excess_cost > 0:
-            charge_per_day = total_excess_cost / total_dorm_days
-
-        # 6. 應用到每位員工
-        worker_days_df['daily_charge'] = charge_per_day
-        worker_days_df['final_bill_amount'] = (worker_days_df['lived_days'] * worker_days_df['daily_charge']).round().astype(int)
-        
-        # 7. 彙總目標雇主 (篩選)
-        target_employer_df = worker_days_df[worker_days_df['employer_name'].isin(safe_employer_names)].copy()
-        
-        if target_employer_df.empty:
-            return dorm_address_list, bills_df, pd.DataFrame(), 0.0, total_excess_cost
-
-        # 8. 整理輸出欄位
-        report_df = target_employer_df[[
-            'employer_name', 'worker_name', 'native_name', 
-            'passport_number', 'nationality', 'gender',
-            'start_date', 'end_date', 'lived_days', 'final_bill_amount'
-        ]].rename(columns={
-            'employer_name': '雇主', 'worker_name': '姓名', 'native_name': '英文姓名',
-            'passport_number': '護照號碼', 'nationality': '國籍', 'gender': '性別',
-            'start_date': '入住日期', 'end_date': '離住日期', 'lived_days': '居住天數',
-            'final_bill_amount': '應收水電費'
-        })
-        
-        total_charge = report_df['應收水電費'].sum()
-        
-        return dorm_address_list, bills_df, report_df, total_charge, total_excess_cost
-    
     except Exception as e:
-        print(f"Error in get_excess_utility_report_data: {e}")
-        return None, None, None, None, None
+        print(f"Error in get_excess_utility_reports: {e}")
+        return {key: (None, None, None, None, None) for key in results}
     finally:
         if conn: conn.close()
 
+def get_excess_utility_report_data(
+    dorm_ids: list, 
+    employer_names: list, 
+    bill_ids: list, 
+    fixed_subsidy: int, 
+    include_external_workers: bool,
+    calculation_mode: str = 'bill', 
+    report_start_date=None, 
+    report_end_date=None
+):
+    """
+    【v3.0 區間運算版】產生超額水電費分攤報表 (單份，實際計算見 get_excess_utility_reports)。
+    針對「同日換宿/換床」的員工，將多筆歷史紀錄合併為單一人員計算：
+    1. 避免 12/15 在舊房與新房重複計算天數 (住宿區間先合併為不重疊區間再計算天數)。
+    2. 正確判斷「最終離住日」（若新房還在住，報表就不會顯示離住）。
+    """
+    job = {
+        'dorm_ids': dorm_ids, 'employer_names': employer_names, 'bill_ids': bill_ids,
+        'fixed_subsidy': fixed_subsidy, 'include_external_workers': include_external_workers,
+        'calculation_mode': calculation_mode,
+        'report_start_date': report_start_date, 'report_end_date': report_end_date,
+    }
+    return get_excess_utility_reports({0: job})[0]
+
 def get_employers_in_dorms_for_period(dorm_ids, start_date, end_date) -> list:
     """
     獲取在指定宿舍列表和日期範圍內有住宿紀錄的雇主名稱。
@@ -824,4 +828,109 @@ def get_employers_in_dorms_for_period(dorm_ids, start_date, end_date) -> list:
         print(f"Error getting employers in dorms for period: {e}")
         return []
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
+def get_employers_by_dorm_for_period(dorm_ids, start_date, end_date) -> dict:
+    """
+    【批次版】一次取得多間宿舍在日期範圍內有住宿紀錄的雇主名稱 (排除掛宿外住)。
+    回傳 {宿舍ID: [雇主名稱, ...]}，每間宿舍的內容與 get_employers_in_dorms_for_period([宿舍ID], ...) 相同。
+    """
+    if not dorm_ids or not start_date or not end_date:
+        return {}
+    conn = database.get_db_connection()
+    if not conn: return {}
+
+    try:
+        query = """
+            SELECT DISTINCT
+                r.dorm_id, w.employer_name
+            FROM "AccommodationHistory" ah
+            JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
+            JOIN "Rooms" r ON ah.room_id = r.id
+            WHERE 
+                r.dorm_id = ANY(%s)
+                AND ah.start_date <= %s
+                AND (ah.end_date IS NULL OR ah.end_date >= %s)
+                AND (w.special_status IS NULL OR w.special_status NOT ILIKE '%%掛宿外住%%')
+            ORDER BY r.dorm_id, w.employer_name;
+        """
+        df = _execute_query_to_dataframe(conn, query, ([int(i) for i in dorm_ids], end_date, start_date))
+        if df.empty:
+            return {}
+        return {dorm_id: group['employer_name'].tolist() for dorm_id, group in df.groupby('dorm_id', sort=False)}
+
+    except Exception as e:
+        print(f"Error getting employers by dorm for period: {e}")
+        return {}
+    finally:
+        if conn: conn.close()
+
+# ==============================================================================
+# 大量明細匯出 (多年度住宿/費用紀錄)：以伺服器端游標直接寫檔，不組成 DataFrame
+# ==============================================================================
+
+RESIDENT_HISTORY_EXPORT_QUERY = """
+    SELECT
+        d.original_address AS "宿舍地址",
+        r.room_number AS "房號",
+        ah.bed_number AS "床位編號",
+        w.employer_name AS "雇主",
+        w.worker_name AS "姓名",
+        w.passport_number AS "護照號碼",
+        w.gender AS "性別",
+        w.nationality AS "國籍",
+        ah.start_date AS "入住日期",
+        ah.end_date AS "離住日期",
+        w.special_status AS "特殊狀況",
+        ah.notes AS "備註"
+    FROM "AccommodationHistory" ah
+    JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
+    JOIN "Rooms" r ON ah.room_id = r.id
+    JOIN "Dormitories" d ON r.dorm_id = d.id
+    WHERE ah.start_date <= %(end_date)s
+      AND (ah.end_date IS NULL OR ah.end_date >= %(start_date)s)
+    ORDER BY d.original_address, r.room_number, ah.start_date, ah.id
+"""
+
+FEE_HISTORY_EXPORT_QUERY = """
+    SELECT
+        d.original_address AS "宿舍地址",
+        w.employer_name AS "雇主",
+        w.worker_name AS "姓名",
+        w.passport_number AS "護照號碼",
+        fh.fee_type AS "費用類型",
+        fh.amount AS "金額",
+        fh.effective_date AS "生效日期"
+    FROM "FeeHistory" fh
+    JOIN "Workers" w ON fh.worker_unique_id = w.unique_id
+    LEFT JOIN "Rooms" r ON w.room_id = r.id
+    LEFT JOIN "Dormitories" d ON r.dorm_id = d.id
+    WHERE fh.effective_date BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY fh.effective_date, d.original_address, w.worker_name, fh.id
+"""
+
+HISTORY_EXPORTS = {
+    'residents': ('住宿歷史明細', RESIDENT_HISTORY_EXPORT_QUERY),
+    'fees': ('費用歷史明細', FEE_HISTORY_EXPORT_QUERY),
+}
+
+def export_history_data(kind: str, start_date, end_date, output, fmt: str = 'xlsx'):
+    """
+    將 start_date ~ end_date 期間的住宿 (kind='residents') 或費用 (kind='fees') 明細直接寫入 output
+    (檔案路徑或二進位檔案物件)，fmt 為 excel_export.FORMATS 的鍵。
+    回傳寫出的筆數；發生錯誤時回傳 None。
+    """
+    sheet_name, query = HISTORY_EXPORTS[kind]
+    conn = database.get_db_connection()
+    if not conn:
+        return None
+    try:
+        return excel_export.stream_query(
+            conn, query, {'start_date': start_date, 'end_date': end_date}, output, fmt=fmt,
+            sheet_name=sheet_name, title=f"{sheet_name} ({start_date} ~ {end_date})"
+        )
+    except Exception as e:
+        print(f"匯出{sheet_name}時發生錯誤: {e}")
+        return None
+    finally:
+        conn.rollback()
+        conn.close()
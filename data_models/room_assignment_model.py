@@ -4,6 +4,7 @@
 import pandas as pd
 import database
 import numpy as np
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -100,6 +101,50 @@ def get_all_unassigned_workers_global():
     finally:
         if conn: conn.close()
 
+def get_unassigned_workers_for_placement():
+    """
+    【v2.2 新增】供「批次安排床位」使用：全系統目前暫掛在我司宿舍 [未分配房間] 的人員，
+    含住宿歷史 ID 與安排所需的性別、國籍、雇主 (欄位名稱與 occupancy_index 的住宿紀錄一致)。
+    """
+    conn = database.get_db_connection()
+    if not conn: return pd.DataFrame()
+    try:
+        query = """
+            WITH LatestAccommodation AS (
+                SELECT
+                    id AS ah_id,
+                    worker_unique_id,
+                    room_id,
+                    start_date,
+                    end_date,
+                    ROW_NUMBER() OVER(PARTITION BY worker_unique_id ORDER BY start_date DESC, id DESC) as rn
+                FROM "AccommodationHistory"
+            )
+            SELECT
+                la.ah_id,
+                w.unique_id AS worker_unique_id,
+                w.worker_name,
+                w.gender,
+                w.nationality,
+                w.employer_name,
+                la.start_date,
+                d.id AS current_dorm_id,
+                d.original_address AS current_address
+            FROM LatestAccommodation la
+            JOIN "Workers" w ON la.worker_unique_id = w.unique_id
+            JOIN "Rooms" r ON la.room_id = r.id
+            JOIN "Dormitories" d ON r.dorm_id = d.id
+            WHERE
+                la.rn = 1
+                AND la.end_date IS NULL
+                AND r.room_number = '[未分配房間]'
+                AND d.primary_manager = '我司'
+            ORDER BY w.employer_name, w.gender, w.nationality, w.worker_name
+        """
+        return _execute_query_to_dataframe(conn, query)
+    finally:
+        if conn: conn.close()
+
 # --- 修改函式定義，加入 protection_level 參數 ---
 def batch_update_assignments(updates: list, protection_level: str):
     """
@@ -180,6 +225,7 @@ def batch_update_assignments(updates: list, protection_level: str):
                 return 0, failed_count, f"更新失敗，所有變更已復原。錯誤: {'; '.join(error_messages)}"
             else:
                 conn.commit()
+                occupancy_index.invalidate()
                 # 【核心修改 3】更新成功訊息
                 return success_count, 0, f"成功分配 {success_count} 位員工，{protection_msg}"
 
@@ -292,6 +338,7 @@ def batch_correct_assignments(updates: list, protection_level: str):
                 return 0, failed_count, f"修正失敗，所有變更已復原。錯誤: {'; '.join(error_messages)}"
             else:
                 conn.commit()
+                occupancy_index.invalidate()
                 return success_count, 0, f"成功修正 {success_count} 筆紀錄，{protection_msg}"
 
     except Exception as e:
@@ -5,6 +5,7 @@ import database
 from decimal import Decimal, InvalidOperation
 import locale
 import re # 引入正則表達式
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -400,82 +401,90 @@ def get_resident_details_as_df(dorm_ids: list, year_month: str):
     finally:
         if conn: conn.close()
 
-def get_dorm_analysis_data(dorm_ids: list, year_month: str):
-    """
-    【v2.0 複選版】為指定的所選宿舍和月份，執行全方位的營運數據分析。
-    """
+def _query_to_dataframe(query, params=None):
+    """自行取得連線執行單一查詢 (供 database.run_concurrently 並行使用)；無法連線時回傳 None。"""
     conn = database.get_db_connection()
     if not conn: return None
-
     try:
-        params = {"dorm_ids": dorm_ids, "year_month": year_month}
-        # --- 使用 JOIN 抓取宿舍地址 ---
-        rooms_sql = """
-            SELECT 
-                r.*, 
-                d.original_address 
-            FROM "Rooms" r
-            JOIN "Dormitories" d ON r.dorm_id = d.id
-            WHERE r.dorm_id = ANY(%(dorm_ids)s)
-        """
-        rooms_df = _execute_query_to_dataframe(conn, rooms_sql, params)
-        
-        workers_query = """
-            WITH DateParams AS (
-                SELECT 
-                    TO_DATE(%(year_month)s || '-01', 'YYYY-MM-DD') as first_day_of_month,
-                    (TO_DATE(%(year_month)s || '-01', 'YYYY-MM-DD') + '1 month'::interval - '1 day'::interval)::date as last_day_of_month
-            )
-            SELECT 
-                w.unique_id, w.gender, w.special_status,
-                ah.room_id, r.room_number, r.capacity as room_capacity, r.room_notes
-            FROM "AccommodationHistory" ah
-            JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
-            JOIN "Rooms" r ON ah.room_id = r.id
-            CROSS JOIN DateParams dp
-            WHERE r.dorm_id = ANY(%(dorm_ids)s)
-              AND ah.start_date <= dp.last_day_of_month
-              AND (ah.end_date IS NULL OR ah.end_date >= dp.first_day_of_month)
-        """
-        workers_df = _execute_query_to_dataframe(conn, workers_query, params)
-
-        total_capacity = int(rooms_df['capacity'].sum())
-
-        is_external = workers_df['special_status'].str.contains("掛宿外住", na=False)
-        external_workers_df = workers_df[is_external]
-        actual_residents_df = workers_df[~is_external]
-
-        total_actual_residents = len(actual_residents_df)
-        male_actual_residents = len(actual_residents_df[actual_residents_df['gender'] == '男'])
-        female_actual_residents = len(actual_residents_df[actual_residents_df['gender'] == '女'])
+        return _execute_query_to_dataframe(conn, query, params)
+    finally:
+        conn.close()
 
-        total_external = len(external_workers_df)
-        male_external = len(external_workers_df[external_workers_df['gender'] == '男'])
-        female_external = len(external_workers_df[external_workers_df['gender'] == '女'])
-        
-        special_rooms_df = rooms_df[rooms_df['room_notes'].notna() & (rooms_df['room_notes'] != '')].copy()
-        if not special_rooms_df.empty:
-            special_room_occupancy = actual_residents_df[actual_residents_df['room_id'].isin(special_rooms_df['id'])]\
-                                     .groupby('room_id').size().rename('目前住的人數')
-            # 1. 先合併 (不對整個表 fillna)
-            special_rooms_df = special_rooms_df.merge(special_room_occupancy, left_on='id', right_index=True, how='left')
-
-            # 2. 只針對人數欄位填補 0 並轉為整數
-            special_rooms_df['目前住的人數'] = special_rooms_df['目前住的人數'].fillna(0).astype(int)
-            special_rooms_df['獨立空床數'] = special_rooms_df['capacity'] - special_rooms_df['目前住的人數']
-            
-        # total_special_empty_beds = int(special_rooms_df['獨立空床數'].sum()) if not special_rooms_df.empty else 0
-        total_available_beds = total_capacity - total_actual_residents
+def get_dorm_analysis_data(dorm_ids: list, year_month: str):
+    """
+    【v2.1 並行查詢版】為指定的所選宿舍和月份，執行全方位的營運數據分析。
+    房間與住宿人員兩個查詢互不相依，以 database.run_concurrently 同時執行。
+    """
+    params = {"dorm_ids": dorm_ids, "year_month": year_month}
+    # --- 使用 JOIN 抓取宿舍地址 ---
+    rooms_sql = """
+        SELECT 
+            r.*, 
+            d.original_address 
+        FROM "Rooms" r
+        JOIN "Dormitories" d ON r.dorm_id = d.id
+        WHERE r.dorm_id = ANY(%(dorm_ids)s)
+    """
+    
+    workers_query = """
+        WITH DateParams AS (
+            SELECT 
+                TO_DATE(%(year_month)s || '-01', 'YYYY-MM-DD') as first_day_of_month,
+                (TO_DATE(%(year_month)s || '-01', 'YYYY-MM-DD') + '1 month'::interval - '1 day'::interval)::date as last_day_of_month
+        )
+        SELECT 
+            w.unique_id, w.gender, w.special_status,
+            ah.room_id, r.room_number, r.capacity as room_capacity, r.room_notes
+        FROM "AccommodationHistory" ah
+        JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
+        JOIN "Rooms" r ON ah.room_id = r.id
+        CROSS JOIN DateParams dp
+        WHERE r.dorm_id = ANY(%(dorm_ids)s)
+          AND ah.start_date <= dp.last_day_of_month
+          AND (ah.end_date IS NULL OR ah.end_date >= dp.first_day_of_month)
+    """
+    results = database.run_concurrently({
+        'rooms': (_query_to_dataframe, rooms_sql, params),
+        'workers': (_query_to_dataframe, workers_query, params),
+    })
+    rooms_df, workers_df = results['rooms'], results['workers']
+    if rooms_df is None or workers_df is None: return None
+
+    total_capacity = int(rooms_df['capacity'].sum())
+
+    is_external = workers_df['special_status'].str.contains("掛宿外住", na=False)
+    external_workers_df = workers_df[is_external]
+    actual_residents_df = workers_df[~is_external]
+
+    total_actual_residents = len(actual_residents_df)
+    male_actual_residents = len(actual_residents_df[actual_residents_df['gender'] == '男'])
+    female_actual_residents = len(actual_residents_df[actual_residents_df['gender'] == '女'])
+
+    total_external = len(external_workers_df)
+    male_external = len(external_workers_df[external_workers_df['gender'] == '男'])
+    female_external = len(external_workers_df[external_workers_df['gender'] == '女'])
+    
+    special_rooms_df = rooms_df[rooms_df['room_notes'].notna() & (rooms_df['room_notes'] != '')].copy()
+    if not special_rooms_df.empty:
+        special_room_occupancy = actual_residents_df[actual_residents_df['room_id'].isin(special_rooms_df['id'])]\
+                                 .groupby('room_id').size().rename('目前住的人數')
+        # 1. 先合併 (不對整個表 fillna)
+        special_rooms_df = special_rooms_df.merge(special_room_occupancy, left_on='id', right_index=True, how='left')
+
+        # 2. 只針對人數欄位填補 0 並轉為整數
+        special_rooms_df['目前住的人數'] = special_rooms_df['目前住的人數'].fillna(0).astype(int)
+        special_rooms_df['獨立空床數'] = special_rooms_df['capacity'] - special_rooms_df['目前住的人數']
         
-        return {
-            "total_capacity": total_capacity,
-            "actual_residents": {"total": total_actual_residents, "male": male_actual_residents, "female": female_actual_residents},
-            "external_residents": {"total": total_external, "male": male_external, "female": female_external},
-            "available_beds": {"total": total_available_beds},
-            "special_rooms": special_rooms_df
-        }
-    finally:
-        if conn: conn.close()
+    # total_special_empty_beds = int(special_rooms_df['獨立空床數'].sum()) if not special_rooms_df.empty else 0
+    total_available_beds = total_capacity - total_actual_residents
+    
+    return {
+        "total_capacity": total_capacity,
+        "actual_residents": {"total": total_actual_residents, "male": male_actual_residents, "female": female_actual_residents},
+        "external_residents": {"total": total_external, "male": male_external, "female": female_external},
+        "available_beds": {"total": total_available_beds},
+        "special_rooms": special_rooms_df
+    }
 
 def get_monthly_financial_trend(dorm_ids: list, end_date_str: str = None):
     """
@@ -778,6 +787,7 @@ def get_room_occupancy_view(dorm_ids: list, year_month: str):
     """
     【v4.1 合規優化版】整合房況、名單、特殊註記與合規面積計算。
     直接計算「每人平均面積」，方便檢查是否符合法規。
+    【v4.2】以 groupby 整欄彙總各房間，不再逐房間 apply。
     """
     conn = database.get_db_connection()
     if not conn or not dorm_ids: return pd.DataFrame()
@@ -825,33 +835,53 @@ def get_room_occupancy_view(dorm_ids: list, year_month: str):
         
         if raw_df.empty: return pd.DataFrame()
 
-        def aggregate_room_info(group):
-            names = [n for n in group['worker_name'].tolist() if n]
-            current_count = len(names)
-            total_area = group['area_sq_meters'].iloc[0] or 0
-            
+        # 整欄彙總每個房間 (房間欄位在同一房間的每一列都相同，取第一列即可)
+        has_name = raw_df['worker_name'] != ''
+        rooms = raw_df.groupby('room_id').nth(0).set_index('room_id')
+        current_count = has_name.groupby(raw_df['room_id']).sum().astype(int)
+        names = raw_df[has_name].groupby('room_id')['worker_name'].agg('、'.join)
+        total_area = pd.to_numeric(rooms['area_sq_meters'], errors='coerce').fillna(0)
+        capacity = pd.to_numeric(rooms['capacity'], errors='coerce').fillna(0).astype(int)
+
+        summary_df = pd.DataFrame({
+            '宿舍地址': rooms['original_address'],
+            '房號': rooms['room_number'],
+            '目前人數': current_count,
+            '總容量': rooms['capacity'],
+            '剩餘空床': capacity - current_count,
+            '總面積(㎡)': total_area,
             # 計算：一人平均面積 (若沒人住則顯示為 0)
-            avg_area = round(total_area / current_count, 2) if current_count > 0 else 0
-            raw_capacity = group['capacity'].iloc[0]
-            capacity = int(raw_capacity) if pd.notnull(raw_capacity) else 0
-            return pd.Series({
-                '宿舍地址': group['original_address'].iloc[0],
-                '房號': group['room_number'].iloc[0],
-                '目前人數': current_count,
-                '總容量': group['capacity'].iloc[0],
-                '剩餘空床': capacity - current_count,
-                '總面積(㎡)': total_area,
-                '一人面積(㎡)': avg_area, # <--- 直接計算出來
-                '在住名單': "、".join(names) if names else "(空房)",
-                '特殊備註': group['room_notes'].iloc[0] or ""
-            })
-
-        summary_df = raw_df.groupby('room_id').apply(aggregate_room_info).reset_index(drop=True)
-        return summary_df
+            '一人面積(㎡)': (total_area / current_count.where(current_count > 0)).round(2).fillna(0),
+            '在住名單': names.reindex(rooms.index).fillna("(空房)"),
+            '特殊備註': rooms['room_notes'].fillna(""),
+        })
+        return summary_df.reset_index(drop=True)
 
     finally:
         if conn: conn.close()
 
+def _current_bed_occupants(conn, dorm_id: int) -> pd.DataFrame:
+    """
+    指定宿舍各房間 (排除未分配房間與容量為 0 者) 與目前在住人員，每位在住人員一列、空房一列。
+    在住：起始日 <= 今天 < 退宿日，每位移工只取最新一筆住宿，排除「掛宿外住」。
+    """
+    index = occupancy_index.get_index(conn)
+    stays = occupancy_index.stays_on(conn=conn, end_inclusive=False)
+    living_in = ~stays['special_status'].fillna('').astype(str).str.contains('掛宿外住', case=False, regex=False)
+    latest = (stays[living_in]
+              .sort_values(['start_date', 'stay_id'], ascending=False, kind='stable')
+              .drop_duplicates('worker_unique_id'))
+
+    rooms = index['rooms']
+    rooms = rooms[(rooms['dorm_id'] == dorm_id) & (rooms['room_number'] != occupancy_index.UNASSIGNED_ROOM)
+                  & (pd.to_numeric(rooms['capacity'], errors='coerce') > 0)]
+    rooms = rooms.assign(capacity=rooms['capacity'].astype(int))
+    raw_df = rooms[['room_id', 'original_address', 'room_number', 'capacity']].merge(
+        latest[['room_id', 'worker_name', 'bed_number']], on='room_id', how='left'
+    )
+    raw_df['bed_number'] = raw_df['bed_number'].fillna('')
+    return raw_df.sort_values('room_number', kind='stable').drop(columns=['room_id']).reset_index(drop=True)
+
 def get_bed_occupancy_report(dorm_id: int):
     """
     查詢指定宿舍的房間床位佔用情況，並返回適用於 Excel 格式的數據。
@@ -888,35 +918,8 @@ def get_bed_occupancy_report(dorm_id: int):
     # -------------------------------------------------------------------
 
     try:
-        # 1. SQL 查詢：抓取所有房間資訊和目前在住人員
-        query = """
-            WITH ActiveWorkers AS (
-                 SELECT DISTINCT ON (ah.worker_unique_id)
-                    ah.worker_unique_id, ah.room_id, ah.bed_number, 
-                    w.worker_name, w.special_status
-                FROM "AccommodationHistory" ah
-                JOIN "Workers" w ON ah.worker_unique_id = w.unique_id
-                WHERE ah.start_date <= CURRENT_DATE
-                  AND (ah.end_date IS NULL OR ah.end_date > CURRENT_DATE)
-                  AND (w.special_status IS NULL OR w.special_status NOT ILIKE '%%掛宿外住%%')
-                ORDER BY ah.worker_unique_id, ah.start_date DESC, ah.id DESC
-            )
-            SELECT 
-                d.original_address, 
-                r.room_number, 
-                r.capacity, 
-                aw.worker_name,
-                COALESCE(aw.bed_number, '') AS bed_number
-            FROM "Rooms" r
-            JOIN "Dormitories" d ON r.dorm_id = d.id
-            LEFT JOIN ActiveWorkers aw ON r.id = aw.room_id
-            WHERE 
-                r.dorm_id = %s
-                AND r.room_number != '[未分配房間]'
-                AND r.capacity > 0
-            ORDER BY r.room_number;
-        """
-        raw_df = _execute_query_to_dataframe(conn, query, (dorm_id,))
+        # 1. 由住宿索引取得房間資訊和目前在住人員 (不需再以 DISTINCT ON 查詢)
+        raw_df = _current_bed_occupants(conn, dorm_id)
         
         if raw_df.empty:
             dorm_info_query = 'SELECT original_address FROM "Dormitories" WHERE id = %s'
@@ -2,6 +2,7 @@
 
 import pandas as pd
 import database
+from . import bulk_import
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -69,6 +70,7 @@ def add_vendor(details: dict):
             cursor.execute(sql, tuple(details.values()))
             new_id = cursor.fetchone()['id']
         conn.commit()
+        bulk_import.invalidate()
         return True, f"成功新增廠商 (ID: {new_id})"
     except Exception as e:
         if conn: conn.rollback()
@@ -87,6 +89,7 @@ def update_vendor(vendor_id: int, details: dict):
             sql = f'UPDATE "Vendors" SET {fields} WHERE id = %s'
             cursor.execute(sql, tuple(values))
         conn.commit()
+        bulk_import.invalidate()
         return True, "廠商資料更新成功！"
     except Exception as e:
         if conn: conn.rollback()
@@ -102,6 +105,7 @@ def delete_vendor(vendor_id: int):
         with conn.cursor() as cursor:
             cursor.execute('DELETE FROM "Vendors" WHERE id = %s', (vendor_id,))
         conn.commit()
+        bulk_import.invalidate()
         return True, "廠商資料已成功刪除。"
     except Exception as e:
         if conn: conn.rollback()
@@ -1,7 +1,10 @@
 import pandas as pd
+import psycopg2
 from datetime import datetime, date, timedelta
 import database
-import numpy as np
+from . import identity_resolver
+from . import editor_sync
+from . import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -190,6 +193,28 @@ def get_single_worker_details(unique_id: str):
     finally:
         if conn: conn.close()
 
+def _write_fee_history(cursor, worker_id, fee_type, amount, effective_date, has_unique_index: bool):
+    """
+    寫入一筆費用歷史；同一人、同一費用類型、同一生效日已有紀錄時改為更新金額 (以最後一次為準)。
+    有唯一索引時以 ON CONFLICT 一次完成；舊資料庫尚有重複紀錄、未建立唯一索引時改為先 UPDATE、沒有才 INSERT。
+    """
+    if has_unique_index:
+        cursor.execute(
+            '''INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date) VALUES (%s, %s, %s, %s)
+               ON CONFLICT (worker_unique_id, fee_type, effective_date) DO UPDATE SET amount = EXCLUDED.amount''',
+            (worker_id, fee_type, amount, effective_date)
+        )
+        return
+    cursor.execute(
+        'UPDATE "FeeHistory" SET amount = %s WHERE worker_unique_id = %s AND fee_type = %s AND effective_date = %s',
+        (amount, worker_id, fee_type, effective_date)
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            'INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date) VALUES (%s, %s, %s, %s)',
+            (worker_id, fee_type, amount, effective_date)
+        )
+
 def _log_fee_change(cursor, worker_id, details, old_details, effective_date):
     """
     【v2.1 修改版】內部函式：比較新舊費用資料，並將變動寫入 FeeHistory。
@@ -203,6 +228,7 @@ def _log_fee_change(cursor, worker_id, details, old_details, effective_date):
         'charging_cleaning_fee': '充電清潔費'
     }
 
+    has_unique_index = None
     for key, fee_type_name in fee_map.items():
         if key not in details:
             continue
@@ -214,8 +240,10 @@ def _log_fee_change(cursor, worker_id, details, old_details, effective_date):
         old_amount = int(old_value) if old_value is not None else 0
         
         if new_amount != old_amount:
-            sql = 'INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date) VALUES (%s, %s, %s, %s)'
-            cursor.execute(sql, (worker_id, fee_type_name, new_amount, effective_date))
+            # 同一天內多次修改時，以最後一次的金額為準
+            if has_unique_index is None:
+                has_unique_index = database.fee_history_unique_index_exists(cursor)
+            _write_fee_history(cursor, worker_id, fee_type_name, new_amount, effective_date, has_unique_index)
             
 def update_worker_details(unique_id: str, details: dict, effective_date: date = None):
     """
@@ -245,6 +273,8 @@ def update_worker_details(unique_id: str, details: dict, effective_date: date =
             sql = f'UPDATE "Workers" SET {fields} WHERE "unique_id" = %s'
             cursor.execute(sql, tuple(values))
         conn.commit()
+        occupancy_index.invalidate()
+        identity_resolver.invalidate()
         return True, "員工核心資料更新成功！"
     except Exception as e:
         if conn: conn.rollback()
@@ -320,6 +350,8 @@ def add_manual_worker(details: dict, initial_status: dict, bed_number: str = Non
                 cursor.execute(status_sql, tuple(initial_status.values()))
 
         conn.commit()
+        occupancy_index.invalidate()
+        identity_resolver.invalidate()
         return True, f"成功新增手動管理員工 (ID: {details['unique_id']})", details['unique_id']
     except Exception as e:
         if conn: conn.rollback()
@@ -335,6 +367,8 @@ def delete_worker_by_id(unique_id: str):
         with conn.cursor() as cursor:
             cursor.execute('DELETE FROM "Workers" WHERE unique_id = %s', (unique_id,))
         conn.commit()
+        occupancy_index.invalidate()
+        identity_resolver.invalidate()
         return True, "員工資料及其所有歷史紀錄已成功刪除。"
     except Exception as e:
         if conn: conn.rollback()
@@ -444,6 +478,7 @@ def add_new_worker_status(details: dict):
                 cursor.execute(update_worker_sql, (details['worker_unique_id'],))
 
         conn.commit()
+        occupancy_index.invalidate()
         
         if new_status:
             return True, f"成功新增狀態「{new_status}」。"
@@ -517,6 +552,7 @@ def update_worker_status(status_id: int, details: dict):
             )
 
         conn.commit()
+        occupancy_index.invalidate()
         
         # 回傳訊息中提示同步結果
         msg_extra = f"，人員目前狀態已同步為「{new_current_status}」" if new_current_status else "，人員目前狀態已同步為「正常在住」"
@@ -573,6 +609,7 @@ def delete_worker_status(status_id: int):
             )
             
         conn.commit()
+        occupancy_index.invalidate()
         return True, f"狀態紀錄已成功刪除，員工狀態已更新為「{new_status}」。"
         
     except Exception as e:
@@ -645,6 +682,7 @@ def change_worker_accommodation(worker_id: str, new_room_id: int, change_date: d
             )
 
         conn.commit()
+        occupancy_index.invalidate()
         return True, "工人住宿資料更新成功！"
     except Exception as e:
         if conn: conn.rollback()
@@ -785,6 +823,7 @@ def update_accommodation_history(history_id: int, details: dict):
             )
 
         conn.commit()
+        occupancy_index.invalidate()
         
         status_msg = f"（{new_end_date}）" if new_end_date else "（在住）"
         return True, f"住宿歷史紀錄更新成功！員工的最終離住日已同步更新為: {status_msg}。"
@@ -841,6 +880,7 @@ def delete_accommodation_history(history_id: int):
             )
             
         conn.commit()
+        occupancy_index.invalidate()
         
         status_msg = f"（{new_end_date}）" if new_end_date else "（在住）"
         return True, f"住宿歷史紀錄已成功刪除，員工的最終離住日已同步更新為: {status_msg}。"
@@ -879,6 +919,9 @@ def add_fee_history(details: dict):
             cursor.execute(sql, tuple(details.values()))
         conn.commit()
         return True, "成功新增費用歷史紀錄。"
+    except psycopg2.errors.UniqueViolation:
+        if conn: conn.rollback()
+        return False, "該員工在此生效日已有相同類型的費用紀錄，請改為編輯該筆紀錄。"
     except Exception as e:
         if conn: conn.rollback()
         return False, f"新增費用歷史時發生錯誤: {e}"
@@ -966,6 +1009,7 @@ def batch_update_workers_complex(worker_ids: list, updates: dict, protection_lev
 
     try:
         with conn.cursor() as cursor:
+            has_unique_index = database.fee_history_unique_index_exists(cursor) if fee_change else False
             for worker_id in worker_ids:
                 
                 # --- 1. 處理住宿異動 (換宿) ---
@@ -1010,11 +1054,8 @@ def batch_update_workers_complex(worker_ids: list, updates: dict, protection_lev
                     for fee_key, fee_amount in fees_to_update.items():
                         if fee_key in fee_key_to_name_map:
                             fee_type_name = fee_key_to_name_map[fee_key]
-                            # 新增一筆費用歷史
-                            cursor.execute(
-                                'INSERT INTO "FeeHistory" (worker_unique_id, fee_type, amount, effective_date) VALUES (%s, %s, %s, %s)',
-                                (worker_id, fee_type_name, int(fee_amount), fee_effective_date)
-                            )
+                            # 新增一筆費用歷史 (同日已有紀錄時更新金額)
+                            _write_fee_history(cursor, worker_id, fee_type_name, int(fee_amount), fee_effective_date, has_unique_index)
                 
                 # --- 4. 統一設定保護層級 ---
                 # 無論執行了 1, 2, 還是 3，最後都根據使用者的選擇來設定 data_source
@@ -1026,6 +1067,7 @@ def batch_update_workers_complex(worker_ids: list, updates: dict, protection_lev
 
             # --- 所有員工都成功處理後，提交交易 ---
             conn.commit()
+            occupancy_index.invalidate()
             return True, f"成功批次更新 {len(worker_ids)} 位員工的資料，並將他們的保護層級設為「{protection_level}」。"
 
     except Exception as e:
@@ -1123,11 +1165,21 @@ def get_fee_history_for_workers(worker_ids: list, date_range: tuple = None):
     finally:
         if conn: conn.close()
 
+HISTORY_EDITOR_COLUMN_MAP = {
+    "入住日": "start_date",
+    "離住日": "end_date",
+    "備註": "notes",
+    "床位編號": "bed_number",
+    "金額": "amount",
+    "生效日期": "effective_date",
+}
+
 def batch_edit_history(original_df: pd.DataFrame, edited_df: pd.DataFrame, table_name: str, key_column: str, columns_to_update: list, protection_level: str):
     """
     【v2.16 修改版】通用的歷史紀錄批次編輯器後端邏輯。
     - 修正了 SQL 更新迴圈中，因欄位名稱 (DataFrame vs DB) 錯用導致更新失敗的 Bug。
     - 新增 protection_level 參數，允許自訂更新後的資料保護層級。
+    【v3.2 差異引擎版】以 editor_sync 比對出有變動的列後，以一道 UPDATE ... FROM (VALUES ...) 寫回。
     """
     # 確保日期格式一致
     for col in columns_to_update:
@@ -1135,68 +1187,31 @@ def batch_edit_history(original_df: pd.DataFrame, edited_df: pd.DataFrame, table
             original_df[col] = pd.to_datetime(original_df[col], errors='coerce').dt.date
             edited_df[col] = pd.to_datetime(edited_df[col], errors='coerce').dt.date
 
-    # 將 NaN/NaT 轉換為 None (與資料庫 NULL 一致)
-    original_df = original_df.replace({np.nan: None})
-    edited_df = edited_df.replace({np.nan: None})
-
-    # 設置索引以便比對
-    original_indexed = original_df.set_index(key_column)
-    edited_indexed = edited_df.set_index(key_column)
-
     # 找出有變更的行
     try:
-        diff_df = edited_indexed[columns_to_update].compare(original_indexed[columns_to_update])
+        rows_to_update = editor_sync.compute_diff(original_df, edited_df, key_column, columns_to_update)['updates']
     except Exception as e:
         return False, f"資料比對時發生型別錯誤: {e}。請確保日期格式正確。"
 
-    if diff_df.empty:
+    if rows_to_update.empty:
         return True, "沒有偵測到任何變更。"
 
-    changed_ids = diff_df.index.tolist()
-    # 從「編輯後」的 DataFrame 中獲取這些變更的完整資料
-    rows_to_update = edited_indexed.loc[changed_ids]
-
     # 找出所有被影響的 worker_unique_id，以便最後設定保護
     if 'worker_unique_id' not in rows_to_update.columns:
         return False, "資料比對時發生內部錯誤：缺少 'worker_unique_id' 欄位。"
         
-    unique_worker_ids_to_protect = rows_to_update['worker_unique_id'].unique()
+    unique_worker_ids_to_protect = rows_to_update['worker_unique_id'].dropna().unique()
     
     conn = database.get_db_connection()
     if not conn: return False, "資料庫連線失敗。"
 
     try:
         with conn.cursor() as cursor:
-            update_count = 0
-            # 遍歷每一筆被修改的紀錄
-            for record_id, row_data in rows_to_update.iterrows():
-                
-                # 構建 UPDATE 語句
-                set_clauses = []
-                set_values = []
-
-                # (v2.15.1 修正)
-                for col_name in columns_to_update:
-                    db_col = col_name 
-                    if col_name == "入住日": db_col = "start_date"
-                    elif col_name == "離住日": db_col = "end_date"
-                    elif col_name == "備註": db_col = "notes"
-                    elif col_name == "床位編號": db_col = "bed_number"
-                    elif col_name == "金額": db_col = "amount"
-                    elif col_name == "生效日期": db_col = "effective_date"
-                    elif col_name == "worker_unique_id": db_col = "worker_unique_id"
-                    
-                    if col_name in row_data:
-                        set_clauses.append(f'"{db_col}" = %s')
-                        set_values.append(row_data[col_name])
-                
-                if set_clauses:
-                    set_sql = ", ".join(set_clauses)
-                    sql = f'UPDATE "{table_name}" SET {set_sql} WHERE "{key_column}" = %s'
-                    set_values.append(record_id)
-                    
-                    cursor.execute(sql, tuple(set_values))
-                    update_count += 1
+            # 介面欄位名稱 → 資料庫欄位名稱，所有變更列以一道 UPDATE 寫回
+            db_columns = [HISTORY_EDITOR_COLUMN_MAP.get(col, col) for col in columns_to_update]
+            updates = rows_to_update[[key_column] + columns_to_update].copy()
+            updates.columns = [key_column] + db_columns
+            update_count = editor_sync.update_rows(cursor, table_name, key_column, updates, db_columns)
             
             # --- 自動設定資料保護 ---
             protection_msg = "（未設定保護層級）。"
@@ -1224,6 +1239,7 @@ def batch_edit_history(original_df: pd.DataFrame, edited_df: pd.DataFrame, table
                 protection_msg = f"並已為 {len(unique_worker_ids_to_protect)} 位員工設定保護層級為「{protection_level}」。"
                 
             conn.commit()
+            occupancy_index.invalidate()
             return True, f"成功更新 {update_count} 筆歷史紀錄，{protection_msg}"
 
     except Exception as e:
@@ -1570,6 +1586,7 @@ def batch_update_worker_status(updates: list):
                     raise e 
         
         conn.commit()
+        occupancy_index.invalidate()
         return success_count, fail_count, f"成功更新 {success_count} 筆狀態。"
 
     except Exception as e:
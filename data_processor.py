@@ -1,292 +1,176 @@
 import pandas as pd
 from lxml import etree
-import re
 import os
+import multiprocessing
 from datetime import datetime
 from typing import List, Callable, Dict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from address_normalizer import normalize_address, normalize_address_series
 
-def chinese_to_arabic(cn_num_str: str) -> str:
+def normalize_taiwan_address(address: str) -> Dict[str, str]:
     """
-    進階的中文數字轉阿拉伯數字函式，能處理'五百五十七'這樣的語意。
+    對台灣地址進行深度正規化 (v2.8 規則)。
+    實作已移至 address_normalizer (預先編譯 + LRU 快取)；整欄處理請改用 normalize_address_series。
     """
-    if not isinstance(cn_num_str, str): return cn_num_str
-    
-    cn_num_map = {'〇': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
-    cn_unit_map = {'十': 10, '百': 100, '千': 1000, '萬': 10000}
-    
-    # 直接替換，處理 "五十之三" -> "50之3"
-    for cn, ar in cn_num_map.items():
-        cn_num_str = cn_num_str.replace(cn, str(ar))
-        
-    # 處理進位
-    if '十' in cn_num_str and cn_num_str.startswith('十'):
-        cn_num_str = '1' + cn_num_str
-
-    def _trans(s):
-        num = 0
-        if s:
-            idx = s.find('十')
-            if idx != -1:
-                num += int(s[:idx]) * 10
-                if len(s) > idx+1:
-                    num += int(s[idx+1:])
-            else:
-                num += int(s)
-        return num
-
-    sec = cn_num_str.split('百')
-    if len(sec) > 2: # 避免多個 "百"
-        return cn_num_str
-
-    num = 0
-    if len(sec) == 2:
-        if sec[0]:
-            num += int(sec[0]) * 100
-        else: #處理 "百三" -> 103
-             num += 100
-        num += _trans(sec[1])
-    else:
-        num = _trans(sec[0])
-    return str(num)
+    return normalize_address(address)
+
+# 報表欄位名稱 -> 系統內部欄位名稱
+REQUIRED_COLS_MAP = {
+    '客戶簡稱': 'employer_name',
+    '姓名(中)': 'worker_name',
+    '英文姓名': 'native_name',
+    '性別': 'gender',
+    '國籍': 'nationality',
+    '護照號碼': 'passport_number',
+    '居留證號': 'arc_number',
+    '交工日': 'accommodation_start_date',
+    '聘僱期滿日': 'work_permit_expiry_date',
+    '居住地址': 'original_address',
+    '出境日期': 'departure_date'
+}
+
+# 檔案數量少於此值時直接在目前行程解析，避免啟動行程池的額外成本
+PARALLEL_MIN_FILES = 4
+
+def parse_report_file(file_path: str):
+    """
+    解析單一份移工報表 (Excel 2003 XML)。
+    此函式會在子行程中執行，因此不直接呼叫 log_callback，
+    而是把日誌訊息依發生順序收集起來，連同資料列一併回傳給主行程。
+    回傳: (資料列字典列表, 日誌訊息列表)
+    """
+    rows_data = []
+    messages = []
+    ns = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
+    parser = etree.XMLParser(recover=True, encoding='utf-8')
+    file_name = os.path.basename(file_path)
+    header_index_map = {}
+    is_data_section = False
 
-def normalize_taiwan_address(address: str) -> Dict[str, str]:
-    """對台灣地址進行深度正規化 (v2.8 最終版)。"""
-    if not isinstance(address, str) or pd.isna(address) or not address.strip():
-        return {'full': "", 'city': "", 'district': ""}
-    
-    addr = address.strip().upper().replace(" ", "").replace("\u3000", "").replace("臺", "台")
-    addr = addr.replace('.', '、').replace('-', '之')
-    full_width_nums = "０１２３４５６７８９"
-    half_width_nums = "0123456789"
-    addr = addr.translate(str.maketrans(full_width_nums, half_width_nums))
-    addr = addr.replace('鎭', '鎮')
-    addr = addr.replace('F', '樓')
-    addr = re.sub(r'[\(（].*?[\)）]', '', addr)
-    addr = re.sub(r'(\d+)鄰', '', addr)
-    addr = re.sub(r'(縣|市|區|鄉|鎮|村|里|路|街|段|巷|弄|號|樓)\1+', r'\1', addr)
-
-    addr = re.sub(r'([一二三四五六七八九十百]+)(?=段|巷|弄|號|樓|街)', lambda m: chinese_to_arabic(m.group(1)), addr)
-
-    county_map = {
-        # 彰化縣 (2市 6鎮 18鄉)
-        "彰化市": "彰化縣彰化市",
-        "員林市": "彰化縣員林市",
-        "和美鎮": "彰化縣和美鎮",
-        "鹿港鎮": "彰化縣鹿港鎮",
-        "溪湖鎮": "彰化縣溪湖鎮",
-        "二林鎮": "彰化縣二林鎮",
-        "田中鎮": "彰化縣田中鎮",
-        "北斗鎮": "彰化縣北斗鎮",
-        "花壇鄉": "彰化縣花壇鄉",
-        "芬園鄉": "彰化縣芬園鄉",
-        "大村鄉": "彰化縣大村鄉",
-        "永靖鄉": "彰化縣永靖鄉",
-        "伸港鄉": "彰化縣伸港鄉",
-        "線西鄉": "彰化縣線西鄉",
-        "福興鄉": "彰化縣福興鄉",
-        "秀水鄉": "彰化縣秀水鄉",
-        "埔心鄉": "彰化縣埔心鄉",
-        "埔鹽鄉": "彰化縣埔鹽鄉",
-        "大城鄉": "彰化縣大城鄉",
-        "芳苑鄉": "彰化縣芳苑鄉",
-        "竹塘鄉": "彰化縣竹塘鄉",
-        "社頭鄉": "彰化縣社頭鄉",
-        "二水鄉": "彰化縣二水鄉",
-        "田尾鄉": "彰化縣田尾鄉",
-        "埤頭鄉": "彰化縣埤頭鄉",
-        "溪州鄉": "彰化縣溪州鄉",
-
-        # 雲林縣 (1市 5鎮 14鄉)
-        "斗六市": "雲林縣斗六市",
-        "斗南鎮": "雲林縣斗南鎮",
-        "虎尾鎮": "雲林縣虎尾鎮",
-        "西螺鎮": "雲林縣西螺鎮",
-        "土庫鎮": "雲林縣土庫鎮",
-        "北港鎮": "雲林縣北港鎮",
-        "莿桐鄉": "雲林縣莿桐鄉",
-        "林內鄉": "雲林縣林內鄉",
-        "古坑鄉": "雲林縣古坑鄉",
-        "大埤鄉": "雲林縣大埤鄉",
-        "崙背鄉": "雲林縣崙背鄉",
-        "二崙鄉": "雲林縣二崙鄉",
-        "麥寮鄉": "雲林縣麥寮鄉",
-        "東勢鄉": "雲林縣東勢鄉",
-        "褒忠鄉": "雲林縣褒忠鄉",
-        "臺西鄉": "雲林縣臺西鄉",
-        "元長鄉": "雲林縣元長鄉",
-        "四湖鄉": "雲林縣四湖鄉",
-        "口湖鄉": "雲林縣口湖鄉",
-        "水林鄉": "雲林縣水林鄉",
-
-        # 嘉義縣 (2市 3鎮 15鄉)
-        "太保市": "嘉義縣太保市",
-        "朴子市": "嘉義縣朴子市",
-        "布袋鎮": "嘉義縣布袋鎮",
-        "大林鎮": "嘉義縣大林鎮",
-        "民雄鄉": "嘉義縣民雄鄉",
-        "溪口鄉": "嘉義縣溪口鄉",
-        "新港鄉": "嘉義縣新港鄉",
-        "六腳鄉": "嘉義縣六腳鄉",
-        "東石鄉": "嘉義縣東石鄉",
-        "義竹鄉": "嘉義縣義竹鄉",
-        "鹿草鄉": "嘉義縣鹿草鄉",
-        "水上鄉": "嘉義縣水上鄉",
-        "中埔鄉": "嘉義縣中埔鄉",
-        "竹崎鄉": "嘉義縣竹崎鄉",
-        "梅山鄉": "嘉義縣梅山鄉",
-        "番路鄉": "嘉義縣番路鄉",
-        "大埔鄉": "嘉義縣大埔鄉",
-        "阿里山鄉": "嘉義縣阿里山鄉",
-
-        # 嘉義市 (直轄市)
-        "嘉義市": "嘉義市嘉義市",
-
-        # 新竹縣 (1市 3鎮 9鄉)
-        "竹北市": "新竹縣竹北市",
-        "竹東鎮": "新竹縣竹東鎮",
-        "新埔鎮": "新竹縣新埔鎮",
-        "關西鎮": "新竹縣關西鎮",
-        "湖口鄉": "新竹縣湖口鄉",
-        "新豐鄉": "新竹縣新豐鄉",
-        "芎林鄉": "新竹縣芎林鄉",
-        "橫山鄉": "新竹縣橫山鄉",
-        "北埔鄉": "新竹縣北埔鄉",
-        "寶山鄉": "新竹縣寶山鄉",
-        "峨眉鄉": "新竹縣峨眉鄉",
-        "尖石鄉": "新竹縣尖石鄉",
-        "五峰鄉": "新竹縣五峰鄉",
-
-        # 新竹市 (直轄市)
-        "新竹市": "新竹市新竹市",
-    }
-
-    for city_short, city_full in county_map.items():
-        if addr.startswith(city_short):
-            addr = addr.replace(city_short, city_full, 1)
-            break
-    pattern = r'(?P<city>\D+?[縣市])?(?P<district>\D+?[區鄉鎮市])?(?P<village>\D+?[村里])?(?P<road>.*?((路|街|大道|道)(?!.*(路|街|大道|道))))?(?P<section>.*?[段])?(?P<lane>.*?[巷])?(?P<alley>.*?[弄])?(?P<number>[\d之、-]+[號])?(?P<floor>.*?[樓])?(?P<rest>.*)'
-    match = re.search(pattern, addr)
-    if not match: return {'full': addr, 'city': "", 'district': ""}
-    parts = match.groupdict(default='')
-    
-    # --- 擴充權威性判斷規則 ---
-    village_part = parts.get('village', '')
-    # 如果地址中包含路/街/段，或「巷」，則村里為贅述，應忽略
-    if parts.get('road') or parts.get('section') or parts.get('lane'):
-        village_part = ''
-        
-    normalized_full = f"{parts.get('city', '')}{parts.get('district', '')}{village_part}{parts.get('road', '')}{parts.get('section', '')}{parts.get('lane', '')}{parts.get('alley', '')}{parts.get('number', '')}{parts.get('floor', '')}{parts.get('rest', '')}"
-    normalized_full = re.sub(r'\s+', '', normalized_full).strip()
-    
-    return {'full': normalized_full, 'city': parts.get('city', ''), 'district': parts.get('district', '')}
+    try:
+        with open(file_path, 'rb') as f:
+            file_content = f.read()
+
+        if not file_content:
+            messages.append(f"WARNING: 檔案 {file_name} 內容為空，已略過。")
+            return rows_data, messages
+
+        tree = etree.fromstring(file_content, parser=parser)
+        rows_xml = tree.xpath('.//ss:Row', namespaces=ns)
+
+        for row in rows_xml:
+
+            cells_text = []
+            for cell in row.findall('ss:Cell', ns):
+                data_element = cell.find('ss:Data', ns)
+                if data_element is not None and data_element.text is not None:
+                    cells_text.append(data_element.text.strip())
+                else:
+                    cells_text.append("")
+
+            if not cells_text: continue
+
+            if "客戶簡稱" in cells_text and "姓名(中)" in cells_text and not is_data_section:
+                is_data_section = True
+
+                header_index_map = {}
+                for i, col_name in enumerate(cells_text):
+                    if col_name in REQUIRED_COLS_MAP:
+                        if col_name not in header_index_map:
+                            header_index_map[col_name] = i
+
+                missing_cols = set(REQUIRED_COLS_MAP.keys()) - set(header_index_map.keys())
+                if missing_cols:
+                    messages.append(f"CRITICAL: 檔案 {file_name} 的標頭中缺少必要欄位: {missing_cols}。跳過此檔案。")
+                    is_data_section = False
+                    header_index_map = {}
+                    break
+                continue
+
+            if is_data_section:
+                worker_dict = {}
+                try:
+                    for xml_col_name, internal_col_name in REQUIRED_COLS_MAP.items():
+                        col_index = header_index_map[xml_col_name]
+                        if col_index < len(cells_text):
+                            worker_dict[internal_col_name] = cells_text[col_index]
+                        else:
+                            worker_dict[internal_col_name] = ""
+
+                    # 基礎驗證，並在失敗時記錄日誌
+                    emp_name = worker_dict.get('employer_name')
+                    w_name = worker_dict.get('worker_name')
+                    addr = worker_dict.get('original_address') # "居住地址"
+
+                    if not emp_name or not w_name or not addr:
+                        messages.append(f"WARNING: [資料過濾] 在檔案 {file_name} 中跳過一筆資料，因缺少必要欄位。 (雇主: '{emp_name}', 姓名: '{w_name}', 居住地址: '{addr}')")
+                        continue # 跳過缺少雇主、姓名、或居住地址的資料
+
+                    rows_data.append(worker_dict)
+
+                except IndexError:
+                    messages.append(f"WARNING: 偵測到資料列長度不足或格式不符，已跳過。")
+                except Exception as e:
+                    messages.append(f"WARNING: 解析資料列時出錯: {e}")
+
+    except Exception as e:
+        messages.append(f"ERROR: 解析檔案 {file_name} 時發生嚴重錯誤: {e}")
+
+    return rows_data, messages
+
+def _map_in_process_pool(func, items: list, log_callback: Callable[[str], None], max_workers: int = None) -> list:
+    """
+    以行程池平行執行 func(item)，並「依 items 原始順序」回傳結果。
+    檔案數量太少或行程池無法啟動時 (例如受限環境)，自動退回單一行程逐一執行。
+    """
+    if len(items) < PARALLEL_MIN_FILES:
+        return [func(item) for item in items]
+
+    workers = min(max_workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    # 每個子行程一次領取多個檔案，降低行程間通訊的次數
+    chunksize = max(1, len(items) // (workers * 4))
+    try:
+        # 以 spawn 啟動子行程：從 Streamlit 背景工作呼叫時主行程有多個執行緒與連線池的連線，fork 會複製到子行程 (可能死結)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(executor.map(func, items, chunksize=chunksize))
+    except (BrokenProcessPool, OSError) as e:
+        log_callback(f"WARNING: 無法啟動平行解析 ({e})，改為逐一解析檔案。")
+        return [func(item) for item in items]
+
+def parse_report_files(
+    file_paths: List[str],
+    log_callback: Callable[[str], None],
+    max_workers: int = None
+) -> List[dict]:
+    """
+    以多核心平行解析多份移工報表，合併所有檔案的資料列。
+    各檔案的警告訊息會依檔案順序轉送給 log_callback，與逐一解析時的日誌順序相同。
+    """
+    results = _map_in_process_pool(parse_report_file, list(file_paths), log_callback, max_workers)
+
+    all_workers_data = []
+    for rows_data, messages in results:
+        for message in messages:
+            log_callback(message)
+        all_workers_data.extend(rows_data)
+    return all_workers_data
 
 def parse_and_process_reports(
     file_paths: List[str],
     log_callback: Callable[[str], None]
 ) -> pd.DataFrame:
     """
-    【v2.19 "日誌增強" 修正版】
-    在過濾掉缺少必要欄位的資料列時，印出明確的警告日誌，
-    讓使用者能追蹤是哪個檔案的哪筆資料被跳過了。
+    【v2.20 平行解析版】
+    報表檔案改由行程池平行解析 (parse_report_files)，解析時間隨核心數縮短；
+    被過濾掉的資料列仍會依檔案順序印出明確的警告日誌。
     """
-    log_callback("INFO: 開始執行報表解析與資料處理程序 (v2.19 日誌增強版)...")
-    all_workers_data = [] # 儲存 {欄位名: 值} 的字典列表
-    ns = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
-    parser = etree.XMLParser(recover=True, encoding='utf-8')
-
-    # 1. 定義我們系統真正需要的欄位
-    REQUIRED_COLS_MAP = {
-        '客戶簡稱': 'employer_name',
-        '姓名(中)': 'worker_name',
-        '英文姓名': 'native_name',
-        '性別': 'gender',
-        '國籍': 'nationality',
-        '護照號碼': 'passport_number',
-        '居留證號': 'arc_number',
-        '交工日': 'accommodation_start_date',
-        '聘僱期滿日': 'work_permit_expiry_date',
-        '居住地址': 'original_address',
-        '出境日期': 'departure_date'
-    }
-    
-    for file_path in file_paths:
-        header_index_map = {}
-        is_data_section = False
-        
-        try:
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
-            if not file_content:
-                log_callback(f"WARNING: 檔案 {os.path.basename(file_path)} 內容為空，已略過。")
-                continue
-
-            tree = etree.fromstring(file_content, parser=parser)
-            rows_xml = tree.xpath('.//ss:Row', namespaces=ns)
-            
-            # log_callback(f"INFO: 正在解析檔案: {os.path.basename(file_path)}...")
-            
-            for row in rows_xml:
-                
-                cells_text = []
-                for cell in row.findall('ss:Cell', ns):
-                    data_element = cell.find('ss:Data', ns)
-                    if data_element is not None and data_element.text is not None:
-                        cells_text.append(data_element.text.strip())
-                    else:
-                        cells_text.append("") 
-                
-                if not cells_text: continue
-                
-                if "客戶簡稱" in cells_text and "姓名(中)" in cells_text and not is_data_section:
-                    is_data_section = True
-                    # log_callback(f"INFO: 在檔案 {os.path.basename(file_path)} 中找到資料標頭，正在建立欄位索引...")
-                     
-                    header_index_map = {}
-                    for i, col_name in enumerate(cells_text):
-                        if col_name in REQUIRED_COLS_MAP:
-                            if col_name not in header_index_map: 
-                                header_index_map[col_name] = i
-                    
-                    missing_cols = set(REQUIRED_COLS_MAP.keys()) - set(header_index_map.keys())
-                    if missing_cols:
-                        log_callback(f"CRITICAL: 檔案 {os.path.basename(file_path)} 的標頭中缺少必要欄位: {missing_cols}。跳過此檔案。")
-                        is_data_section = False
-                        header_index_map = {}
-                        break 
-                    
-                    # log_callback(f"INFO: 欄位索引建立成功。 '居住地址' 位於索引 {header_index_map.get('居住地址', 'N/A')}, '交工日' 位於索引 {header_index_map.get('交工日', 'N/A')}。")
-                    continue 
-
-                if is_data_section:
-                    worker_dict = {}
-                    try:
-                        for xml_col_name, internal_col_name in REQUIRED_COLS_MAP.items():
-                            col_index = header_index_map[xml_col_name]
-                            if col_index < len(cells_text):
-                                worker_dict[internal_col_name] = cells_text[col_index]
-                            else:
-                                worker_dict[internal_col_name] = ""
-                        
-                        # 基礎驗證，並在失敗時印出日誌
-                        emp_name = worker_dict.get('employer_name')
-                        w_name = worker_dict.get('worker_name')
-                        addr = worker_dict.get('original_address') # "居住地址"
-
-                        if not emp_name or not w_name or not addr:
-                            # 新增日誌，讓被跳過的資料不再是 "安靜" 的
-                            log_callback(f"WARNING: [資料過濾] 在檔案 {os.path.basename(file_path)} 中跳過一筆資料，因缺少必要欄位。 (雇主: '{emp_name}', 姓名: '{w_name}', 居住地址: '{addr}')")
-                            continue # 跳過缺少雇主、姓名、或居住地址的資料
-
-                        all_workers_data.append(worker_dict)
-                    
-                    except IndexError:
-                        log_callback(f"WARNING: 偵測到資料列長度不足或格式不符，已跳過。")
-                    except Exception as e:
-                         log_callback(f"WARNING: 解析資料列時出錯: {e}")
-
-        except Exception as e:
-            log_callback(f"ERROR: 解析檔案 {os.path.basename(file_path)} 時發生嚴重錯誤: {e}")
+    log_callback("INFO: 開始執行報表解析與資料處理程序 (v2.20 平行解析版)...")
+    all_workers_data = parse_report_files(file_paths, log_callback)
 
     if not all_workers_data:
         log_callback("CRITICAL: 所有檔案均解析失敗或為空，未抓取到任何有效資料。")
@@ -295,6 +179,92 @@ def parse_and_process_reports(
     master_df = pd.DataFrame(all_workers_data)
     log_callback(f"INFO: 所有報表已成功合併！總共有 {len(master_df)} 筆有效資料。")
 
+    return clean_worker_frame(master_df, log_callback)
+
+# 報表中常見的日期格式 {格式: 值必須完全符合的樣式}，依序嘗試；樣式限定只有寫法明確的值才套用格式
+# (例如 %Y%m%d 只用於剛好 8 位數字，'2024015' 這類殘缺值不會被猜成日期)，其餘一律退回 pandas 的通用解析
+DATE_FORMAT_HINTS = {
+    '%Y-%m-%d': r'\d{4}-\d{1,2}-\d{1,2}',
+    '%Y/%m/%d': r'\d{4}/\d{1,2}/\d{1,2}',
+    '%Y%m%d': r'\d{8}',
+    '%Y-%m-%d %H:%M:%S': r'\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}',
+    '%Y/%m/%d %H:%M:%S': r'\d{4}/\d{1,2}/\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}',
+}
+
+def convert_date_columns(df: pd.DataFrame, columns: List[str], log_callback: Callable[[str], None]) -> pd.DataFrame:
+    """
+    以整欄向量化的方式，將日期欄位統一為 'YYYY-MM-DD' 字串 (空白或無效值為 None)。
+    先用 DATE_FORMAT_HINTS 逐一整欄比對 (只比對完全符合樣式的值)，無法以格式解析的值再逐一交給
+    pd.to_datetime 通用解析 (每個不同的值只解析一次)。輸出只保留日期部分。無效日期只會在最後彙總成一則警告。
+    """
+    for col in columns:
+        if col not in df.columns:
+            continue
+        raw = df[col]
+        text = raw.astype(object).where(raw.notna(), None)
+        stripped = text.map(lambda x: str(x).strip() if x is not None else "")
+        has_value = stripped != ""
+
+        parsed = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+        pending = has_value.copy()
+        for fmt, pattern in DATE_FORMAT_HINTS.items():
+            if not pending.any():
+                break
+            candidates = pending & stripped.str.fullmatch(pattern)
+            if not candidates.any():
+                continue
+            attempt = pd.to_datetime(stripped[candidates], format=fmt, errors='coerce')
+            matched = attempt.notna()
+            parsed.loc[matched[matched].index] = attempt[matched]
+            pending.loc[matched[matched].index] = False
+
+        if pending.any():
+            # 格式提示都不符合的值：每個「不同的原始值」只解析一次
+            leftovers = text[pending]
+            unique_values = leftovers.drop_duplicates()
+            fallback = {value: pd.to_datetime(value, errors='coerce') for value in unique_values}
+            parsed.loc[leftovers.index] = leftovers.map(fallback).astype('datetime64[ns]')
+
+        invalid_mask = has_value & parsed.isna()
+        if invalid_mask.any():
+            invalid_values = text[invalid_mask]
+            samples = ', '.join(f"'{v}'" for v in invalid_values.drop_duplicates().head(5))
+            log_callback(f"WARNING: 欄位 {col} 發現 {int(invalid_mask.sum())} 筆無效日期格式 (例如: {samples})，已將其設定為 NULL。")
+
+        formatted = parsed.dt.strftime('%Y-%m-%d').astype(object)
+        df[col] = formatted.where(parsed.notna(), None)
+    return df
+
+def generate_unique_ids(df: pd.DataFrame) -> pd.Series:
+    """
+    以字串欄位組合的方式整欄產生 Unique ID。
+    規則：雇主_姓名_ARC{居留證號} > 雇主_姓名_PASS{護照號碼} > 雇主_姓名_NOID
+    """
+    def _text(col):
+        if col not in df.columns:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[col].astype(object).where(df[col].notna(), "").astype(str).str.strip()
+
+    # 移除 ID 命名中可能導致問題的特殊字元
+    def _safe(series):
+        return series.str.replace('_', '-', regex=False).str.replace('/', '-', regex=False)
+
+    arc_number = _text('arc_number')
+    passport = _text('passport_number')
+    prefix = _safe(_text('employer_name')) + '_' + _safe(_text('worker_name'))
+
+    unique_ids = prefix + '_NOID'
+    # 居留證號不存在，但有護照：ID 使用護照 (臨時)
+    unique_ids = unique_ids.mask(passport != '', prefix + '_PASS' + passport)
+    # 居留證號存在：ID 使用 ARC (最穩定)
+    unique_ids = unique_ids.mask(arc_number != '', prefix + '_ARC' + arc_number)
+    return unique_ids
+
+def clean_worker_frame(master_df: pd.DataFrame, log_callback: Callable[[str], None]) -> pd.DataFrame:
+    """
+    向量化的資料清理階段：過濾空地址、統一日期格式、清理雇主名稱、
+    產生 Unique ID，並一次批次正規化所有地址。
+    """
     log_callback("INFO: 正在過濾地址 (居住地址) 為空的資料列...")
     original_rows = len(master_df)
     master_df = master_df.loc[master_df['original_address'].notna() & (master_df['original_address'].str.strip() != '')].copy()
@@ -302,50 +272,15 @@ def parse_and_process_reports(
 
     log_callback("INFO: 正在強制統一所有日期欄位格式為 YYYY-MM-DD...")
     date_columns = ['accommodation_start_date', 'work_permit_expiry_date', 'departure_date']
-    
-    def robust_date_converter(x):
-        if pd.isna(x) or str(x).strip() == "":
-            return None
-        dt = pd.to_datetime(x, errors='coerce')
-        if pd.isna(dt):
-            log_callback(f"WARNING: 發現無效日期格式 '{x}'，將其設定為 NULL。")
-            return None
-        return dt.strftime('%Y-%m-%d')
-
-    for col in date_columns:
-        if col in master_df.columns:
-            master_df[col] = master_df[col].apply(robust_date_converter)
+    master_df = convert_date_columns(master_df, date_columns, log_callback)
 
     regex_pattern = r'\s?\(接\)$|\s?\(遞:.*?\)$'
     master_df['employer_name'] = master_df['employer_name'].str.replace(regex_pattern, '', regex=True).str.strip()
     
     log_callback("INFO: 正在根據最新規則生成 Unique ID...")
-    def generate_unique_id(row):
-        employer = str(row.get('employer_name', '')).strip()
-        name = str(row.get('worker_name', '')).strip()
-        passport = str(row.get('passport_number', '')).strip()
-        
-        # --- 【核心修改】優先使用居留證號作為唯一識別 ---
-        arc_number = str(row.get('arc_number', '')).strip()
-        
-        # 移除 ID 命名中可能導致問題的特殊字元
-        safe_employer = employer.replace('_', '-').replace('/', '-')
-        safe_name = name.replace('_', '-').replace('/', '-')
-        
-        # 邏輯：ARC > PASS > NOID
-        if arc_number:
-            # 居留證號存在：ID 使用 ARC (最穩定)
-            return f"{safe_employer}_{safe_name}_ARC{arc_number}"
-        elif passport:
-            # 居留證號不存在，但有護照：ID 使用護照 (臨時)
-            return f"{safe_employer}_{safe_name}_PASS{passport}"
-        else:
-            # 居留證號和護照都不存在
-            return f"{safe_employer}_{safe_name}_NOID"
+    master_df['unique_id'] = generate_unique_ids(master_df)
 
-    master_df['unique_id'] = master_df.apply(generate_unique_id, axis=1)
-
-    addr_info = master_df['original_address'].apply(normalize_taiwan_address).apply(pd.Series)
+    addr_info = normalize_address_series(master_df['original_address'])
     master_df[['normalized_address', 'city', 'district']] = addr_info[['full', 'city', 'district']]
     
     final_columns = [
@@ -468,4 +403,18 @@ def parse_b04_xml(file_path_or_buffer, fee_mapping: dict) -> pd.DataFrame:
 
     except Exception as e:
         print(f"解析 XML 失敗: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
+
+def parse_b04_files(
+    file_paths: List[str],
+    fee_mapping: dict,
+    log_callback: Callable[[str], None],
+    max_workers: int = None
+) -> List[tuple]:
+    """
+    以多核心平行解析多份 B04 報表。
+    回傳依 file_paths 原始順序排列的 [(檔案路徑, DataFrame), ...]。
+    """
+    file_paths = list(file_paths)
+    results = _map_in_process_pool(partial(parse_b04_xml, fee_mapping=fee_mapping), file_paths, log_callback, max_workers)
+    return list(zip(file_paths, results))
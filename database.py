@@ -1,7 +1,11 @@
 import os
+import io
 import sys
+import threading
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 
 from sqlalchemy import create_engine
@@ -84,24 +88,34 @@ def get_db_config():
         raise ValueError("config.ini 中缺少 [Database] 區塊")
     return config['Database']
 
+def _connection_kwargs() -> dict:
+    """由 config.ini 組出 psycopg2.connect 的參數。"""
+    config = get_db_config()
+    db_type = config.get('type', '').lower()
+
+    if db_type != 'postgresql':
+        raise ValueError(f"設定檔中的資料庫類型不是 'postgresql'，請檢查 config.ini。")
+
+    return dict(
+        host=config.get('host'),
+        port=config.getint('port', 5432),
+        user=config.get('user'),
+        password=config.get('password'),
+        dbname=config.get('dbname'),
+        # 這行是解決問題的核心，它告訴 psycopg2 將查詢結果打包成字典
+        cursor_factory=RealDictCursor
+    )
+
 def get_db_connection():
-    """根據設定檔建立並回傳 PostgreSQL 資料庫連線。"""
+    """
+    根據設定檔建立並回傳 PostgreSQL 資料庫連線。
+    在 run_concurrently 的工作執行緒中呼叫時，改為向連線池借用連線 (close() 即歸還)。
+    """
     try:
-        config = get_db_config()
-        db_type = config.get('type', '').lower()
-
-        if db_type != 'postgresql':
-            raise ValueError(f"設定檔中的資料庫類型不是 'postgresql'，請檢查 config.ini。")
-
-        conn = psycopg2.connect(
-            host=config.get('host'),
-            port=config.getint('port', 5432),
-            user=config.get('user'),
-            password=config.get('password'),
-            dbname=config.get('dbname'),
-            # 這行是解決問題的核心，它告訴 psycopg2 將查詢結果打包成字典
-            cursor_factory=RealDictCursor 
-        )
+        if getattr(_pool_state, 'borrowed', None) is not None:
+            return _borrow_connection()
+
+        conn = psycopg2.connect(**_connection_kwargs())
         # print("INFO: 已成功連線至 PostgreSQL 資料庫 (使用 RealDictCursor)。")
         return conn
             
@@ -109,6 +123,282 @@ def get_db_connection():
         print(f"資料庫連線失敗: {e}")
         return None
 
+# --- 連線池與並行查詢 ---
+# 頁面上互不相依的多個查詢以 run_concurrently 同時執行，總耗時約等於最慢的那一個查詢。
+# 工作執行緒內的 get_db_connection() 會向連線池借用連線，模型函式原本的 conn.close() 就是歸還，
+# 所以模型函式不需要任何修改；同時借出的連線數以 POOL_MAX_CONNECTIONS 為上限 (所有使用者共用)。
+POOL_MAX_CONNECTIONS = 8
+POOL_WAIT_SECONDS = 10 # 連線池滿載時最多等待的秒數，逾時改為建立一般連線 (不會卡死)
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+_pool_lock = threading.Lock()
+_idle_connections = []
+_pool_state = threading.local() # borrowed: 目前工作借出的連線 (None 表示不在並行工作中)
+
+class _PooledConnection(psycopg2.extensions.connection):
+    """連線池的連線：借出中呼叫 close() 時會結束未完成的交易並放回連線池，而不是真的斷線。"""
+    pool_kwargs = None
+    borrowed = False
+
+    def close(self):
+        if not self.borrowed:
+            return super().close()
+        self.borrowed = False
+        try:
+            if not self.closed:
+                status = self.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    super().close()
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    self.rollback()
+        except psycopg2.Error:
+            super().close()
+        if not self.closed:
+            with _pool_lock:
+                _idle_connections.append(self)
+        _pool_slots.release()
+
+def _is_alive(conn) -> bool:
+    """
+    閒置連線借出前先以 SELECT 1 確認仍可使用：資料庫重啟或被防火牆/伺服器閒置逾時切斷後，
+    conn.closed 仍是 0，不檢查的話下一個查詢才會失敗 (模型函式多半會吞掉錯誤，頁面只會顯示「沒有資料」)。
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _borrow_connection():
+    """從連線池取出一條可用的連線 (沒有閒置連線時新建)。"""
+    kwargs = _connection_kwargs()
+    if not _pool_slots.acquire(timeout=POOL_WAIT_SECONDS):
+        print("WARNING: 連線池已滿，改用一般連線。")
+        return psycopg2.connect(**kwargs)
+
+    conn = None
+    while conn is None:
+        with _pool_lock:
+            candidate = _idle_connections.pop() if _idle_connections else None
+        if candidate is None:
+            break
+        if not candidate.closed and candidate.pool_kwargs == kwargs and _is_alive(candidate):
+            conn = candidate
+        else:
+            candidate.close() # 已斷線或設定檔已變更
+    if conn is None:
+        try:
+            conn = psycopg2.connect(connection_factory=_PooledConnection, **kwargs)
+        except Exception:
+            _pool_slots.release()
+            raise
+        conn.pool_kwargs = kwargs
+    conn.borrowed = True
+    _pool_state.borrowed.append(conn)
+    return conn
+
+def _run_pooled(func, args):
+    """在目前執行緒以連線池執行一個工作；工作結束後歸還它忘記關閉的連線。"""
+    outer = getattr(_pool_state, 'borrowed', None)
+    _pool_state.borrowed = []
+    try:
+        return func(*args)
+    finally:
+        for conn in _pool_state.borrowed:
+            if conn.borrowed:
+                conn.close()
+        _pool_state.borrowed = outer
+
+def run_concurrently(tasks: dict, max_workers: int = None) -> dict:
+    """
+    同時執行多個互不相依的查詢，回傳 {名稱: 結果}。
+    tasks 為 {名稱: 函式} 或 {名稱: (函式, 參數1, 參數2, ...)}，函式內照常使用 get_db_connection()。
+    任一工作拋出例外時，等所有工作結束後拋出 (與依序呼叫時相同，模型函式自己攔下的錯誤則照原本的回傳值)。
+    """
+    calls = {}
+    for name, task in tasks.items():
+        if callable(task):
+            calls[name] = (task, ())
+        else:
+            calls[name] = (task[0], tuple(task[1:]))
+    if len(calls) <= 1:
+        return {name: _run_pooled(func, args) for name, (func, args) in calls.items()}
+
+    workers = min(len(calls), max_workers or POOL_MAX_CONNECTIONS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-fanout') as executor:
+        futures = {name: executor.submit(_run_pooled, func, args) for name, (func, args) in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+def _copy_text_value(value) -> str:
+    """將單一值轉為 PostgreSQL COPY (text 格式) 的欄位字串。"""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return '\\N'
+    if isinstance(value, float) and value != value: # NaN
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def copy_dataframe(cursor, table_name: str, df: pd.DataFrame, columns: list):
+    """
+    以 COPY FROM STDIN 將 DataFrame 的指定欄位一次寫入資料表 (通常是暫存表)。
+    比逐筆 INSERT 快上數十倍；None / NaN / NaT 會寫成 NULL。
+    """
+    if df.empty:
+        return
+    buffer = io.StringIO()
+    values = df[columns].astype(object).itertuples(index=False, name=None)
+    buffer.write(''.join('\t'.join(_copy_text_value(v) for v in row) + '\n' for row in values))
+    buffer.seek(0)
+    column_sql = ', '.join(f'"{c}"' for c in columns)
+    cursor.copy_expert(f'COPY {table_name} ({column_sql}) FROM STDIN', buffer)
+
+# 彙總/統計資料的重新整理函式 (名稱 -> 函式(cursor))，由各模組在載入時以 register_aggregate_refresher 註冊，
+# 排程 CLI 的 refresh-aggregates 指令會依序執行它們。
+AGGREGATE_REFRESHERS = {}
+
+def register_aggregate_refresher(name: str):
+    """裝飾器：註冊一個彙總資料重新整理函式。"""
+    def decorator(func):
+        AGGREGATE_REFRESHERS[name] = func
+        return func
+    return decorator
+
+@register_aggregate_refresher('analyze')
+def _analyze_tables(cursor):
+    """大量同步後更新查詢規劃器的統計資訊。"""
+    cursor.execute('ANALYZE')
+
+def refresh_aggregates(log_callback=print, names: list = None) -> dict:
+    """
+    依序執行已註冊的彙總資料重新整理函式，每個函式各自一個交易。
+    回傳 {名稱: 'success' 或錯誤訊息}。
+    """
+    results = {}
+    conn = get_db_connection()
+    if not conn:
+        log_callback("CRITICAL: 無法連接到資料庫，重新整理程序終止。")
+        return results
+    try:
+        for name, refresher in AGGREGATE_REFRESHERS.items():
+            if names and name not in names:
+                continue
+            try:
+                with conn.cursor() as cursor:
+                    refresher(cursor)
+                conn.commit()
+                results[name] = 'success'
+                log_callback(f"INFO: 已重新整理 {name}。")
+            except Exception as e:
+                conn.rollback()
+                results[name] = str(e)
+                log_callback(f"ERROR: 重新整理 {name} 失敗: {e}")
+    finally:
+        conn.close()
+    return results
+
+# --- 到期提醒 ---
+# 合規紀錄 (ComplianceRecords) 的日期存在 details (JSONB) 的文字欄位中。safe_to_date 將 YYYY-MM-DD (或 YYYY/M/D)
+# 轉為日期，格式錯誤或不存在的日期回傳 NULL (不會讓整個查詢失敗)；宣告為 IMMUTABLE，可用於運算式索引。
+SAFE_TO_DATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION safe_to_date(value TEXT) RETURNS DATE
+    LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE AS $$
+    DECLARE
+        parts TEXT[] := regexp_match(value, '^([0-9]{4})[-/]([0-9]{1,2})[-/]([0-9]{1,2})');
+    BEGIN
+        IF parts IS NULL THEN
+            RETURN NULL;
+        END IF;
+        RETURN make_date(parts[1]::int, parts[2]::int, parts[3]::int);
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+CLEANING_RECORD_TYPES_SQL = "('宿舍簡易清掃', '宿舍大掃除')"
+BUILDING_SAFETY_RECORD_TYPES_SQL = "('建物申報', '建築物公共安全申報')"
+COMPLIANCE_NEXT_DATE_SQL = "COALESCE(safe_to_date(details ->> 'next_check_date'), safe_to_date(details ->> 'next_declaration_start'))"
+
+# 所有到期項目的統一檢視表：一列一個到期事件 (source 為來源)，任何提醒期間都只需一次 due_date 範圍查詢，
+# 條件會推入各來源並使用上方的索引。extra 為各來源額外顯示的欄位。
+DUE_ITEMS_VIEW = f"""
+    CREATE OR REPLACE VIEW "DueItems" AS
+        SELECT 'lease' AS source, l.id::text AS ref_id, l.dorm_id, d.original_address AS dorm_address,
+               l.lease_end_date AS due_date, '租賃合約到期' AS label,
+               jsonb_build_object('月租金', l.monthly_rent) AS extra
+        FROM "Leases" l JOIN "Dormitories" d ON l.dorm_id = d.id
+        UNION ALL
+        SELECT 'worker', w.unique_id, r.dorm_id, d.original_address,
+               w.work_permit_expiry_date, w.worker_name || ' 工作期限到期',
+               jsonb_build_object('雇主', w.employer_name, '姓名', w.worker_name)
+        FROM "Workers" w
+        LEFT JOIN "AccommodationHistory" ah ON w.unique_id = ah.worker_unique_id AND ah.end_date IS NULL
+        LEFT JOIN "Rooms" r ON ah.room_id = r.id
+        LEFT JOIN "Dormitories" d ON r.dorm_id = d.id
+        UNION ALL
+        SELECT 'equipment', e.id::text, e.dorm_id, d.original_address,
+               e.next_maintenance_date, e.equipment_name || ' 保養/檢查',
+               jsonb_build_object('設備名稱', e.equipment_name, '位置', e.location)
+        FROM "DormitoryEquipment" e JOIN "Dormitories" d ON e.dorm_id = d.id
+        UNION ALL
+        SELECT 'insurance', d.id::text, d.id, d.original_address,
+               d.insurance_end_date, '宿舍保險到期',
+               jsonb_build_object('年度保險費', d.insurance_fee)
+        FROM "Dormitories" d
+        UNION ALL
+        SELECT 'compliance', cr.id::text, cr.dorm_id, d.original_address,
+               {COMPLIANCE_NEXT_DATE_SQL.replace('details', 'cr.details')},
+               concat_ws(' ', cr.record_type, cr.details ->> 'declaration_item'),
+               jsonb_build_object('申報類型', cr.record_type, '申報項目', cr.details ->> 'declaration_item')
+        FROM "ComplianceRecords" cr JOIN "Dormitories" d ON cr.dorm_id = d.id
+        WHERE cr.record_type NOT IN {CLEANING_RECORD_TYPES_SQL}
+        UNION ALL
+        SELECT 'cleaning', cr.id::text, cr.dorm_id, d.original_address,
+               safe_to_date(cr.details ->> 'next_schedule_date'), cr.record_type,
+               jsonb_build_object('清掃類型', cr.record_type,
+                                  '下次預計日期', cr.details ->> 'next_schedule_date',
+                                  '上次完成日期', cr.details ->> 'last_completion_date')
+        FROM "ComplianceRecords" cr JOIN "Dormitories" d ON cr.dorm_id = d.id
+        WHERE cr.record_type IN {CLEANING_RECORD_TYPES_SQL}
+        UNION ALL
+        SELECT 'building_safety', cr.id::text, cr.dorm_id, d.original_address,
+               safe_to_date(cr.details ->> 'next_declaration_end'), cr.record_type || ' 截止',
+               jsonb_build_object('申報類型', cr.record_type,
+                                  '上次申報日', cr.details ->> 'submission_date',
+                                  '下次開始日', cr.details ->> 'next_declaration_start',
+                                  '截止日期', cr.details ->> 'next_declaration_end',
+                                  '配合廠商', cr.details ->> 'architect_name')
+        FROM "ComplianceRecords" cr JOIN "Dormitories" d ON cr.dorm_id = d.id
+        WHERE cr.record_type IN {BUILDING_SAFETY_RECORD_TYPES_SQL};
+"""
+
+# --- 費用歷史唯一索引 ---
+FEE_HISTORY_UNIQUE_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS uq_feehistory_worker_type_date ON "FeeHistory" ("worker_unique_id", "fee_type", "effective_date");'
+FEE_HISTORY_DUPLICATE_REPORT_LIMIT = 20
+
+def fee_history_unique_index_exists(cursor) -> bool:
+    """費用歷史的唯一索引是否已建立 (舊資料庫有重複紀錄時，create_all_tables_and_indexes 會略過它)。"""
+    cursor.execute("SELECT to_regclass('uq_feehistory_worker_type_date') IS NOT NULL AS index_exists")
+    row = cursor.fetchone()
+    return bool(row['index_exists'] if isinstance(row, dict) else row[0])
+
+def find_fee_history_duplicates(cursor) -> list:
+    """列出 FeeHistory 中違反唯一索引的鍵值：[{worker_unique_id, fee_type, effective_date, count, amounts}]。"""
+    cursor.execute("""
+        SELECT worker_unique_id, fee_type, effective_date, COUNT(*) AS count,
+               string_agg(amount::text, ', ' ORDER BY id) AS amounts
+        FROM "FeeHistory"
+        GROUP BY worker_unique_id, fee_type, effective_date
+        HAVING COUNT(*) > 1
+        ORDER BY worker_unique_id, fee_type, effective_date
+    """)
+    return cursor.fetchall()
+
 def create_all_tables_and_indexes():
     """為 PostgreSQL 執行所有 CREATE TABLE 和 CREATE INDEX 指令。"""
     conn = get_db_connection()
@@ -265,6 +555,24 @@ def create_all_tables_and_indexes():
             );
             """
 
+            # 水電帳單的異常旗標 (analytics_model.refresh_anomalies 依電水錶增量更新)
+            TABLES['UtilityAnomalies'] = """
+            CREATE TABLE IF NOT EXISTS "UtilityAnomalies" (
+                "id" SERIAL PRIMARY KEY,
+                "bill_id" INTEGER NOT NULL,
+                "meter_id" INTEGER NOT NULL,
+                "kind" VARCHAR(20) NOT NULL, -- expense (金額 IQR) / usage (用量波動)
+                "verdict" VARCHAR(20) NOT NULL, -- 費用過高 / 費用過低 / 用量過高 / 用量過低
+                "baseline" NUMERIC, -- 用量異常的比較基準
+                "description" TEXT, -- 金額異常的正常範圍或用量異常的分析說明
+                "status" VARCHAR(20) NOT NULL DEFAULT 'open', -- open / dismissed
+                "detected_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE ("bill_id", "kind"),
+                FOREIGN KEY ("bill_id") REFERENCES "UtilityBills" ("id") ON DELETE CASCADE,
+                FOREIGN KEY ("meter_id") REFERENCES "Meters" ("id") ON DELETE CASCADE
+            );
+            """
+
             TABLES['ComplianceRecords'] = """
             CREATE TABLE IF NOT EXISTS "ComplianceRecords" (
                 "id" SERIAL PRIMARY KEY,
@@ -318,7 +626,7 @@ def create_all_tables_and_indexes():
                 "end_date" DATE,   -- 生效結束日
                 "active" BOOLEAN DEFAULT TRUE,
                 "calc_method" VARCHAR(20),
-                "target_employer" VARCHAR(100);
+                "target_employer" VARCHAR(100),
                 "notes" TEXT,
                 FOREIGN KEY ("dorm_id") REFERENCES "Dormitories" ("id") ON DELETE CASCADE
             );
@@ -415,6 +723,27 @@ def create_all_tables_and_indexes():
             );
             """
 
+            # 背景工作 (job_runner) 的狀態、進度與計數
+            TABLES['Jobs'] = """
+            CREATE TABLE IF NOT EXISTS "Jobs" (
+                "id" SERIAL PRIMARY KEY,
+                "job_type" VARCHAR(50) NOT NULL,
+                "title" TEXT,
+                "status" VARCHAR(20) NOT NULL DEFAULT 'queued', -- queued / running / success / failed / interrupted
+                "owner" TEXT, -- 執行工作的主機與行程 (hostname:pid)
+                "progress_current" INTEGER,
+                "progress_total" INTEGER,
+                "progress_message" TEXT,
+                "counters" JSONB,
+                "error" TEXT,
+                "log_tail" TEXT,
+                "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                "started_at" TIMESTAMP WITH TIME ZONE,
+                "finished_at" TIMESTAMP WITH TIME ZONE,
+                "heartbeat_at" TIMESTAMP WITH TIME ZONE
+            );
+            """
+
             print("INFO: (PostgreSQL) 正在建立所有表格...")
             for table_name, table_sql in TABLES.items():
                 cursor.execute(table_sql)
@@ -425,21 +754,59 @@ def create_all_tables_and_indexes():
                 'CREATE INDEX IF NOT EXISTS idx_rooms_dorm_id ON "Rooms" ("dorm_id");',
                 'CREATE INDEX IF NOT EXISTS idx_workers_room_id ON "Workers" ("room_id");',
                 'CREATE INDEX IF NOT EXISTS idx_feehistory_worker_id ON "FeeHistory" ("worker_unique_id");',
+                # 同一人、同一費用類型、同一生效日只保留一筆 (B04 匯入以 ON CONFLICT 批次新增或更新)
+                FEE_HISTORY_UNIQUE_INDEX,
                 'CREATE INDEX IF NOT EXISTS idx_statushistory_worker_id ON "WorkerStatusHistory" ("worker_unique_id");',
                 'CREATE INDEX IF NOT EXISTS idx_accomhistory_worker_id ON "AccommodationHistory" ("worker_unique_id");',
                 'CREATE INDEX IF NOT EXISTS idx_accomhistory_room_id ON "AccommodationHistory" ("room_id");',
+                # 異常偵測依電水錶分組、依帳單迄日排序 (也用於只重新計算指定電水錶)
+                'CREATE INDEX IF NOT EXISTS idx_utilitybills_meter_end_date ON "UtilityBills" ("meter_id", "bill_end_date");',
+                'CREATE INDEX IF NOT EXISTS idx_utilityanomalies_meter_id ON "UtilityAnomalies" ("meter_id");',
+                'CREATE INDEX IF NOT EXISTS idx_utilityanomalies_status_detected ON "UtilityAnomalies" ("status", "detected_at");',
                 'CREATE INDEX IF NOT EXISTS idx_vendors_service_category ON public."Vendors" (service_category);',
                 'CREATE INDEX IF NOT EXISTS idx_vendors_vendor_name ON public."Vendors" (vendor_name);',
                 'CREATE INDEX IF NOT EXISTS idx_vendors_contact_person ON public."Vendors" (contact_person);',
-                'CREATE INDEX IF NOT EXISTS idx_vendors_phone_number ON public."Vendors" (phone_number);'
-
+                'CREATE INDEX IF NOT EXISTS idx_vendors_phone_number ON public."Vendors" (phone_number);',
+                # 同一類型的背景工作同時只能有一個在排隊或執行中
+                'CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_active_type ON "Jobs" ("job_type") WHERE status IN (\'queued\', \'running\');',
+                # 到期提醒 ("DueItems") 各來源的到期日；合規紀錄的日期存在 details (JSONB) 中，以運算式索引建立
+                'CREATE INDEX IF NOT EXISTS idx_leases_end_date ON "Leases" ("lease_end_date");',
+                'CREATE INDEX IF NOT EXISTS idx_workers_permit_expiry ON "Workers" ("work_permit_expiry_date");',
+                'CREATE INDEX IF NOT EXISTS idx_equipment_next_maintenance ON "DormitoryEquipment" ("next_maintenance_date");',
+                'CREATE INDEX IF NOT EXISTS idx_dorms_insurance_end ON "Dormitories" ("insurance_end_date");',
+                f'CREATE INDEX IF NOT EXISTS idx_compliance_next_date ON "ComplianceRecords" (({COMPLIANCE_NEXT_DATE_SQL})) WHERE record_type NOT IN {CLEANING_RECORD_TYPES_SQL};',
+                f'CREATE INDEX IF NOT EXISTS idx_compliance_next_schedule ON "ComplianceRecords" ((safe_to_date(details ->> \'next_schedule_date\'))) WHERE record_type IN {CLEANING_RECORD_TYPES_SQL};',
+                f'CREATE INDEX IF NOT EXISTS idx_compliance_declaration_end ON "ComplianceRecords" ((safe_to_date(details ->> \'next_declaration_end\'))) WHERE record_type IN {BUILDING_SAFETY_RECORD_TYPES_SQL};',
             ]
+            # 既有資料庫可能已有重複的費用紀錄：不自動刪除，列出衝突的鍵值並略過唯一索引，
+            # 由使用者確認後以資料品質檢查的 fee_history_duplicates 規則 (--apply) 清理
+            if not fee_history_unique_index_exists(cursor):
+                duplicates = find_fee_history_duplicates(cursor)
+                if duplicates:
+                    INDEXES.remove(FEE_HISTORY_UNIQUE_INDEX)
+                    print(f"WARNING: (PostgreSQL) FeeHistory 有 {len(duplicates)} 組重複的 (worker_unique_id, fee_type, effective_date)，"
+                          "未建立唯一索引 uq_feehistory_worker_type_date。衝突的鍵值：")
+                    for row in duplicates[:FEE_HISTORY_DUPLICATE_REPORT_LIMIT]:
+                        print(f"    {row['worker_unique_id']} / {row['fee_type']} / {row['effective_date']}：{row['count']} 筆 (金額 {row['amounts']})")
+                    if len(duplicates) > FEE_HISTORY_DUPLICATE_REPORT_LIMIT:
+                        print(f"    ... 其餘 {len(duplicates) - FEE_HISTORY_DUPLICATE_REPORT_LIMIT} 組省略")
+                    print("    受影響的寫入：B04 帳務同步 (「帳務報表抓取」頁面與 cli.py sync-b04，以 ON CONFLICT 批次寫入費用) 在建立索引前會失敗；")
+                    print("    人工編輯員工費用與批次編輯員工會改以「先更新、沒有才新增」寫入，不受影響，但重複的紀錄會一起被更新。")
+                    print("    確認後請執行 python cli.py data-quality --only fee_history_duplicates --apply (每組保留最新一筆)，再重新執行本程式。")
+
             print("INFO: (PostgreSQL) 正在建立所有索引...")
+            cursor.execute(SAFE_TO_DATE_FUNCTION)
             for index_sql in INDEXES:
                 cursor.execute(index_sql)
+
+            print("INFO: (PostgreSQL) 正在建立檢視表...")
+            cursor.execute(DUE_ITEMS_VIEW)
         
         conn.commit()
-        print("SUCCESS: (PostgreSQL) 所有表格與索引已成功建立！")
+        if FEE_HISTORY_UNIQUE_INDEX in INDEXES:
+            print("SUCCESS: (PostgreSQL) 所有表格與索引已成功建立！")
+        else:
+            print("WARNING: (PostgreSQL) 表格與索引已建立，但費用歷史的唯一索引因重複資料而未建立 (見上方說明)。")
     except psycopg2.Error as err:
         print(f"資料庫操作失敗: {err}")
         conn.rollback()
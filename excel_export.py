@@ -0,0 +1,279 @@
+# excel_export.py
+# 共用的報表匯出：各頁面的 Excel 下載與大量明細匯出都經過這裡。
+#   1. write_workbook / dataframe_to_excel：以 xlsxwriter 的 constant_memory 模式逐列寫出
+#      (每個工作表寫完一列就釋放，不在記憶體中保留整本活頁簿的儲存格物件)。
+#   2. stream_query：以伺服器端 (具名) 游標分批讀取查詢結果，直接寫入 Excel / CSV / Parquet，
+#      不先組成 DataFrame；超過 Excel 列數上限時自動接續到下一個工作表。
+#   3. export_dataframe：已在記憶體中的 DataFrame 依格式匯出；大型表格可選 CSV / Parquet (速度快、檔案小)。
+# Parquet 需要 pyarrow (選用套件)，未安裝時 available_formats() 不會列出。
+
+import csv
+import io
+import math
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import psycopg2.extensions
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+FORMATS = {
+    'xlsx': {'label': 'Excel (.xlsx)', 'mime': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+    'csv': {'label': 'CSV (.csv，大量資料較快)', 'mime': 'text/csv'},
+    'parquet': {'label': 'Parquet (.parquet，大量資料最快)', 'mime': 'application/octet-stream'},
+}
+# Excel 單一工作表的列數上限 (含標題列)
+MAX_EXCEL_ROWS = 1_048_576
+# 伺服器端游標每次取回的列數
+STREAM_BATCH_SIZE = 5000
+
+WORKBOOK_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_urls': False,
+    'strings_to_formulas': False,
+    'nan_inf_to_errors': True,
+    'remove_timezone': True,
+    'default_date_format': 'yyyy-mm-dd',
+}
+
+def available_formats() -> list:
+    """目前環境可用的匯出格式 (Parquet 需安裝 pyarrow)。"""
+    return [fmt for fmt in FORMATS if fmt != 'parquet' or pq is not None]
+
+# ==============================================================================
+# Excel (xlsxwriter constant_memory)
+# ==============================================================================
+
+def _open_workbook(output):
+    workbook = xlsxwriter.Workbook(output, WORKBOOK_OPTIONS)
+    formats = {
+        'header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+        'date': workbook.add_format({'num_format': 'yyyy-mm-dd'}),
+        'datetime': workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+    }
+    return workbook, formats
+
+def _write_value(worksheet, row, col, value, formats):
+    """依值的型別寫入一個儲存格；空值 (None、NaN、NaT) 留白。"""
+    if value is None or value is pd.NaT:
+        return
+    if isinstance(value, (bool, np.bool_)):
+        worksheet.write_boolean(row, col, bool(value))
+    elif isinstance(value, (int, np.integer)):
+        worksheet.write_number(row, col, int(value))
+    elif isinstance(value, (float, np.floating, Decimal)):
+        value = float(value)
+        if not math.isnan(value):
+            worksheet.write_number(row, col, value)
+    elif isinstance(value, datetime):
+        worksheet.write_datetime(row, col, value.to_pydatetime() if isinstance(value, pd.Timestamp) else value, formats['datetime'])
+    elif isinstance(value, date):
+        worksheet.write_datetime(row, col, datetime(value.year, value.month, value.day), formats['date'])
+    elif isinstance(value, np.datetime64):
+        if not np.isnat(value):
+            worksheet.write_datetime(row, col, pd.Timestamp(value).to_pydatetime(), formats['datetime'])
+    else:
+        worksheet.write_string(row, col, str(value))
+
+def _write_header(worksheet, row, columns, formats):
+    for col_idx, name in enumerate(columns):
+        worksheet.write_string(row, col_idx, str(name), formats['header'])
+
+def _column_cells(series: pd.Series, formats):
+    """
+    回傳 (寫入函式, 值清單)。依欄位型別先選好寫入方式，整欄同型別時不必逐格判斷；
+    其他欄位 (文字、日期、混合型別、可為空的擴充型別) 交給 _write_value，空值轉為 None。
+    """
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else 'O'
+    if kind == 'b':
+        return (lambda ws, r, c, v: ws.write_boolean(r, c, v)), series.tolist()
+    if kind in 'iu':
+        return (lambda ws, r, c, v: ws.write_number(r, c, v)), series.tolist()
+    if kind == 'f':
+        return (lambda ws, r, c, v: v != v or ws.write_number(r, c, v)), series.tolist()
+    values = series.astype(object)
+    return (lambda ws, r, c, v: _write_value(ws, r, c, v, formats)), values.where(series.notna(), None).tolist()
+
+def _write_frame(worksheet, start_row, df: pd.DataFrame, formats) -> int:
+    """逐列寫入 DataFrame 的資料列 (constant_memory 模式需依列順序寫入)，回傳下一個可用的列號。"""
+    cells = [_column_cells(df.iloc[:, col_idx], formats) for col_idx in range(df.shape[1])]
+    for offset in range(len(df)):
+        row_idx = start_row + offset
+        for col_idx, (write, values) in enumerate(cells):
+            write(worksheet, row_idx, col_idx, values[offset])
+    return start_row + len(df)
+
+def write_workbook(sheet_data: dict, output=None, keep_empty: bool = False):
+    """
+    將 {工作表名稱: [{'dataframe': df, 'title': 標題}, ...]} 寫成 Excel。每個表格前可加一列標題，表格之間空一列。
+    output 為檔案路徑或可寫入的二進位檔案物件；未提供時回傳檔案內容 (bytes)。
+    keep_empty=False 時略過空的表格，全部都是空表格則不產生檔案 (回傳 b'')；
+    keep_empty=True 時空表格仍寫出欄位名稱 (例如匯入範本)。
+    """
+    has_data_to_write = keep_empty or any(
+        table_info.get('dataframe') is not None and not table_info.get('dataframe').empty
+        for tables in sheet_data.values() for table_info in tables
+    )
+    if not has_data_to_write:
+        return b'' if output is None else None
+
+    target = io.BytesIO() if output is None else output
+    workbook, formats = _open_workbook(target)
+    try:
+        for sheet_name, tables in sheet_data.items():
+            tables = [
+                table_info for table_info in tables
+                if table_info.get('dataframe') is not None and (keep_empty or not table_info.get('dataframe').empty)
+            ]
+            if not tables:
+                continue
+            worksheet = workbook.add_worksheet(sheet_name)
+            row_idx = 0
+            for table_info in tables:
+                df = table_info['dataframe']
+                title = table_info.get('title')
+                if title:
+                    worksheet.write_string(row_idx, 0, str(title))
+                    row_idx += 2
+                _write_header(worksheet, row_idx, df.columns, formats)
+                row_idx = _write_frame(worksheet, row_idx + 1, df, formats) + 1
+    finally:
+        workbook.close()
+    return target.getvalue() if output is None else None
+
+def dataframe_to_excel(df: pd.DataFrame, sheet_name: str = 'Sheet1', title: str = None) -> bytes:
+    """單一 DataFrame 轉為 Excel 檔內容 (空的 DataFrame 仍保留欄位名稱)。"""
+    return write_workbook({sheet_name: [{'dataframe': df, 'title': title}]}, keep_empty=True)
+
+def export_dataframe(df: pd.DataFrame, fmt: str = 'xlsx', sheet_name: str = 'Sheet1', title: str = None) -> bytes:
+    """依格式匯出 DataFrame：xlsx、csv (UTF-8 BOM，Excel 可直接開啟) 或 parquet。"""
+    if fmt == 'csv':
+        return df.to_csv(index=False).encode('utf-8-sig')
+    if fmt == 'parquet':
+        if pq is None:
+            raise RuntimeError("未安裝 pyarrow，無法匯出 Parquet。")
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+        return buffer.getvalue()
+    return dataframe_to_excel(df, sheet_name, title)
+
+# ==============================================================================
+# 伺服器端游標串流匯出
+# ==============================================================================
+
+def _stream_xlsx(output, columns, batches, sheet_name, title):
+    workbook, formats = _open_workbook(output)
+    try:
+        sheet_no = 1
+        worksheet = workbook.add_worksheet(sheet_name)
+        row_idx = 0
+        if title:
+            worksheet.write_string(0, 0, str(title))
+            row_idx = 2
+        _write_header(worksheet, row_idx, columns, formats)
+        row_idx += 1
+        for batch in batches:
+            for values in batch:
+                if row_idx >= MAX_EXCEL_ROWS:
+                    sheet_no += 1
+                    worksheet = workbook.add_worksheet(f"{sheet_name} ({sheet_no})"[:31])
+                    _write_header(worksheet, 0, columns, formats)
+                    row_idx = 1
+                for col_idx, value in enumerate(values):
+                    _write_value(worksheet, row_idx, col_idx, value, formats)
+                row_idx += 1
+    finally:
+        workbook.close()
+
+def _stream_csv(output, columns, batches):
+    is_path = isinstance(output, str)
+    stream = open(output, 'w', encoding='utf-8-sig', newline='') if is_path \
+        else io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+    try:
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows(batch)
+    finally:
+        if is_path:
+            stream.close()
+        else:
+            # 不關閉呼叫端的檔案物件 (例如下載用的 BytesIO)
+            stream.flush()
+            stream.detach()
+
+# PostgreSQL 型別 OID 對應的 Parquet 欄位型別與轉換
+_PARQUET_TYPES = {
+    16: ('bool_', None),
+    20: ('int64', None), 21: ('int16', None), 23: ('int32', None),
+    700: ('float32', None), 701: ('float64', None), 1700: ('float64', float),
+    1082: ('date32', None), 1114: ('timestamp_us', None), 1184: ('timestamp_us_utc', None),
+}
+
+def _parquet_field(name, type_code):
+    type_name, convert = _PARQUET_TYPES.get(type_code, ('string', str))
+    if type_name == 'timestamp_us':
+        arrow_type = pa.timestamp('us')
+    elif type_name == 'timestamp_us_utc':
+        arrow_type = pa.timestamp('us', tz='UTC')
+    else:
+        arrow_type = getattr(pa, type_name)()
+    return pa.field(name, arrow_type), convert
+
+def _stream_parquet(output, columns, type_codes, batches):
+    if pq is None:
+        raise RuntimeError("未安裝 pyarrow，無法匯出 Parquet。")
+    fields, converters = zip(*(_parquet_field(name, code) for name, code in zip(columns, type_codes)))
+    schema = pa.schema(fields)
+    with pq.ParquetWriter(output, schema) as writer:
+        for batch in batches:
+            arrays = []
+            for col_idx, (field, convert) in enumerate(zip(fields, converters)):
+                values = [row[col_idx] for row in batch]
+                if convert is not None:
+                    values = [None if value is None else convert(value) for value in values]
+                arrays.append(pa.array(values, type=field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+def stream_query(conn, query: str, params, output, fmt: str = 'xlsx', sheet_name: str = '資料',
+                 title: str = None, batch_size: int = STREAM_BATCH_SIZE) -> int:
+    """
+    以伺服器端游標執行查詢，分批 (batch_size 列) 寫入 output (檔案路徑或二進位檔案物件)。
+    fmt 為 FORMATS 的鍵；title 只用於 xlsx。回傳寫出的資料列數。
+    具名游標需在交易中使用，函式結束後由呼叫端決定 commit/rollback 與關閉連線。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}")
+    row_count = 0
+    with conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}", cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        first_batch = cursor.fetchmany(batch_size)
+        # 具名游標要取過一次資料後才有欄位資訊
+        columns = [desc[0] for desc in cursor.description]
+        type_codes = [desc[1] for desc in cursor.description]
+
+        def batches():
+            nonlocal row_count
+            batch = first_batch
+            while batch:
+                row_count += len(batch)
+                yield batch
+                batch = cursor.fetchmany(batch_size)
+
+        if fmt == 'csv':
+            _stream_csv(output, columns, batches())
+        elif fmt == 'parquet':
+            _stream_parquet(output, columns, type_codes, batches())
+        else:
+            _stream_xlsx(output, columns, batches(), sheet_name, title)
+    return row_count
@@ -0,0 +1,277 @@
+# job_runner.py
+# 背景工作執行器
+# 長時間的同步與匯入 (移工名冊同步、B04 帳務同步…) 不再於 Streamlit 的腳本執行緒中進行，
+# 而是送進本模組的執行緒池。工作狀態、進度與計數寫入資料庫的 "Jobs" 表，
+# 日誌則存放於每個工作一個的環狀緩衝區 (deque)。頁面只需送出工作並定期讀取進度，
+# 因此瀏覽器斷線或頁面重新執行都不會中斷工作，多位使用者也能同時觀看同一個工作。
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable
+
+import pandas as pd
+
+import database
+
+# 同時執行的工作數上限
+MAX_CONCURRENT_JOBS = 2
+# 每個工作在記憶體中保留的日誌行數
+LOG_BUFFER_SIZE = 2000
+# 記憶體中保留日誌的工作數 (較舊的工作只剩資料庫中的 log_tail)
+KEEP_LOGS_FOR_JOBS = 20
+# 工作結束時寫回資料庫的最後幾行日誌
+LOG_TAIL_SIZE = 200
+# 進度寫回資料庫的最短間隔 (秒)
+PROGRESS_FLUSH_INTERVAL = 2.0
+# 執行中的工作每隔多久更新一次 heartbeat_at (秒)；超過 3 倍時間未更新即視為已中斷
+HEARTBEAT_INTERVAL = 30
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix='job')
+_lock = threading.Lock()
+_active_jobs = {}           # job_type -> job_id (本行程中排隊或執行中的工作)
+_job_logs = OrderedDict()   # job_id -> deque
+_last_flush = {}            # job_id -> 上次寫回進度的時間
+_heartbeat_thread = None
+
+def _execute_query_to_dataframe(conn, query, params=None):
+    """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        records = cursor.fetchall()
+        if not records:
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            return pd.DataFrame([], columns=columns)
+
+        columns = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(records, columns=columns)
+
+def _execute(sql: str, params=None, fetch_one: bool = False):
+    """執行單一寫入語句並 commit；fetch_one 為 True 時回傳第一筆結果。"""
+    conn = database.get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            record = cursor.fetchone() if fetch_one else None
+        conn.commit()
+        return record
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"工作紀錄寫入失敗: {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+def _stale_condition() -> str:
+    return f"heartbeat_at < NOW() - INTERVAL '{HEARTBEAT_INTERVAL * 3} seconds'"
+
+def _heartbeat_loop():
+    """定期更新本行程中執行中工作的 heartbeat_at，讓其他行程能辨識工作仍在進行。"""
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _lock:
+            job_ids = list(_active_jobs.values())
+        if job_ids:
+            _execute('UPDATE "Jobs" SET heartbeat_at = NOW() WHERE id = ANY(%s)', (job_ids,))
+
+def _ensure_heartbeat():
+    global _heartbeat_thread
+    if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+        _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='job-heartbeat', daemon=True)
+        _heartbeat_thread.start()
+
+def _log_buffer(job_id: int) -> deque:
+    """取得 (或建立) 工作的日誌緩衝區。呼叫端需持有 _lock。"""
+    buffer = _job_logs.get(job_id)
+    if buffer is None:
+        buffer = deque(maxlen=LOG_BUFFER_SIZE)
+        _job_logs[job_id] = buffer
+        while len(_job_logs) > KEEP_LOGS_FOR_JOBS:
+            _job_logs.popitem(last=False)
+    return buffer
+
+def _make_log_callback(job_id: int, echo: Callable[[str], None] = None) -> Callable[[str], None]:
+    def log_callback(message: str):
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with _lock:
+            _log_buffer(job_id).append(f"[{timestamp}] {message}")
+        if echo:
+            echo(message)
+    return log_callback
+
+def _make_progress_callback(job_id: int) -> Callable:
+    def progress_callback(current: int, total: int, message: str = None):
+        now = datetime.now().timestamp()
+        with _lock:
+            last = _last_flush.get(job_id, 0)
+            if now - last < PROGRESS_FLUSH_INTERVAL and current < total:
+                return
+            _last_flush[job_id] = now
+        _execute(
+            'UPDATE "Jobs" SET progress_current = %s, progress_total = %s, progress_message = %s, heartbeat_at = NOW() WHERE id = %s',
+            (current, total, message, job_id)
+        )
+    return progress_callback
+
+def _claim_job(job_type: str, title: str, status: str) -> tuple:
+    """
+    建立工作紀錄。"Jobs" 上的部分唯一索引保證同一 job_type 只會有一個排隊或執行中的工作
+    (跨行程亦然，例如排程 CLI 與介面同時觸發)；先將逾時未回報的舊工作標記為 interrupted。
+    回傳 (job_id, 是否為新建立的工作)；無法連線時 job_id 為 None。
+    """
+    conn = database.get_db_connection()
+    if not conn: return None, False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""UPDATE "Jobs" SET status = 'interrupted', finished_at = NOW()
+                    WHERE job_type = %s AND status IN %s AND {_stale_condition()}""",
+                (job_type, ACTIVE_STATUSES)
+            )
+            cursor.execute(
+                """INSERT INTO "Jobs" (job_type, title, status, owner, heartbeat_at) VALUES (%s, %s, %s, %s, NOW())
+                   ON CONFLICT (job_type) WHERE status IN ('queued', 'running') DO NOTHING
+                   RETURNING id""",
+                (job_type, title, status, f"{socket.gethostname()}:{os.getpid()}")
+            )
+            record = cursor.fetchone()
+            created = record is not None
+            if not created:
+                cursor.execute('SELECT id FROM "Jobs" WHERE job_type = %s AND status IN %s ORDER BY id DESC LIMIT 1', (job_type, ACTIVE_STATUSES))
+                record = cursor.fetchone()
+        conn.commit()
+        return (record['id'] if record else None), created
+    except Exception as e:
+        if conn: conn.rollback()
+        print(f"工作紀錄寫入失敗: {e}")
+        return None, False
+    finally:
+        if conn: conn.close()
+
+def _finish_job(job_id: int, status: str, result: dict = None, error: str = None):
+    with _lock:
+        tail = list(_job_logs.get(job_id, []))[-LOG_TAIL_SIZE:]
+        _last_flush.pop(job_id, None)
+    _execute(
+        """UPDATE "Jobs" SET status = %s, counters = %s, error = %s, log_tail = %s,
+               finished_at = NOW(), heartbeat_at = NOW()
+           WHERE id = %s""",
+        (status, json.dumps(result or {}, ensure_ascii=False, default=str), error, '\n'.join(tail), job_id)
+    )
+
+def _run_job(job_id: int, job_type: str, func: Callable, args: tuple, kwargs: dict, echo: Callable[[str], None] = None) -> dict:
+    """實際執行工作並記錄結果。func 的回傳值若為 dict 且 status 為 'failed'，工作即標記為失敗。"""
+    log_callback = _make_log_callback(job_id, echo)
+    _execute('UPDATE "Jobs" SET status = %s, started_at = NOW(), heartbeat_at = NOW() WHERE id = %s', ('running', job_id))
+    try:
+        result = func(*args, log_callback=log_callback, progress_callback=_make_progress_callback(job_id), **kwargs)
+        result = result if isinstance(result, dict) else {'result': result}
+        status = 'failed' if result.get('status') == 'failed' else 'success'
+        _finish_job(job_id, status, result)
+        return result
+    except Exception as e:
+        log_callback(f"CRITICAL: 背景工作執行失敗: {e}")
+        _finish_job(job_id, 'failed', error=traceback.format_exc())
+        return {'status': 'failed', 'error': str(e)}
+    finally:
+        with _lock:
+            if _active_jobs.get(job_type) == job_id:
+                del _active_jobs[job_type]
+
+def submit_job(job_type: str, title: str, func: Callable, *args, **kwargs) -> tuple:
+    """
+    送出一個背景工作。func 會以 func(*args, log_callback=..., progress_callback=..., **kwargs) 的方式被呼叫。
+    同一 job_type 同時只會有一個工作：若已有執行中的工作，直接回傳其 ID。
+    回傳 (job_id, 是否為新建立的工作)；無法寫入資料庫時 job_id 為 None。
+    """
+    job_id, created = _claim_job(job_type, title, 'queued')
+    if not created:
+        return job_id, False
+    with _lock:
+        _active_jobs[job_type] = job_id
+        _log_buffer(job_id)
+    _ensure_heartbeat()
+    _executor.submit(_run_job, job_id, job_type, func, args, kwargs)
+    return job_id, True
+
+def run_job_inline(job_type: str, title: str, func: Callable, *args, echo: Callable[[str], None] = None, **kwargs) -> dict:
+    """
+    在目前的執行緒中同步執行工作 (供 CLI 排程使用)，但同樣記錄於 "Jobs" 表，
+    讓介面上也能看到排程工作的進度。已有同類型工作執行中時回傳 status='busy'。
+    """
+    job_id, created = _claim_job(job_type, title, 'running')
+    if job_id is None:
+        return {'status': 'failed', 'error': '無法建立工作紀錄'}
+    if not created:
+        return {'status': 'busy', 'job_id': job_id}
+    with _lock:
+        _active_jobs[job_type] = job_id
+    _ensure_heartbeat()
+    result = _run_job(job_id, job_type, func, args, kwargs, echo)
+    result.setdefault('job_id', job_id)
+    return result
+
+def get_job(job_id: int) -> dict:
+    """取得單一工作的狀態 (已逾時未回報 heartbeat 的執行中工作會顯示為 interrupted)。"""
+    conn = database.get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT *, CASE WHEN status IN %s AND {_stale_condition()} THEN 'interrupted' ELSE status END AS display_status
+                FROM "Jobs" WHERE id = %s
+            """, (ACTIVE_STATUSES, job_id))
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+def get_latest_job(job_type: str) -> dict:
+    """取得某類型最近的一個工作。"""
+    conn = database.get_db_connection()
+    if not conn: return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT id FROM "Jobs" WHERE job_type = %s ORDER BY id DESC LIMIT 1', (job_type,))
+            record = cursor.fetchone()
+    finally:
+        conn.close()
+    return get_job(record['id']) if record else None
+
+def get_recent_jobs(job_type: str = None, limit: int = 20) -> pd.DataFrame:
+    """取得最近的工作清單。"""
+    conn = database.get_db_connection()
+    if not conn: return pd.DataFrame()
+    try:
+        query = f"""
+            SELECT id AS "ID", title AS "工作",
+                CASE WHEN status IN %s AND {_stale_condition()} THEN 'interrupted' ELSE status END AS "狀態",
+                progress_current AS "進度", progress_total AS "總數",
+                created_at AS "建立時間", finished_at AS "完成時間"
+            FROM "Jobs"
+            WHERE (%s IS NULL OR job_type = %s)
+            ORDER BY id DESC LIMIT %s
+        """
+        return _execute_query_to_dataframe(conn, query, (ACTIVE_STATUSES, job_type, job_type, limit))
+    finally:
+        conn.close()
+
+def get_job_logs(job_id: int) -> list:
+    """取得工作的日誌 (依時間先後)。記憶體中已無緩衝區時，改讀資料庫中的 log_tail。"""
+    with _lock:
+        buffer = _job_logs.get(job_id)
+        if buffer is not None:
+            return list(buffer)
+    job = get_job(job_id)
+    if job and job.get('log_tail'):
+        return job['log_tail'].split('\n')
+    return []
@@ -41,6 +41,7 @@ from views import (
     unassigned_worker_view,
     guide_view,
     finance_dashboard_view,
+    date_fix_view,
 )
 
 def load_config():
@@ -98,7 +99,8 @@ PAGES = {
         "批次資料匯入": batch_import_view,           # Excel 匯入
         "移工系統同步 (爬蟲)": scraper_view,          # 抓人
         "財務系統同步 (B04)": accounting_scraper_view, # 抓錢
-        "報表匯出中心": report_view                  # 下載報表
+        "報表匯出中心": report_view,                 # 下載報表
+        "資料品質檢查": date_fix_view                # 日期/月份/地址校正
     },
     "📘 系統使用指南": {
         "操作手冊": guide_view
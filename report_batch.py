@@ -0,0 +1,261 @@
+# report_batch.py
+# 月底批次報表：為多間宿舍一次產生每間一份的 Excel 活頁簿 (宿舍報表、床位佔用報表、超額水電費報表)，
+# 寫入 ZIP 檔 (或下載用的記憶體緩衝區) 或輸出資料夾。
+#   1. 共用資料只查詢一次：所有宿舍的住宿/費用明細、帳單與雇主各一次查詢，超額水電費以
+#      report_model.get_excess_utility_reports 一起計算；床位佔用使用共用的住宿索引。
+#   2. 活頁簿的產生 (excel_export.write_workbook，耗 CPU) 交給行程池 (spawn 啟動)，呼叫端執行緒依宿舍順序寫入輸出，
+#      尚未寫出的活頁簿數量有上限，記憶體用量不隨宿舍數增加。行程池無法啟動時改為逐一產生。
+#   3. 以 log_callback / progress_callback 回報進度 (與 job_runner 的工作簽章相同，可直接作為背景工作或 CLI 指令)。
+
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pandas as pd
+
+import excel_export
+import utils
+
+REPORT_TYPES = {
+    'dorm': '宿舍報表',
+    'beds': '床位佔用報表',
+    'excess': '超額水電費報表',
+}
+DEFAULT_FIXED_SUBSIDY = 300
+# 已送去產生但尚未寫出的活頁簿上限
+MAX_PENDING_RENDERS = 8
+
+# ==============================================================================
+# 各報表的工作表內容 (與「各式報表匯出」頁面的單一宿舍報表相同)
+# ==============================================================================
+
+def dorm_report_sheets(dorm_address: str, year_month: str, report_df: pd.DataFrame) -> dict:
+    """宿舍報表：人數摘要 (總人數、男女、各國籍) + 在住人員明細。"""
+    nationality_counts = report_df['國籍'].dropna().value_counts().to_dict()
+    summary_items = ["總人數", "男性人數", "女性人數"] + [f"{nat}籍人數" for nat in nationality_counts.keys()]
+    summary_values = [
+        len(report_df),
+        len(report_df[report_df['性別'] == '男']),
+        len(report_df[report_df['性別'] == '女'])
+    ] + list(nationality_counts.values())
+    summary_df = pd.DataFrame({"統計項目": summary_items, "數值": summary_values})
+    return {
+        "宿舍報表": [
+            {"dataframe": summary_df, "title": f"{dorm_address} 人數摘要 ({year_month})"},
+            {"dataframe": report_df, "title": "在住人員明細"}
+        ]
+    }
+
+def bed_report_sheets(dorm_address: str, occupancy_df: pd.DataFrame) -> dict:
+    """床位佔用報表：每個房間一欄的床位矩陣。"""
+    return {
+        "床位佔用報表": [
+            {"dataframe": occupancy_df, "title": f"{dorm_address} 床位佔用總覽"}
+        ]
+    }
+
+def excess_report_sheets(dorm_title: str, employer_title: str, fixed_subsidy: int,
+                         bills_df: pd.DataFrame, details_df: pd.DataFrame, total_charge) -> dict:
+    """超額水電費報表：請款摘要 + 帳單摘要 + 應收費用明細。"""
+    summary_header_df = pd.DataFrame({
+        "宿舍地址": [dorm_title],
+        "目標雇主": [employer_title],
+        "總水電費": [f"NT$ {int(total_charge):,}"],
+        "計算基準 (元/月)": [fixed_subsidy],
+        "總人數": [details_df.shape[0]],
+    })
+
+    bill_summary_df = bills_df.rename(columns={
+        'bill_type': '帳單', 'bill_start_date': '起日', 'bill_end_date': '迄日', 'amount': '費用'
+    })
+    bill_summary_df['天數'] = (pd.to_datetime(bill_summary_df['迄日']) - pd.to_datetime(bill_summary_df['起日'])).dt.days + 1
+
+    final_details_df = details_df[['雇主', '姓名', '英文姓名', '護照號碼', '國籍', '性別', '入住日期', '離住日期', '居住天數', '應收水電費']].copy()
+    final_details_df['應收水電費'] = final_details_df['應收水電費'].round().astype(int)
+
+    return {
+        "超額水電費報表": [
+            {"dataframe": summary_header_df, "title": "【超額水電費請款單】"},
+            {"dataframe": bill_summary_df[['帳單', '起日', '迄日', '天數', '費用']], "title": "帳單摘要"},
+            {"dataframe": final_details_df, "title": "應收費用明細"}
+        ]
+    }
+
+# ==============================================================================
+# 批次產生
+# ==============================================================================
+
+def _month_range(year_month: str) -> tuple:
+    month_start = datetime.strptime(year_month, '%Y-%m').date()
+    next_month = (month_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return month_start, next_month - timedelta(days=1)
+
+def collect_dorm_workbooks(dorm_ids: list, year_month: str, report_types: list = None,
+                           fixed_subsidy: int = DEFAULT_FIXED_SUBSIDY, include_external_workers: bool = False,
+                           log_callback: Callable[[str], None] = print):
+    """
+    查詢所有宿舍的報表資料 (共用資料只查詢一次)，依 dorm_ids 的順序逐一產生
+    (宿舍ID, 檔名, 工作表內容)。沒有任何資料的宿舍會略過並記錄於日誌。
+    超額水電費以「帳單迄日/起日與該月份重疊」的水電費帳單、該月份在住的所有雇主計算 (依帳單全額)；
+    未達超額標準的宿舍不產生此工作表。
+    """
+    from data_models import dormitory_model, report_model, single_dorm_analyzer
+
+    report_types = report_types or list(REPORT_TYPES)
+    month_start, month_end = _month_range(year_month)
+    addresses = {d['id']: d['original_address'] for d in dormitory_model.get_dorms_for_selection()}
+
+    dorm_reports = report_model.get_dorm_reports_data(dorm_ids, year_month) if 'dorm' in report_types else {}
+
+    excess_results, employers_by_dorm = {}, {}
+    if 'excess' in report_types:
+        bills_by_dorm = {}
+        for bill in report_model.get_utility_bills_for_selection(dorm_ids, month_start, month_end):
+            bills_by_dorm.setdefault(bill['dorm_id'], []).append(bill['id'])
+        employers_by_dorm = report_model.get_employers_by_dorm_for_period(dorm_ids, month_start, month_end)
+        jobs = {
+            dorm_id: {
+                'dorm_ids': [dorm_id], 'employer_names': employers_by_dorm.get(dorm_id, []),
+                'bill_ids': bills_by_dorm.get(dorm_id, []), 'fixed_subsidy': fixed_subsidy,
+                'include_external_workers': include_external_workers, 'calculation_mode': 'bill',
+            }
+            for dorm_id in dorm_ids
+        }
+        excess_results = report_model.get_excess_utility_reports(jobs)
+
+    used_names = set()
+    for dorm_id in dorm_ids:
+        dorm_address = addresses.get(dorm_id) or f"宿舍{dorm_id}"
+        sheets = {}
+
+        report_df = dorm_reports.get(dorm_id)
+        if report_df is not None and not report_df.empty:
+            sheets.update(dorm_report_sheets(dorm_address, year_month, report_df))
+
+        if 'beds' in report_types:
+            bed_address, occupancy_df = single_dorm_analyzer.get_bed_occupancy_report(dorm_id)
+            if occupancy_df is not None and not occupancy_df.empty:
+                sheets.update(bed_report_sheets(bed_address or dorm_address, occupancy_df))
+
+        address_list, bills_df, details_df, total_charge, total_excess = excess_results.get(dorm_id, (None,) * 5)
+        if details_df is not None and not details_df.empty:
+            if total_excess > 0:
+                employer_title = " / ".join(employers_by_dorm.get(dorm_id, []))
+                sheets.update(excess_report_sheets(" / ".join(address_list), employer_title, fixed_subsidy, bills_df, details_df, total_charge))
+            else:
+                log_callback(f"INFO: {dorm_address} 的水電費未達超額標準，不產生超額水電費報表。")
+
+        if not sheets:
+            log_callback(f"INFO: {dorm_address} 在 {year_month} 沒有可產生的報表資料，略過。")
+            yield dorm_id, None, None
+            continue
+
+        base_name = utils.sanitize_filename(dorm_address) or f"宿舍{dorm_id}"
+        if base_name in used_names:
+            base_name = f"{base_name}_{dorm_id}"
+        used_names.add(base_name)
+        yield dorm_id, f"{base_name}_{year_month}.xlsx", sheets
+
+def _open_output(output):
+    """
+    開啟輸出目的地，回傳 (寫入函式, 關閉函式)。
+    output 可為 .zip 路徑、可寫入的二進位檔案物件 (寫成 ZIP，例如下載用的 BytesIO) 或資料夾路徑。
+    """
+    if isinstance(output, (str, os.PathLike)) and not str(output).lower().endswith('.zip'):
+        os.makedirs(output, exist_ok=True)
+        def write_file(file_name, data):
+            with open(os.path.join(output, file_name), 'wb') as f:
+                f.write(data)
+        return write_file, lambda: None
+
+    if isinstance(output, (str, os.PathLike)) and os.path.dirname(str(output)):
+        os.makedirs(os.path.dirname(str(output)), exist_ok=True)
+    # xlsx 本身已是壓縮檔，ZIP 中直接存放 (不再壓縮)
+    archive = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED)
+    return archive.writestr, archive.close
+
+def _completed_future(func, item) -> Future:
+    """在目前的執行緒直接執行 func(item)，包裝成已完成的 Future。"""
+    future = Future()
+    try:
+        future.set_result(func(item))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def generate_dorm_reports(dorm_ids: list, year_month: str, output, report_types: list = None,
+                          fixed_subsidy: int = DEFAULT_FIXED_SUBSIDY, include_external_workers: bool = False,
+                          log_callback: Callable[[str], None] = print, progress_callback: Callable = None,
+                          max_workers: int = None) -> dict:
+    """
+    為 dorm_ids 中的每間宿舍產生 year_month (YYYY-MM) 的報表活頁簿並寫入 output (見 _open_output)。
+    report_types 為 REPORT_TYPES 的鍵 (預設全部)。max_workers=1 時不使用行程池。
+    回傳 {'status', 'files', 'skipped'}。
+    """
+    dorm_ids = [int(i) for i in dorm_ids]
+    total = len(dorm_ids)
+    if not total:
+        return {'status': 'success', 'files': 0, 'skipped': 0}
+    progress = progress_callback or (lambda current, total, message=None: None)
+    log_callback(f"INFO: 開始產生 {total} 間宿舍的 {year_month} 報表...")
+
+    write_file, close_output = _open_output(output)
+    workers = max_workers or os.cpu_count() or 1
+    # 以 spawn 啟動子行程：從 Streamlit 呼叫時主行程有多個執行緒與連線池的連線，fork 會複製到子行程 (可能死結)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    pending = deque()  # [(宿舍ID, 檔名, 工作表內容, Future)]，依宿舍順序排列
+    counts = {'files': 0, 'skipped': 0}
+
+    def _submit(sheets):
+        nonlocal executor
+        if executor is not None:
+            try:
+                return executor.submit(excel_export.write_workbook, sheets)
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                log_callback(f"WARNING: 無法啟動平行產生 ({e})，改為逐一產生活頁簿。")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+        return _completed_future(excel_export.write_workbook, sheets)
+
+    def _write_head():
+        nonlocal executor
+        dorm_id, file_name, sheets, future = pending.popleft()
+        try:
+            data = future.result()
+        except BrokenProcessPool as e:
+            if executor is not None:
+                log_callback(f"WARNING: 無法啟動平行產生 ({e})，改為逐一產生活頁簿。")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+            data = excel_export.write_workbook(sheets)
+        write_file(file_name, data)
+        counts['files'] += 1
+        done = counts['files'] + counts['skipped']
+        progress(done, total, file_name)
+        log_callback(f"INFO: ({done}/{total}) 已產生 {file_name}")
+
+    try:
+        workbooks = collect_dorm_workbooks(dorm_ids, year_month, report_types, fixed_subsidy, include_external_workers, log_callback)
+        for dorm_id, file_name, sheets in workbooks:
+            if file_name is None:
+                counts['skipped'] += 1
+                progress(counts['files'] + counts['skipped'], total, f"略過宿舍 {dorm_id}")
+                continue
+            pending.append((dorm_id, file_name, sheets, _submit(sheets)))
+            # 先寫出已完成的活頁簿；待寫出的數量達上限時等待最前面的完成
+            while pending and (pending[0][3].done() or len(pending) >= MAX_PENDING_RENDERS):
+                _write_head()
+        while pending:
+            _write_head()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        close_output()
+
+    log_callback(f"SUCCESS: 已產生 {counts['files']} 份報表，略過 {counts['skipped']} 間沒有資料的宿舍。")
+    return {'status': 'success', **counts}
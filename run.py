@@ -1,6 +1,7 @@
 import streamlit.web.cli as stcli
 import sys
 import os
+import multiprocessing
 
 def get_resource_path(relative_path):
     """
@@ -15,6 +16,14 @@ def get_resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 if __name__ == "__main__":
+    # 打包成 .exe 後，報表平行解析所啟動的子行程需要此呼叫才能正確執行
+    multiprocessing.freeze_support()
+
+    # 帶有子指令參數時 (例如 run.exe sync-workers)，改為執行排程用的命令列工具，不啟動介面
+    if len(sys.argv) > 1:
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
+
     # 獲取主程式 main_app.py 的路徑
     # 我們需要 --add-data "main_app.py;." 來確保這個檔案被打包進去
     app_path = get_resource_path('main_app.py')
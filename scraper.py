@@ -5,7 +5,7 @@ import os
 import shutil
 import time
 import string
-from typing import List, Tuple, Callable
+from typing import List, Tuple, Callable, Iterator
 from datetime import datetime, timedelta # 引入 timedelta 來計算日期
 
 # ==============================================================================
@@ -47,6 +47,21 @@ def download_all_reports(
     """
     遍歷所有查詢區間，下載所有報表，並將它們存入指定的暫存資料夾。
     """
+    return list(iter_download_reports(target_url, auth_credentials, query_ranges, temp_dir, log_callback))
+
+def iter_download_reports(
+    target_url: str,
+    auth_credentials: Tuple[str, str],
+    query_ranges: List[Tuple[str, str]],
+    temp_dir: str,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None
+) -> Iterator[str]:
+    """
+    download_all_reports 的產生器版本：每下載完一個區間的報表就立即 yield 其檔案路徑，
+    讓後續的解析與寫入可以在下載進行中就開始 (見 sync_pipeline)。
+    progress_callback(已處理區間數, 總區間數, 說明) 會在每個區間開始前被呼叫。
+    """
     log_callback("INFO: 開始執行報表下載程序 (新版系統)...")
 
     try:
@@ -56,9 +71,9 @@ def download_all_reports(
         log_callback(f"INFO: 已建立並清空暫存資料夾: {temp_dir}")
     except OSError as e:
         log_callback(f"CRITICAL: 無法建立暫存資料夾 {temp_dir}，請檢查權限。錯誤: {e}")
-        return []
+        return
 
-    downloaded_files = []
+    downloaded_count = 0
     total_ranges = len(query_ranges)
 
     # --- 【核心修改 1】計算基準日期 (改為今天) ---
@@ -66,6 +81,8 @@ def download_all_reports(
     log_callback(f"INFO: 將使用基準日期: {base_date_str} (今日) 進行查詢。")
 
     for i, (start_code, end_code) in enumerate(query_ranges):
+        if progress_callback:
+            progress_callback(i, total_ranges, f"下載 {start_code}-{end_code}")
         # log_callback(f"INFO: 正在下載第 {i+1}/{total_ranges} 批: {start_code} - {end_code} ...")
         
         # --- 【核心修改 2】更新 payload ---
@@ -120,7 +137,8 @@ def download_all_reports(
             with open(file_path, 'wb') as f:
                 f.write(response.content)
 
-            downloaded_files.append(file_path)
+            downloaded_count += 1
+            yield file_path
             # log_callback(f"SUCCESS: 已儲存報表: {os.path.basename(file_path)}")
             
             time.sleep(1)
@@ -133,9 +151,10 @@ def download_all_reports(
             log_callback(f"ERROR: 處理 {start_code}-{end_code} 時發生未知系統錯誤: {e}")
 
 
-    if not downloaded_files:
+    if progress_callback:
+        progress_callback(total_ranges, total_ranges, "下載完成")
+
+    if not downloaded_count:
         log_callback("WARNING: 本次執行未下載任何報表檔案。")
     else:
-        log_callback(f"\nINFO: 全部下載程序完成，共成功下載 {len(downloaded_files)} 個檔案。")
-
-    return downloaded_files
\ No newline at end of file
+        log_callback(f"\nINFO: 全部下載程序完成，共成功下載 {downloaded_count} 個檔案。")
\ No newline at end of file
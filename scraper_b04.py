@@ -17,6 +17,20 @@ def download_b04_in_batches(
     """
     使用與 scraper.py 相同的分批策略，下載 B04 報表。
     """
+    return list(iter_b04_batches(url_base, auth, date_range, temp_dir, log_callback))
+
+def iter_b04_batches(
+    url_base: str, 
+    auth: tuple, 
+    date_range: tuple, 
+    temp_dir: str, 
+    log_callback,
+    progress_callback=None
+):
+    """
+    download_b04_in_batches 的產生器版本：每下載完一個批次就立即 yield 其檔案路徑。
+    progress_callback(已處理批次數, 總批次數, 說明) 會在每個批次開始前被呼叫。
+    """
     log_callback(f"INFO: 啟動 B04 帳務報表下載流程 (長效連線模式)...")
     
     # 1. 準備環境
@@ -44,10 +58,12 @@ def download_b04_in_batches(
     log_callback(f"INFO: 查詢帳款區間: {str_start} ~ {str_end}")
     log_callback(f"INFO: 設定連線逾時時間為 3000 秒 (50分鐘)，請耐心等候。")
 
-    downloaded_files = []
+    downloaded_count = 0
 
     # 3. 開始迴圈下載
     for i, (start_code, end_code) in enumerate(code_ranges):
+        if progress_callback:
+            progress_callback(i, total_batches, f"下載 {start_code}-{end_code}")
         
         payload = {
             'CU00_BNO1': start_code,   # 起始雇主
@@ -102,7 +118,8 @@ def download_b04_in_batches(
             with open(file_path, "wb") as f:
                 f.write(response.content)
             
-            downloaded_files.append(file_path)
+            downloaded_count += 1
+            yield file_path
             
             # 稍微休息一下
             time.sleep(0.5) 
@@ -117,9 +134,10 @@ def download_b04_in_batches(
         except Exception as e:
             log_callback(f"ERROR: 下載批次 {start_code}-{end_code} 失敗: {e}")
 
-    if not downloaded_files:
+    if progress_callback:
+        progress_callback(total_batches, total_batches, "下載完成")
+
+    if not downloaded_count:
         log_callback("WARNING: 所有批次執行完畢，但未下載到任何有效檔案。")
     else:
-        log_callback(f"SUCCESS: 下載完成！共取得 {len(downloaded_files)} 個檔案。")
-
-    return downloaded_files
\ No newline at end of file
+        log_callback(f"SUCCESS: 下載完成！共取得 {downloaded_count} 個檔案。")
\ No newline at end of file
@@ -0,0 +1,397 @@
+# sync_pipeline.py
+# 管線化的「下載 → 解析 → 寫入」同步流程
+# 原本的全自動同步是三段依序執行：全部下載完才開始解析，全部解析完才開始寫入。
+# 這裡改為三個同時進行的階段，階段之間以有上限的佇列銜接：
+#   下載 (背景執行緒) --[file_queue]--> 解析 (行程池) --[pending]--> 寫入 (呼叫端執行緒)
+# 下游來不及消化時，上游會被佇列上限擋住 (backpressure)，記憶體用量因此維持在固定範圍，
+# 總耗時趨近於最慢的那一段，而不是三段相加。
+
+import os
+import json
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, Iterator
+
+import pandas as pd
+
+import scraper
+import scraper_b04
+import data_processor
+import updater
+from data_models import finance_model
+
+# 已下載但尚未送去解析的檔案上限
+DOWNLOAD_QUEUE_SIZE = 8
+# 解析中或已解析但尚未寫入的檔案上限
+MAX_PENDING_PARSES = 8
+# 等待下載時，每隔多久檢查一次是否有已解析完成、可以寫入的檔案 (秒)
+POLL_INTERVAL = 0.1
+
+def _put(target_queue: queue.Queue, item, stop_event: threading.Event):
+    """放入佇列；佇列已滿時持續等待，但在收到停止訊號時放棄。"""
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _download_stage(download_iter_factory: Callable[[Callable[[str], None]], Iterator[str]], file_queue: queue.Queue, stop_event: threading.Event):
+    """
+    下載階段 (背景執行緒)。
+    下載器的日誌也經由 file_queue 傳回呼叫端執行緒輸出，
+    因此 log_callback (例如寫入 st.session_state) 永遠只在呼叫端執行緒被呼叫。
+    """
+    log = lambda message: _put(file_queue, ('log', message), stop_event)
+    downloads = download_iter_factory(log)
+    try:
+        for file_path in downloads:
+            if not _put(file_queue, ('file', file_path), stop_event):
+                break
+    except Exception as e:
+        log(f"ERROR: 下載流程發生未預期錯誤: {e}")
+    finally:
+        downloads.close()
+        _put(file_queue, ('done', None), stop_event)
+
+def _completed_future(func, item) -> Future:
+    """在目前的執行緒直接執行 func(item)，包裝成已完成的 Future。"""
+    future = Future()
+    try:
+        future.set_result(func(item))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def run_pipeline(
+    download_iter_factory: Callable[[Callable[[str], None]], Iterator[str]],
+    parse_func: Callable,
+    write_func: Callable,
+    log_callback: Callable[[str], None],
+    max_workers: int = None,
+    queue_size: int = DOWNLOAD_QUEUE_SIZE,
+    max_pending: int = MAX_PENDING_PARSES
+) -> int:
+    """
+    執行三段式管線。
+    - download_iter_factory(log) 回傳一個逐一 yield 檔案路徑的產生器 (在背景執行緒執行)。
+    - parse_func(file_path) 在行程池中執行，必須是可被 pickle 的模組層級函式。
+    - write_func(file_path, parsed) 在呼叫端執行緒中，依「下載順序」逐一被呼叫。
+    行程池無法啟動時自動改為在呼叫端執行緒逐一解析。回傳處理的檔案數。
+    """
+    file_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    downloader = threading.Thread(
+        target=_download_stage, args=(download_iter_factory, file_queue, stop_event),
+        name='sync-pipeline-download', daemon=True
+    )
+
+    # 以 spawn 啟動子行程：背景工作執行緒呼叫時主行程有多個執行緒與連線池的連線，fork 會複製到子行程 (可能死結)
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn')
+    )
+    pending = deque()  # [(檔案路徑, Future)]，依下載順序排列
+    processed_count = 0
+
+    def _submit(file_path):
+        nonlocal executor
+        if executor is not None:
+            try:
+                return executor.submit(parse_func, file_path)
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                log_callback(f"WARNING: 無法啟動平行解析 ({e})，改為逐一解析檔案。")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+        return _completed_future(parse_func, file_path)
+
+    def _write_head():
+        nonlocal processed_count, executor
+        file_path, future = pending.popleft()
+        try:
+            parsed = future.result()
+        except BrokenProcessPool as e:
+            if executor is not None:
+                log_callback(f"WARNING: 無法啟動平行解析 ({e})，改為逐一解析檔案。")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+            parsed = parse_func(file_path)
+        write_func(file_path, parsed)
+        processed_count += 1
+
+    downloader.start()
+    try:
+        downloading = True
+        while downloading or pending:
+            # 1. 先寫入所有「排在最前面且已解析完成」的檔案，維持下載順序
+            while pending and pending[0][1].done():
+                _write_head()
+
+            # 2. 下載已結束，或解析中的檔案已達上限：等最前面的解析完成並寫入後才繼續
+            if not downloading or len(pending) >= max_pending:
+                if pending:
+                    _write_head()
+                continue
+
+            # 3. 接收下載階段的下一個事件；有待寫入的檔案時只短暫等待
+            try:
+                kind, payload = file_queue.get(timeout=POLL_INTERVAL if pending else None)
+            except queue.Empty:
+                continue
+            if kind == 'log':
+                log_callback(payload)
+            elif kind == 'file':
+                pending.append((payload, _submit(payload)))
+            else:
+                downloading = False
+    finally:
+        stop_event.set()
+        downloader.join(timeout=5)
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return processed_count
+
+# ==============================================================================
+# 移工名冊同步
+# ==============================================================================
+
+def run_worker_sync_pipeline(
+    target_url: str,
+    auth_credentials: tuple,
+    temp_dir: str,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None,
+    max_workers: int = None,
+    max_departure_ratio=updater.DEPARTURE_SAFETY_RATIO
+) -> dict:
+    """
+    管線化的全自動移工同步：報表一下載完就送去解析，解析結果依下載順序累積。
+    由於「不在名單中即標記離職」必須看到完整名單，資料庫寫入仍在全部檔案解析完後，
+    以 updater.run_bulk_update_process 於單一交易中完成。
+    回傳 run_bulk_update_process 的結果，並加上 files (處理的檔案數)。
+    """
+    log_callback("INFO: 開始執行管線化同步 (下載、解析同時進行)...")
+    all_workers_data = []
+
+    def _collect(file_path, parsed):
+        rows_data, messages = parsed
+        for message in messages:
+            log_callback(message)
+        all_workers_data.extend(rows_data)
+
+    download_iter_factory = partial(
+        scraper.iter_download_reports, target_url, auth_credentials,
+        scraper.generate_code_ranges(), temp_dir, progress_callback=progress_callback
+    )
+    files_count = run_pipeline(download_iter_factory, data_processor.parse_report_file, _collect, log_callback, max_workers)
+
+    result = {'status': 'failed', 'added': 0, 'updated': 0, 'moved': 0, 'marked_as_left': 0, 'files': files_count}
+    if not all_workers_data:
+        log_callback("CRITICAL: 所有檔案均解析失敗或為空，未抓取到任何有效資料。")
+        return result
+
+    master_df = pd.DataFrame(all_workers_data)
+    log_callback(f"INFO: 所有報表已成功合併！總共有 {len(master_df)} 筆有效資料。")
+    fresh_df = data_processor.clean_worker_frame(master_df, log_callback)
+    if fresh_df.empty:
+        log_callback("資料處理後為空，沒有需要更新到資料庫的內容。")
+        return result
+
+    result.update(updater.run_bulk_update_process(fresh_df, log_callback, max_departure_ratio))
+    return result
+
+def download_worker_reports(
+    target_url: str,
+    auth_credentials: tuple,
+    temp_dir: str,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None
+) -> dict:
+    """僅下載移工報表至暫存資料夾。回傳 {'status', 'files'}。"""
+    files = list(scraper.iter_download_reports(
+        target_url, auth_credentials, scraper.generate_code_ranges(), temp_dir, log_callback, progress_callback
+    ))
+    if files:
+        log_callback(f"下載完成！共 {len(files)} 個檔案已存放於 '{temp_dir}' 資料夾。")
+    else:
+        log_callback("下載流程結束，但未獲取任何檔案。")
+    return {'status': 'success' if files else 'failed', 'files': len(files)}
+
+def write_worker_reports(
+    temp_dir: str,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None,
+    max_departure_ratio=updater.DEPARTURE_SAFETY_RATIO
+) -> dict:
+    """處理暫存資料夾中的所有移工報表並寫入資料庫。回傳 run_bulk_update_process 的結果加上 files。"""
+    result = {'status': 'failed', 'added': 0, 'updated': 0, 'moved': 0, 'marked_as_left': 0, 'files': 0}
+    if not os.path.exists(temp_dir) or not any(f.endswith('.xls') for f in os.listdir(temp_dir)):
+        log_callback(f"錯誤：在 '{temp_dir}' 中找不到報表檔案，請先執行「僅下載資料」。")
+        return result
+
+    file_paths = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.xls')]
+    result['files'] = len(file_paths)
+    log_callback(f"在 '{temp_dir}' 中找到 {len(file_paths)} 個報表檔案，開始處理...")
+    if progress_callback:
+        progress_callback(0, 2, "解析報表")
+
+    processed_df = data_processor.parse_and_process_reports(file_paths=file_paths, log_callback=log_callback)
+    if processed_df is None or processed_df.empty:
+        log_callback("資料處理後為空，沒有需要更新到資料庫的內容。")
+        return result
+
+    if progress_callback:
+        progress_callback(1, 2, "寫入資料庫")
+    result.update(updater.run_bulk_update_process(fresh_df=processed_df, log_callback=log_callback, max_departure_ratio=max_departure_ratio))
+    if progress_callback:
+        progress_callback(2, 2, "完成")
+    return result
+
+# ==============================================================================
+# B04 帳務同步
+# ==============================================================================
+
+# --- 費用設定檔路徑 ---
+FEE_CONFIG_FILE = "fee_config.json"
+
+def load_fee_config():
+    """讀取費用設定（包含「內部費用列表」與「對照表」）"""
+    default_config = {
+        "internal_types": ["房租", "水電費", "清潔費", "宿舍復歸費", "充電清潔費", "服務費"],
+        "mapping": {
+            "房租": "房租",
+            "電費": "水電費",
+            "水費": "水電費", 
+            "清潔費": "清潔費",
+            "服務費": "服務費"
+        }
+    }
+    
+    if os.path.exists(FEE_CONFIG_FILE):
+        try:
+            with open(FEE_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return default_config
+    return default_config
+
+def import_b04_frames(parsed_files: list, log_callback: Callable[[str], None]) -> dict:
+    """
+    將所有 B04 檔案的解析結果合併後一次寫入資料庫：只建立一次員工比對快取、只用一個交易，
+    並輸出一份彙整的「找不到員工」報告 (每人一行)，取代原本逐檔只顯示前 3 筆錯誤的方式。
+    回傳 {'status', 'success', 'skipped', 'unmatched'}；整批寫入失敗時 status 為 'failed'。
+    """
+    frames = []
+    for file_path, df in parsed_files:
+        if df.empty:
+            log_callback(f"  -> {os.path.basename(file_path)}: 解析結果為空 (可能無符合對照表的費用)。")
+        else:
+            log_callback(f"  -> {os.path.basename(file_path)}: {len(df)} 筆費用。")
+            frames.append(df)
+    if not frames:
+        log_callback("所有檔案均無可匯入的費用。")
+        return {'status': 'success', 'success': 0, 'skipped': 0, 'unmatched': 0}
+
+    all_fees = pd.concat(frames, ignore_index=True)
+    log_callback(f"INFO: 已合併 {len(frames)} 個檔案，共 {len(all_fees)} 筆費用，開始寫入資料庫...")
+    success, skipped, errors = finance_model.batch_import_external_fees(all_fees)
+    if errors and not success and not skipped:
+        # 兩個計數皆為 0 代表整批寫入失敗 (交易已復原)
+        log_callback(f"ERROR: {errors[0]}")
+        return {'status': 'failed', 'success': 0, 'skipped': 0, 'unmatched': 0}
+    log_callback(f"  -> 寫入成功: {success}, 跳過: {skipped}")
+    if errors:
+        log_callback(f"WARNING: 以下 {len(errors)} 項資料未能匯入：")
+        for err in errors:
+            log_callback(f"     * {err}")
+    unmatched = sum(1 for err in errors if err.startswith("找不到員工"))
+    return {'status': 'success', 'success': success, 'skipped': skipped, 'unmatched': unmatched}
+
+def run_b04_sync_pipeline(
+    url_base: str,
+    auth: tuple,
+    date_range: tuple,
+    temp_dir: str,
+    fee_mapping: dict,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None,
+    max_workers: int = None
+) -> dict:
+    """
+    管線化的 B04 全自動同步：報表一下載完就送去解析，解析結果依下載順序累積，
+    全部下載完成後再以 import_b04_frames 合併、一次寫入資料庫。
+    回傳 {'status', 'files', 'success', 'skipped', 'unmatched'}。
+    """
+    log_callback("INFO: 開始執行管線化 B04 同步 (下載、解析同時進行)...")
+    totals = {'status': 'failed', 'files': 0, 'success': 0, 'skipped': 0, 'unmatched': 0}
+    parsed_files = []
+
+    def _collect(file_path, df):
+        parsed_files.append((file_path, df))
+
+    download_iter_factory = partial(scraper_b04.iter_b04_batches, url_base, auth, date_range, temp_dir, progress_callback=progress_callback)
+    parse_func = partial(data_processor.parse_b04_xml, fee_mapping=fee_mapping)
+    totals['files'] = run_pipeline(download_iter_factory, parse_func, _collect, log_callback, max_workers)
+    if not totals['files']:
+        log_callback("流程結束，但未下載到任何檔案。")
+        return totals
+
+    totals.update(import_b04_frames(parsed_files, log_callback))
+    if totals['status'] != 'success':
+        return totals
+    log_callback(f"全部完成！共處理 {totals['files']} 個檔案，新增/更新 {totals['success']} 筆費用，跳過 {totals['skipped']} 筆。")
+    return totals
+
+def download_b04_reports(
+    url_base: str,
+    auth: tuple,
+    date_range: tuple,
+    temp_dir: str,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None
+) -> dict:
+    """僅下載 B04 報表至暫存資料夾。回傳 {'status', 'files'}。"""
+    files = list(scraper_b04.iter_b04_batches(url_base, auth, date_range, temp_dir, log_callback, progress_callback))
+    if files:
+        log_callback(f"下載完成，共 {len(files)} 個檔案。")
+    return {'status': 'success' if files else 'failed', 'files': len(files)}
+
+def write_b04_reports(
+    temp_dir: str,
+    fee_mapping: dict,
+    log_callback: Callable[[str], None],
+    progress_callback: Callable[[int, int, str], None] = None
+) -> dict:
+    """解析暫存資料夾中的所有 B04 報表，合併後一次寫入資料庫。回傳 {'status', 'files', 'success', 'skipped', 'unmatched'}。"""
+    totals = {'status': 'failed', 'files': 0, 'success': 0, 'skipped': 0, 'unmatched': 0}
+    if not os.path.exists(temp_dir):
+        log_callback(f"錯誤：找不到資料夾 '{temp_dir}'。")
+        return totals
+
+    file_paths = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.xls')]
+    if not file_paths:
+        log_callback("資料夾中無 Excel 檔案，請先下載。")
+        return totals
+
+    # 解析 (多核心平行處理，結果依檔案順序回傳)
+    if progress_callback:
+        progress_callback(0, 2, "解析報表")
+    log_callback(f"正在平行解析 {len(file_paths)} 個檔案...")
+    parsed_files = data_processor.parse_b04_files(file_paths, fee_mapping, log_callback)
+
+    if progress_callback:
+        progress_callback(1, 2, "寫入資料庫")
+    totals.update(import_b04_frames(parsed_files, log_callback))
+    totals['files'] = len(file_paths)
+    if totals['status'] != 'success':
+        return totals
+    if progress_callback:
+        progress_callback(2, 2, "完成")
+    log_callback(f"全部完成！共新增/更新 {totals['success']} 筆費用，跳過 {totals['skipped']} 筆。")
+    return totals
@@ -0,0 +1,39 @@
+from collections import Counter
+
+from data_models import placement_model
+
+
+def _room(**overrides):
+    room = {
+        'room_id': 1, 'dorm_id': 1, 'address': '', 'room_number': '101',
+        'gender_policy': '可混住', 'nationality_policy': '不限',
+        'open_beds': 4, 'residents': 0,
+        'genders': Counter(), 'nationalities': Counter(), 'employers': Counter(),
+        'planned': [],
+    }
+    room.update(overrides)
+    return room
+
+
+def _worker(gender, nationality='越南'):
+    return {'gender': gender, 'nationality': nationality, 'employer_name': '甲公司'}
+
+
+def test_workers_without_gender_can_share_a_room():
+    room = _room()
+    assert placement_model._room_accepts(room, _worker(None), strict_gender_policy=False)
+    placement_model._place(room, _worker(None))
+    assert placement_model._room_accepts(room, _worker(None), strict_gender_policy=False)
+
+
+def test_opposite_gender_is_still_rejected():
+    room = _room()
+    placement_model._place(room, _worker('男'))
+    assert not placement_model._room_accepts(room, _worker('女'), strict_gender_policy=False)
+    assert placement_model._room_accepts(room, _worker('男'), strict_gender_policy=False)
+
+
+def test_conflicts_ignores_missing_gender():
+    room = _room()
+    assert not placement_model._conflicts(_worker(None), _worker(None), room)
+    assert placement_model._conflicts(_worker('男'), _worker('女'), room)
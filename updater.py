@@ -1,10 +1,13 @@
 # updater.py (v2.38 簡化匹配版)
 
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Callable
 import database
-from data_processor import normalize_taiwan_address 
+from psycopg2.extras import execute_values
+from address_normalizer import normalize_address_map
+from data_models import identity_resolver
+from data_models import occupancy_index
 
 def _execute_query_to_dataframe(conn, query, params=None):
     """一個輔助函式，用來手動執行查詢並回傳 DataFrame。"""
@@ -18,353 +21,347 @@ def _execute_query_to_dataframe(conn, query, params=None):
         columns = [desc[0] for desc in cursor.description]
         return pd.DataFrame(records, columns=columns)
 
-def run_update_process(fresh_df: pd.DataFrame, log_callback: Callable[[str], None]):
+def _build_room_maps(conn, db_dorms_df: pd.DataFrame):
     """
-    【v2.41 換宿日誌增強版】
-    解決同雇主、同姓名、甚至同宿舍但不同人的問題。
-    新增邏輯：利用「交工日 (accommodation_start_date)」作為區分同名人員的關鍵指紋。
+    建立同步所需的三個映射：
+    正規化地址 -> [未分配房間] room_id、原始地址 -> [未分配房間] room_id、room_id -> dorm_id。
+    """
+    address_room_df = _execute_query_to_dataframe(conn, 'SELECT d.normalized_address, r.id as room_id FROM "Rooms" r JOIN "Dormitories" d ON r.dorm_id = d.id WHERE r.room_number = %s', ("[未分配房間]",))
+    address_room_map = pd.Series(address_room_df.room_id.values, index=address_room_df.normalized_address).to_dict()
+    
+    original_addr_map = pd.Series(db_dorms_df.id.values, index=db_dorms_df.original_address).to_dict()
+    original_addr_to_norm_map = normalize_address_map(original_addr_map.keys())
+    original_addr_to_room_map = {}
+    for addr, norm_addr in original_addr_to_norm_map.items():
+        if norm_addr in address_room_map:
+            original_addr_to_room_map[addr] = address_room_map[norm_addr]
+
+    all_rooms_df = _execute_query_to_dataframe(conn, 'SELECT id as room_id, dorm_id FROM "Rooms"')
+    room_to_dorm_map = pd.Series(all_rooms_df.dorm_id.values, index=all_rooms_df.room_id).to_dict()
+    return address_room_map, original_addr_to_room_map, room_to_dorm_map
+
+# 離職標記的安全閥：本次將被標記離職的人數超過「在住可同步人數」的此比例時中止同步，
+# 避免下載不完整時把大量仍在住的工人誤標為離職。人數低於下限時不檢查。
+DEPARTURE_SAFETY_RATIO = 0.3
+DEPARTURE_SAFETY_MIN_COUNT = 20
+
+def _mark_missing_workers_as_departed(cursor, processed_ids: set, today, log_callback: Callable[[str], None], max_departure_ratio=DEPARTURE_SAFETY_RATIO) -> int:
+    """
+    將不在本次同步名單中的可同步工人標記為今日離住 (Workers 與 AccommodationHistory 同步更新)。
+    「手動管理(他仲)」完全跳過；「手動調整」若已有離住日則不覆蓋。回傳被標記的人數。
+    以一道 anti-join 的 UPDATE ... RETURNING 完成；若人數超過安全比例則拋出 ValueError
+    (由呼叫端復原整個交易)。max_departure_ratio 傳入 None 可停用此檢查。
+    """
+    params = {'today': today, 'excluded_source': '手動管理(他仲)', 'processed_ids': list(processed_ids)}
+    missing_condition = """
+        w.accommodation_end_date IS NULL AND w.data_source != %(excluded_source)s
+        AND NOT EXISTS (SELECT 1 FROM unnest(%(processed_ids)s::text[]) AS p(unique_id) WHERE p.unique_id = w.unique_id)
+    """
+
+    if max_departure_ratio is not None:
+        cursor.execute("""
+            SELECT COUNT(*) AS active_count,
+                   COUNT(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM unnest(%(processed_ids)s::text[]) AS p(unique_id) WHERE p.unique_id = w.unique_id)) AS missing_count
+            FROM "Workers" w
+            WHERE w.accommodation_end_date IS NULL AND w.data_source != %(excluded_source)s
+        """, params)
+        counts = cursor.fetchone()
+        active_count, missing_count = counts['active_count'], counts['missing_count']
+        if missing_count >= DEPARTURE_SAFETY_MIN_COUNT and missing_count > active_count * max_departure_ratio:
+            raise ValueError(
+                f"本次將有 {missing_count} / {active_count} 位在住工人被標記離職，超過安全上限 ({max_departure_ratio:.0%})，"
+                f"可能是報表下載不完整，已中止同步。"
+            )
+
+    cursor.execute(f"""
+        WITH marked AS (
+            UPDATE "Workers" w SET accommodation_end_date = %(today)s
+            WHERE {missing_condition}
+            RETURNING w.unique_id
+        ), closed AS (
+            UPDATE "AccommodationHistory" ah SET end_date = %(today)s
+            FROM marked m
+            WHERE ah.worker_unique_id = m.unique_id AND ah.end_date IS NULL
+        )
+        SELECT unique_id FROM marked
+    """, params)
+    marked_ids = sorted(rec['unique_id'] for rec in cursor.fetchall())
+    for uid in marked_ids:
+        log_callback(f"INFO: [自動] 移工 '{uid}' 已不在名單，同步標記為今日離職。")
+    return len(marked_ids)
+
+# ==============================================================================
+# 批次 (set-based) 同步模式
+# 比對規則：
+#   - 身分比對依序為 unique_id → ARC → 護照 → 雇主+姓名(+交工日)，細節見 identity_resolver.resolve_sync；
+#     比對不到的列視為新進人員。
+#   - 既有工人以報表覆蓋基本資料 (ARC、護照、雇主、姓名、交工日若報表空白則保留原值)；
+#     資料來源為「手動管理(他仲)」或「手動調整」者不改資料來源與房間、也不自動換宿。
+#   - 換到不同宿舍，或離職超過 REHIRE_THRESHOLD_DAYS 天後又出現時，結束舊住宿紀錄並以今日建立新紀錄；
+#     否則僅更新最新一筆住宿紀錄的離住日。
+#   - 報表中不再出現的工人標記為今日離職 (受 DEPARTURE_SAFETY_RATIO 保護)。
+# 比對在 pandas 中整批完成，結果以 COPY 寫入暫存表後，
+# 再以少數幾道批次 SQL 套用新增、更新、換宿與結束舊住宿紀錄。
+# ==============================================================================
+
+PROTECTED_SOURCES = ('手動管理(他仲)', '手動調整')
+REHIRE_THRESHOLD_DAYS = 7
+
+# 報表資料中，會被寫入 Workers 的欄位 (實際寫入時再與 Workers 的欄位取交集)
+FRESH_WORKER_COLUMNS = [
+    'unique_id', 'employer_name', 'worker_name', 'native_name', 'gender', 'nationality',
+    'passport_number', 'arc_number', 'accommodation_start_date', 'work_permit_expiry_date',
+    'departure_date', 'original_address', 'normalized_address', 'city', 'district'
+]
+# 既有工人要以報表覆蓋的欄位；其中 KEEP_IF_BLANK 的欄位若報表為空白則保留資料庫原值
+UPDATE_WORKER_COLUMNS = ['native_name', 'gender', 'nationality', 'passport_number', 'arc_number', 'work_permit_expiry_date', 'employer_name', 'worker_name', 'accommodation_start_date']
+KEEP_IF_BLANK_COLUMNS = ['arc_number', 'passport_number', 'employer_name', 'worker_name', 'accommodation_start_date']
+DATE_COLUMNS = ['accommodation_start_date', 'work_permit_expiry_date', 'departure_date']
+
+SYNC_STAGING_TABLE = 'sync_staging'
+
+def _text_key(series: pd.Series) -> pd.Series:
+    """將欄位轉為去除前後空白的字串 (空值轉為空字串)，供比對使用。"""
+    return series.astype(object).where(series.notna(), '').astype(str).str.strip()
+
+def _to_date_series(series: pd.Series) -> pd.Series:
+    """將 'YYYY-MM-DD' 字串或 date 物件整欄轉為 datetime64 (無效值為 NaT)。"""
+    return pd.to_datetime(series.astype(object).where(series.notna(), None), errors='coerce').dt.normalize()
+
+def _as_python_date(value):
+    return value.date() if pd.notna(value) else None
+
+def _sync_dormitories_bulk(cursor, fresh_df: pd.DataFrame, db_dorms_df: pd.DataFrame, log_callback: Callable[[str], None]):
+    """批次建立新宿舍與其 [未分配房間]，並補齊缺少 [未分配房間] 的既有宿舍。"""
+    db_addresses_norm = set(db_dorms_df['normalized_address']) if not db_dorms_df.empty else set()
+    unique_new_dorms = fresh_df[~fresh_df['normalized_address'].isin(db_addresses_norm) & fresh_df['normalized_address'].notna()].drop_duplicates(subset=['normalized_address'])
+
+    if not unique_new_dorms.empty:
+        log_callback(f"INFO: 發現 {len(unique_new_dorms)} 個新宿舍地址，將自動建立...")
+        dorm_values = [(row.original_address, row.normalized_address, '雇主') for row in unique_new_dorms[['original_address', 'normalized_address']].itertuples(index=False)]
+        new_dorm_ids = execute_values(
+            cursor,
+            'INSERT INTO "Dormitories" ("original_address", "normalized_address", "primary_manager") VALUES %s RETURNING id',
+            dorm_values, fetch=True, page_size=1000
+        )
+        execute_values(
+            cursor,
+            'INSERT INTO "Rooms" (dorm_id, room_number) VALUES %s',
+            [(rec['id'], "[未分配房間]") for rec in new_dorm_ids], page_size=1000
+        )
+
+    # 修復缺少未分配房間的宿舍 (一道 SQL 完成)
+    cursor.execute("""
+        INSERT INTO "Rooms" (dorm_id, room_number)
+        SELECT d.id, '[未分配房間]' FROM "Dormitories" d
+        LEFT JOIN "Rooms" r ON d.id = r.dorm_id AND r.room_number = '[未分配房間]'
+        WHERE r.id IS NULL
+    """)
+
+def _load_worker_states(conn) -> pd.DataFrame:
+    """一次取得所有工人的識別特徵、交工日與最新一筆住宿紀錄。"""
+    query = """
+        SELECT DISTINCT ON (w.unique_id)
+            w.unique_id, w.data_source, w.accommodation_end_date AS worker_end_date,
+            w.arc_number, w.passport_number, w.employer_name, w.worker_name,
+            w.accommodation_start_date,
+            ah.id AS history_id, ah.room_id, ah.end_date AS history_end_date, ah.start_date AS history_start_date
+        FROM "Workers" w
+        LEFT JOIN "AccommodationHistory" ah ON ah.worker_unique_id = w.unique_id
+        ORDER BY w.unique_id, ah.start_date DESC NULLS LAST, ah.id DESC NULLS LAST
+    """
+    return _execute_query_to_dataframe(conn, query)
+
+def _plan_sync_actions(fresh: pd.DataFrame, workers: pd.DataFrame, room_to_dorm_map: dict, today, row_logs: list) -> pd.DataFrame:
+    """
+    依比對結果整批計算每一列要執行的動作：新增人員、更新資料、換宿 (含結束舊紀錄) 或僅更新離住日。
+    同一位工人若在報表中出現多次，資料庫動作以最後一筆為準。
+    """
+    plan = fresh.merge(
+        workers[['unique_id', 'data_source', 'worker_end_date', 'history_id', 'room_id', 'history_end_date', 'history_start_date']]
+            .rename(columns={'unique_id': 'resolved_id', 'room_id': 'current_room_id'}),
+        on='resolved_id', how='left'
+    )
+    plan.index = fresh.index
+    plan['new_room_id'] = pd.to_numeric(fresh['room_id'], errors='coerce').astype('Int64')
+    plan['is_new'] = ~plan['is_matched']
+    plan['is_last'] = ~plan['resolved_id'].duplicated(keep='last')
+
+    departure = _to_date_series(plan['departure_date']) if 'departure_date' in plan else pd.Series(pd.NaT, index=plan.index)
+    history_end = _to_date_series(plan['history_end_date'])
+    history_start = _to_date_series(plan['history_start_date'])
+    worker_end = _to_date_series(plan['worker_end_date'])
+    today_ts = pd.Timestamp(today)
+
+    has_new_room = plan['is_matched'] & plan['new_room_id'].notna()
+    new_dorm = plan['new_room_id'].map(room_to_dorm_map)
+    current_dorm = plan['current_room_id'].map(room_to_dorm_map)
+    is_dorm_change = (new_dorm != current_dorm) | current_dorm.isna()
+    is_rehire = worker_end.notna() & departure.isna() & ((today_ts - worker_end).dt.days > REHIRE_THRESHOLD_DAYS)
+    is_protected = plan['data_source'].isin(PROTECTED_SOURCES)
+
+    plan['do_move'] = has_new_room & ~is_protected & (is_dorm_change | is_rehire).fillna(False)
+    plan['close_old'] = plan['do_move'] & history_end.isna()
+    end_changed = ~(departure.eq(history_end) | (departure.isna() & history_end.isna()))
+    end_valid = departure.isna() | (history_start.notna() & (departure >= history_start))
+    plan['update_end'] = has_new_room & ~plan['do_move'] & end_changed & end_valid & plan['history_id'].notna()
+    plan['history_id'] = pd.to_numeric(plan['history_id'], errors='coerce').astype('Int64')
+
+    for col in DATE_COLUMNS:
+        if col in plan:
+            plan[col] = _to_date_series(plan[col]).map(_as_python_date).astype(object)
+
+    positions = {idx: pos for pos, idx in enumerate(plan.index)}
+    stripped_names = _text_key(plan['worker_name'])
+    for idx in plan.index[plan['is_new']]:
+        row_logs.append((positions[idx], 2, f"INFO: [新增人員] {plan.at[idx, 'worker_name']} ({plan.at[idx, 'employer_name']})"))
+    for idx in plan.index[plan['do_move'] & plan['is_last']]:
+        cur = current_dorm[idx]
+        cur_display = int(cur) if pd.notna(cur) else None
+        row_logs.append((positions[idx], 2, f"INFO: [換宿] 偵測到 '{stripped_names[idx]}' 地址變更 ({cur_display} -> {int(new_dorm[idx])})，已建立新住宿紀錄 (起始日: {today})。"))
+    return plan
+
+def _apply_sync_plan(cursor, plan: pd.DataFrame, worker_columns: set, today):
+    """把整批動作 COPY 進暫存表，再以少數幾道批次 SQL 套用到 Workers 與 AccommodationHistory。"""
+    staged_fresh_cols = [c for c in FRESH_WORKER_COLUMNS if c in plan.columns]
+    column_types = {c: ('DATE' if c in DATE_COLUMNS else 'TEXT') for c in staged_fresh_cols}
+    column_sql = ', '.join(f'"{c}" {t}' for c, t in column_types.items())
+    cursor.execute(f"""
+        CREATE TEMP TABLE {SYNC_STAGING_TABLE} (
+            resolved_id TEXT, is_new BOOLEAN, is_last BOOLEAN, new_room_id INTEGER,
+            do_move BOOLEAN, close_old BOOLEAN, update_end BOOLEAN, history_id INTEGER,
+            {column_sql}
+        ) ON COMMIT DROP
+    """)
+    action_cols = ['resolved_id', 'is_new', 'is_last', 'new_room_id', 'do_move', 'close_old', 'update_end', 'history_id']
+    database.copy_dataframe(cursor, SYNC_STAGING_TABLE, plan, action_cols + staged_fresh_cols)
+
+    # 1. 新增人員
+    insert_cols = [c for c in staged_fresh_cols if c in worker_columns]
+    target_cols = insert_cols + ['data_source', 'special_status', 'room_id', 'accommodation_end_date']
+    cursor.execute(f"""
+        INSERT INTO "Workers" ({', '.join(f'"{c}"' for c in target_cols)})
+        SELECT {', '.join(f's."{c}"' for c in insert_cols)}, '系統自動更新', NULL, s.new_room_id, s.departure_date
+        FROM {SYNC_STAGING_TABLE} s WHERE s.is_new
+    """)
+
+    # 2. 更新既有人員 (空白的關鍵欄位保留原值；受保護的資料來源不改 data_source 與 room_id)
+    set_clauses = []
+    for col in UPDATE_WORKER_COLUMNS:
+        if col not in staged_fresh_cols or col not in worker_columns:
+            continue
+        if col in KEEP_IF_BLANK_COLUMNS:
+            if col in DATE_COLUMNS:
+                set_clauses.append(f'"{col}" = COALESCE(s."{col}", w."{col}")')
+            else:
+                set_clauses.append(f'"{col}" = CASE WHEN btrim(COALESCE(s."{col}", \'\')) = \'\' THEN w."{col}" ELSE s."{col}" END')
+        else:
+            set_clauses.append(f'"{col}" = s."{col}"')
+    set_clauses.append("data_source = CASE WHEN w.data_source IN %(protected)s THEN w.data_source ELSE '系統自動更新' END")
+    set_clauses.append("room_id = CASE WHEN s.new_room_id IS NOT NULL AND COALESCE(w.data_source, '') NOT IN %(protected)s THEN s.new_room_id ELSE w.room_id END")
+    set_clauses.append("accommodation_end_date = s.departure_date")
+    cursor.execute(f"""
+        UPDATE "Workers" w SET {', '.join(set_clauses)}
+        FROM {SYNC_STAGING_TABLE} s
+        WHERE NOT s.is_new AND s.is_last AND w.unique_id = s.resolved_id
+    """, {'protected': PROTECTED_SOURCES})
+
+    # 3. 換宿：先結束仍在住的舊紀錄，再建立今日起算的新紀錄
+    cursor.execute(f"""
+        UPDATE "AccommodationHistory" ah SET end_date = %(today)s
+        FROM {SYNC_STAGING_TABLE} s
+        WHERE s.close_old AND s.is_last AND ah.worker_unique_id = s.resolved_id AND ah.end_date IS NULL
+    """, {'today': today})
+    cursor.execute(f"""
+        INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, end_date)
+        SELECT s.resolved_id, s.new_room_id, %(today)s, s.departure_date
+        FROM {SYNC_STAGING_TABLE} s WHERE s.do_move AND s.is_last
+    """, {'today': today})
+
+    # 4. 新人員的第一筆住宿紀錄 (以交工日為起始日，沒有交工日則為今天)
+    cursor.execute(f"""
+        INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number, end_date)
+        SELECT s.resolved_id, s.new_room_id, COALESCE(s.accommodation_start_date, %(today)s), NULL, s.departure_date
+        FROM {SYNC_STAGING_TABLE} s WHERE s.is_new AND s.new_room_id IS NOT NULL
+    """, {'today': today})
+
+    # 5. 僅更新最新一筆住宿紀錄的離住日
+    cursor.execute(f"""
+        UPDATE "AccommodationHistory" ah SET end_date = s.departure_date
+        FROM {SYNC_STAGING_TABLE} s
+        WHERE s.update_end AND s.is_last AND ah.id = s.history_id
+    """)
+
+def run_bulk_update_process(fresh_df: pd.DataFrame, log_callback: Callable[[str], None], max_departure_ratio=DEPARTURE_SAFETY_RATIO) -> dict:
+    """
+    【v3.0 批次同步版】將移工報表同步至資料庫 (比對規則見本節開頭說明)。
+    1. 將比對後的報表資料 COPY 進暫存表。
+    2. 身分比對 (unique_id → ARC → 護照 → 雇主+姓名+交工日) 以 identity_resolver 整批完成。
+    3. 新增、更新、換宿與結束舊紀錄各只需一道 SQL。
+    回傳各項計數 (新增、更新、換宿、標記離職) 與執行狀態。
+    max_departure_ratio 為離職標記的安全比例 (見 DEPARTURE_SAFETY_RATIO)，傳入 None 可停用。
     """
     log_callback("\n===== 開始執行核心資料庫更新程序 (v2.41 換宿日誌增強版) =====")
     today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-    
-    REHIRE_THRESHOLD_DAYS = 7
-    
+    result = {'status': 'failed', 'added': 0, 'updated': 0, 'moved': 0, 'marked_as_left': 0}
+
     conn = database.get_db_connection()
     if not conn:
         log_callback("CRITICAL: 無法連接到資料庫，更新程序終止。")
-        return
-        
+        return result
+
     try:
         with conn.cursor() as cursor:
-            # --- 步驟 1: 同步宿舍與地址映射 (邏輯不變) ---
-            log_callback("INFO: 步驟 1/5 - 同步宿舍地址...")
-            db_dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, normalized_address, original_address FROM "Dormitories"')
-            db_addresses_norm = set(db_dorms_df['normalized_address']) if not db_dorms_df.empty else set()
-            unique_new_dorms = fresh_df[~fresh_df['normalized_address'].isin(db_addresses_norm) & fresh_df['normalized_address'].notna()].drop_duplicates(subset=['normalized_address'])
-            
-            if not unique_new_dorms.empty:
-                log_callback(f"INFO: 發現 {len(unique_new_dorms)} 個新宿舍地址，將自動建立...")
-                for _, row in unique_new_dorms.iterrows():
-                    dorm_details = { 
-                        "original_address": row['original_address'], 
-                        "normalized_address": row['normalized_address'], 
-                        "primary_manager": "雇主" 
-                    }
-                    columns = ', '.join(f'"{k}"' for k in dorm_details.keys()); placeholders = ', '.join(['%s'] * len(dorm_details))
-                    cursor.execute(f'INSERT INTO "Dormitories" ({columns}) VALUES ({placeholders}) RETURNING id', tuple(dorm_details.values()))
-                    dorm_id = cursor.fetchone()['id']
-                    cursor.execute('INSERT INTO "Rooms" (dorm_id, room_number) VALUES (%s, %s)', (dorm_id, "[未分配房間]"))
-            
-            # 修復缺少未分配房間的宿舍
-            cursor.execute("SELECT d.id, d.original_address FROM \"Dormitories\" d LEFT JOIN \"Rooms\" r ON d.id = r.dorm_id AND r.room_number = '[未分配房間]' WHERE r.id IS NULL;")
-            dorms_to_repair = cursor.fetchall()
-            if dorms_to_repair:
-                for dorm in dorms_to_repair:
-                    try:
-                        cursor.execute('INSERT INTO "Rooms" (dorm_id, room_number) VALUES (%s, %s)', (dorm['id'], "[未分配房間]"))
-                    except Exception: pass
-            
-            # 準備地址映射
-            address_room_df = _execute_query_to_dataframe(conn, 'SELECT d.normalized_address, r.id as room_id FROM "Rooms" r JOIN "Dormitories" d ON r.dorm_id = d.id WHERE r.room_number = %s', ("[未分配房間]",))
-            address_room_map = pd.Series(address_room_df.room_id.values, index=address_room_df.normalized_address).to_dict()
-            
-            original_addr_map = pd.Series(db_dorms_df.id.values, index=db_dorms_df.original_address).to_dict()
-            original_addr_to_room_map = {}
-            for dorm_id, addr in original_addr_map.items():
-                norm_addr = normalize_taiwan_address(addr)['full']
-                if norm_addr in address_room_map:
-                    original_addr_to_room_map[addr] = address_room_map[norm_addr]
-
-            all_rooms_df = _execute_query_to_dataframe(conn, 'SELECT id as room_id, dorm_id FROM "Rooms"')
-            room_to_dorm_map = pd.Series(all_rooms_df.dorm_id.values, index=all_rooms_df.room_id).to_dict()
-
-            fresh_df['room_id'] = fresh_df['normalized_address'].map(address_room_map)
-            fresh_df['room_id'] = fresh_df['room_id'].fillna(fresh_df['original_address'].map(original_addr_to_room_map))
-
-            # --- 步驟 2: 取得現有工人狀態 (加入 accommodation_start_date) ---
-            log_callback("INFO: 步驟 4/5 - 正在取得現有工人的識別特徵與交工日...")
-            
-            # 【核心修改】Select 加入 w.accommodation_start_date
-            all_workers_info_query = """
-                WITH LatestHistory AS (
-                    SELECT 
-                        ah.worker_unique_id, ah.room_id, ah.end_date AS history_end_date,
-                        ah.start_date AS history_start_date, 
-                        ROW_NUMBER() OVER(PARTITION BY ah.worker_unique_id ORDER BY ah.start_date DESC, ah.id DESC) as rn
-                    FROM "AccommodationHistory" ah
-                )
-                SELECT 
-                    w.unique_id, w.data_source, w.accommodation_end_date AS worker_end_date,
-                    w.arc_number, w.passport_number, w.employer_name, w.worker_name,
-                    w.accommodation_start_date, -- 【新增】此欄位用於同名比對
-                    lh.room_id, lh.history_end_date, lh.history_start_date 
-                FROM "Workers" w
-                LEFT JOIN LatestHistory lh ON w.unique_id = lh.worker_unique_id AND lh.rn = 1;
-            """
-            all_workers_info_df = _execute_query_to_dataframe(conn, all_workers_info_query)
-
-            # 建立反向映射
-            arc_to_id_map = {str(row['arc_number']).strip(): row['unique_id'] for _, row in all_workers_info_df.iterrows() if row['arc_number']}
-            passport_to_id_map = {str(row['passport_number']).strip(): row['unique_id'] for _, row in all_workers_info_df.iterrows() if row['passport_number']}
-            
-            # 建立 (雇主, 姓名) -> ID 列表
-            name_employer_to_id_map = {}
-            for _, row in all_workers_info_df.iterrows():
-                key = (str(row['employer_name']).strip(), str(row['worker_name']).strip())
-                if key not in name_employer_to_id_map:
-                    name_employer_to_id_map[key] = []
-                name_employer_to_id_map[key].append(row['unique_id'])
-
-            worker_info_cache = {row['unique_id']: row for _, row in all_workers_info_df.iterrows()}
-            
-            # --- 步驟 3: 逐筆比對 ---
-            log_callback("INFO: 步驟 5/5 - 正在執行智慧比對...")
-            processed_ids = set()
-            added_count, updated_count, marked_as_left_count, moved_count = 0, 0, 0, 0
-            
-            cursor.execute('SELECT * FROM "Workers" LIMIT 0')
-            worker_columns = {desc[0] for desc in cursor.description}
-
-            for index, fresh_worker in fresh_df.iterrows():
-                # ----------------------------------------------------
-                # A. 識別邏輯
-                # ----------------------------------------------------
-                fresh_arc = str(fresh_worker.get('arc_number', '')).strip()
-                fresh_passport = str(fresh_worker.get('passport_number', '')).strip()
-                fresh_employer = str(fresh_worker.get('employer_name', '')).strip()
-                fresh_name = str(fresh_worker.get('worker_name', '')).strip()
-                
-                # 取得報表中的交工日 (這非常重要)
-                fresh_start_date_str = fresh_worker.get('accommodation_start_date')
-                fresh_start_date_obj = None
-                if fresh_start_date_str:
-                    try:
-                        fresh_start_date_obj = datetime.strptime(fresh_start_date_str, '%Y-%m-%d').date()
-                    except: pass
-
-                raw_room_id = fresh_worker.get('room_id')
-                new_room_id = int(raw_room_id) if pd.notna(raw_room_id) else None
-                
-                # 1. ID Match (完全命中)
-                worker_id = fresh_worker['unique_id']
-                is_worker_matched = (worker_id in worker_info_cache)
-
-                if not is_worker_matched:
-                    matched_id = None
-                    match_reason = ""
-                    
-                    # 2. Fallback Match (ARC 或 Passport)
-                    if not matched_id and fresh_arc:
-                        matched_id = arc_to_id_map.get(fresh_arc)
-                        if matched_id: match_reason = "ARC匹配"
-                    
-                    if not matched_id and fresh_passport:
-                        matched_id = passport_to_id_map.get(fresh_passport)
-                        if matched_id: match_reason = "Passport匹配"
-
-                    # 3. Name + Employer Match (同名處理邏輯)
-                    if not matched_id:
-                        key = (fresh_employer, fresh_name)
-                        potential_ids = name_employer_to_id_map.get(key, [])
-                        
-                        if len(potential_ids) == 1:
-                            # 只有一位同名，且報表有交工日，資料庫也有交工日，進行核對
-                            pid = potential_ids[0]
-                            db_start_date = worker_info_cache[pid].get('accommodation_start_date')
-                            
-                            # 如果兩邊都有日期，且日期不同 -> 視為不同人
-                            if fresh_start_date_obj and db_start_date:
-                                if fresh_start_date_obj == db_start_date:
-                                    matched_id = pid
-                                    match_reason = "姓名+雇主+交工日匹配"
-                                else:
-                                    log_callback(f"INFO: 同雇主同名 '{fresh_name}'，但交工日不同 (DB:{db_start_date} vs File:{fresh_start_date_obj})，視為新人。")
-                            else:
-                                # 其中一邊沒日期，為了避免誤判，還是採納 (因為只有一位候選人)
-                                # 這是舊邏輯，保留以相容舊資料
-                                matched_id = pid
-                                match_reason = "姓名+雇主匹配(單一)"
-
-                        elif len(potential_ids) > 1:
-                            # --- 多位同名：必須依靠「交工日」區分 ---
-                            date_matched_candidates = []
-                            if fresh_start_date_obj:
-                                for pid in potential_ids:
-                                    db_start_date = worker_info_cache[pid].get('accommodation_start_date')
-                                    if db_start_date == fresh_start_date_obj:
-                                        date_matched_candidates.append(pid)
-                            
-                            if len(date_matched_candidates) == 1:
-                                matched_id = date_matched_candidates[0]
-                                match_reason = "姓名+雇主+交工日(多名中唯一)"
-                            else:
-                                log_callback(f"INFO: 雇主'{fresh_employer}'下有多位'{fresh_name}'，無法透過交工日區分 (符合日期者有{len(date_matched_candidates)}人)，視為新進人員。")
-
-                    # --- 確認匹配結果 ---
-                    if matched_id:
-                        # 再次檢查雇主是否相同 (防呆)
-                        db_employer = str(worker_info_cache[matched_id].get('employer_name', '')).strip()
-                        if db_employer == fresh_employer:
-                            worker_id = matched_id 
-                            is_worker_matched = True
-                            if match_reason not in ["ARC匹配", "Passport匹配"]: # 減少日誌雜訊
-                                log_callback(f"INFO: [{match_reason}] 關聯舊資料 ID: {matched_id}。")
-                        else:
-                            matched_id = None 
-
-                # ----------------------------------------------------
-                # B. 資料操作 (新增/更新)
-                # ----------------------------------------------------
-                db_info = worker_info_cache.get(worker_id, {})
-                data_source = db_info.get('data_source')
-                
-                departure_date_from_file_str = fresh_worker.get('departure_date')
-                final_departure_date = None 
-                if pd.notna(departure_date_from_file_str) and departure_date_from_file_str:
-                    try:
-                        final_departure_date = datetime.strptime(departure_date_from_file_str, '%Y-%m-%d').date()
-                    except ValueError:
-                        final_departure_date = None
-
-                current_room_id = db_info.get('room_id')
-                current_history_end_date = db_info.get('history_end_date')
-                current_worker_end_date = db_info.get('worker_end_date')
-                current_history_start_date = db_info.get('history_start_date')
-                
-                if not is_worker_matched:
-                    # --- 新增 (New Worker) ---
-                    new_worker_details = fresh_worker.to_dict()
-                    new_worker_details['data_source'] = '系統自動更新'
-                    new_worker_details['special_status'] = None
-                    final_details = {k: v for k, v in new_worker_details.items() if k in worker_columns}
-                    
-                    if new_room_id is not None: final_details['room_id'] = new_room_id
-                    else: final_details['room_id'] = None 
-                    final_details['accommodation_end_date'] = final_departure_date
-                    
-                    columns = ', '.join(f'"{k}"' for k in final_details.keys())
-                    placeholders = ', '.join(['%s'] * len(final_details))
-                    try:
-                        cursor.execute(f'INSERT INTO "Workers" ({columns}) VALUES ({placeholders})', tuple(final_details.values()))
-                        added_count += 1
-                        log_callback(f"INFO: [新增人員] {final_details.get('worker_name')} ({final_details.get('employer_name')})")
-                        
-                        if new_room_id is not None:
-                            # 使用交工日作為住宿起始日
-                            start_date = fresh_start_date_obj if fresh_start_date_obj else today
-                            cursor.execute('INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, bed_number, end_date) VALUES (%s, %s, %s, %s, %s)', 
-                                        (worker_id, new_room_id, start_date, None, final_departure_date))
-                            moved_count += 1 
-                    except Exception as insert_e:
-                        log_callback(f"ERROR: 新增工人 {worker_id} 失敗: {insert_e}")
-                
-                else:
-                    # --- 更新 (Update Existing) ---
-                    # 1. 更新基本資料
-                    update_cols = ['native_name', 'gender', 'nationality', 'passport_number', 'arc_number', 'work_permit_expiry_date', 'employer_name', 'worker_name', 'accommodation_start_date']
-                    update_details = {col: fresh_worker.get(col) for col in update_cols if col in fresh_worker}
-                    
-                    # 避免更新成空值
-                    for key in ['arc_number', 'passport_number', 'employer_name', 'worker_name', 'accommodation_start_date']:
-                        if key in update_details and (pd.isna(update_details[key]) or not str(update_details[key]).strip()):
-                            update_details.pop(key)
-                    
-                    if data_source != '手動管理(他仲)' and data_source != '手動調整':
-                         update_details['data_source'] = '系統自動更新'
-                    
-                    # 修正：如果資料來源是受保護的狀態，則不更新 room_id
-                    protected_sources = ['手動管理(他仲)', '手動調整']
-                    if new_room_id is not None and data_source not in protected_sources: 
-                        update_details['room_id'] = new_room_id
-                    update_details['accommodation_end_date'] = final_departure_date
-                    
-                    fields = ', '.join([f'"{key}" = %s' for key in update_details.keys()])
-                    values = list(update_details.values()) + [worker_id]
-                    cursor.execute(f'UPDATE "Workers" SET {fields} WHERE unique_id = %s', tuple(values))
-                    updated_count += 1 
-                    
-                    # 2. 住宿歷史更新
-                    if new_room_id is not None:
-                        new_dorm_id = room_to_dorm_map.get(new_room_id)
-                        current_dorm_id = room_to_dorm_map.get(current_room_id)
-                        # 判斷是否換了宿舍
-                        is_dorm_change = (new_dorm_id != current_dorm_id)
-                        
-                        # 重新入職判斷 (離職超過7天後又出現)
-                        is_long_term_rehire = False
-                        if (current_worker_end_date is not None) and (final_departure_date is None):
-                            time_difference = today - current_worker_end_date
-                            if time_difference.days > REHIRE_THRESHOLD_DAYS:
-                                is_long_term_rehire = True
-                        
-                        # 【核心修正區塊開始】
-                        if data_source not in ['手動調整', '手動管理(他仲)'] and (is_dorm_change or is_long_term_rehire):
-                            # 修正邏輯：換宿時，新紀錄的起始日必須是 "今天" (today)，
-                            # 不能使用 fresh_start_date_obj (這是 Excel 裡的交工日，通常是舊日期)
-                            
-                            # 1. 設定新紀錄的開始日 = 今天 (例如 11/15)
-                            new_hist_start = today 
-                            
-                            # 2. 結束舊的紀錄
-                            if current_history_end_date is None:
-                                # 將舊紀錄的 end_date 設為新紀錄開始日【同一天】
-                                # 效果：A宿舍 住到 11/15，B宿舍 從 11/15 開始住
-                                end_date_for_old_record = new_hist_start
-                                
-                                cursor.execute(
-                                    'UPDATE "AccommodationHistory" SET end_date = %s WHERE worker_unique_id = %s AND end_date IS NULL', 
-                                    (end_date_for_old_record, worker_id)
-                                )
-                            
-                            # 3. 建立新的紀錄
-                            # 注意：這裡使用的是 new_hist_start (今天)，而不是 fresh_worker 的日期
-                            cursor.execute(
-                                'INSERT INTO "AccommodationHistory" (worker_unique_id, room_id, start_date, end_date) VALUES (%s, %s, %s, %s)', 
-                                (worker_id, new_room_id, new_hist_start, final_departure_date)
-                            )
-                            moved_count += 1
-                            
-                            log_callback(f"INFO: [換宿] 偵測到 '{fresh_name}' 地址變更 ({current_dorm_id} -> {new_dorm_id})，已建立新住宿紀錄 (起始日: {new_hist_start})。")
-                            
-                        elif final_departure_date != current_history_end_date:
-                            # 僅更新離住日
-                            is_valid_update = False
-                            if final_departure_date is None: is_valid_update = True 
-                            elif current_history_start_date and final_departure_date >= current_history_start_date: is_valid_update = True 
-                            if is_valid_update:
-                                cursor.execute(
-                                    """SELECT id FROM "AccommodationHistory" WHERE worker_unique_id = %s ORDER BY start_date DESC, id DESC LIMIT 1""",
-                                    (worker_id,)
-                                )
-                                latest_history_record = cursor.fetchone()
-                                if latest_history_record:
-                                    cursor.execute('UPDATE "AccommodationHistory" SET end_date = %s WHERE id = %s', (final_departure_date, latest_history_record['id']))
-                
-                processed_ids.add(worker_id)
-            
-            # --- 處理消失的工人 (離職) ---
-            cursor.execute('SELECT unique_id, data_source FROM "Workers" WHERE data_source != %s', ('手動管理(他仲)',))
-            db_syncable_workers = {rec['unique_id']: rec['data_source'] for rec in cursor.fetchall()}
-            ids_to_check_for_departure = set(db_syncable_workers.keys()) - processed_ids
-            
-            if ids_to_check_for_departure:
-                for uid in ids_to_check_for_departure:
-                    cursor.execute('SELECT accommodation_end_date FROM "Workers" WHERE unique_id = %s', (uid,))
-                    worker_status = cursor.fetchone()
-                    if db_syncable_workers.get(uid) == '手動調整' and worker_status and worker_status['accommodation_end_date'] is not None:
-                        continue 
-                    cursor.execute('UPDATE "Workers" SET accommodation_end_date = %s WHERE unique_id = %s AND accommodation_end_date IS NULL', (today, uid))
-                    if cursor.rowcount > 0: 
-                        marked_as_left_count += 1
-                        cursor.execute('UPDATE "AccommodationHistory" SET end_date = %s WHERE worker_unique_id = %s AND end_date IS NULL', (today, uid))
-                        log_callback(f"INFO: [自動] 移工 '{uid}' 已不在名單，同步標記為今日離職。")
-
+            result.update(_run_bulk_sync(conn, cursor, fresh_df, today, log_callback, max_departure_ratio))
         conn.commit()
-        log_callback(f"SUCCESS: 資料庫更新完成！新增: {added_count}, 更新: {updated_count}, 換宿: {moved_count}, 標記離職: {marked_as_left_count}。")
-
+        identity_resolver.invalidate()
+        occupancy_index.invalidate()
+        result['status'] = 'success'
+        log_callback(f"SUCCESS: 資料庫更新完成！新增: {result['added']}, 更新: {result['updated']}, 換宿: {result['moved']}, 標記離職: {result['marked_as_left']}。")
     except Exception as e:
         log_callback(f"CRITICAL: 更新資料庫時發生嚴重錯誤，所有操作已復原: {e}")
         if conn: conn.rollback()
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
+    return result
+
+def _run_bulk_sync(conn, cursor, fresh_df: pd.DataFrame, today, log_callback: Callable[[str], None], max_departure_ratio=DEPARTURE_SAFETY_RATIO) -> dict:
+    """批次同步的主體 (在呼叫端的交易中執行，不 commit)。回傳計數。"""
+    fresh_df = fresh_df.reset_index(drop=True)
+
+    # --- 步驟 1: 同步宿舍與地址映射 ---
+    log_callback("INFO: 步驟 1/5 - 同步宿舍地址...")
+    db_dorms_df = _execute_query_to_dataframe(conn, 'SELECT id, normalized_address, original_address FROM "Dormitories"')
+    _sync_dormitories_bulk(cursor, fresh_df, db_dorms_df, log_callback)
+    address_room_map, original_addr_to_room_map, room_to_dorm_map = _build_room_maps(conn, db_dorms_df)
+
+    fresh_df['room_id'] = fresh_df['normalized_address'].map(address_room_map)
+    fresh_df['room_id'] = fresh_df['room_id'].fillna(fresh_df['original_address'].map(original_addr_to_room_map))
+
+    # --- 步驟 2: 取得現有工人狀態 ---
+    log_callback("INFO: 步驟 4/5 - 正在取得現有工人的識別特徵與交工日...")
+    workers_df = _load_worker_states(conn)
+
+    # --- 步驟 3: 整批比對與套用 ---
+    log_callback("INFO: 步驟 5/5 - 正在執行智慧比對...")
+    cursor.execute('SELECT * FROM "Workers" LIMIT 0')
+    worker_columns = {desc[0] for desc in cursor.description}
+
+    row_logs = []
+    resolved = identity_resolver.resolve_sync(fresh_df, identity_resolver.build_index(workers_df), row_logs)
+    plan = _plan_sync_actions(resolved, workers_df, room_to_dorm_map, today, row_logs)
+    _apply_sync_plan(cursor, plan, worker_columns, today)
+
+    # 依報表列的順序輸出逐筆日誌，與逐筆模式的日誌順序一致
+    for _, _, message in sorted(row_logs, key=lambda entry: (entry[0], entry[1])):
+        log_callback(message)
+
+    processed_ids = set(plan['resolved_id'])
+    marked_as_left_count = _mark_missing_workers_as_departed(cursor, processed_ids, today, log_callback, max_departure_ratio)
+
+    return {
+        'added': int(plan['is_new'].sum()),
+        'updated': int(plan['is_matched'].sum()),
+        'moved': int((plan['is_new'] & plan['new_room_id'].notna()).sum() + (plan['do_move'] & plan['is_last']).sum()),
+        'marked_as_left': marked_as_left_count,
+    }
@@ -2,36 +2,17 @@
 
 import streamlit as st
 import pandas as pd
-import os
 import json
-from datetime import datetime, date
-import scraper_b04  # 引用我們寫好的 B04 爬蟲模組
-import data_processor
-from data_models import finance_model
-
-# --- 設定檔路徑 ---
-FEE_CONFIG_FILE = "fee_config.json"
-
-def load_fee_config():
-    """讀取費用設定（包含「內部費用列表」與「對照表」）"""
-    default_config = {
-        "internal_types": ["房租", "水電費", "清潔費", "宿舍復歸費", "充電清潔費", "服務費"],
-        "mapping": {
-            "房租": "房租",
-            "電費": "水電費",
-            "水費": "水電費", 
-            "清潔費": "清潔費",
-            "服務費": "服務費"
-        }
-    }
-    
-    if os.path.exists(FEE_CONFIG_FILE):
-        try:
-            with open(FEE_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return default_config
-    return default_config
+from datetime import date
+import sync_pipeline  # 下載、解析、寫入 B04 報表的後端流程
+from views import job_panel
+
+# 三個按鈕共用暫存資料夾，因此屬於同一類工作 (同時只會執行一個)
+JOB_TYPE = 'b04_sync'
+
+# 費用設定的讀取移至 sync_pipeline，讓排程 CLI 也能使用同一份設定
+FEE_CONFIG_FILE = sync_pipeline.FEE_CONFIG_FILE
+load_fee_config = sync_pipeline.load_fee_config
 
 def save_fee_config(config_data):
     """儲存設定到 JSON"""
@@ -43,70 +24,10 @@ def save_fee_config(config_data):
         st.error(f"儲存設定失敗: {e}")
         return False
 
-def log_message(message: str):
-    """將帶有時間戳的日誌訊息附加到 session_state 中。"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    if 'log_messages_acc' not in st.session_state:
-        st.session_state.log_messages_acc = []
-    st.session_state.log_messages_acc.insert(0, f"[{timestamp}] {message}")
-
-# --- 執行邏輯 ---
-def _run_download(url, auth, date_range, temp_dir):
-    log_message(f"啟動下載流程 (目標: {temp_dir})...")
-    files = scraper_b04.download_b04_in_batches(
-        url_base=url, auth=auth, date_range=date_range, 
-        temp_dir=temp_dir, log_callback=log_message
-    )
-    if files:
-        log_message(f"下載完成，共 {len(files)} 個檔案。")
-        st.success(f"下載成功！共 {len(files)} 個檔案，請繼續執行「寫入資料庫」。")
-    else:
-        st.warning("流程結束，但未下載到任何檔案。")
-
-def _run_write(temp_dir, mapping):
-    log_message(f"啟動資料庫寫入流程 (來源: {temp_dir})...")
-    if not os.path.exists(temp_dir):
-        st.error(f"錯誤：找不到資料夾 '{temp_dir}'。")
-        return
-    
-    file_paths = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.xls')]
-    if not file_paths:
-        st.warning("資料夾中無 Excel 檔案，請先下載。")
-        return
-
-    total_success = 0
-    total_skipped = 0
-    
-    for file_path in file_paths:
-        log_message(f"處理檔案: {os.path.basename(file_path)}")
-        # 解析
-        df = data_processor.parse_b04_xml(file_path, mapping)
-        if df.empty:
-            log_message("  -> 解析結果為空 (可能無符合對照表的費用)。")
-            continue
-        
-        # 寫入
-        success, skipped, errors = finance_model.batch_import_external_fees(df)
-        total_success += success
-        total_skipped += skipped
-        
-        log_message(f"  -> 寫入成功: {success}, 跳過: {skipped}")
-        if errors:
-            for err in errors[:3]: # 只顯示前3個錯誤避免洗版
-                log_message(f"     * 錯誤: {err}")
-
-    st.success(f"全部完成！共新增/更新 {total_success} 筆費用，跳過 {total_skipped} 筆。")
-    log_message("=== 全部流程結束 ===")
-
-
 def render(config):
     """渲染頁面"""
     st.header("財務系統爬取與設定 (B04)")
 
-    # 初始化日誌
-    if 'log_messages_acc' not in st.session_state:
-        st.session_state.log_messages_acc = []
-
     # 1. 載入費用設定
     fee_config = load_fee_config()
     internal_types = fee_config.get("internal_types", [])
@@ -207,25 +128,17 @@ def render(config):
     # 按鈕區
     btn1, btn2, btn3 = st.columns(3)
     
+    # 長時間的同步改為背景工作：送出後即可離開頁面，進度與日誌由下方面板定期更新
     if btn1.button("① 僅下載報表"):
-        st.session_state.log_messages_acc = []
-        with st.spinner("下載中..."):
-            _run_download(b04_url, (b04_acc, b04_pwd), date_range, b04_temp_dir)
+        job_panel.submit(JOB_TYPE, "僅下載 B04 報表", sync_pipeline.download_b04_reports, b04_url, (b04_acc, b04_pwd), date_range, b04_temp_dir)
 
     if btn2.button("② 僅寫入資料庫"):
-        st.session_state.log_messages_acc = []
-        with st.spinner("寫入中..."):
-            _run_write(b04_temp_dir, current_mapping)
+        job_panel.submit(JOB_TYPE, "寫入暫存 B04 報表至資料庫", sync_pipeline.write_b04_reports, b04_temp_dir, current_mapping)
 
     if btn3.button("🚀 全自動同步 (下載+寫入)", type="primary"):
-        st.session_state.log_messages_acc = []
-        with st.spinner("全自動執行中..."):
-            _run_download(b04_url, (b04_acc, b04_pwd), date_range, b04_temp_dir)
-            if os.path.exists(b04_temp_dir) and any(f.endswith('.xls') for f in os.listdir(b04_temp_dir)):
-                _run_write(b04_temp_dir, current_mapping)
+        job_panel.submit(JOB_TYPE, "B04 全自動同步 (下載+寫入)", sync_pipeline.run_b04_sync_pipeline, b04_url, (b04_acc, b04_pwd), date_range, b04_temp_dir, current_mapping)
 
-    # 日誌區
+    # 執行狀態與日誌
     with st.expander("執行日誌", expanded=True):
-        log_container = st.container(height=300)
-        for msg in st.session_state.log_messages_acc:
-            log_container.text(msg)
\ No newline at end of file
+        job_panel.render_job_panel(JOB_TYPE)
+    job_panel.render_job_history(JOB_TYPE)
@@ -2,13 +2,40 @@ import streamlit as st
 import pandas as pd
 from data_models import analytics_model, dormitory_model, meter_model
 
+def _render_dismiss_form(anomalies_df: pd.DataFrame, key: str, value_column: str):
+    """讓使用者將已確認的異常標示為已處理 (不再顯示)。"""
+    options = {
+        row['id']: f"{row['宿舍地址']} {row['類型']}({row['錶號']}) {row['帳單迄日']} - {row['判斷']} ({row[value_column]})"
+        for _, row in anomalies_df.iterrows()
+    }
+    with st.form(f"dismiss_{key}_anomalies"):
+        selected = st.multiselect("選擇已確認、不需再提醒的異常紀錄：", options=list(options), format_func=options.get)
+        if st.form_submit_button("標示為已處理"):
+            success, message = analytics_model.dismiss_anomalies(selected)
+            if success:
+                st.success(message)
+                st.cache_data.clear()
+                st.rerun()
+            else:
+                st.warning(message)
+
 def render():
     """渲染「費用分析」儀表板"""
     st.header("水電費用分析儀表板")
     st.info("此工具用於追蹤單一電水錶的歷史費用，並自動偵測潛在的異常帳單。")
-    
-    if st.button("🔄 重新整理所有數據"):
+    st.caption("異常紀錄會在新增、修改或匯入帳單時自動更新；若資料是由其他途徑寫入，可按「重新計算所有異常」。")
+
+    col_refresh, col_rebuild = st.columns(2)
+    if col_refresh.button("🔄 重新整理所有數據"):
         st.cache_data.clear()
+    if col_rebuild.button("🧮 重新計算所有異常"):
+        with st.spinner("正在重新計算所有電水錶的異常..."):
+            success, message = analytics_model.rebuild_all_anomalies()
+        if success:
+            st.success(message)
+            st.cache_data.clear()
+        else:
+            st.error(message)
 
     st.markdown("---")
     tab1, tab2 = st.tabs(["🚨 金額異常數據警告", "💧 用量異常數據警告"])
@@ -29,7 +56,7 @@ def render():
 
         @st.cache_data
         def get_anomalies():
-            return analytics_model.find_expense_anomalies()
+            return analytics_model.get_open_expense_anomalies()
             
         anomalies_df = get_anomalies()
         
@@ -49,7 +76,7 @@ def render():
 
             # --- 在 column_config 中，將布林值轉換為更容易閱讀的 "是/否" ---
             st.dataframe(
-                anomalies_df.style.apply(lambda x: x.map(style_anomaly_reason) if x.name == '判斷' else [''] * len(x)),
+                anomalies_df.drop(columns=['id']).style.apply(lambda x: x.map(style_anomaly_reason) if x.name == '判斷' else [''] * len(x)),
                 width="stretch", 
                 hide_index=True,
                 column_config={
@@ -61,6 +88,7 @@ def render():
                     ),
                 }
             )
+            _render_dismiss_form(anomalies_df, "expense", "異常金額")
 
     st.markdown("---")
 
@@ -76,7 +104,7 @@ def render():
 
         @st.cache_data
         def get_usage_anomalies():
-            return analytics_model.find_usage_anomalies()
+            return analytics_model.get_open_usage_anomalies()
             
         usage_anomalies_df = get_usage_anomalies()
 
@@ -92,7 +120,7 @@ def render():
                 return f'color: {color}; font-weight: bold;'
             
             st.dataframe(
-                usage_anomalies_df.style.apply(lambda x: x.map(style_usage_anomaly) if x.name == '判斷' else [''] * len(x)),
+                usage_anomalies_df.drop(columns=['id']).style.apply(lambda x: x.map(style_usage_anomaly) if x.name == '判斷' else [''] * len(x)),
                 width="stretch", hide_index=True,
                 column_config={
                     "本期用量": st.column_config.NumberColumn(format="%.2f"),
@@ -100,6 +128,7 @@ def render():
                     "代收代付?": st.column_config.CheckboxColumn(default=False),
                 }
             )
+            _render_dismiss_form(usage_anomalies_df, "usage", "本期用量")
 
     st.markdown("---")
     st.subheader("📈 歷史費用趨勢查詢")
@@ -1,16 +1,37 @@
 import streamlit as st
 import pandas as pd
-from io import BytesIO
-from data_models import importer_model
+from data_models import importer_model, bulk_import, excel_reader
+import excel_export
 from datetime import date
 
 def to_excel(df):
     """將 DataFrame 轉換為可供下載的 Excel 檔案。"""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
-    processed_data = output.getvalue()
-    return processed_data
+    return excel_export.dataframe_to_excel(df, sheet_name='Sheet1')
+
+def _import_in_chunks(uploaded_file, import_func, as_text=False):
+    """分段讀取上傳的檔案並逐段匯入，過程中即時顯示進度與目前為止失敗的資料列。"""
+    total_rows = excel_reader.estimate_row_count(uploaded_file)
+    progress_bar = st.progress(0.0, text="正在讀取與匯入資料...")
+    live_errors = st.empty()
+    failed_parts = []
+
+    def on_progress(processed, failed_chunk):
+        if total_rows:
+            progress_bar.progress(min(processed / total_rows, 1.0), text=f"已處理 {processed} / {total_rows} 筆...")
+        else:
+            progress_bar.progress(0.0, text=f"已處理 {processed} 筆...")
+        if not failed_chunk.empty:
+            failed_parts.append(failed_chunk)
+            failed_so_far = pd.concat(failed_parts)
+            with live_errors.container():
+                st.warning(f"目前已有 {len(failed_so_far)} 筆資料失敗，匯入繼續進行中...")
+                st.dataframe(failed_so_far.tail(excel_reader.PREVIEW_ROWS))
+
+    chunks = excel_reader.iter_excel_chunks(uploaded_file, as_text=as_text)
+    result = bulk_import.import_in_chunks(import_func, chunks, on_progress)
+    progress_bar.empty()
+    live_errors.empty()
+    return result
 
 def render():
     """渲染「批次匯入」頁面"""
@@ -50,12 +71,12 @@ def render():
 
         if uploaded_monthly_file:
             try:
-                df_monthly = pd.read_excel(uploaded_monthly_file)
+                df_monthly = excel_reader.read_excel_preview(uploaded_monthly_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_monthly.head())
                 if st.button("🚀 開始匯入變動費用", type="primary", key="monthly_import_btn"):
                     with st.spinner("正在處理與匯入資料..."):
-                        success, failed_df = importer_model.batch_import_expenses(df_monthly)
+                        success, failed_df = _import_in_chunks(uploaded_monthly_file, importer_model.batch_import_expenses)
                     st.success(f"匯入完成！成功 {success} 筆。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -96,12 +117,12 @@ def render():
 
         if uploaded_annual_file:
             try:
-                df_annual = pd.read_excel(uploaded_annual_file)
+                df_annual = excel_reader.read_excel_preview(uploaded_annual_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_annual.head())
                 if st.button("🚀 開始匯入一般年度費用", type="primary", key="annual_import_btn"):
                     with st.spinner("正在處理與匯入資料..."):
-                        success, failed_df = importer_model.batch_import_annual_expenses(df_annual)
+                        success, failed_df = _import_in_chunks(uploaded_annual_file, importer_model.batch_import_annual_expenses)
                     st.success(f"匯入完成！成功 {success} 筆。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -144,13 +165,13 @@ def render():
 
         if uploaded_permit_file:
             try:
-                df_permit = pd.read_excel(uploaded_permit_file)
+                df_permit = excel_reader.read_excel_preview(uploaded_permit_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_permit.head())
                 if st.button("🚀 開始匯入建物申報", type="primary", key="permit_import_btn"):
                     with st.spinner("正在處理與匯入建物申報資料..."):
                         # --- 【核心修改 2】接收三個回傳值 ---
-                        success, failed_df, skipped_df = importer_model.batch_import_building_permits(df_permit)
+                        success, failed_df, skipped_df = _import_in_chunks(uploaded_permit_file, importer_model.batch_import_building_permits)
                     st.success(f"匯入完成！成功新增 {success} 筆。")
                     
                     # --- 【核心修改 3】顯示跳過的紀錄 ---
@@ -200,12 +221,12 @@ def render():
 
         if uploaded_fire_safety_file:
             try:
-                df_fire_safety = pd.read_excel(uploaded_fire_safety_file)
+                df_fire_safety = excel_reader.read_excel_preview(uploaded_fire_safety_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_fire_safety.head())
                 if st.button("🚀 開始匯入消防安檢紀錄", type="primary", key="fire_safety_import_btn"):
                     with st.spinner("正在處理與匯入消防安檢紀錄..."):
-                        success, failed_df, skipped_df = importer_model.batch_import_fire_safety(df_fire_safety)
+                        success, failed_df, skipped_df = _import_in_chunks(uploaded_fire_safety_file, importer_model.batch_import_fire_safety)
                     st.success(f"匯入完成！成功新增 {success} 筆。")
                     if not skipped_df.empty:
                         st.warning(f"有 {len(skipped_df)} 筆資料因重複而跳過：")
@@ -257,13 +278,13 @@ def render():
             
             if uploaded_file_move:
                 try:
-                    df_move = pd.read_excel(uploaded_file_move, dtype=str).fillna('')
+                    df_move = excel_reader.read_excel_preview(uploaded_file_move, as_text=True)
                     st.markdown("##### 檔案內容預覽：")
                     st.dataframe(df_move.head())
                     if st.button("🚀 開始匯入異動資料", type="primary", key="accommodation_import_move_btn"):
                         with st.spinner("正在處理與匯入異動資料..."):
                             # 呼叫新的 "move" 函式
-                            success, failed_df = importer_model.batch_import_accommodation_move(df_move)
+                            success, failed_df = _import_in_chunks(uploaded_file_move, importer_model.batch_import_accommodation_move, as_text=True)
                         st.success(f"匯入完成！成功 {success} 筆。")
                         if not failed_df.empty:
                             st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -299,13 +320,13 @@ def render():
             
             if uploaded_file_overwrite:
                 try:
-                    df_overwrite = pd.read_excel(uploaded_file_overwrite, dtype=str).fillna('')
+                    df_overwrite = excel_reader.read_excel_preview(uploaded_file_overwrite, as_text=True)
                     st.markdown("##### 檔案內容預覽：")
                     st.dataframe(df_overwrite.head())
                     if st.button("🚀 開始匯入覆蓋資料", type="primary", key="accommodation_import_overwrite_btn"):
                         with st.spinner("正在處理與匯入覆蓋資料..."):
                             # 呼叫新的 "overwrite" 函式
-                            success, failed_df = importer_model.batch_import_accommodation_overwrite(df_overwrite)
+                            success, failed_df = _import_in_chunks(uploaded_file_overwrite, importer_model.batch_import_accommodation_overwrite, as_text=True)
                         st.success(f"匯入完成！成功 {success} 筆。")
                         if not failed_df.empty:
                             st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -348,12 +369,12 @@ def render():
 
         if uploaded_lease_file:
             try:
-                df_lease = pd.read_excel(uploaded_lease_file)
+                df_lease = excel_reader.read_excel_preview(uploaded_lease_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_lease.head())
                 if st.button("🚀 開始匯入長期合約", type="primary", key="lease_import_btn"):
                     with st.spinner("正在處理與匯入長期合約..."):
-                        success, failed_df, skipped_df = importer_model.batch_import_leases(df_lease)
+                        success, failed_df, skipped_df = _import_in_chunks(uploaded_lease_file, importer_model.batch_import_leases)
                     
                     st.success(f"匯入完成！成功新增 {success} 筆。")
 
@@ -405,12 +426,12 @@ def render():
 
         if uploaded_income_file:
             try:
-                df_income = pd.read_excel(uploaded_income_file)
+                df_income = excel_reader.read_excel_preview(uploaded_income_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_income.head())
                 if st.button("🚀 開始匯入其他收入", type="primary", key="income_import_btn"):
                     with st.spinner("正在處理與匯入資料..."):
-                        success, failed_df = importer_model.batch_import_other_income(df_income)
+                        success, failed_df = _import_in_chunks(uploaded_income_file, importer_model.batch_import_other_income)
                     st.success(f"匯入完成！成功 {success} 筆。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -446,12 +467,12 @@ def render():
 
             if uploaded_dorm_room_file:
                 try:
-                    df_dorm_room = pd.read_excel(uploaded_dorm_room_file)
+                    df_dorm_room = excel_reader.read_excel_preview(uploaded_dorm_room_file)
                     st.markdown("##### 檔案內容預覽：")
                     st.dataframe(df_dorm_room.head())
                     if st.button("🚀 開始匯入宿舍與房間", type="primary", key="dorm_room_import_btn"):
                         with st.spinner("正在處理與匯入資料..."):
-                            success, failed_df = importer_model.batch_import_dorms_and_rooms(df_dorm_room)
+                            success, failed_df = _import_in_chunks(uploaded_dorm_room_file, importer_model.batch_import_dorms_and_rooms)
                         st.success(f"匯入完成！成功處理 {success} 筆房間紀錄。")
                         if not failed_df.empty:
                             st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -494,12 +515,12 @@ def render():
 
         if uploaded_vendor_file:
             try:
-                df_vendor = pd.read_excel(uploaded_vendor_file)
+                df_vendor = excel_reader.read_excel_preview(uploaded_vendor_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_vendor.head())
                 if st.button("🚀 開始匯入廠商資料", type="primary", key="vendor_import_btn"):
                     with st.spinner("正在處理與匯入廠商資料..."):
-                        success, failed_df = importer_model.batch_import_vendors(df_vendor)
+                        success, failed_df = _import_in_chunks(uploaded_vendor_file, importer_model.batch_import_vendors)
                     st.success(f"匯入完成！成功處理 {success} 筆廠商紀錄。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -554,12 +575,12 @@ def render():
 
             if uploaded_maintenance_file:
                 try:
-                    df_maintenance = pd.read_excel(uploaded_maintenance_file)
+                    df_maintenance = excel_reader.read_excel_preview(uploaded_maintenance_file)
                     st.markdown("##### 檔案內容預覽：")
                     st.dataframe(df_maintenance.head())
                     if st.button("🚀 開始新增維修紀錄", type="primary", key="maintenance_import_btn"):
                         with st.spinner("正在處理與匯入維修紀錄..."):
-                            success, failed_df = importer_model.batch_insert_maintenance_logs(df_maintenance)
+                            success, failed_df = _import_in_chunks(uploaded_maintenance_file, importer_model.batch_insert_maintenance_logs)
                         st.success(f"匯入完成！成功新增 {success} 筆維修紀錄。")
                         if not failed_df.empty:
                             st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -597,12 +618,12 @@ def render():
 
             if uploaded_update_file:
                 try:
-                    df_update = pd.read_excel(uploaded_update_file)
+                    df_update = excel_reader.read_excel_preview(uploaded_update_file)
                     st.markdown("##### 檔案內容預覽：")
                     st.dataframe(df_update.head())
                     if st.button("🚀 開始更新維修紀錄", type="primary", key="maintenance_update_btn"):
                         with st.spinner("正在處理與更新維修紀錄..."):
-                            success, failed_df = importer_model.batch_update_maintenance_logs(df_update)
+                            success, failed_df = _import_in_chunks(uploaded_update_file, importer_model.batch_update_maintenance_logs)
                         st.success(f"更新完成！成功處理 {success} 筆維修紀錄。")
                         if not failed_df.empty:
                             st.error(f"有 {len(failed_df)} 筆資料更新失敗：")
@@ -655,12 +676,12 @@ def render():
 
         if uploaded_equipment_file:
             try:
-                df_equipment = pd.read_excel(uploaded_equipment_file)
+                df_equipment = excel_reader.read_excel_preview(uploaded_equipment_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_equipment.head())
                 if st.button("🚀 開始匯入設備", type="primary", key="equipment_import_btn"):
                     with st.spinner("正在處理與匯入設備資料..."):
-                        success, failed_df = importer_model.batch_import_equipment(df_equipment)
+                        success, failed_df = _import_in_chunks(uploaded_equipment_file, importer_model.batch_import_equipment)
                     st.success(f"匯入完成！成功處理 {success} 筆紀錄。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -698,12 +719,12 @@ def render():
 
         if uploaded_invoice_file:
             try:
-                df_invoice = pd.read_excel(uploaded_invoice_file)
+                df_invoice = excel_reader.read_excel_preview(uploaded_invoice_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_invoice.head())
                 if st.button("🚀 開始匯入發票資訊", type="primary", key="invoice_import_btn"):
                     with st.spinner("正在處理與匯入資料..."):
-                        success, failed_df = importer_model.batch_import_invoice_info(df_invoice)
+                        success, failed_df = _import_in_chunks(uploaded_invoice_file, importer_model.batch_import_invoice_info)
                     st.success(f"匯入完成！成功處理 {success} 筆紀錄。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -740,12 +761,12 @@ def render():
 
         if uploaded_landlord_file:
             try:
-                df_landlord = pd.read_excel(uploaded_landlord_file)
+                df_landlord = excel_reader.read_excel_preview(uploaded_landlord_file)
                 st.markdown("##### 檔案內容預覽：")
                 st.dataframe(df_landlord.head())
                 if st.button("🚀 開始匯入房東資訊", type="primary", key="landlord_import_btn"):
                     with st.spinner("正在處理與匯入資料..."):
-                        success, failed_df = importer_model.batch_import_landlord_info(df_landlord)
+                        success, failed_df = _import_in_chunks(uploaded_landlord_file, importer_model.batch_import_landlord_info)
                     st.success(f"匯入完成！成功處理 {success} 筆紀錄。")
                     if not failed_df.empty:
                         st.error(f"有 {len(failed_df)} 筆資料匯入失敗：")
@@ -18,11 +18,13 @@ def render():
         if st.button("🔄 重新整理住宿數據", key="refresh_overview"):
             st.cache_data.clear()
 
+        # 不需篩選條件的三個查詢 (含財務頁籤的年均預測) 同時執行並一起快取
         @st.cache_data
         def get_overview_data():
-            return dashboard_model.get_dormitory_dashboard_data()
+            return dashboard_model.get_dashboard_overview_data()
 
-        overview_df = get_overview_data()
+        overview_data = get_overview_data()
+        overview_df = overview_data['overview']
 
         if overview_df is None or overview_df.empty:
             st.warning("目前沒有任何在住人員的資料可供統計。")
@@ -40,11 +42,7 @@ def render():
             st.markdown("---")
             st.subheader("特殊狀況人員統計")
 
-            @st.cache_data
-            def get_status_summary():
-                return dashboard_model.get_special_status_summary()
-
-            status_df = get_status_summary()
+            status_df = overview_data['status_summary']
 
             if status_df is None or status_df.empty:
                 st.info("目前沒有任何註記特殊狀況的在住人員。")
@@ -125,17 +123,26 @@ def render():
             selected_month_month = c2.selectbox("選擇月份", options=range(1, 13), index=default_month - 1, key="month_month")
             year_month_str = f"{selected_year_month}-{selected_month_month:02d}"
 
-            with st.container(border=True):
+            # 預測區塊先佔位，等下方按鈕處理完、當月資料 (季節性預測與損益同時查詢) 載入後再填入
+            forecast_box = st.container(border=True)
+
+            st.markdown("---")
+            st.subheader("每月實際損益")
+            st.info("此報表統計實際發生的「總收入」(員工月費+其他收入)與「總支出」(宿舍月租+當月帳單攤銷+年度費用攤銷)的差額。")
+
+            @st.cache_data
+            def get_monthly_data(period):
+                return dashboard_model.get_monthly_dashboard_data(period)
+
+            if st.button("🔍 產生每月財務報表", key="generate_monthly_report"):
+                get_monthly_data.clear()
+
+            monthly_data = get_monthly_data(year_month_str)
+
+            with forecast_box:
                 st.markdown("##### 費用預測分析")
-                @st.cache_data
-                def get_annual_forecast():
-                    return dashboard_model.get_expense_forecast_data()
-                annual_forecast_data = get_annual_forecast()
-                
-                @st.cache_data
-                def get_seasonal_forecast(period):
-                    return dashboard_model.get_seasonal_expense_forecast(period)
-                seasonal_forecast_data = get_seasonal_forecast(year_month_str)
+                annual_forecast_data = overview_data['annual_forecast']
+                seasonal_forecast_data = monthly_data['seasonal_forecast']
                 
                 if annual_forecast_data and seasonal_forecast_data:
                     f_col1, f_col2 = st.columns(2)
@@ -146,18 +153,7 @@ def render():
                 else:
                     st.info("尚無足夠歷史數據進行預測。")
 
-            st.markdown("---")
-            st.subheader("每月實際損益")
-            st.info("此報表統計實際發生的「總收入」(員工月費+其他收入)與「總支出」(宿舍月租+當月帳單攤銷+年度費用攤銷)的差額。")
-
-            @st.cache_data
-            def get_finance_data(period):
-                return dashboard_model.get_financial_dashboard_data(period)
-
-            if st.button("🔍 產生每月財務報表", key="generate_monthly_report"):
-                get_finance_data.clear()
-
-            finance_df = get_finance_data(year_month_str)
+            finance_df = monthly_data['finance']
 
             if finance_df is None or finance_df.empty:
                 st.warning(f"在 {year_month_str} 沒有找到任何「我司管理」的收支數據。")
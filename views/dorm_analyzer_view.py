@@ -93,7 +93,16 @@ def render():
     selected_month = sc2.selectbox("選擇月份", options=range(1, 13), index=default_month - 1)
     year_month_str = f"{selected_year}-{selected_month:02d}"
 
-    resident_data = single_dorm_analyzer.get_resident_summary(selected_dorm_ids, year_month_str)
+    # 以下各區塊的查詢互不相依，先一次並行查詢，總耗時約等於最慢的一個查詢
+    page_data = database.run_concurrently({
+        'resident_summary': (single_dorm_analyzer.get_resident_summary, selected_dorm_ids, year_month_str),
+        'analysis': (single_dorm_analyzer.get_dorm_analysis_data, selected_dorm_ids, year_month_str),
+        'income': (single_dorm_analyzer.get_income_summary, selected_dorm_ids, year_month_str),
+        'expense': (single_dorm_analyzer.get_expense_summary, selected_dorm_ids, year_month_str),
+        'resident_details': (single_dorm_analyzer.get_resident_details_as_df, selected_dorm_ids, year_month_str),
+    })
+
+    resident_data = page_data['resident_summary']
     
     st.markdown(f"#### {year_month_str} 住宿人員分析 (彙總)")
     
@@ -118,7 +127,7 @@ def render():
     st.dataframe(resident_data['combined_summary'], width="stretch", hide_index=True)
 
     st.subheader(f"{year_month_str} 宿舍營運分析 (彙總)")
-    analysis_data = single_dorm_analyzer.get_dorm_analysis_data(selected_dorm_ids, year_month_str)
+    analysis_data = page_data['analysis']
     if not analysis_data:
         st.error("分析數據時發生錯誤，請檢查資料庫連線。")
     else:
@@ -198,8 +207,8 @@ def render():
     st.markdown("---")
     st.subheader(f"{year_month_str} 財務分析 (我司視角 - 彙總)")
 
-    income_total = single_dorm_analyzer.get_income_summary(selected_dorm_ids, year_month_str)
-    expense_data_df = single_dorm_analyzer.get_expense_summary(selected_dorm_ids, year_month_str)
+    income_total = page_data['income']
+    expense_data_df = page_data['expense']
     
     our_company_expense_df = expense_data_df[expense_data_df['費用項目'].str.contains("我司支付", na=False)]
     expense_total_our_company = int(our_company_expense_df['金額'].sum())
@@ -391,7 +400,7 @@ def render():
     st.markdown("---")
     st.subheader(f"{year_month_str} 在住人員詳細名單 (彙總)")
     
-    resident_details_df = single_dorm_analyzer.get_resident_details_as_df(selected_dorm_ids, year_month_str)
+    resident_details_df = page_data['resident_details']
 
     if resident_details_df.empty:
         st.info("所選宿舍於該月份沒有在住人員。")
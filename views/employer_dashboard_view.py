@@ -5,7 +5,7 @@ import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from data_models import employer_dashboard_model, dormitory_model
-from views.report_view import to_excel 
+import excel_export
 
 def generate_html_report(title, kpi_data, summary_df, resident_summary_df, details_data, custom_cols=None):
     """
@@ -190,15 +190,12 @@ def render():
             selected_month_month = c2.selectbox("選擇月份", options=range(1, 13), index=default_date.month - 1, key="monthly_month")
             year_month_str = f"{selected_year_month}-{selected_month_month:02d}"
 
+            # 收支摘要與人員明細兩個查詢同時執行
             @st.cache_data
-            def get_finance_summary(employers, period, only_mc):
-                return employer_dashboard_model.get_employer_financial_summary(employers, period, only_mc)
-            finance_df_month = get_finance_summary(selected_employers, year_month_str, only_my_company)
-
-            @st.cache_data
-            def get_details_for_period(employers, period, only_mc):
-                return employer_dashboard_model.get_employer_resident_details(employers, period, only_mc)
-            report_df_month = get_details_for_period(selected_employers, year_month_str, only_my_company)
+            def get_monthly_data(employers, period, only_mc):
+                return employer_dashboard_model.get_employer_monthly_data(employers, period, only_mc)
+            monthly_data = get_monthly_data(selected_employers, year_month_str, only_my_company)
+            finance_df_month, report_df_month = monthly_data['summary'], monthly_data['details']
 
             if finance_df_month.empty:
                 st.warning(f"在 {year_month_str} 中，找不到與所選雇主相關的收支紀錄。")
@@ -260,10 +257,13 @@ def render():
                 all_details_list_excel = []
 
                 with st.spinner("正在準備詳細資料..."):
+                    # 各宿舍明細一次並行查詢
+                    details_by_dorm = employer_dashboard_model.get_employer_details_for_dorms(
+                        selected_employers, [dorm_id_map[a] for a in display_df['宿舍地址'] if dorm_id_map.get(a)], year_month_str)
                     for _, row in display_df.iterrows():
                         d_addr = row['宿舍地址']; d_id = dorm_id_map.get(d_addr)
                         if d_id:
-                            inc, exp = employer_dashboard_model.get_employer_financial_details_for_dorm(selected_employers, d_id, year_month_str)
+                            inc, exp = details_by_dorm[d_id]
                             all_details_dict[d_addr] = (inc, exp)
                             if not inc.empty:
                                 inc['宿舍'] = d_addr; inc['類別'] = '收入'; inc = inc.rename(columns={'項目': '細項', '金額': '金額'})
@@ -278,7 +278,7 @@ def render():
 
                 summary_sheet = display_df_with_total[cols_exist].copy()
                 details_sheet = pd.concat(all_details_list_excel, ignore_index=True) if all_details_list_excel else pd.DataFrame(columns=['宿舍', '類別', '細項', '金額'])
-                excel_data = to_excel({ "損益總表": [{"dataframe": summary_sheet, "title": f"雇主損益總表 - {title_str}"}], "住宿統計": [{"dataframe": dorm_summary_df, "title": "住宿人數統計"}] if not dorm_summary_df.empty else [], "詳細收支": [{"dataframe": details_sheet, "title": "各宿舍收支明細"}] })
+                excel_data = excel_export.write_workbook({ "損益總表": [{"dataframe": summary_sheet, "title": f"雇主損益總表 - {title_str}"}], "住宿統計": [{"dataframe": dorm_summary_df, "title": "住宿人數統計"}] if not dorm_summary_df.empty else [], "詳細收支": [{"dataframe": details_sheet, "title": "各宿舍收支明細"}] })
                 col_export_excel.download_button("📊 下載 Excel", excel_data, file_name=f"Report_{year_month_str}.xlsx")
 
                 st.markdown("---")
@@ -287,6 +287,9 @@ def render():
                         columns_to_show = ["宿舍地址", "房號", "姓名", "性別", "國籍", "入住日", "離住日", "員工月費", "特殊狀況", "雇主"]
                         existing_columns = [col for col in columns_to_show if col in report_df_month.columns]
                         st.dataframe(report_df_month[existing_columns], width='stretch', hide_index=True, column_config={ "員工月費": st.column_config.NumberColumn(format="NT$ %d"), "入住日": st.column_config.DateColumn(format="YYYY-MM-DD"), "離住日": st.column_config.DateColumn(format="YYYY-MM-DD") })
+                        lc1, lc2 = st.columns([1, 2])
+                        list_fmt = lc1.selectbox("名單檔案格式", options=excel_export.available_formats(), format_func=lambda x: excel_export.FORMATS[x]['label'], key="resident_list_fmt")
+                        lc2.download_button("📥 下載員工名單", excel_export.export_dataframe(report_df_month[existing_columns], list_fmt, sheet_name="員工名單"), file_name=f"Residents_{year_month_str}.{list_fmt}", mime=excel_export.FORMATS[list_fmt]['mime'])
                     else: st.info("無詳細名單。")
 
         # ==============================================================================
@@ -357,10 +360,13 @@ def render():
                 ann_details_dict = {}
                 ann_details_list = []
                 with st.spinner("準備資料中..."):
+                    # 各宿舍明細一次並行查詢
+                    details_by_dorm = employer_dashboard_model.get_employer_details_for_dorms(
+                        selected_employers, [dorm_id_map[a] for a in display_df_annual['宿舍地址'] if dorm_id_map.get(a)], str(selected_year_annual))
                     for _, row in display_df_annual.iterrows():
                         d_addr = row['宿舍地址']; d_id = dorm_id_map.get(d_addr)
                         if d_id:
-                            inc, exp = employer_dashboard_model.get_employer_financial_details_for_dorm(selected_employers, d_id, str(selected_year_annual))
+                            inc, exp = details_by_dorm[d_id]
                             ann_details_dict[d_addr] = (inc, exp)
                             if not inc.empty:
                                 inc['宿舍'] = d_addr; inc['類別'] = '收入'; inc = inc.rename(columns={'項目': '細項', '金額': '金額'})
@@ -377,7 +383,7 @@ def render():
                 # Excel
                 sheet_ann = display_df_annual_with_total[cols_exist_annual].copy()
                 det_ann = pd.concat(ann_details_list, ignore_index=True) if ann_details_list else pd.DataFrame()
-                excel_ann = to_excel({ "年度總表": [{"dataframe": sheet_ann, "title": title_ann}], "詳細收支": [{"dataframe": det_ann, "title": "各宿舍收支明細"}] })
+                excel_ann = excel_export.write_workbook({ "年度總表": [{"dataframe": sheet_ann, "title": title_ann}], "詳細收支": [{"dataframe": det_ann, "title": "各宿舍收支明細"}] })
                 eac2.download_button("📊 下載 Excel", excel_ann, file_name=f"Report_Annual_{selected_year_annual}.xlsx")
 
         # ==============================================================================
@@ -478,10 +484,13 @@ def render():
                 
                 cf_details_dict = {}; cf_details_list = []
                 with st.spinner("準備詳細資料中..."):
+                    # 各宿舍明細一次並行查詢
+                    details_by_dorm = employer_dashboard_model.get_employer_details_for_dorms(
+                        selected_employers, [dorm_id_map[a] for a in cf_df['宿舍地址'] if dorm_id_map.get(a)], cf_period, cash_flow=True)
                     for _, row in cf_df.iterrows():
                         d_addr = row['宿舍地址']; d_id = dorm_id_map.get(d_addr)
                         if d_id:
-                            inc, exp = employer_dashboard_model.get_employer_cash_flow_details_for_dorm(selected_employers, d_id, cf_period)
+                            inc, exp = details_by_dorm[d_id]
                             cf_details_dict[d_addr] = (inc, exp)
                             if not inc.empty:
                                 inc['宿舍'] = d_addr; inc['類別'] = '收入'; inc = inc.rename(columns={'項目': '細項', '金額': '金額'})
@@ -496,5 +505,5 @@ def render():
 
                 sheet_cf = cf_df_final[cols_exist_cf].copy()
                 det_cf = pd.concat(cf_details_list, ignore_index=True) if cf_details_list else pd.DataFrame()
-                excel_cf = to_excel({ "現金流總表": [{"dataframe": sheet_cf, "title": title_cf}], "詳細收支": [{"dataframe": det_cf, "title": "各宿舍收支明細"}] })
+                excel_cf = excel_export.write_workbook({ "現金流總表": [{"dataframe": sheet_cf, "title": title_cf}], "詳細收支": [{"dataframe": det_cf, "title": "各宿舍收支明細"}] })
                 exp_c2.download_button("📊 下載 Excel", excel_cf, file_name=f"CashFlow_{cf_period}.xlsx")
\ No newline at end of file
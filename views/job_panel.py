@@ -0,0 +1,66 @@
+# views/job_panel.py
+# 背景工作 (job_runner) 的共用送出與進度顯示元件，供各同步頁面使用。
+
+import streamlit as st
+import job_runner
+
+STATUS_LABELS = {
+    'queued': '⏳ 排隊中',
+    'running': '🔄 執行中',
+    'success': '✅ 已完成',
+    'failed': '❌ 失敗',
+    'interrupted': '⚠️ 已中斷',
+}
+
+# 進度面板自動重新整理的間隔 (秒)
+REFRESH_INTERVAL = 2
+
+def submit(job_type: str, title: str, func, *args, **kwargs):
+    """送出背景工作並在頁面上顯示結果。已有同類型工作執行中時不會重複送出。"""
+    job_id, created = job_runner.submit_job(job_type, title, func, *args, **kwargs)
+    if job_id is None:
+        st.error("無法建立背景工作，請檢查資料庫連線。")
+    elif created:
+        st.success(f"已送出背景工作 #{job_id}「{title}」，您可以離開此頁面，工作會在背景持續執行。")
+    else:
+        st.warning(f"已有同類型的工作 #{job_id} 正在執行中，請等待其完成後再試。")
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def render_job_panel(job_type: str):
+    """顯示某類型最近一個工作的狀態、進度、計數與日誌，並定期自動更新。"""
+    job = job_runner.get_latest_job(job_type)
+    if not job:
+        st.info("尚未執行過任何工作。")
+        return
+
+    status = job['display_status']
+    st.markdown(f"**工作 #{job['id']}：{job['title']}** — {STATUS_LABELS.get(status, status)}")
+
+    total = job.get('progress_total') or 0
+    current = job.get('progress_current') or 0
+    if total > 0:
+        st.progress(min(current / total, 1.0), text=f"{job.get('progress_message') or ''} ({current}/{total})")
+
+    counters = job.get('counters') or {}
+    visible_counters = {k: v for k, v in counters.items() if k not in ('status', 'job_id')}
+    if visible_counters:
+        cols = st.columns(len(visible_counters))
+        for col, (key, value) in zip(cols, visible_counters.items()):
+            col.metric(key, value)
+
+    if job.get('error'):
+        with st.expander("錯誤詳情"):
+            st.code(job['error'])
+
+    log_container = st.container(height=400)
+    for message in reversed(job_runner.get_job_logs(job['id'])):
+        log_container.text(message)
+
+def render_job_history(job_type: str):
+    """顯示最近的工作紀錄。"""
+    with st.expander("最近的工作紀錄"):
+        history_df = job_runner.get_recent_jobs(job_type)
+        if history_df.empty:
+            st.info("尚無紀錄。")
+        else:
+            st.dataframe(history_df, width='stretch', hide_index=True)
@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 from datetime import date
-from data_models import placement_model, dormitory_model
+from data_models import placement_model, dormitory_model, room_assignment_model
 
 def render():
     """渲染「空床位智慧查詢」頁面"""
@@ -85,4 +85,74 @@ def render():
                 results_df[display_cols].sort_values(by=["縣市", "區域", "空床位數"], ascending=[True, True, False]),
                 width="stretch",
                 hide_index=True
-            )
\ No newline at end of file
+            )
+
+    st.markdown("---")
+    _render_batch_placement({
+        "query_date": query_date,
+        "dorm_ids": selected_dorm_ids,
+        "cities": selected_cities,
+        "districts": selected_districts,
+    })
+
+def _render_batch_placement(location_filters: dict):
+    """批次安排：為暫掛在 [未分配房間] 的一批人員一次排出完整的床位計畫，確認後寫入。"""
+    st.subheader("📋 批次安排新進人員")
+    st.info("沿用上方的「查詢日期」與地點範圍，為目前暫掛在 `[未分配房間]` 的人員一次排出房間。計畫確認後才會寫入，不會移動已在住的人員。")
+
+    candidates_df = room_assignment_model.get_unassigned_workers_for_placement()
+    if candidates_df.empty:
+        st.success("目前沒有暫掛在 `[未分配房間]` 的人員。")
+        return
+
+    employers = sorted(candidates_df['employer_name'].dropna().unique().tolist())
+    c1, c2, c3 = st.columns([2, 1, 1])
+    selected_employers = c1.multiselect("只安排這些雇主的人員", options=employers, placeholder="全部")
+    keep_together = c2.checkbox("同雇主盡量同宿舍", value=True)
+    strict_policy = c3.checkbox("嚴格遵守房間性別限制", value=True, help="取消勾選時，空房不論性別限制皆可入住 (與上方查詢相同)。")
+
+    if selected_employers:
+        candidates_df = candidates_df[candidates_df['employer_name'].isin(selected_employers)]
+    st.caption(f"待安排人員：{len(candidates_df)} 位")
+
+    if st.button("🧩 產生床位計畫"):
+        constraints = dict(location_filters, keep_employer_together=keep_together, strict_gender_policy=strict_policy)
+        with st.spinner("正在計算床位計畫..."):
+            st.session_state['placement_plan'] = placement_model.plan_batch_placement(candidates_df, constraints)
+
+    if 'placement_plan' not in st.session_state:
+        return
+    plan_df, unplaced_df = st.session_state['placement_plan']
+
+    if plan_df.empty:
+        st.warning("範圍內找不到可安排的空床位。請嘗試放寬地點篩選條件。")
+    else:
+        st.success(f"可安排 {len(plan_df)} 位，共使用 {plan_df['room_id'].nunique()} 個房間。")
+        st.dataframe(plan_df.drop(columns=['ah_id', 'worker_unique_id', 'room_id', 'dorm_id']), width="stretch", hide_index=True)
+    if not unplaced_df.empty:
+        st.error(f"有 {len(unplaced_df)} 位無法安排：")
+        st.dataframe(
+            unplaced_df.rename(columns={'worker_name': '姓名', 'employer_name': '雇主', 'gender': '性別', 'nationality': '國籍'})
+            [['雇主', '姓名', '性別', '國籍', '原因']],
+            width="stretch", hide_index=True
+        )
+
+    if plan_df.empty:
+        return
+    with st.form("apply_placement_form"):
+        a1, a2 = st.columns(2)
+        new_start_date = a1.date_input("新入住日 (選填)", value=None, help="若留空，將保留原入住日")
+        protection_level = a2.selectbox(
+            "更新後的保護層級*",
+            options=["手動調整", "系統自動更新", "手動管理(他仲)"],
+            index=0
+        )
+        if st.form_submit_button("🚀 套用床位計畫", type="primary"):
+            with st.spinner(f"正在更新 {len(plan_df)} 位員工..."):
+                success_cnt, failed_cnt, msg = placement_model.apply_batch_placement(plan_df, protection_level, new_start_date)
+            if failed_cnt > 0:
+                st.error(msg)
+            else:
+                st.success(msg)
+                del st.session_state['placement_plan']
+                st.cache_data.clear()
\ No newline at end of file
@@ -2,9 +2,13 @@
 
 import streamlit as st
 import pandas as pd
-from data_models import reminder_model
+from data_models import reminder_model, analytics_model
 from datetime import datetime
 
+# 水電異常區塊的回溯天數選項
+ANOMALY_LOOKBACK_OPTIONS = [7, 30, 90, 180]
+DEFAULT_ANOMALY_LOOKBACK_DAYS = 30
+
 def render():
     """渲染「智慧提醒」儀表板"""
     st.header("智慧提醒儀表板")
@@ -34,6 +38,10 @@ def render():
 
     reminders = get_reminders(days_ahead)
 
+    @st.cache_data
+    def get_recent_anomalies(days):
+        return analytics_model.get_recent_anomalies(days)
+
     st.markdown("---")
 
     # --- 合規申報提醒 ---
@@ -92,6 +100,21 @@ def render():
         st.success("在指定範圍內，沒有需要執行的清掃排程。")
     st.markdown("---")
 
+    # --- 水電異常提醒 (讀取已保存的異常旗標，不需重新掃描帳單) ---
+    # 異常是「已發生」的事件，回溯天數與上方的到期提醒範圍無關，另外選擇
+    anomaly_days = st.selectbox(
+        "水電異常回溯天數：", options=ANOMALY_LOOKBACK_OPTIONS,
+        index=ANOMALY_LOOKBACK_OPTIONS.index(DEFAULT_ANOMALY_LOOKBACK_DAYS), key="anomaly_lookback_days"
+    )
+    anomalies_df = get_recent_anomalies(anomaly_days)
+    st.subheader(f"⚡ 近 {anomaly_days} 天新偵測到的水電異常 ({len(anomalies_df)} 筆)")
+    if not anomalies_df.empty:
+        st.dataframe(anomalies_df, width="stretch", hide_index=True)
+        st.caption("可至「水電用量分析」頁面查看詳情，並將已確認的異常標示為已處理。")
+    else:
+        st.success("近期沒有新偵測到的水電異常。")
+    st.markdown("---")
+
     # --- 移工工作期限提醒 ---
     st.subheader(f"🧑‍💼 移工工作期限 ({len(reminders.get('workers', []))} 筆)")
     workers_df = reminders.get('workers', pd.DataFrame())
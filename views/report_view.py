@@ -4,35 +4,15 @@ from io import BytesIO
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 from data_models import report_model, dormitory_model, export_model, employer_dashboard_model, single_dorm_analyzer
+import excel_export
+import report_batch
 
 def to_excel(sheet_data: dict):
     """
     【修改版】將一個包含多個 DataFrame 的字典寫入一個 Excel 檔案。
-    現在支援為每個 DataFrame 添加標題。
+    現在支援為每個 DataFrame 添加標題。(以 excel_export 的 constant_memory 模式寫出，與批次報表共用)
     """
-    output = BytesIO()
-    has_data_to_write = any(
-        table_info.get('dataframe') is not None and not table_info.get('dataframe').empty
-        for tables in sheet_data.values() for table_info in tables
-    )
-    
-    if has_data_to_write:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name, tables in sheet_data.items():
-                start_row_counter = 0
-                for table_info in tables:
-                    df = table_info.get('dataframe')
-                    title = table_info.get('title')
-                    
-                    if df is not None and not df.empty:
-                        if title:
-                            pd.DataFrame([title]).to_excel(writer, index=False, header=False, sheet_name=sheet_name, startrow=start_row_counter)
-                            start_row_counter += 2
-                        
-                        df.to_excel(writer, index=False, sheet_name=sheet_name, startrow=start_row_counter)
-                        start_row_counter += len(df) + 2
-    
-    return output.getvalue()
+    return excel_export.write_workbook(sheet_data)
 
 
 def render():
@@ -165,25 +145,66 @@ def render():
         st.subheader("月份異動人員報表")
         st.info("選擇一個月份，系統將匯出該月份所有「離住」以及「有特殊狀況」的人員清單。")
         today = datetime.now()
-        c1, c2, c3 = st.columns([1, 1, 2])
+        c1, c2, c3, c4 = st.columns([1, 1, 1, 2])
         selected_year = c1.selectbox("選擇年份", options=range(today.year - 2, today.year + 2), index=2, key="exception_report_year")
         selected_month = c2.selectbox("選擇月份", options=range(1, 13), index=today.month - 1, key="exception_report_month")
+        exception_fmt = c3.selectbox(
+            "檔案格式", options=excel_export.available_formats(),
+            format_func=lambda x: excel_export.FORMATS[x]['label'], key="exception_report_fmt"
+        )
         year_month_str = f"{selected_year}-{selected_month:02d}"
         download_placeholder = st.empty()
-        if c3.button("🚀 產生異動報表", key="generate_exception_report"):
+        if c4.button("🚀 產生異動報表", key="generate_exception_report"):
             with st.spinner(f"正在查詢 {year_month_str} 的異動人員資料..."):
                 report_df = report_model.get_monthly_exception_report(year_month_str)
             if report_df.empty:
                 st.warning("在您選擇的月份中，找不到任何離住或有特殊狀況的人員。")
             else:
                 st.success(f"報表已產生！共找到 {len(report_df)} 筆紀錄。請點擊下方按鈕下載。")
-                excel_file = to_excel({"異動人員清單": [{"dataframe": report_df}]})
+                report_file = excel_export.export_dataframe(report_df, exception_fmt, sheet_name="異動人員清單")
                 download_placeholder.download_button(
-                    label="📥 點此下載 Excel 報表",
-                    data=excel_file,
-                    file_name=f"住宿特例_{year_month_str}.xlsx"
+                    label="📥 點此下載報表",
+                    data=report_file,
+                    file_name=f"住宿特例_{year_month_str}.{exception_fmt}",
+                    mime=excel_export.FORMATS[exception_fmt]['mime']
                 )
 
+    with st.container(border=True):
+        st.subheader("住宿 / 費用歷史明細匯出")
+        st.info("匯出指定期間 (可跨多年) 的所有住宿紀錄或費用紀錄。資料直接由資料庫逐批寫入檔案；筆數很多時建議選擇 CSV 或 Parquet，速度較快、檔案較小。")
+
+        hc1, hc2, hc3, hc4 = st.columns(4)
+        history_kind = hc1.selectbox(
+            "匯出內容", options=list(report_model.HISTORY_EXPORTS.keys()),
+            format_func=lambda x: report_model.HISTORY_EXPORTS[x][0], key="history_export_kind"
+        )
+        history_start = hc2.date_input("起始日", value=date(date.today().year - 2, 1, 1), key="history_export_start")
+        history_end = hc3.date_input("結束日", value=date.today(), key="history_export_end")
+        history_fmt = hc4.selectbox(
+            "檔案格式", options=excel_export.available_formats(),
+            format_func=lambda x: excel_export.FORMATS[x]['label'], key="history_export_fmt"
+        )
+
+        if st.button("🚀 產生明細檔", key="generate_history_export"):
+            if history_start > history_end:
+                st.error("起始日不可晚於結束日！")
+            else:
+                history_buffer = BytesIO()
+                with st.spinner("正在匯出明細..."):
+                    row_count = report_model.export_history_data(history_kind, history_start, history_end, history_buffer, fmt=history_fmt)
+                if row_count is None:
+                    st.error("匯出時發生錯誤，請檢查後台日誌。")
+                elif row_count == 0:
+                    st.warning("在您選擇的期間內沒有任何紀錄。")
+                else:
+                    st.success(f"已匯出 {row_count:,} 筆紀錄，請點擊下方按鈕下載。")
+                    st.download_button(
+                        label="📥 點此下載明細檔",
+                        data=history_buffer.getvalue(),
+                        file_name=f"{report_model.HISTORY_EXPORTS[history_kind][0]}_{history_start}_{history_end}.{history_fmt}",
+                        mime=excel_export.FORMATS[history_fmt]['mime']
+                    )
+
     with st.container(border=True):
         st.subheader("單一宿舍深度分析報表")
         st.info("選擇一個宿舍與月份，產生包含人數、國籍、性別統計與人員詳情的完整報告。")
@@ -227,26 +248,9 @@ def render():
                         if report_df.empty:
                             st.warning(f"此宿舍在 {year_month_str_deep} 沒有在住人員紀錄。")
                         else:
-                            # 製作摘要表
-                            nationality_counts = report_df['國籍'].dropna().value_counts().to_dict()
-                            summary_items = ["總人數", "男性人數", "女性人數"] + [f"{nat}籍人數" for nat in nationality_counts.keys()]
-                            summary_values = [
-                                len(report_df), 
-                                len(report_df[report_df['性別'] == '男']), 
-                                len(report_df[report_df['性別'] == '女'])
-                            ] + list(nationality_counts.values())
-                            summary_df = pd.DataFrame({"統計項目": summary_items, "數值": summary_values})
-
                             # 【核心修改】客製化標題：地址 人數摘要 (YYYY-MM)
                             dorm_address_str = dorm_options.get(selected_dorm_id, "").split(') ')[-1] # 取出括號後面的地址部分
-                            custom_title = f"{dorm_address_str} 人數摘要 ({year_month_str_deep})"
-
-                            excel_file_data = {
-                                "宿舍報表": [
-                                    {"dataframe": summary_df, "title": custom_title}, # 使用新標題
-                                    {"dataframe": report_df, "title": "在住人員明細"}
-                                ]
-                            }
+                            excel_file_data = report_batch.dorm_report_sheets(dorm_address_str, year_month_str_deep, report_df)
                             excel_file = to_excel(excel_file_data)
                             
                             dorm_name_for_file = dorm_address_str.replace(" ", "_").replace("/", "_")
@@ -639,33 +643,9 @@ def render():
                             dorm_title = " / ".join(dorm_address_list) 
                             employer_title = " / ".join(final_selected_employers)
                             
-                            # 準備 Excel 數據
-                            summary_header_df = pd.DataFrame({
-                                "宿舍地址": [dorm_title],
-                                "目標雇主": [employer_title],
-                                "總水電費": [f"NT$ {int(total_charge):,}"],
-                                "計算基準 (元/月)": [fixed_subsidy_amount],
-                                "總人數": [details_df.shape[0]],
-                            })
-
-                            bill_summary_df = bills_df.copy()
-                            bill_summary_df.rename(columns={
-                                'bill_type': '帳單', 'bill_start_date': '起日', 'bill_end_date': '迄日', 'amount': '費用'
-                            }, inplace=True)
-                            bill_summary_df['天數'] = (pd.to_datetime(bill_summary_df['迄日']) - pd.to_datetime(bill_summary_df['起日'])).dt.days + 1
-                            
-                            
-                            final_details_df = details_df[['雇主', '姓名', '英文姓名', '護照號碼', '國籍', '性別', '入住日期', '離住日期', '居住天數', '應收水電費']].copy()
-                            
-                            final_details_df['應收水電費'] = final_details_df['應收水電費'].round().astype(int)
-
-                            excel_file_data = {
-                                "超額水電費報表": [
-                                    {"dataframe": summary_header_df, "title": "【超額水電費請款單】"},
-                                    {"dataframe": bill_summary_df[['帳單', '起日', '迄日', '天數', '費用']], "title": "帳單摘要"},
-                                    {"dataframe": final_details_df, "title": "應收費用明細"}
-                                ]
-                            }
+                            excel_file_data = report_batch.excess_report_sheets(
+                                dorm_title, employer_title, fixed_subsidy_amount, bills_df, details_df, total_charge
+                            )
 
                             excel_file = to_excel(excel_file_data)
                             
@@ -714,14 +694,7 @@ def render():
                     else:
                         st.success(f"床位佔用報表已產生！請點擊下方按鈕下載。")
                         
-                        # 準備 Excel 數據
-                        excel_title = f"{dorm_address} 床位佔用總覽"
-                        
-                        excel_file_data = {
-                            "床位佔用報表": [
-                                {"dataframe": occupancy_df, "title": excel_title}
-                            ]
-                        }
+                        excel_file_data = report_batch.bed_report_sheets(dorm_address, occupancy_df)
                         excel_file = to_excel(excel_file_data)
                         
                         dorm_name_for_file = dorm_address.replace(" ", "_").replace("/", "_")
@@ -729,4 +702,69 @@ def render():
                             label="📥 點此下載 Excel 床位佔用報表",
                             data=excel_file,
                             file_name=f"床位佔用報表_{dorm_name_for_file}_{date.today().strftime('%Y%m%d')}.xlsx"
-                        )
\ No newline at end of file
+                        )
+    st.markdown("---")
+    with st.container(border=True):
+        st.subheader("📦 月底批次報表")
+        st.info("一次為多間宿舍產生指定月份的報表，每間宿舍一個 Excel 檔，打包成 ZIP 下載。沒有資料的宿舍會自動略過。")
+
+        my_dorms = dormitory_model.get_my_company_dorms_for_selection()
+        if not my_dorms:
+            st.warning("目前沒有「我司管理」的宿舍可供選擇。")
+        else:
+            dorm_options = {d['id']: f"({d.get('legacy_dorm_code') or '無編號'}) {d.get('original_address', '')}" for d in my_dorms}
+
+            selected_dorm_ids_batch = st.multiselect(
+                "選擇宿舍 (預設全部)",
+                options=list(dorm_options.keys()),
+                default=list(dorm_options.keys()),
+                format_func=lambda x: dorm_options.get(x),
+                key="batch_report_dorms"
+            )
+
+            today_batch = datetime.now()
+            default_date_batch = today_batch - relativedelta(months=1)
+            year_opts_batch = list(range(today_batch.year - 2, today_batch.year + 2))
+            default_year_idx_batch = year_opts_batch.index(default_date_batch.year) if default_date_batch.year in year_opts_batch else 2
+
+            bc1, bc2, bc3 = st.columns(3)
+            selected_year_batch = bc1.selectbox("年份", options=year_opts_batch, index=default_year_idx_batch, key="batch_rep_year")
+            selected_month_batch = bc2.selectbox("月份", options=range(1, 13), index=default_date_batch.month - 1, key="batch_rep_month")
+            fixed_subsidy_batch = bc3.number_input("超額水電費計算基準 (元/月)", min_value=0, value=report_batch.DEFAULT_FIXED_SUBSIDY, step=50, key="batch_rep_subsidy")
+            year_month_str_batch = f"{selected_year_batch}-{selected_month_batch:02d}"
+
+            type_cols = st.columns(len(report_batch.REPORT_TYPES))
+            selected_types_batch = [
+                type_key for col, (type_key, type_label) in zip(type_cols, report_batch.REPORT_TYPES.items())
+                if col.checkbox(type_label, value=True, key=f"batch_rep_type_{type_key}")
+            ]
+            include_external_batch = st.checkbox("超額水電費將「掛宿外住」人員納入分攤計算", value=False, key="batch_rep_external")
+
+            if st.button("🚀 產生批次報表", key="generate_batch_reports"):
+                if not selected_dorm_ids_batch:
+                    st.error("請至少選擇一間宿舍！")
+                elif not selected_types_batch:
+                    st.error("請至少勾選一種報表！")
+                else:
+                    progress_bar = st.progress(0.0, text="準備中...")
+                    zip_buffer = BytesIO()
+                    result = report_batch.generate_dorm_reports(
+                        selected_dorm_ids_batch, year_month_str_batch, zip_buffer,
+                        report_types=selected_types_batch,
+                        fixed_subsidy=fixed_subsidy_batch,
+                        include_external_workers=include_external_batch,
+                        log_callback=lambda message: None,
+                        progress_callback=lambda current, total, message=None: progress_bar.progress(current / total, text=f"({current}/{total}) {message or ''}")
+                    )
+                    progress_bar.empty()
+
+                    if result['files'] == 0:
+                        st.warning(f"所選宿舍在 {year_month_str_batch} 都沒有可產生的報表資料。")
+                    else:
+                        st.success(f"已產生 {result['files']} 份報表，略過 {result['skipped']} 間沒有資料的宿舍。")
+                        st.download_button(
+                            label="📥 點此下載 ZIP",
+                            data=zip_buffer.getvalue(),
+                            file_name=f"宿舍批次報表_{year_month_str_batch}.zip",
+                            mime="application/zip"
+                        )